@@ -0,0 +1,79 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+# Measures the memory usage and the processing time of flame graphs
+# in the columnar form (see adaptiveperf.FlameGraph) compared to
+# the nested dictionaries produced by json.load(), including reading
+# a flame graph file incrementally (see adaptiveperf.read_flame_graphs()).
+#
+# Usage: PYTHONPATH=src python benchmarks/flamegraph.py [NODES] [THRESHOLD]
+
+import sys
+import gc
+import json
+import time
+import tempfile
+import tracemalloc
+from adaptiveperf import FlameGraph, read_flame_graphs
+from generate import generate_tree
+
+
+def measure(func):
+    # The time is measured without tracemalloc, as it slows down
+    # allocation-heavy code considerably.
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, current, peak
+
+
+def report(label, elapsed, current, peak):
+    print(f'{label:24}{elapsed:8.3f} s, retained {current / 2**20:8.1f} MiB, '
+          f'peak {peak / 2**20:8.1f} MiB')
+
+
+def main():
+    node_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.025
+    data = generate_tree(node_count)
+
+    tree, *stats = measure(lambda: json.loads(data))
+    report('json.loads()', *stats)
+
+    graph, *stats = measure(lambda: FlameGraph.from_dict(tree))
+    report('FlameGraph.from_dict()', *stats)
+
+    del tree
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f'{tmp_dir}/1_1.json'
+
+        with open(path, mode='w') as f:
+            f.write('{"walltime": [' + data + ']}')
+
+        def read():
+            with open(path, mode='r') as f:
+                return list(read_flame_graphs(f))
+
+        _, *stats = measure(read)
+        report('read_flame_graphs()', *stats)
+
+    compressed, *stats = measure(lambda: graph.compress(threshold, True))
+    report('FlameGraph.compress()', *stats)
+
+    result, *stats = measure(compressed.to_json)
+    report('to_json()', *stats)
+    print(f'{len(result)} bytes of JSON produced')
+
+
+if __name__ == '__main__':
+    main()
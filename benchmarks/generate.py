@@ -0,0 +1,254 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+# Generates synthetic profiling sessions in the format produced by
+# AdaptivePerf (i.e. "processed" directories), at a configurable scale.
+# The sessions are used by the benchmark suite (see test_benchmarks.py),
+# but they can also be served by AdaptivePerfHTML for manual testing.
+#
+# Usage: python benchmarks/generate.py OUTPUT [options]
+# (see python benchmarks/generate.py --help)
+
+import json
+import random
+import argparse
+from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+def generate_tree(node_count, seed=0, max_depth=100, names=None):
+    """
+    Generate a flame graph JSON string with a given number of blocks, in
+    the format of the per-thread/process flame graph files.
+
+    :param int node_count: The number of blocks.
+    :param int seed: The seed of the random number generator.
+    :param int max_depth: The maximum depth of the flame graph.
+    :param list names: The list of block names to choose from (by
+                       default, one name for every 50 blocks).
+    """
+    rng = random.Random(seed)
+
+    if names is None:
+        names = [f'function_{i}' for i in range(node_count // 50 + 1)]
+
+    nodes = [{'name': 'all', 'value': 0, 'children': []}]
+    parents = [-1]
+    depths = [0]
+
+    for _ in range(node_count - 1):
+        # Parents are chosen mostly among the recently added blocks,
+        # so that the tree is both deep and wide.
+        parent = max(0, len(nodes) - 1 - int(rng.expovariate(0.05)))
+
+        while depths[parent] >= max_depth:
+            parent = parents[parent]
+
+        node = {'name': rng.choice(names), 'value': 0, 'children': []}
+        nodes[parent]['children'].append(node)
+        nodes.append(node)
+        parents.append(parent)
+        depths.append(depths[parent] + 1)
+
+    for node in reversed(nodes):
+        node['value'] = rng.randint(1, 100) + \
+            sum(c['value'] for c in node['children'])
+
+    return json.dumps(nodes[0])
+
+
+def generate_session(path, threads=100, flame_graphs=10,
+                     flame_graph_nodes=10000, flame_graph_depth=100,
+                     off_cpu_regions=100, perf_map_entries=10000,
+                     source_files=10, source_lines=10000, seed=0):
+    """
+    Generate a synthetic profiling session in a given directory.
+
+    The session has one process with a given number of threads (spawned
+    by the main thread) and the following files in "processed":
+    * metadata.json with the thread tree, off-CPU regions, and
+      start callchains,
+    * event_dict.data with one extra metric,
+    * <PID>_<TID>.json flame graphs (for the first threads only),
+    * walltime_callchains.json and syscall_callchains.json mapping
+      callchain names to symbols,
+    * perf-<PID>.map with JIT-ed symbols,
+    * sources.json and src.zip with the source code files.
+
+    :param pathlib.Path path: The path to a session directory, whose name
+                              should be a valid session identifier.
+    :param int threads: The number of threads.
+    :param int flame_graphs: The number of threads with flame graphs.
+    :param int flame_graph_nodes: The number of blocks of every flame
+                                  graph.
+    :param int flame_graph_depth: The maximum depth of every flame graph.
+    :param int off_cpu_regions: The number of off-CPU regions of every
+                                thread.
+    :param int perf_map_entries: The number of perf map entries.
+    :param int source_files: The number of source code files.
+    :param int source_lines: The number of lines of every source code
+                             file.
+    :param int seed: The seed of the random number generator.
+    """
+    rng = random.Random(seed)
+    processed_path = Path(path) / 'processed'
+    processed_path.mkdir(parents=True, exist_ok=True)
+
+    pid = 1000
+    library = '/usr/lib/libexample.so'
+    symbol_count = max(1, flame_graph_nodes // 50)
+
+    # Every tenth symbol is JIT-ed, i.e. it must be resolved with
+    # the perf map.
+    perf_map_name = f'perf-{pid}.map'
+    jit_base = 0x7f0000000000
+    callchains = {}
+
+    for i in range(symbol_count):
+        if i % 10 == 0 and perf_map_entries > 0:
+            address = jit_base + rng.randrange(perf_map_entries) * 0x100
+            callchains[f's{i}'] = [f'[{hex(address)}]', perf_map_name]
+        else:
+            callchains[f's{i}'] = [f'function_{i}', library]
+
+    names = list(callchains.keys())
+
+    with (processed_path / 'walltime_callchains.json').open(mode='w') as f:
+        json.dump(callchains, f)
+
+    with (processed_path / 'syscall_callchains.json').open(mode='w') as f:
+        json.dump(callchains, f)
+
+    with (processed_path / perf_map_name).open(mode='w') as f:
+        for i in range(perf_map_entries):
+            f.write(f'{jit_base + i * 0x100:x} {rng.randint(0x10, 0x100):x} '
+                    f'LuaJIT::trace_{i}::interpreted_function_{i}\n')
+
+    (processed_path / 'event_dict.data').write_text(
+        'cache-misses Cache misses\n')
+
+    # Threads run for up to 10 s, with off-CPU regions spread evenly
+    # across their runtime.
+    thread_tree = []
+    offcpu = {}
+    sampled_times = {}
+    start_callchains = {}
+
+    for i in range(threads):
+        tid = pid + i
+        pid_tid = f'{pid}_{tid}'
+        start = 0 if i == 0 else rng.randrange(10 ** 9)
+        runtime = 10 ** 10 if i == 0 else rng.randrange(10 ** 6, 9 * 10 ** 9)
+        node = {'tag': ['example', f'{pid}/{tid}', start, runtime],
+                'identifier': pid_tid}
+
+        if i > 0:
+            node['parent'] = f'{pid}_{pid}'
+
+        thread_tree.append(node)
+        sampled_times[pid_tid] = int(runtime * rng.uniform(0.9, 1.0))
+        start_callchains[str(tid)] = [
+            [rng.choice(names), hex(rng.randrange(0x10000))]
+            for _ in range(rng.randint(5, 20))]
+
+        regions = []
+        step = runtime // max(1, off_cpu_regions)
+
+        for j in range(off_cpu_regions):
+            region_start = start + j * step + rng.randrange(max(1, step // 2))
+            regions.append([region_start, rng.randint(1, max(1, step // 2))])
+
+        offcpu[pid_tid] = regions
+
+    with (processed_path / 'metadata.json').open(mode='w') as f:
+        json.dump({
+            'thread_tree': thread_tree,
+            'offcpu_regions': offcpu,
+            'sampled_times': sampled_times,
+            'callchains': start_callchains,
+            'start_time': 0
+        }, f)
+
+    for i in range(min(threads, flame_graphs)):
+        trees = []
+
+        for metric in ['walltime', 'cache-misses']:
+            for time_ordered in [False, True]:
+                trees.append(json.loads(generate_tree(
+                    flame_graph_nodes, rng.randrange(2 ** 32),
+                    flame_graph_depth, names)))
+
+        (processed_path / f'{pid}_{pid + i}.json').write_text(json.dumps({
+            'walltime': trees[:2],
+            'cache-misses': trees[2:]
+        }))
+
+    sources = {library: {}}
+    index = {}
+
+    with ZipFile(processed_path / 'src.zip', mode='w',
+                 compression=ZIP_DEFLATED) as zip:
+        for i in range(source_files):
+            source_path = f'/home/user/project/src/file_{i}.c'
+            index[source_path] = str(i)
+            zip.writestr(str(i), ''.join(
+                f'int function_{i}_{j}(int x) {{ return x * {j}; }}\n'
+                for j in range(source_lines)))
+
+            for _ in range(100):
+                sources[library][hex(rng.randrange(0x10000))] = {
+                    'file': source_path,
+                    'line': rng.randint(1, source_lines)
+                }
+
+        zip.writestr('index.json', json.dumps(index))
+
+    with (processed_path / 'sources.json').open(mode='w') as f:
+        json.dump(sources, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic profiling session')
+
+    parser.add_argument('output', metavar='OUTPUT',
+                        help='path to a profiling results directory where '
+                        'the session should be created')
+    parser.add_argument('--name', default='2024_01_01_12_00_00_bench__example',
+                        help='session identifier, default: %(default)s')
+    parser.add_argument('--threads', type=int, default=100,
+                        help='number of threads, default: %(default)s')
+    parser.add_argument('--flame-graphs', type=int, default=10,
+                        help='number of threads with flame graphs, '
+                        'default: %(default)s')
+    parser.add_argument('--nodes', type=int, default=10000,
+                        help='number of blocks of every flame graph, '
+                        'default: %(default)s')
+    parser.add_argument('--depth', type=int, default=100,
+                        help='maximum flame graph depth, '
+                        'default: %(default)s')
+    parser.add_argument('--off-cpu', type=int, default=100,
+                        help='number of off-CPU regions per thread, '
+                        'default: %(default)s')
+    parser.add_argument('--perf-map', type=int, default=10000,
+                        help='number of perf map entries, '
+                        'default: %(default)s')
+    parser.add_argument('--source-files', type=int, default=10,
+                        help='number of source code files, '
+                        'default: %(default)s')
+    parser.add_argument('--source-lines', type=int, default=10000,
+                        help='number of lines per source code file, '
+                        'default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed, default: %(default)s')
+
+    args = parser.parse_args()
+
+    generate_session(Path(args.output) / args.name, args.threads,
+                     args.flame_graphs, args.nodes, args.depth,
+                     args.off_cpu, args.perf_map, args.source_files,
+                     args.source_lines, args.seed)
+
+
+if __name__ == '__main__':
+    main()
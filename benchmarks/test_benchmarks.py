@@ -0,0 +1,172 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+# Benchmark suite of the ProfilingResults methods used by the website,
+# run on synthetic sessions (see generate.py). Every benchmark reports
+# the processing time (measured by pytest-benchmark) and the peak
+# memory usage in MiB (in "extra_info", measured by tracemalloc in
+# a separate run).
+#
+# Usage: PYTHONPATH=src python -m pytest benchmarks
+# The size of the sessions can be scaled with the BENCHMARK_SCALE
+# environment variable (1 by default), e.g. BENCHMARK_SCALE=10.
+# Use --benchmark-autosave and --benchmark-compare (see pytest-benchmark)
+# for detecting regressions.
+
+import os
+import gc
+import tracemalloc
+import pytest
+from adaptiveperf import ProfilingResults
+from generate import generate_session
+
+pytest.importorskip('pytest_benchmark')
+
+
+SCALE = float(os.environ.get('BENCHMARK_SCALE', 1))
+IDENTIFIER = '2024_01_01_12_00_00_bench__example'
+
+
+def scaled(value):
+    return max(1, int(value * SCALE))
+
+
+@pytest.fixture(scope='module')
+def storage(tmp_path_factory):
+    path = tmp_path_factory.mktemp('results')
+    generate_session(path / IDENTIFIER,
+                     threads=scaled(1000),
+                     flame_graphs=2,
+                     flame_graph_nodes=scaled(20000),
+                     flame_graph_depth=100,
+                     off_cpu_regions=scaled(100),
+                     perf_map_entries=scaled(100000),
+                     source_files=5,
+                     source_lines=scaled(20000))
+
+    # Empty directories are enough for listing sessions.
+    for i in range(scaled(5000)):
+        (path / f'2023_01_01_00_00_{i % 60:02}_host{i}__program').mkdir()
+
+    return str(path)
+
+
+def run_benchmark(benchmark, storage, func, rounds=5):
+    """
+    Benchmark a function called with a new ProfilingResults object
+    (without the on-disk cache) every time, so that nothing is reused
+    between rounds.
+    """
+    def setup():
+        return (ProfilingResults(storage, IDENTIFIER),), {}
+
+    args, _ = setup()
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    benchmark.extra_info['peak_memory_mib'] = round(peak / 2 ** 20, 2)
+
+    return benchmark.pedantic(func, setup=setup, rounds=rounds)
+
+
+def test_get_flame_graph(benchmark, storage):
+    result = run_benchmark(
+        benchmark, storage,
+        lambda results: results.get_flame_graph(1000, 1000, 0.025))
+
+    assert result is not None
+
+
+def test_get_flame_graph_depth_limited(benchmark, storage):
+    result = run_benchmark(
+        benchmark, storage,
+        lambda results: results.get_flame_graph(1000, 1000, 0.025, 30))
+
+    assert result is not None
+
+
+def test_get_merged_flame_graph(benchmark, storage):
+    result = run_benchmark(
+        benchmark, storage,
+        lambda results: results.get_merged_flame_graph(None, 0.025, 30))
+
+    assert result is not None
+
+
+def test_search_symbols(benchmark, storage):
+    # Only the search is measured, with the symbol index built beforehand
+    # (as it is built once per session).
+    results = ProfilingResults(storage, IDENTIFIER)
+    results.get_symbol_index()
+    result = benchmark(lambda: results.search_symbols('function_1'))
+
+    assert len(result) > 0
+
+
+def test_get_hot_functions(benchmark, storage):
+    # The symbol index is built beforehand, as in test_search_symbols().
+    results = ProfilingResults(storage, IDENTIFIER)
+    results.get_symbol_index()
+    result = benchmark(lambda: results.get_hot_functions(
+        'all', 'walltime', 'total', 0, 50))
+
+    assert result is not None
+
+
+def test_get_json_tree(benchmark, storage):
+    run_benchmark(benchmark, storage,
+                  lambda results: results.get_json_tree())
+
+
+def test_get_json_tree_skeleton(benchmark, storage):
+    run_benchmark(benchmark, storage,
+                  lambda results: results.get_json_tree(
+                      include_off_cpu=False, skeleton=True))
+
+
+def test_get_off_cpu_regions(benchmark, storage):
+    ids = [f'1000_{1000 + i}' for i in range(min(200, scaled(1000)))]
+    run_benchmark(benchmark, storage,
+                  lambda results: results.get_off_cpu_regions(
+                      ids, 0, 10000, 10))
+
+
+def test_get_perf_maps(benchmark, storage):
+    run_benchmark(benchmark, storage,
+                  lambda results: results.get_perf_maps())
+
+
+def test_resolve_symbols(benchmark, storage):
+    symbols = [f'perf-1000.map:{hex(0x7f0000000000 + i * 0x100)}'
+               for i in range(200)]
+    run_benchmark(benchmark, storage,
+                  lambda results: results.resolve_symbols(symbols))
+
+
+def test_get_callchain_mappings(benchmark, storage):
+    run_benchmark(benchmark, storage,
+                  lambda results: results.get_callchain_mappings())
+
+
+def test_get_source_code(benchmark, storage):
+    result = run_benchmark(benchmark, storage,
+                           lambda results: results.get_source_code('0'))
+
+    assert result is not None
+
+
+def test_get_source_code_lines(benchmark, storage):
+    result = run_benchmark(
+        benchmark, storage,
+        lambda results: results.get_source_code('0', (100, 500)))
+
+    assert result is not None
+
+
+def test_get_all_ids(benchmark, storage):
+    result = benchmark(ProfilingResults.get_all_ids, storage)
+
+    assert len(result) == scaled(5000) + 1
@@ -1 +1,15 @@
 from .results import *
+from .flamegraph import *
+from .cache import *
+from .wire import *
+from .index import *
+from .offcpu import *
+from .perfmap import *
+from .sources import *
+from .metrics import *
+from .singleflight import *
+from .jobs import *
+from .store import *
+from .merge import *
+from .symbols import *
+from .lru import *
@@ -1,10 +1,17 @@
 # AdaptivePerfHTML: Tool for producing HTML summary of profiling results
 # Copyright (C) CERN. See LICENSE for details.
 
+import os
+import json
+import hashlib
 import traceback
-from flask import Flask, render_template, request
+from datetime import date
+from flask import Flask, render_template, request, make_response
 from pathlib import Path
-from . import ProfilingResults, Identifier
+from . import Identifier, SessionCache, SessionIndex, SharedCache, \
+    CacheStatistics, BINARY_MIME_TYPE, get_fingerprint, \
+    get_content_encodings, RequestMetrics, PhaseTimer, JobManager, \
+    format_metric
 
 
 app = Flask(__name__)
@@ -18,6 +25,72 @@ if 'PROFILING_STORAGE' not in app.config:
                        '(usually "results").')
 
 
+# SESSION_CACHE_SIZE is the maximum total size in MiB of the session
+# files kept parsed in memory across requests (see the SessionCache
+# docstring for details). CACHE_DIR is the directory where on-disk
+# caches of computation results are stored (by default, they are stored
+# inside session directories) and CACHE_SIZE is the maximum size in MiB
+# of the on-disk cache of a single session. If CREATE_STORES is true,
+# the store of every session (see SessionStore) is created the first
+# time the session is opened. MERGE_PROCESSES is the number of processes
+# merging the flame graphs of all threads/processes of a process or
+# a session for a single request (1 merges them in the worker process
+# handling the request).
+session_cache = SessionCache(
+    app.config['PROFILING_STORAGE'],
+    int(app.config.get('SESSION_CACHE_SIZE', 256)) * 1024 * 1024,
+    app.config.get('CACHE_DIR', None),
+    int(app.config.get('CACHE_SIZE', 1024)) * 1024 * 1024,
+    bool(app.config.get('CREATE_STORES', False)),
+    int(app.config.get('MERGE_PROCESSES', 1)))
+
+
+session_index = SessionIndex(app.config['PROFILING_STORAGE'])
+
+# The index is built right away, so that Gunicorn workers share it when
+# the app is preloaded.
+session_index.refresh()
+
+
+# SHARED_CACHE is the path to an SQLite database where responses are
+# cached for all server processes (e.g. Gunicorn workers), so that
+# a response computed by one worker is served by the others without
+# loading the session again. SHARED_CACHE_SIZE is the maximum size in
+# MiB of the cached responses. The shared cache is disabled if
+# SHARED_CACHE is not set or SHARED_CACHE_SIZE is 0.
+shared_cache_statistics = CacheStatistics()
+shared_cache = None
+
+if app.config.get('SHARED_CACHE') and \
+   int(app.config.get('SHARED_CACHE_SIZE', 256)) > 0:
+    shared_cache = SharedCache(
+        Path(app.config['SHARED_CACHE']),
+        int(app.config.get('SHARED_CACHE_SIZE', 256)) * 1024 * 1024,
+        shared_cache_statistics)
+
+
+# The metrics are kept per process, so every Gunicorn worker reports
+# its own requests.
+request_metrics = RequestMetrics()
+
+
+def publish_job(job):
+    # The status of a job is stored in the shared cache, so that it can
+    # be polled through any worker.
+    if shared_cache is not None:
+        shared_cache.put(f'job:{job.id}', json.dumps(job.to_dict()).encode())
+
+
+# JOB_THREADS is the maximum number of requests with the "async"
+# argument computed at the same time in the background by every
+# process. ASYNC_WAIT is the number of seconds such a request waits for
+# its computation before the server answers with 202 and the job ID
+# to be polled.
+job_manager = JobManager(int(app.config.get('JOB_THREADS', 2)),
+                         on_update=publish_job)
+async_wait = float(app.config.get('ASYNC_WAIT', 0.5))
+
+
 static_path = Path(app.root_path) / 'static'
 scripts = list(map(lambda x: x.name,
                    static_path.glob('*.js')))
@@ -26,18 +99,523 @@ stylesheets = list(map(lambda x: x.name,
 d3_flamegraph_css = (static_path / 'd3-flamegraph.css').read_text()
 
 
-@app.post('/<identifier>/')
-def post(identifier):
+# Responses smaller than this number of bytes are not compressed,
+# as the compression overhead would outweigh the gain.
+MIN_COMPRESSED_SIZE = 1024
+
+
+def is_query_valid():
+    values = request.values
+    return 'tree' in values or 'perf_map' in values or \
+        'general_analysis' in values or \
+        ('pid' in values and 'tid' in values and 'threshold' in values) or \
+        ('merged' in values and 'threshold' in values) or \
+        ('diff' in values and 'baseline' in values and
+         'threshold' in values) or \
+        'callchain' in values or 'src' in values or \
+        'details' in values or 'src_map' in values or \
+        'symbols' in values or 'search' in values or 'hot' in values or \
+        ('off_cpu_regions' in values and 'start' in values and
+         'end' in values and 'resolution' in values)
+
+
+def get_query_type():
     """
-    Process a POST request relevant to a profiling session with
+    Get the type of the current request used for grouping metrics,
+    i.e. the name of its main argument (or "flame_graph" for flame
+    graphs), in the same order as the arguments are checked by
+    get_query_data(). If the request is not valid, "invalid" is returned.
+    """
+    if not is_query_valid():
+        return 'invalid'
+
+    for arg in ['tree', 'details', 'src_map', 'symbols', 'search', 'hot',
+                'perf_map', 'general_analysis']:
+        if arg in request.values:
+            return arg
+
+    if 'pid' in request.values and 'tid' in request.values and \
+       'threshold' in request.values:
+        return 'flame_graph'
+
+    if 'merged' in request.values and 'threshold' in request.values:
+        return 'merged_flame_graph'
+
+    if 'diff' in request.values and 'baseline' in request.values and \
+       'threshold' in request.values:
+        return 'differential_flame_graph'
+
+    for arg in ['callchain', 'src']:
+        if arg in request.values:
+            return arg
+
+    return 'off_cpu_regions'
+
+
+def finish_request(response, request_type, timer):
+    """
+    Record the metrics of the current request and attach its
+    Server-Timing header to a given response.
+
+    :param flask.Response response: The response to the request.
+    :param str request_type: The type of the request (see
+                             get_query_type()).
+    :param PhaseTimer timer: The timer measuring the phases of handling
+                             the request.
+    """
+    timer.stop()
+    request_metrics.observe(request_type, response.status_code,
+                            timer.durations,
+                            response.calculate_content_length() or 0)
+    response.headers['Server-Timing'] = timer.get_server_timing()
+
+    return response
+
+
+def is_binary_requested():
+    """
+    Check whether the client asks for the binary wire format (see wire.py)
+    either with the "format" argument set to "binary" or with the binary
+    MIME type preferred in the Accept header. The source code is always
+    returned as plain text.
+    """
+    if 'src' in request.values and 'lines' not in request.values:
+        return False
+
+    return request.values.get('format') == 'binary' or \
+        request.accept_mimetypes.best_match(
+            ['application/json', BINARY_MIME_TYPE]) == BINARY_MIME_TYPE
+
+
+def get_baseline_session(values):
+    """
+    Get the identifier of the session with the baseline flame graphs of
+    a differential flame graph request, i.e. "baseline_session" if it is
+    provided or None for the session of the request.
+
+    Only the sessions found in the results directory by the session
+    index are accepted, so that the identifier cannot point to any other
+    directory (e.g. with "..").
+
+    :param values: The arguments of the request (i.e. request.values).
+    :raises ValueError: When the identifier is incorrect or there is
+                        no such session.
+    """
+    identifier = values.get('baseline_session', '')
+
+    if identifier == '':
+        return None
+
+    if not session_index.contains(identifier):
+        raise ValueError(f'There is no session {identifier}!')
+
+    return identifier
+
+
+def get_query_fingerprint(identifier):
+    """
+    Get a fingerprint of the session files the response to the current
+    request is computed from.
+
+    The requests involving the flame graphs of many threads/processes
+    (e.g. merged flame graphs or hot functions) use the fingerprint of
+    the whole session taken when it was loaded into the session cache
+    (see SessionCache.get_session_fingerprint()) instead, so that
+    the files do not need to be listed and checked on every request.
+    The session is not loaded if it is not cached.
+
+    :param str identifier: A profiling session identifier.
+    """
+    session_path = Path(app.config['PROFILING_STORAGE']) / identifier
+    processed_path = session_path / 'processed'
+    paths = [session_path / p for p in SessionCache.SESSION_FILES]
+
+    if 'perf_map' in request.values or 'symbols' in request.values:
+        paths += sorted(processed_path.glob('perf-*.map'))
+    elif 'callchain' in request.values:
+        paths += sorted(processed_path.glob('*_callchains.json'))
+    elif 'search' in request.values or 'hot' in request.values:
+        return session_cache.get_session_fingerprint(identifier)
+    elif 'pid' in request.values and 'tid' in request.values:
+        paths.append(processed_path / (f'{request.values["pid"]}_'
+                                       f'{request.values["tid"]}.json'))
+    elif 'merged' in request.values:
+        return session_cache.get_session_fingerprint(identifier)
+    elif 'diff' in request.values and 'baseline' in request.values:
+        baseline_session = get_baseline_session(request.values)
+        fingerprint = session_cache.get_session_fingerprint(identifier)
+
+        if baseline_session is not None:
+            fingerprint += session_cache.get_session_fingerprint(
+                baseline_session)
+
+        return fingerprint
+
+    return get_fingerprint(paths)
+
+
+def get_etag(identifier, binary, encoding):
+    """
+    Get a strong ETag of the response to the current request, derived
+    from the request arguments, the representation of the response
+    (i.e. the format and the content encoding), the server settings
+    affecting the response, and the fingerprint of the session files
+    the response is computed from.
+
+    :param str identifier: A profiling session identifier.
+    :param bool binary: Whether the response is in the binary wire format.
+    :param str encoding: The content encoding of the response (None for
+                         no encoding).
+    """
+    values = sorted((k, v) for k, v in request.values.items(multi=True)
+                    if k not in ['format', 'async'])
+    return hashlib.sha256(repr((
+        identifier, values, binary, encoding,
+        app.config.get('OFFCPU_SAMPLING', 0),
+        get_query_fingerprint(identifier))).encode()).hexdigest()
+
+
+def get_query_data(results, values, binary=False):
+    """
+    Get the string to be returned for a request, or None if
+    the requested data do not exist.
+
+    :param ProfilingResults results: The ProfilingResults object
+                                     of the session the request is
+                                     relevant to.
+    :param values: The arguments of the request (i.e. request.values).
+    :param bool binary: Whether flame graphs should be returned in
+                        the binary wire format (as bytes) rather than
+                        as JSON strings.
+    """
+
+    if 'tree' in values:
+        return results.get_json_tree(
+            include_off_cpu='lod' not in values,
+            skeleton=values['tree'] == 'skeleton')
+    elif 'details' in values:
+        return results.get_thread_details(
+            values['details'].split(','),
+            include_off_cpu='lod' not in values)
+    elif 'src_map' in values:
+        return results.get_source_mappings()
+    elif 'symbols' in values:
+        return results.resolve_symbols(values['symbols'].split(','))
+    elif 'search' in values:
+        return results.search_symbols(
+            values['search'], values.get('metric'), 'exact' in values,
+            int(values.get('limit', 100)))
+    elif 'hot' in values:
+        return results.get_hot_functions(
+            values['hot'], values.get('metric', 'walltime'),
+            values.get('sort', 'self'), int(values.get('offset', 0)),
+            int(values.get('limit', 50)))
+    elif 'perf_map' in values:
+        return results.get_perf_maps()
+    elif 'general_analysis' in values:
+        return results.get_general_analysis(values['general_analysis'])
+    elif 'pid' in values and 'tid' in values and 'threshold' in values:
+        max_depth = None
+
+        time_range = None
+
+        if 'depth' in values:
+            max_depth = int(values['depth'])
+
+        if 't0' in values and 't1' in values:
+            time_range = (float(values['t0']), float(values['t1']))
+
+        if 'node' in values:
+            return results.get_flame_graph_subtree(
+                values['pid'], values['tid'], float(values['threshold']),
+                values['node'], max_depth, time_range, binary)
+        else:
+            return results.get_flame_graph(
+                values['pid'], values['tid'], float(values['threshold']),
+                max_depth, time_range, binary)
+    elif 'merged' in values and 'threshold' in values:
+        pid = None if values['merged'] == 'all' else values['merged']
+        max_depth = None
+
+        if 'depth' in values:
+            max_depth = int(values['depth'])
+
+        if 'node' in values:
+            return results.get_merged_flame_graph_subtree(
+                pid, float(values['threshold']), values['node'], max_depth,
+                binary)
+        else:
+            return results.get_merged_flame_graph(
+                pid, float(values['threshold']), max_depth, binary)
+    elif 'diff' in values and 'baseline' in values and 'threshold' in values:
+        baseline_session = get_baseline_session(values)
+        baseline = results
+        max_depth = None
+
+        if baseline_session is not None:
+            baseline = session_cache.get(baseline_session)
+
+        if 'depth' in values:
+            max_depth = int(values['depth'])
+
+        if 'node' in values:
+            return results.get_differential_flame_graph_subtree(
+                values['diff'], baseline, values['baseline'],
+                float(values['threshold']), values['node'], max_depth,
+                binary)
+        else:
+            return results.get_differential_flame_graph(
+                values['diff'], baseline, values['baseline'],
+                float(values['threshold']), max_depth, binary)
+    elif 'callchain' in values:
+        return results.get_callchain_mappings()
+    elif 'src' in values:
+        lines = None
+
+        if 'lines' in values:
+            first, last = values['lines'].split('-')
+            lines = (int(first), int(last))
+
+        return results.get_source_code(values['src'], lines)
+    elif 'off_cpu_regions' in values:
+        # OFFCPU_SAMPLING describes the sampling *period* (not
+        # frequency) in ms for off-CPU regions to be displayed on the
+        # timeline (as rendering a large number of these regions
+        # can be resource-heavy). It works in a similar way to
+        # sampling in off-CPU profiling in AdaptivePerf.
+        return results.get_off_cpu_regions(
+            values['off_cpu_regions'].split(','), float(values['start']),
+            float(values['end']), float(values['resolution']),
+            app.config.get('OFFCPU_SAMPLING', 0))
+
+
+def get_mimetype(binary, values):
+    """
+    Get the MIME type of the response to a request.
+
+    :param bool binary: Whether the response is in the binary wire format.
+    :param values: The arguments of the request (i.e. request.values).
+    """
+    if binary:
+        return BINARY_MIME_TYPE
+    elif 'src' in values and 'lines' not in values:
+        return 'text/plain'
+    else:
+        return 'application/json'
+
+
+def compute_payload(identifier, values, binary, encoding, timer):
+    """
+    Compute the body of the response to a request, returning
+    a (body, whether the body is compressed) tuple, or None if
+    the requested data do not exist. This does not need a request
+    context, so it can run in the background.
+
+    :param str identifier: A profiling session identifier.
+    :param values: The arguments of the request (i.e. request.values).
+    :param bool binary: Whether the response should be in the binary
+                        wire format.
+    :param str encoding: The content encoding of the response (None for
+                         no encoding).
+    :param PhaseTimer timer: The timer measuring the phases of handling
+                             the request.
+    """
+    results = session_cache.get(identifier)
+    timer.start('compute')
+    data = get_query_data(results, values, binary)
+
+    if data is None:
+        return None
+
+    timer.start('serialize')
+
+    # Flame graphs are already returned as bytes if binary is true.
+    if binary and isinstance(data, str):
+        data = results.get_binary(data)
+    elif isinstance(data, str):
+        data = data.encode()
+
+    # The ETag does not need to change when a small response is
+    # not compressed, as the response is still determined
+    # by the request and the session files.
+    if encoding is not None and len(data) >= MIN_COMPRESSED_SIZE:
+        return results.get_compressed(data, encoding), True
+
+    return data, False
+
+
+def store_payload(etag, payload):
+    """
+    Store the body of a response in the shared cache (if enabled).
+
+    :param str etag: The ETag of the response.
+    :param tuple payload: The tuple returned by compute_payload().
+    """
+    if shared_cache is not None:
+        # The first byte tells whether the response is compressed.
+        shared_cache.put(etag, (b'1' if payload[1] else b'0') + payload[0])
+
+
+def make_payload_response(payload, binary, encoding):
+    """
+    Make the response to the current request with a given body.
+
+    :param tuple payload: The tuple returned by compute_payload().
+    :param bool binary: Whether the body is in the binary wire format.
+    :param str encoding: The content encoding requested by the client.
+    """
+    response = make_response(payload[0])
+    response.mimetype = get_mimetype(binary, request.values)
+
+    if payload[1]:
+        response.content_encoding = encoding
+
+    return response
+
+
+def get_shared_job_status(job_id):
+    """
+    Get the status dictionary (see Job.to_dict()) of a job run by another
+    server process, or None if it is unknown or its process has exited.
+
+    :param str job_id: The identifier of the job.
+    """
+    if shared_cache is None:
+        return None
+
+    status = shared_cache.get(f'job:{job_id}')
+
+    if status is None:
+        return None
+
+    status = json.loads(status)
+
+    try:
+        os.kill(status['pid'], 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+
+    return status
+
+
+def make_job_response(status):
+    """
+    Make the 202 response to the current request with a given status
+    of the job computing the response (see Job.to_dict()).
+
+    :param dict status: The status of the job.
+    """
+    response = make_response(json.dumps(status), 202)
+    response.mimetype = 'application/json'
+    response.headers['Location'] = f'/jobs/{status["job"]}'
+
+    return response
+
+
+def get_async_response(identifier, etag, binary, encoding):
+    """
+    Get the response to the current request with the "async" argument,
+    computed by a background job identified by the ETag of the response.
+    If the job finishes within ASYNC_WAIT seconds, the response is
+    returned as usual. Otherwise, the response is 202 with the status
+    of the job (see Job.to_dict()), which can be polled at /jobs/<job ID>
+    before repeating the request to get the result. If the requested
+    data do not exist, None is returned.
+
+    :param str identifier: A profiling session identifier.
+    :param str etag: The ETag of the response.
+    :param bool binary: Whether the response should be in the binary
+                        wire format.
+    :param str encoding: The content encoding of the response (None for
+                         no encoding).
+    """
+    job = job_manager.get(etag)
+
+    if job is None:
+        # The job may be running in another process, in which case
+        # the result will be available in the shared cache.
+        status = get_shared_job_status(etag)
+
+        if status is not None and status['state'] == 'running':
+            return make_job_response(status)
+
+        values = request.values.copy()
+
+        def compute():
+            payload = compute_payload(identifier, values, binary, encoding,
+                                      PhaseTimer())
+
+            if payload is not None:
+                store_payload(etag, payload)
+
+            return payload
+
+        job = job_manager.submit(etag, compute)
+
+    if not job.wait(async_wait):
+        return make_job_response(job.to_dict())
+
+    if job.state == 'failed':
+        raise job.error
+
+    if job.result is None:
+        return None
+
+    return make_payload_response(job.result, binary, encoding)
+
+
+@app.route('/<identifier>/', methods=['GET', 'POST'])
+def query(identifier):
+    """
+    Process a GET or POST request relevant to a profiling session with
     an identifier given in the URL. The request should have one of the
     following arguments:
     * "tree" (with any value):
       This instructs AdaptivePerfHTML to return the thread/process
-      tree obtained in the session.
+      tree obtained in the session. If "lod" (with any value) is also
+      provided, the off-CPU regions are omitted from the tree and should
+      be obtained with "off_cpu_regions" instead. If the value is
+      "skeleton", only the shape of the tree along with the timing
+      information is returned, with the rest to be obtained with
+      "details" and "src_map".
+    * "details" (with a comma-separated list of thread/process IDs):
+      This instructs AdaptivePerfHTML to return the start callchains
+      and the off-CPU regions of the threads/processes (the latter
+      are omitted if "lod" with any value is also provided).
+    * "src_map" (with any value):
+      This instructs AdaptivePerfHTML to return the mappings between
+      library/executable offsets and source code lines obtained
+      in the session.
     * "perf_map" (with any value):
       This instructs AdaptivePerfHTML to return perf symbol maps
       obtained in the session.
+    * "symbols" (with a comma-separated list of symbols in form of
+      "<perf map name>:<hex address>"):
+      This instructs AdaptivePerfHTML to resolve the symbols using
+      perf symbol maps obtained in the session, without sending
+      the maps themselves.
+    * "search" (with a string value):
+      This instructs AdaptivePerfHTML to return the symbols containing
+      the value (case-insensitively) along with the threads/processes
+      and the metrics they appear in and their total and self values
+      there, using the symbol index of the session (see SymbolIndex).
+      If "exact" (with any value) is also provided, only the symbols
+      equal to the value are returned. If "metric" (with a string value)
+      is also provided, only the values of that metric are returned.
+      At most 100 symbols are returned unless "limit" (with a numeric
+      value) is provided.
+    * "hot" (with a value in form of "<PID>_<TID>", "<PID>", or "all"):
+      This instructs AdaptivePerfHTML to return the table of
+      the functions of the thread/process (or all threads/processes
+      with a given PID, or the whole session) sorted by their self
+      values of the metric specified by "metric" ("walltime" by
+      default), along with their total values (see
+      ProfilingResults.get_hot_functions()). If "sort" is set to
+      "total", the functions are sorted by their total values instead.
+      The table is returned in pages of "limit" functions (50 by
+      default) starting from "offset" (0 by default).
     * "general_analysis" (with a string value):
       This instructs AdaptivePerfHTML to return general analysis data
       of a type specified in the value (e.g. "roofline" for a cache-aware
@@ -50,81 +628,294 @@ def post(identifier):
       less than a specified share of samples (e.g. if "threshold" is
       set to 0.10, blocks taking less than 10% of samples
       will be collapsed, with an option to expand them at runtime).
+      If "depth" (with a numeric value) is also provided, only the top
+      "depth" + 1 levels of the flame graph are returned, with the blocks
+      at the last level replaced with stubs having the "stub_id" key.
+      If "node" (with a stub ID value) is also provided, only the subtree
+      with the root being the stub is returned (limited to "depth" + 1
+      levels if "depth" is provided). If "t0" and "t1" (with decimal
+      values in milliseconds, on the timeline scale) are also provided,
+      the flame graph is restricted to the time window between them
+      (the same window must be provided when requesting stubs).
+    * "merged" (with a numeric PID value or "all") and "threshold" (with
+      a decimal value):
+      This instructs AdaptivePerfHTML to return a flame graph of all
+      threads/processes with a given PID (or of the whole session if
+      the value is "all"), i.e. their non-time-ordered flame graphs
+      merged by call path, in the same format as for "pid" and "tid"
+      except that the time-ordered flame graphs are null. "depth" and
+      "node" are also supported in the same way.
+    * "diff" and "baseline" (with values in form of "<PID>_<TID>",
+      "<PID>", or "all") and "threshold" (with a decimal value):
+      This instructs AdaptivePerfHTML to return a differential flame
+      graph comparing the flame graphs of the thread/process (or all
+      threads/processes with a given PID, or the whole session)
+      specified by "diff" with the baseline ones specified by
+      "baseline", in the same format as for "merged" with "baseline"
+      and "delta" set for every block. If "baseline_session" (with
+      a session identifier value) is also provided, the baseline flame
+      graphs are taken from that session. "depth" and "node" are also
+      supported in the same way as for "pid" and "tid".
     * "callchain" (with any value):
       This instructs AdaptivePerfHTML to return the session dictionaries
       mapping compressed symbol names to full symbol names.
     * "src" (with a string value):
       This instructs AdaptivePerfHTML to return the source code stored
-      in the session under a provided name.
+      in the session under a provided name. If "lines" (with a value
+      in form of "<first>-<last>", 1-based and inclusive) is also
+      provided, only these lines are returned along with the total
+      number of lines and the offsets of the returned lines (see
+      SourceArchive.get_lines() for details).
+    * "off_cpu_regions" (with a comma-separated list of thread/process
+      IDs) and "start", "end", and "resolution" (with decimal values
+      in ms):
+      This instructs AdaptivePerfHTML to return the off-CPU regions
+      of the threads/processes within the time window between "start"
+      and "end", with the regions separated by gaps smaller than
+      "resolution" (e.g. the time span of one pixel of the timeline)
+      merged together. The OFFCPU_SAMPLING period is applied to
+      the regions before merging.
+
+    If the "async" argument (with any value) is also provided, the data
+    are computed in the background. If this takes longer than ASYNC_WAIT
+    seconds, the response is 202 with a JSON object describing
+    the progress of the computation (see Job.to_dict()) and the Location
+    header pointing to /jobs/<job ID>, which can be polled until
+    the computation finishes. Repeating the request afterwards returns
+    the data.
+
+    Apart from the source code (unless "lines" is provided), all data are
+    returned as JSON by default.
+    If the "format" argument is set to "binary" or the Accept header
+    prefers the "application/x-adaptiveperf-binary" MIME type, the data
+    are returned in the binary wire format described in wire.py instead.
+
+    Every response has a Server-Timing header with the time spent on
+    parsing (i.e. validating the request, computing the ETag, and
+    loading the session files), computing, and serializing (i.e.
+    converting to the binary wire format and compressing) the response.
+    These timings are also recorded in the metrics returned by /metrics.
+
+    Every response has a strong ETag derived from the fingerprint of
+    the session files it is computed from, so GET requests with
+    a matching If-None-Match header are answered with 304 without
+    touching the session. Responses are compressed according to
+    the Accept-Encoding header (gzip or, if the "zstandard" package is
+    installed, zstd), with the compressed variants stored in the on-disk
+    cache if it is enabled. If the shared cache is enabled (see
+    SHARED_CACHE), responses are also stored there and served from it
+    without loading the session, whichever server process computed them.
 
     :param str identifier: A profiling session identifier in the form
                            described in the Identifier class docstring.
     """
+    timer = PhaseTimer()
+    timer.start('parse')
+    request_type = get_query_type()
+
     try:
         # Check if identifier is correct by verifying that ValueError
         # is not raised
         Identifier(identifier)
 
-        if 'tree' in request.values or 'perf_map' in request.values or \
-           'general_analysis' in request.values or \
-           ('pid' in request.values and 'tid' in request.values and
-            'threshold' in request.values) or \
-           'callchain' in request.values or 'src' in request.values:
-            results = ProfilingResults(app.config['PROFILING_STORAGE'],
-                                       identifier)
-
-            if 'tree' in request.values:
-                return results.get_json_tree()
-            elif 'perf_map' in request.values:
-                return results.get_perf_maps()
-            elif 'general_analysis' in request.values:
-                json_data = results.get_general_analysis(
-                    request.values['general_analysis'])
-
-                if json_data is None:
-                    return '', 404
-                else:
-                    return json_data
-            elif 'pid' in request.values and 'tid' in request.values and \
-                 'threshold' in request.values:
-                json_data = results.get_flame_graph(
-                    request.values['pid'],
-                    request.values['tid'],
-                    float(request.values['threshold']))
-
-                if json_data is None:
-                    return '', 404
-                else:
-                    return json_data
-            elif 'callchain' in request.values:
-                return results.get_callchain_mappings()
-            elif 'src' in request.values:
-                result = results.get_source_code(request.values['src'])
+        if request_type == 'invalid':
+            return finish_request(make_response('', 400), request_type,
+                                  timer)
 
-                if result is None:
-                    return '', 404
+        binary = is_binary_requested()
+        encoding = request.accept_encodings.best_match(
+            get_content_encodings())
+        etag = get_etag(identifier, binary, encoding)
 
-                return result
+        if request.method == 'GET' and request.if_none_match.contains(etag):
+            response = make_response('', 304)
         else:
-            return '', 400
+            cached = None if shared_cache is None else shared_cache.get(etag)
+
+            if cached is not None:
+                response = make_payload_response(
+                    (cached[1:], cached[:1] == b'1'), binary, encoding)
+            elif 'async' in request.values:
+                response = get_async_response(identifier, etag, binary,
+                                              encoding)
+            else:
+                payload = compute_payload(identifier, request.values, binary,
+                                          encoding, timer)
+
+                if payload is not None:
+                    store_payload(etag, payload)
+                    response = make_payload_response(payload, binary,
+                                                     encoding)
+                else:
+                    response = None
+
+            if response is None:
+                return finish_request(make_response('', 404),
+                                      request_type, timer)
+
+            if response.status_code == 202:
+                response.cache_control.no_store = True
+                return finish_request(response, request_type, timer)
+
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        response.vary.add('Accept-Encoding')
+
+        # Responses can be stored by browsers and proxies, but they must
+        # be revalidated every time, as sessions can change.
+        response.cache_control.no_cache = True
+
+        return finish_request(response, request_type, timer)
     except ValueError:
         traceback.print_exc()
-        return '', 404
+        return finish_request(make_response('', 404), request_type, timer)
+
+
+@app.get('/sessions')
+def sessions():
+    """
+    Return a JSON object with a page of the list of profiling sessions
+    in the results directory, sorted from the newest to the oldest one.
+    The request can have the following optional arguments:
+    * "offset" (with a numeric value, 0 by default):
+      The number of sessions to skip.
+    * "limit" (with a numeric value, 100 by default, 1000 at most):
+      The maximum number of sessions to return.
+    * "executor" (with a string value):
+      Only the sessions with this executor are returned.
+    * "name" (with a string value):
+      Only the sessions with the profiled filename containing this
+      string (ignoring case) are returned.
+    * "from" and "to" (with a YYYY-MM-DD date value):
+      Only the sessions started within this date range (inclusive)
+      are returned.
+
+    The object has the form of {"total": <number of matching sessions>,
+    "offset": <offset>, "sessions": [{"id": <identifier>, "label":
+    <label>, "text": <user-friendly string representation of
+    the identifier>}, ...], "executors": [<all executors in the results
+    directory>, ...]}.
+    """
+    timer = PhaseTimer()
+    timer.start('parse')
+
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(1000, max(1, int(request.args.get('limit', 100))))
+        dates = []
+
+        for arg in ['from', 'to']:
+            if request.args.get(arg, '') == '':
+                dates.append(None)
+            else:
+                value = date.fromisoformat(request.args[arg])
+                dates.append((value.year, value.month, value.day))
+    except ValueError:
+        return finish_request(make_response('', 400), 'sessions', timer)
+
+    timer.start('compute')
+    total, ids = session_index.query(
+        request.args.get('executor') or None,
+        request.args.get('name') or None,
+        dates[0], dates[1], offset, limit)
+
+    timer.start('serialize')
+    response = make_response(json.dumps({
+        'total': total,
+        'offset': offset,
+        'sessions': [{'id': x.value, 'label': x.label, 'text': str(x)}
+                     for x in ids],
+        'executors': session_index.get_executors()
+    }))
+    response.mimetype = 'application/json'
+
+    return finish_request(response, 'sessions', timer)
+
+
+@app.get('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Return a JSON object describing the status of a background job
+    started by a session data request with the "async" argument (see
+    query() and Job.to_dict()), in any server process. The "state" key
+    is "running", "done", or "failed" and "phase" is one of "waiting",
+    "load", "compress", and "serialize" (or any other phase reported by
+    the computation), with "progress" being the progress of the phase
+    between 0 and 1. If the job is unknown (e.g. it finished a long time
+    ago), 404 is returned.
+
+    :param str job_id: The identifier of the job.
+    """
+    timer = PhaseTimer()
+    timer.start('parse')
+
+    job = job_manager.get(job_id)
+    status = job.to_dict() if job is not None else \
+        get_shared_job_status(job_id)
+
+    if status is None:
+        return finish_request(make_response('', 404), 'jobs', timer)
+
+    response = make_response(json.dumps(status))
+    response.mimetype = 'application/json'
+    response.cache_control.no_store = True
+
+    return finish_request(response, 'jobs', timer)
+
+
+@app.get('/metrics')
+def metrics():
+    """
+    Return the metrics of the requests handled by this process
+    (see RequestMetrics) and of the session caches in the Prometheus
+    text format.
+    """
+    disk_statistics = session_cache.disk_statistics
+    cache_metrics = [
+        ('adaptiveperf_session_cache_hits_total', 'counter',
+         'Number of requests served with a session kept in memory.',
+         session_cache.hits),
+        ('adaptiveperf_session_cache_misses_total', 'counter',
+         'Number of requests which required loading a session.',
+         session_cache.misses),
+        ('adaptiveperf_session_cache_sessions', 'gauge',
+         'Number of sessions kept in memory.', len(session_cache)),
+        ('adaptiveperf_session_cache_size_bytes', 'gauge',
+         'Estimated size of sessions kept in memory.', session_cache.size),
+        ('adaptiveperf_session_cache_max_size_bytes', 'gauge',
+         'Maximum estimated size of sessions kept in memory.',
+         session_cache.max_size),
+        ('adaptiveperf_disk_cache_hits_total', 'counter',
+         'Number of results found in on-disk caches.',
+         disk_statistics.hits),
+        ('adaptiveperf_disk_cache_misses_total', 'counter',
+         'Number of results not found in on-disk caches.',
+         disk_statistics.misses),
+        ('adaptiveperf_coalesced_computations_total', 'counter',
+         'Number of computations which waited for an identical one '
+         'in progress instead of running.',
+         session_cache.single_flight.coalesced),
+        ('adaptiveperf_shared_cache_hits_total', 'counter',
+         'Number of responses found in the shared cache.',
+         shared_cache_statistics.hits),
+        ('adaptiveperf_shared_cache_misses_total', 'counter',
+         'Number of responses not found in the shared cache.',
+         shared_cache_statistics.misses)
+    ]
+
+    response = make_response(request_metrics.render() + ''.join(
+        format_metric(name, metric_type, description, [('', {}, value)])
+        for name, metric_type, description, value in cache_metrics))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; ' \
+        'charset=utf-8'
+
+    return response
 
 
 @app.route('/')
 def main():
-    # offcpu_sampling describes the sampling *period* (not
-    # frequency) in ms for off-CPU regions to be displayed on the
-    # timeline (as rendering a large number of these regions
-    # can be resource-heavy). It works in a similar way to
-    # sampling in off-CPU profiling in AdaptivePerf.
     return render_template(
         'viewer.html',
-        ids=ProfilingResults.get_all_ids(
-            app.config['PROFILING_STORAGE']),
-        offcpu_sampling=app.config.get(
-            'OFFCPU_SAMPLING', 0),
         scripts=scripts,
         stylesheets=stylesheets,
         d3_flamegraph_css=d3_flamegraph_css.replace('\n', ' '))
@@ -0,0 +1,724 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from .results import ProfilingResults
+from .singleflight import SingleFlight
+from .store import SessionStore
+
+
+_SIZE_FILE_NAME = 'size.index'
+
+
+def get_fingerprint(paths) -> tuple:
+    """
+    Get a fingerprint of a given list of files, i.e. a tuple of
+    (name, modification time in ns, size in bytes) triples. Missing
+    files are also included in the fingerprint (with None as their
+    modification time and size), so that creating a file changes
+    the fingerprint as well.
+
+    :param list paths: The list of pathlib.Path objects to be
+                       fingerprinted.
+    """
+    result = []
+
+    for path in paths:
+        try:
+            stat = path.stat()
+            result.append((path.name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            result.append((path.name, None, None))
+
+    return tuple(result)
+
+
+class CacheStatistics:
+    """
+    A class describing thread-safe hit and miss counters, which can be
+    shared by several caches (e.g. the on-disk caches of all sessions).
+    """
+
+    def __init__(self):
+        """
+        Construct a CacheStatistics object.
+        """
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool):
+        """
+        Record a cache lookup.
+
+        :param bool hit: Whether the lookup was a hit.
+        """
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+class DiskCache:
+    """
+    A class describing a persistent on-disk cache of computation results
+    (e.g. serialized flame graphs) with a limit on the total size of
+    cache entries.
+
+    Every entry is identified by a key and the fingerprint of the files
+    the entry was computed from, so an entry becomes unreachable as soon
+    as any of its source files changes. When the total size exceeds
+    the limit, the least recently used entries are removed.
+
+    The total size is kept in a small index file in the cache directory,
+    updated under a file lock on every put(), so that the directory is
+    scanned only when the limit is exceeded (or the index file does not
+    exist yet). The total may drift slightly when several processes
+    replace the same entry at the same time, but it is recomputed by
+    every scan.
+
+    The cache directory is created lazily. If it cannot be written to
+    (e.g. because the profiling results directory is read-only), a warning
+    is printed and the cache stops storing new entries.
+    """
+
+    def __init__(self, path: Path, max_bytes: int,
+                 statistics: CacheStatistics = None):
+        """
+        Construct a DiskCache object.
+
+        :param pathlib.Path path: The path to a cache directory.
+        :param int max_bytes: The maximum total size of cache entries
+                              in bytes.
+        :param CacheStatistics statistics: The counters where hits and
+                                           misses of get() and get_path()
+                                           should be recorded (None
+                                           for not recording them).
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._statistics = statistics
+        self._writable = True
+        self._lock = threading.Lock()
+
+    def _record(self, hit: bool):
+        if self._statistics is not None:
+            self._statistics.record(hit)
+
+    def _get_entry_path(self, key: tuple, sources: list) -> Path:
+        digest = hashlib.sha256(
+            repr((key, get_fingerprint(sources))).encode()).hexdigest()
+        return self._path / digest
+
+    def get(self, key: tuple, sources: list, binary: bool = False):
+        """
+        Get the payload of a cache entry, or None if there
+        is no up-to-date entry.
+
+        :param tuple key: The key of a cache entry. It must consist of
+                          objects with a stable repr() (e.g. strings
+                          and numbers).
+        :param list sources: The list of pathlib.Path objects pointing to
+                             the files the entry was computed from.
+        :param bool binary: Whether the payload should be returned
+                            as bytes rather than a string.
+        """
+        entry_path = self._get_entry_path(key, sources)
+
+        try:
+            with entry_path.open(mode='rb' if binary else 'r') as f:
+                payload = f.read()
+        except OSError:
+            self._record(False)
+            return None
+
+        self._record(True)
+
+        try:
+            # The modification time is used as the last access time
+            # for eviction purposes.
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return payload
+
+    def get_path(self, key: tuple, sources: list):
+        """
+        Get the path to the file storing the payload of a cache entry
+        (e.g. for memory-mapping it), or None if there is no up-to-date
+        entry. The file must not be modified.
+
+        :param tuple key: The key of a cache entry (see get()).
+        :param list sources: The list of pathlib.Path objects pointing to
+                             the files the entry was computed from.
+        """
+        entry_path = self._get_entry_path(key, sources)
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            self._record(False)
+            return None
+
+        self._record(True)
+        return entry_path
+
+    @contextmanager
+    def lock(self, key: tuple, sources: list):
+        """
+        Hold an exclusive lock on a cache entry for the duration of
+        a "with" block, so that only one process (or thread) at a time
+        computes the entry. The lock is a file lock (flock()), so it works
+        across processes sharing the cache directory.
+
+        The (empty) lock file is kept when the lock is released, as
+        removing it would let a process waiting for the lock and a process
+        creating the file anew hold locks on different files at the same
+        time. If the lock file cannot be created (e.g. because the cache
+        directory is read-only), no lock is taken.
+
+        :param tuple key: The key of a cache entry (see get()).
+        :param list sources: The list of pathlib.Path objects pointing to
+                             the files the entry is computed from.
+        """
+        lock_path = self._get_entry_path(key, sources).with_suffix('.lock')
+
+        try:
+            self._path.mkdir(parents=True, exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            fd = None
+
+        if fd is None:
+            yield
+            return
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def put(self, key: tuple, sources: list, payload):
+        """
+        Store a payload in the cache, evicting the least recently
+        used entries if the size limit is exceeded.
+
+        :param tuple key: The key of a cache entry (see get()).
+        :param list sources: The list of pathlib.Path objects pointing to
+                             the files the entry was computed from.
+        :param payload: The payload to be stored, either a string or bytes.
+        """
+        if not self._writable or len(payload) > self._max_bytes:
+            return
+
+        entry_path = self._get_entry_path(key, sources)
+
+        try:
+            self._path.mkdir(parents=True, exist_ok=True)
+
+            # The entry is written to a temporary file first, so that
+            # a partially-written entry is never read by another
+            # process.
+            fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+
+            with os.fdopen(fd, mode='wb' if isinstance(payload, bytes)
+                           else 'w') as f:
+                f.write(payload)
+
+            size = os.stat(tmp_path).st_size
+
+            try:
+                size -= entry_path.stat().st_size
+            except FileNotFoundError:
+                pass
+
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            print(f'Could not write to the cache in {self._path} ({e}), '
+                  'disabling it.', file=sys.stderr)
+            self._writable = False
+            return
+
+        with self._lock:
+            self._add_size(size)
+
+    def _add_size(self, size):
+        # Add a given number of bytes to the total size of entries in
+        # the index file, evicting entries if the limit is exceeded.
+        try:
+            fd = os.open(self._path / _SIZE_FILE_NAME,
+                         os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            self._evict()
+            return
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 64)
+
+            try:
+                total = int(data) + size
+            except ValueError:
+                # The index file has just been created (or is corrupted),
+                # so the total must be computed from scratch.
+                total = None
+
+            if total is None or total > self._max_bytes:
+                total = self._evict()
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(total).encode())
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _evict(self):
+        # Scan the cache directory, remove the least recently used
+        # entries if the limit is exceeded, and return the total size of
+        # the remaining entries.
+        entries = []
+        total = 0
+
+        with os.scandir(self._path) as it:
+            for entry in it:
+                if entry.name.endswith('.tmp') or \
+                   entry.name.endswith('.lock') or \
+                   entry.name == _SIZE_FILE_NAME:
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self._max_bytes:
+            return total
+
+        entries.sort()
+
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total -= size
+
+            if total <= self._max_bytes:
+                break
+
+        return total
+
+
+class SharedCache:
+    """
+    A class describing a cache of byte payloads (e.g. HTTP responses)
+    stored in an SQLite database, with a limit on the total size of
+    cache entries.
+
+    Unlike the per-process caches (e.g. SessionCache), SharedCache can be
+    used by several processes at the same time (e.g. Gunicorn workers),
+    so a payload computed by one process can be served by all others.
+    SQLite takes care of locking and of making every entry visible
+    atomically. When the total size exceeds the limit, the least recently
+    used entries are removed.
+
+    Every process (and thread) opens its own connection to the database
+    lazily, so a SharedCache object can be created before forking worker
+    processes. If the database cannot be used (e.g. because it cannot be
+    created), a warning is printed and the cache is disabled.
+    """
+
+    def __init__(self, path: Path, max_bytes: int,
+                 statistics: CacheStatistics = None):
+        """
+        Construct a SharedCache object.
+
+        :param pathlib.Path path: The path to an SQLite database file
+                                  (created if it does not exist).
+        :param int max_bytes: The maximum total size of cache entries
+                              in bytes.
+        :param CacheStatistics statistics: The counters where hits and
+                                           misses of get() should be
+                                           recorded (None for not
+                                           recording them).
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._statistics = statistics
+        self._enabled = True
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self._path), timeout=30,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'key TEXT PRIMARY KEY, payload BLOB NOT NULL, '
+                           'size INTEGER NOT NULL, '
+                           'accessed REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                           'ON entries (accessed)')
+
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+
+        return connection
+
+    def _get_connection(self):
+        try:
+            return self._connect()
+        except (OSError, sqlite3.Error) as e:
+            print(f'Could not open the shared cache in {self._path} ({e}), '
+                  'disabling it.', file=sys.stderr)
+            self._enabled = False
+            return None
+
+    def get(self, key: str) -> bytes:
+        """
+        Get the payload of a cache entry, or None if there is no such
+        entry.
+
+        :param str key: The key of a cache entry.
+        """
+        if not self._enabled:
+            return None
+
+        connection = self._get_connection()
+
+        if connection is None:
+            return None
+
+        try:
+            row = connection.execute(
+                'SELECT payload FROM entries WHERE key = ?',
+                (key,)).fetchone()
+
+            if row is not None:
+                connection.execute(
+                    'UPDATE entries SET accessed = ? WHERE key = ?',
+                    (time.time(), key))
+        except sqlite3.Error as e:
+            # E.g. the database is locked for longer than the timeout,
+            # which is treated as a miss.
+            print(f'Could not read from the shared cache in {self._path} '
+                  f'({e}).', file=sys.stderr)
+            row = None
+
+        if self._statistics is not None:
+            self._statistics.record(row is not None)
+
+        return None if row is None else bytes(row[0])
+
+    def put(self, key: str, payload: bytes):
+        """
+        Store a payload in the cache, evicting the least recently
+        used entries if the size limit is exceeded.
+
+        :param str key: The key of a cache entry.
+        :param bytes payload: The payload to be stored.
+        """
+        if not self._enabled or len(payload) > self._max_bytes:
+            return
+
+        connection = self._get_connection()
+
+        if connection is None:
+            return
+
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, payload, len(payload), time.time()))
+                total = connection.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+                if total > self._max_bytes:
+                    evicted = []
+
+                    for evicted_key, size in connection.execute(
+                            'SELECT key, size FROM entries '
+                            'ORDER BY accessed'):
+                        if total <= self._max_bytes:
+                            break
+
+                        evicted.append((evicted_key,))
+                        total -= size
+
+                    connection.executemany(
+                        'DELETE FROM entries WHERE key = ?', evicted)
+
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f'Could not write to the shared cache in {self._path} '
+                  f'({e}).', file=sys.stderr)
+
+
+class SessionCache:
+    """
+    A class describing a process-wide, size-aware LRU cache of
+    ProfilingResults objects stored inside a given profiling results
+    directory.
+
+    Constructing a ProfilingResults object involves parsing several
+    session files (e.g. metadata.json), so caching these objects
+    avoids parsing the same files again when many requests
+    relevant to the same session arrive in a row.
+
+    The size of a cached session is estimated as the total size of
+    the files parsed by the ProfilingResults constructor plus the size
+    of the data the ProfilingResults object keeps in memory (see
+    ProfilingResults.memory_size). As the latter grows while
+    the session is used, all cached sessions are measured again every
+    time a session is requested, and the least recently used ones are
+    dropped if they no longer fit. A cached session is invalidated as
+    soon as the modification time or size of any of the parsed files
+    changes, or files are added to or removed from the "processed"
+    directory of the session (the results of computations involving
+    the other session files are identified by the fingerprint taken
+    when the session is loaded, see ProfilingResults.fingerprint).
+
+    Every ProfilingResults object returned by SessionCache is also given
+    its own DiskCache object (if enabled), so that the results of costly
+    computations persist across requests and server restarts, and
+    a SingleFlight object shared by all sessions, so that identical
+    computations requested concurrently run only once. If enabled,
+    the store of every session (see SessionStore) is created the first
+    time the session is loaded.
+    """
+
+    # The paths are relative to the session directory.
+    SESSION_FILES = ProfilingResults.SESSION_FILES
+
+    def __init__(self, profiling_storage: str, max_bytes: int,
+                 disk_cache_dir: str = None, disk_cache_max_bytes: int = 0,
+                 create_stores: bool = False, merge_processes: int = 1):
+        """
+        Construct a SessionCache object.
+
+        :param str profiling_storage: The path string to a profiling
+                                      results directory.
+        :param int max_bytes: The maximum total size of cached sessions
+                              in bytes (see the class docstring for how
+                              the size of a session is estimated). If it
+                              is 0, nothing is cached.
+        :param str disk_cache_dir: The path string to a directory where
+                                   per-session on-disk caches should be
+                                   stored (in subdirectories named after
+                                   session identifiers). If it is None,
+                                   the on-disk cache of each session is
+                                   stored in the "cache" subdirectory of
+                                   the session directory.
+        :param int disk_cache_max_bytes: The maximum total size of
+                                         on-disk cache entries in bytes
+                                         per session. If it is 0,
+                                         the on-disk cache is disabled.
+        :param bool create_stores: Whether the stores of sessions should
+                                   be created when they are loaded
+                                   (see ProfilingResults).
+        :param int merge_processes: The number of worker processes merging
+                                    flame graphs of many threads/processes
+                                    for a single request (see
+                                    ProfilingResults).
+        """
+        self._profiling_storage = profiling_storage
+        self._max_bytes = max_bytes
+        self._disk_cache_dir = disk_cache_dir
+        self._disk_cache_max_bytes = disk_cache_max_bytes
+        self._create_stores = create_stores
+        self._merge_processes = merge_processes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._disk_statistics = CacheStatistics()
+        self._single_flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def get(self, identifier: str) -> ProfilingResults:
+        """
+        Get a ProfilingResults object corresponding to a profiling
+        session with a given identifier, constructing it only if it
+        is not cached or its cached version is out of date.
+
+        :param str identifier: The identifier of a profiling session
+                               stored inside the results directory.
+        """
+        session_path = Path(self._profiling_storage) / identifier
+        fingerprint = self._get_validation_fingerprint(session_path)
+
+        with self._lock:
+            entry = self._entries.get(identifier)
+
+            if entry is not None and entry[1] == fingerprint:
+                self._entries.move_to_end(identifier)
+                self._hits += 1
+            else:
+                entry = None
+                self._misses += 1
+
+        if entry is not None:
+            self._measure()
+            return entry[0]
+
+        # Sessions requested by several threads at once are loaded
+        # only once.
+        results = self._single_flight.run(
+            ('session', identifier, fingerprint),
+            lambda: ProfilingResults(self._profiling_storage, identifier,
+                                     self._get_disk_cache(identifier),
+                                     self._single_flight,
+                                     self._create_stores,
+                                     self._merge_processes))
+        size = sum(x[2] for x in fingerprint[:-1] if x[2] is not None)
+
+        with self._lock:
+            self._entries.pop(identifier, None)
+
+            # A session larger than the whole cache must not evict
+            # anything.
+            if size + results.memory_size <= self._max_bytes:
+                self._entries[identifier] = (results, fingerprint, size)
+
+        self._measure()
+        return results
+
+    def get_session_fingerprint(self, identifier: str) -> tuple:
+        """
+        Get the fingerprint of the files of a profiling session with
+        a given identifier (see ProfilingResults.fingerprint) without
+        loading the session, i.e. the fingerprint of its cached
+        ProfilingResults object if it is up to date, or a new fingerprint
+        of the files otherwise. This does not count as a use of
+        the session for the hit and miss counters and for eviction.
+
+        :param str identifier: The identifier of a profiling session
+                               stored inside the results directory.
+        """
+        session_path = Path(self._profiling_storage) / identifier
+        fingerprint = self._get_validation_fingerprint(session_path)
+
+        with self._lock:
+            entry = self._entries.get(identifier)
+
+        if entry is not None and entry[1] == fingerprint:
+            return entry[0].fingerprint
+
+        return tuple(SessionStore.get_fingerprint(session_path))
+
+    def _get_validation_fingerprint(self, session_path):
+        # The "processed" directory is checked as well, as its
+        # modification time changes when files are added to it, removed
+        # from it, or replaced in it (see ProfilingResults.fingerprint).
+        return get_fingerprint(
+            [session_path / p for p in SessionCache.SESSION_FILES] +
+            [session_path / 'processed'])
+
+    def _measure(self):
+        # Estimate the sizes of all cached sessions again (outside
+        # the lock, as the results of computations which have changed
+        # since the last time are measured in full) and drop the least
+        # recently used sessions until the rest fit.
+        with self._lock:
+            entries = list(self._entries.items())
+
+        sizes = {identifier: file_size + results.memory_size
+                 for identifier, (results, _, file_size) in entries}
+
+        with self._lock:
+            self._size = 0
+
+            for identifier, entry in self._entries.items():
+                self._size += sizes.get(identifier, entry[2])
+
+            while self._size > self._max_bytes:
+                identifier, entry = self._entries.popitem(last=False)
+                self._size -= sizes.get(identifier, entry[2])
+
+    def _get_disk_cache(self, identifier: str) -> DiskCache:
+        if self._disk_cache_max_bytes == 0:
+            return None
+
+        if self._disk_cache_dir is None:
+            path = Path(self._profiling_storage) / identifier / 'cache'
+        else:
+            path = Path(self._disk_cache_dir) / identifier
+
+        return DiskCache(path, self._disk_cache_max_bytes,
+                         self._disk_statistics)
+
+    def clear(self):
+        """
+        Remove all sessions from the cache. The hit and miss counters
+        are not reset.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def single_flight(self):
+        return self._single_flight
+
+    @property
+    def disk_statistics(self):
+        return self._disk_statistics
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def max_size(self):
+        return self._max_bytes
+
+    def __len__(self):
+        return len(self._entries)
@@ -5,12 +5,185 @@ import argparse
 import sys
 import subprocess
 import os
+import tempfile
+from datetime import datetime
 from pathlib import Path
+from .precompute import precompute, import_sessions
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('-c',
+                        metavar='DIR',
+                        dest='cache_dir',
+                        help='directory where on-disk caches of computation '
+                        'results (e.g. compressed flame graphs) should be '
+                        'stored, default: the "cache" subdirectory of each '
+                        'session directory',
+                        default=None)
+    parser.add_argument('-s',
+                        metavar='SIZE',
+                        dest='cache_size',
+                        help='maximum size in MiB of the on-disk cache of '
+                        'a single session (0 disables on-disk caching), '
+                        'default: 1024',
+                        default=1024)
+
+
+def check_results_path(prog, path_str):
+    result_path = Path(path_str)
+
+    if not result_path.exists():
+        print(f'{prog}: error: {result_path} does not exist',
+              file=sys.stderr)
+        return None
+    elif not result_path.is_dir():
+        print(f'{prog}: error: {result_path} is not a directory',
+              file=sys.stderr)
+        return None
+
+    return result_path.resolve()
+
+
+def parse_date(date_str):
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'invalid date: {date_str} (expected YYYY-MM-DD)')
+
+
+def add_session_arguments(parser):
+    parser.add_argument('results', metavar='PATH',
+                        help='path to a profiling results directory '
+                        '(relative or absolute)')
+    parser.add_argument('-j', '--jobs',
+                        metavar='N',
+                        dest='jobs',
+                        type=int,
+                        help='number of sessions processed in parallel, '
+                        'default: the number of CPUs',
+                        default=None)
+    parser.add_argument('--since',
+                        metavar='DATE',
+                        dest='since',
+                        type=parse_date,
+                        help='process only the sessions started on or after '
+                        'DATE (in form of YYYY-MM-DD), default: all sessions',
+                        default=None)
+
+
+def get_since(args):
+    return None if args.since is None else \
+        (args.since.year, args.since.month, args.since.day)
+
+
+def import_main(argv):
+    prog = 'adaptiveperfhtml import'
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Convert the files of all profiling sessions to '
+        'indexed SQLite stores (saved as "session.sqlite3" in session '
+        'directories), which the AdaptivePerfHTML website reads instead '
+        'of the files as long as the files stay the same. Up-to-date '
+        'stores are not created again.')
+
+    add_session_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    result_path = check_results_path(prog, args.results)
+
+    if result_path is None:
+        return 1
+
+    try:
+        failed = import_sessions(str(result_path), args.jobs,
+                                 get_since(args))
+    except KeyboardInterrupt:
+        return 130
+
+    if failed > 0:
+        print(f'{prog}: error: {failed} session(s) could not be imported',
+              file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def precompute_main(argv):
+    prog = 'adaptiveperfhtml precompute'
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Compute the data shown by the AdaptivePerfHTML '
+        'website for all profiling sessions in advance and store them in '
+        'the on-disk cache, so that opening a session for the first time '
+        'is as fast as opening it again')
+
+    add_session_arguments(parser)
+    parser.add_argument('-t',
+                        metavar='THRESHOLD',
+                        dest='threshold',
+                        type=float,
+                        help='flame graph compression threshold (e.g. 0.025 '
+                        'for collapsing blocks taking less than 2.5%% of '
+                        'samples, as by default on the website), '
+                        'default: 0.025',
+                        default=0.025)
+    parser.add_argument('-d',
+                        metavar='DEPTH',
+                        dest='depth',
+                        type=int,
+                        help='number of flame graph levels loaded at once '
+                        '(0 for all levels, as on the website), default: 30',
+                        default=30)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    result_path = check_results_path(prog, args.results)
+
+    if result_path is None:
+        return 1
+
+    cache_size = int(args.cache_size) * 1024 * 1024
+
+    if cache_size == 0:
+        print(f'{prog}: error: the on-disk cache must be enabled',
+              file=sys.stderr)
+        return 1
+
+    cache_dir = None if args.cache_dir is None else \
+        str(Path(args.cache_dir).resolve())
+    try:
+        failed = precompute(str(result_path), cache_dir, cache_size,
+                            args.jobs, get_since(args), args.threshold,
+                            args.depth)
+    except KeyboardInterrupt:
+        return 130
+
+    if failed > 0:
+        print(f'{prog}: error: {failed} session(s) could not be processed',
+              file=sys.stderr)
+        return 1
+
+    return 0
 
 
 def main():
-    parser = argparse.ArgumentParser(prog='adaptiveperfhtml',
-                                     description='AdaptivePerfHTML web server')
+    # "adaptiveperfhtml precompute/import ..." are handled separately so
+    # that "adaptiveperfhtml PATH" keeps working as before.
+    if len(sys.argv) > 1 and sys.argv[1] == 'precompute':
+        return precompute_main(sys.argv[2:])
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        return import_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(
+        prog='adaptiveperfhtml',
+        description='AdaptivePerfHTML web server (run "adaptiveperfhtml '
+        'precompute -h" for precomputing session data in advance and '
+        '"adaptiveperfhtml import -h" for converting sessions to indexed '
+        'stores)')
 
     parser.add_argument('results', metavar='PATH',
                         help='path to a profiling results directory '
@@ -31,31 +204,123 @@ def main():
                         'website display all captured off-CPU regions), '
                         'default: 0',
                         default=0)
+    parser.add_argument('-m',
+                        metavar='SIZE',
+                        dest='session_cache_size',
+                        help='maximum total size in MiB of session files '
+                        'kept parsed in memory between requests by all '
+                        'workers (0 disables caching sessions), default: 256',
+                        default=256)
+    parser.add_argument('-w', '--workers',
+                        metavar='N',
+                        dest='workers',
+                        type=int,
+                        help='number of worker processes handling requests '
+                        'in parallel, default: 1',
+                        default=1)
+    parser.add_argument('--threads',
+                        metavar='N',
+                        dest='threads',
+                        type=int,
+                        help='number of threads handling requests in every '
+                        'worker process (ignored by the gevent worker '
+                        'class), default: 4',
+                        default=4)
+    parser.add_argument('-k', '--worker-class',
+                        dest='worker_class',
+                        choices=['sync', 'gthread', 'gevent'],
+                        help='Gunicorn worker class ("gevent" requires '
+                        'the gevent package), default: gthread',
+                        default='gthread')
+    parser.add_argument('--timeout',
+                        metavar='SECONDS',
+                        dest='timeout',
+                        type=int,
+                        help='number of seconds after which a worker '
+                        'process handling a request is restarted, '
+                        'default: 120',
+                        default=120)
+    parser.add_argument('--preload',
+                        dest='preload',
+                        action='store_true',
+                        help='load the website before starting worker '
+                        'processes, so that they share the loaded code and '
+                        'the index of profiling sessions')
+    parser.add_argument('--shared-cache-size',
+                        metavar='SIZE',
+                        dest='shared_cache_size',
+                        type=int,
+                        help='maximum size in MiB of the cache of responses '
+                        'shared by all worker processes (0 disables it), '
+                        'default: 256',
+                        default=256)
+    parser.add_argument('--create-stores',
+                        dest='create_stores',
+                        action='store_true',
+                        help='convert every session to an indexed store '
+                        'the first time it is opened, in the same way as '
+                        '"adaptiveperfhtml import" does')
+    parser.add_argument('--merge-processes',
+                        metavar='N',
+                        dest='merge_processes',
+                        type=int,
+                        help='number of processes merging the flame graphs '
+                        'of all threads/processes of a process or a session '
+                        'for a single request (1 merges them in the worker '
+                        'process handling the request), default: 1',
+                        default=1)
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
 
-    result_path = Path(args.results)
+    result_path = check_results_path('adaptiveperfhtml', args.results)
 
-    if not result_path.exists():
-        print(f'adaptiveperfhtml: error: {result_path} does not exist',
-              file=sys.stderr)
-        return 1
-    elif not result_path.is_dir():
-        print(f'adaptiveperfhtml: error: {result_path} is not a directory',
-              file=sys.stderr)
+    if result_path is None:
         return 1
 
-    result_path = result_path.resolve()
+    if args.workers < 1 or args.threads < 1 or args.merge_processes < 1:
+        print('adaptiveperfhtml: error: the numbers of workers, threads, '
+              'and merge processes must be positive', file=sys.stderr)
+        return 1
 
+    # The memory budget of the session cache is shared by all workers.
     env = os.environ.copy()
     env.update({
         'FLASK_PROFILING_STORAGE': str(result_path),
-        'FLASK_OFFCPU_SAMPLING': str(args.off_cpu_sampling)
+        'FLASK_OFFCPU_SAMPLING': str(args.off_cpu_sampling),
+        'FLASK_SESSION_CACHE_SIZE': str(int(args.session_cache_size) //
+                                        args.workers),
+        'FLASK_CACHE_SIZE': str(args.cache_size),
+        'FLASK_SHARED_CACHE_SIZE': str(args.shared_cache_size),
+        'FLASK_CREATE_STORES': 'true' if args.create_stores else 'false',
+        'FLASK_MERGE_PROCESSES': str(args.merge_processes)
     })
 
+    gunicorn_args = ['gunicorn', '-b', args.address,
+                     '-w', str(args.workers),
+                     '-k', args.worker_class,
+                     '-t', str(args.timeout)]
+
+    if args.worker_class != 'gevent':
+        gunicorn_args += ['--threads', str(args.threads)]
+
+    if args.preload:
+        gunicorn_args.append('--preload')
+
     try:
-        return subprocess.run(['gunicorn', '-b', args.address,
-                               'adaptiveperf.app:app'],
-                              env=env).returncode
+        with tempfile.TemporaryDirectory(
+                prefix='adaptiveperfhtml-') as tmp_dir:
+            # Unless a cache directory is chosen, the shared cache lives
+            # only as long as the server.
+            if args.cache_dir is not None:
+                cache_dir = Path(args.cache_dir).resolve()
+                env['FLASK_CACHE_DIR'] = str(cache_dir)
+                env['FLASK_SHARED_CACHE'] = str(cache_dir / 'shared.sqlite3')
+            else:
+                env['FLASK_SHARED_CACHE'] = str(Path(tmp_dir) /
+                                                'shared.sqlite3')
+
+            return subprocess.run(gunicorn_args + ['adaptiveperf.app:app'],
+                                  env=env).returncode
     except KeyboardInterrupt:
         return 130
@@ -0,0 +1,1458 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import re
+import json
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from json.decoder import scanstring
+from .wire import BinaryEncoder
+
+
+# Threshold interval bounds are narrowed by this relative margin so that
+# floating-point rounding in "value < threshold * total" cannot make
+# a threshold inside an interval produce a different flame graph.
+_INTERVAL_MARGIN = 1e-9
+
+
+class FlameGraph:
+    """
+    A class describing a flame graph in a columnar form, i.e. with its
+    blocks stored in parallel arrays rather than nested dictionaries
+    (as returned by json.load() for {pid}_{tid}.json files).
+
+    Blocks are indexed in preorder, with the root having index 0.
+    For every block, the following is stored: the index of its parent
+    (-1 for the root), the ID of its name in the interned string table,
+    its value, the index of its first child and its next sibling (-1 if
+    there is none), and the size of its subtree. Any other block
+    properties (e.g. "cold" or "offsets") are kept as pre-serialized JSON
+    fragments, as they are only passed through to the website.
+    """
+
+    def __init__(self):
+        """
+        Construct an empty FlameGraph object. Blocks should be added in
+        preorder with _add_block() and described with _set_block() (at any
+        time), followed by calling _finish(). Use from_dict() for
+        converting a flame graph in form of nested dictionaries and
+        read_flame_graphs() for reading flame graphs from a file.
+        """
+        self._parent = array('i')
+        self._name = array('i')
+        self._value = array('q')
+        self._first_child = array('i')
+        self._next_sibling = array('i')
+        self._last_child = array('i')
+        self._subtree_size = None
+        self._extra = []
+        self._names = []
+        self._encoded_names = []
+        self._name_ids = {}
+        self._extra_strings = {}
+
+    def from_dict(tree):
+        """
+        Convert a flame graph in form of nested {"name": ...,
+        "value": ..., "children": [...]} dictionaries to a FlameGraph
+        object.
+
+        :param dict tree: The root of a flame graph.
+        """
+        graph = FlameGraph()
+        stack = [(tree, -1)]
+
+        while len(stack) > 0:
+            node, parent = stack.pop()
+
+            if len(node) > 3:
+                extra = ', '.join(json.dumps(k) + ': ' + json.dumps(v)
+                                  for k, v in node.items()
+                                  if k not in ['name', 'value', 'children'])
+            else:
+                extra = None
+
+            index = graph._add_block(parent)
+            graph._set_block(index, node['name'], node['value'], extra)
+
+            children = node['children']
+
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], index))
+
+        graph._finish()
+        return graph
+
+    def _add_block(self, parent: int) -> int:
+        index = len(self._parent)
+
+        self._parent.append(parent)
+        self._name.append(-1)
+        self._value.append(0)
+        self._first_child.append(-1)
+        self._next_sibling.append(-1)
+        self._last_child.append(-1)
+
+        if parent != -1:
+            last_child = self._last_child[parent]
+
+            if last_child == -1:
+                self._first_child[parent] = index
+            else:
+                self._next_sibling[last_child] = index
+
+            self._last_child[parent] = index
+
+        self._extra.append(None)
+
+        return index
+
+    def _set_block(self, index: int, name, value, extra: str):
+        name_id = self._name_ids.get(name)
+
+        if name_id is None:
+            name_id = len(self._names)
+            self._names.append(name)
+            self._encoded_names.append(json.dumps(name))
+            self._name_ids[name] = name_id
+
+        if isinstance(value, float) and self._value.typecode == 'q':
+            self._value = array('d', self._value)
+
+        self._name[index] = name_id
+        self._value[index] = value
+
+        if extra is not None:
+            self._extra[index] = self._extra_strings.setdefault(extra, extra)
+
+    def _finish(self):
+        parent = self._parent
+        subtree_size = array('i', [1]) * len(parent)
+
+        for i in range(len(parent) - 1, 0, -1):
+            subtree_size[parent[i]] += subtree_size[i]
+
+        self._subtree_size = subtree_size
+        self._last_child = None
+        self._extra_strings = None
+
+    # The magic bytes of the serialized form (see to_bytes()).
+    MAGIC = b'AFG1'
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the flame graph, so that it can be restored with
+        from_bytes() without parsing its JSON file again.
+
+        Layout (integers are in the native byte order, as the flame graph
+        is meant to be restored on the machine it is serialized on):
+        * the "AFG1" magic bytes,
+        * the number of blocks N (unsigned 64-bit),
+        * the type code of the values ("q" for integers or "d" for
+          floating-point numbers),
+        * the parent, name ID, value, first child, next sibling, and
+          subtree size arrays of N elements each,
+        * the UTF-8 JSON list of the names (indexed by name IDs) and
+          the list of the pre-serialized other properties of blocks.
+        """
+        return b''.join([
+            FlameGraph.MAGIC,
+            struct.pack('=Qc', len(self._parent),
+                        self._value.typecode.encode()),
+            self._parent.tobytes(),
+            self._name.tobytes(),
+            self._value.tobytes(),
+            self._first_child.tobytes(),
+            self._next_sibling.tobytes(),
+            self._subtree_size.tobytes(),
+            json.dumps([self._names, self._extra]).encode('utf-8')
+        ])
+
+    def from_bytes(data: bytes):
+        """
+        Restore a flame graph serialized with to_bytes().
+
+        :param bytes data: The serialized flame graph.
+        :raises ValueError: When the data is not a serialized flame graph.
+        """
+        view = memoryview(data)
+        offset = len(FlameGraph.MAGIC) + struct.calcsize('=Qc')
+
+        if len(view) < offset or \
+           bytes(view[:len(FlameGraph.MAGIC)]) != FlameGraph.MAGIC:
+            raise ValueError('The data is not a serialized flame graph!')
+
+        count, typecode = struct.unpack_from('=Qc', view,
+                                             len(FlameGraph.MAGIC))
+        graph = FlameGraph()
+
+        for attribute, code in [('_parent', 'i'), ('_name', 'i'),
+                                ('_value', typecode.decode()),
+                                ('_first_child', 'i'),
+                                ('_next_sibling', 'i'),
+                                ('_subtree_size', 'i')]:
+            values = array(code)
+            size = count * values.itemsize
+
+            if len(view) < offset + size:
+                raise ValueError('The serialized flame graph is truncated!')
+
+            values.frombytes(view[offset:offset + size])
+            setattr(graph, attribute, values)
+            offset += size
+
+        graph._names, graph._extra = json.loads(
+            bytes(view[offset:]).decode('utf-8'))
+        graph._encoded_names = [json.dumps(x) for x in graph._names]
+        graph._last_child = None
+        graph._extra_strings = None
+
+        return graph
+
+    def get_children(self, index: int) -> list:
+        """
+        Get the list of indices of the children of a block.
+
+        :param int index: The index of a block.
+        """
+        result = []
+        child = self._first_child[index]
+
+        while child != -1:
+            result.append(child)
+            child = self._next_sibling[child]
+
+        return result
+
+    def get_name(self, index: int):
+        return self._names[self._name[index]]
+
+    def rename(self, names: dict):
+        """
+        Get a copy of the flame graph with block names replaced according
+        to a given dictionary (the names absent from the dictionary are
+        kept). Several names can be replaced with the same one, in which
+        case the copy can have sibling blocks with the same name.
+
+        :param dict names: The dictionary mapping old names to new ones.
+        """
+        graph = FlameGraph()
+        graph._parent = self._parent
+        graph._name = array('i', [0]) * len(self._name)
+        graph._value = self._value
+        graph._first_child = self._first_child
+        graph._next_sibling = self._next_sibling
+        graph._subtree_size = self._subtree_size
+        graph._extra = self._extra
+        graph._last_child = None
+        graph._extra_strings = None
+
+        name_ids = []
+
+        for name in self._names:
+            name = names.get(name, name)
+            name_id = graph._name_ids.get(name)
+
+            if name_id is None:
+                name_id = len(graph._names)
+                graph._names.append(name)
+                graph._encoded_names.append(json.dumps(name))
+                graph._name_ids[name] = name_id
+
+            name_ids.append(name_id)
+
+        for i, name_id in enumerate(self._name):
+            graph._name[i] = name_ids[name_id]
+
+        return graph
+
+    def get_value(self, index: int):
+        return self._value[index]
+
+    def get_function_values(self) -> dict:
+        """
+        Get the total and self values of every function (i.e. block name)
+        in the flame graph apart from the root, computed in one pass over
+        the blocks.
+
+        The total value of a function is the sum of the values of its
+        blocks, excluding the blocks nested in another block of the same
+        function (so that recursive calls are not counted twice). The self
+        value of a function is the sum of the values of its blocks minus
+        the values of their children.
+
+        :return: The dictionary mapping function names to [total, self]
+                 lists.
+        """
+        count = len(self._parent)
+        self_values = array(self._value.typecode, self._value)
+
+        for i in range(1, count):
+            self_values[self._parent[i]] -= self._value[i]
+
+        totals = [0] * len(self._names)
+        selfs = [0] * len(self._names)
+        present = [False] * len(self._names)
+        active = [0] * len(self._names)
+
+        # Every item is (the index following the subtree of a block,
+        # the name ID of the block) for the blocks on the current path.
+        stack = []
+
+        for i in range(1, count):
+            while len(stack) > 0 and stack[-1][0] <= i:
+                active[stack.pop()[1]] -= 1
+
+            name_id = self._name[i]
+
+            if active[name_id] == 0:
+                totals[name_id] += self._value[i]
+
+            selfs[name_id] += self_values[i]
+            present[name_id] = True
+            active[name_id] += 1
+            stack.append((i + self._subtree_size[i], name_id))
+
+        return {name: [totals[j], selfs[j]]
+                for j, name in enumerate(self._names) if present[j]}
+
+    def compress(self, compress_threshold: float,
+                 time_ordered: bool):
+        """
+        Collapse the blocks taking less than a specified share of total
+        samples into "(compressed)" blocks, which can be expanded at
+        runtime by d3-flame-graph. The flame graph itself is not modified.
+
+        Apart from collapsing the blocks, the threshold interval which
+        the result is valid for is determined. That is, compressing
+        the same flame graph with any threshold t such that
+        lo < t <= hi produces exactly the same result as compressing it
+        with compress_threshold. The interval is available through
+        the "lo" and "hi" properties of the returned object.
+
+        :param float compress_threshold: A compression threshold. For
+                                         example, if its value is 0.10,
+                                         blocks taking less than 10% of
+                                         total samples will be collapsed.
+        :param bool time_ordered: Whether the flame graph is time-ordered.
+        :return: A CompressedFlameGraph object.
+        """
+        result = CompressedFlameGraph(self)
+
+        n = len(self._parent)
+        value = self._value
+        first_child = self._first_child
+        next_sibling = self._next_sibling
+        start = result._start
+        end = result._end
+        items = result._items
+        block_value = result._block_value
+
+        lo = float('-inf')
+        hi = float('inf')
+
+        # Hidden children of "(compressed)" blocks waiting in the queue.
+        # Only original blocks can be hidden children.
+        pending = {}
+
+        def new_block(compressed_value, hidden_children):
+            block = n + len(block_value)
+            block_value.append(compressed_value)
+            start.append(0)
+            end.append(0)
+            pending[block] = hidden_children
+            return block
+
+        queue = [(0, value[0], False)]
+
+        while len(queue) > 0:
+            result_block, total, parent_is_compressed = queue.pop()
+
+            if result_block < n:
+                children = []
+                child = first_child[result_block]
+
+                while child != -1:
+                    children.append(child)
+                    child = next_sibling[child]
+            else:
+                children = pending.pop(result_block)
+
+            new_children = []
+            compressed_value = 0
+            hidden_children = []
+            compressed_children = []
+            limit = compress_threshold * total
+            max_compressed_value = None
+            min_uncompressed_value = None
+
+            for child in children:
+                child_value = value[child]
+
+                if child_value < limit:
+                    compressed_children.append(True)
+
+                    if max_compressed_value is None or \
+                       child_value > max_compressed_value:
+                        max_compressed_value = child_value
+                else:
+                    compressed_children.append(False)
+                    queue.append((child, total, False))
+
+                    if min_uncompressed_value is None or \
+                       child_value < min_uncompressed_value:
+                        min_uncompressed_value = child_value
+
+            if total > 0:
+                if max_compressed_value is not None:
+                    lo = max(lo, max_compressed_value / total *
+                             (1 + _INTERVAL_MARGIN))
+
+                if min_uncompressed_value is not None:
+                    hi = min(hi, min_uncompressed_value / total *
+                             (1 - _INTERVAL_MARGIN))
+
+            for i, child in enumerate(children):
+                if time_ordered:
+                    if compressed_children[i]:
+                        compressed_value += value[child]
+                        hidden_children.append(child)
+                    else:
+                        if compressed_value > 0:
+                            if compressed_value == total \
+                               and parent_is_compressed:
+                                new_children += hidden_children
+                            else:
+                                block = new_block(compressed_value,
+                                                  hidden_children)
+                                queue.append((block, compressed_value,
+                                              True))
+                                new_children.append(block)
+
+                            compressed_value = 0
+                            hidden_children = []
+
+                        new_children.append(child)
+                else:
+                    if compressed_children[i]:
+                        compressed_value += value[child]
+                        hidden_children.append(child)
+                    else:
+                        new_children.append(child)
+
+            if compressed_value > 0:
+                if len(hidden_children) == 1 and \
+                   first_child[hidden_children[0]] == -1:
+                    new_children += hidden_children
+                elif compressed_value == total and parent_is_compressed:
+                    if len(hidden_children) > 1:
+                        part1_cnt = len(hidden_children) // 2
+
+                        compressed_value_part1 = 0
+                        for i in range(part1_cnt):
+                            compressed_value_part1 += \
+                                value[hidden_children[i]]
+
+                        compressed_value_part2 = compressed_value - \
+                            compressed_value_part1
+
+                        block1 = new_block(compressed_value_part1,
+                                           hidden_children[:part1_cnt])
+                        block2 = new_block(compressed_value_part2,
+                                           hidden_children[part1_cnt:])
+
+                        queue.append((block1, compressed_value_part1, True))
+                        queue.append((block2, compressed_value_part2, True))
+
+                        new_children.append(block1)
+                        new_children.append(block2)
+                    else:
+                        new_children += hidden_children
+                else:
+                    block = new_block(compressed_value, hidden_children)
+                    queue.append((block, compressed_value, True))
+                    new_children.append(block)
+
+            start[result_block] = len(items)
+            items.extend(new_children)
+            end[result_block] = len(items)
+
+        # Chains of "(compressed)" blocks with only one "(compressed)"
+        # block hidden inside are flattened.
+        deleted_blocks = set()
+        for block in range(n, n + len(block_value)):
+            if block in deleted_blocks:
+                continue
+
+            while end[block] - start[block] == 1 and \
+                    items[start[block]] >= n:
+                hidden_block = items[start[block]]
+                deleted_blocks.add(hidden_block)
+                start[block] = start[hidden_block]
+                end[block] = end[hidden_block]
+
+        result._lo = lo
+        result._hi = hi
+
+        return result
+
+
+def merge_flame_graphs(graphs: list) -> FlameGraph:
+    """
+    Merge flame graphs into one non-time-ordered flame graph, where
+    the roots of all flame graphs are merged into one root and blocks
+    with the same name and the same parent are merged recursively into
+    one block, with the values added up. The other properties of
+    a merged block (e.g. "cold") are taken from the first block merged
+    into it, and the blocks are in the order of their first appearance.
+
+    :param list graphs: The non-empty list of FlameGraph objects.
+    """
+    result = FlameGraph()
+
+    # Every item is (the list of (graph, block) pairs merged into one
+    # block, the parent of the merged block in the result).
+    stack = [([(graph, 0) for graph in graphs], -1)]
+
+    while len(stack) > 0:
+        sources, parent = stack.pop()
+        first_graph, first_block = sources[0]
+        index = result._add_block(parent)
+        groups = {}
+
+        for graph, block in sources:
+            child = graph._first_child[block]
+
+            while child != -1:
+                name = graph._names[graph._name[child]]
+                group = groups.get(name)
+
+                if group is None:
+                    groups[name] = [(graph, child)]
+                else:
+                    group.append((graph, child))
+
+                child = graph._next_sibling[child]
+
+        result._set_block(index, first_graph.get_name(first_block),
+                          sum(graph._value[block]
+                              for graph, block in sources),
+                          first_graph._extra[first_block])
+
+        for group in reversed(list(groups.values())):
+            stack.append((group, index))
+
+    result._finish()
+    return result
+
+
+def diff_flame_graphs(baseline: FlameGraph, new: FlameGraph) -> FlameGraph:
+    """
+    Compute a differential flame graph of two non-time-ordered flame
+    graphs (i.e. with unique names among siblings, see
+    merge_flame_graphs()), where the blocks of both flame graphs are
+    aligned by call path (the roots are always aligned with each other).
+
+    Every block of the result has the value of its counterpart in
+    the new flame graph (0 if there is none), so the result has
+    the shape of the new flame graph, and the following extra
+    properties: "baseline" (the value of its counterpart in the baseline
+    flame graph, 0 if there is none) and "delta" (the new value minus
+    the baseline one). The other properties are taken from the new
+    flame graph, or the baseline one for the blocks absent from the new
+    flame graph.
+
+    Both flame graphs are traversed together once, with the children of
+    every pair of aligned blocks merge-joined after sorting them by name.
+
+    :param FlameGraph baseline: The baseline flame graph.
+    :param FlameGraph new: The new flame graph.
+    """
+    result = FlameGraph()
+
+    def get_sorted_children(graph, block):
+        if block == -1:
+            return []
+
+        return sorted(graph.get_children(block), key=graph.get_name)
+
+    # Every item is (the block in the baseline flame graph, the block in
+    # the new one, the parent of the aligned block in the result), with
+    # -1 for a block without a counterpart.
+    stack = [(0, 0, -1)]
+
+    while len(stack) > 0:
+        a, b, parent = stack.pop()
+        baseline_value = 0 if a == -1 else baseline._value[a]
+        new_value = 0 if b == -1 else new._value[b]
+        graph, block = (baseline, a) if b == -1 else (new, b)
+        extra = f'"baseline": {json.dumps(baseline_value)}, ' \
+            f'"delta": {json.dumps(new_value - baseline_value)}'
+
+        if graph._extra[block] is not None:
+            extra = graph._extra[block] + ', ' + extra
+
+        index = result._add_block(parent)
+        result._set_block(index, graph.get_name(block), new_value, extra)
+
+        baseline_children = get_sorted_children(baseline, a)
+        new_children = get_sorted_children(new, b)
+        pairs = []
+        i = 0
+        j = 0
+
+        while i < len(baseline_children) or j < len(new_children):
+            if j == len(new_children):
+                pairs.append((baseline_children[i], -1))
+                i += 1
+                continue
+
+            if i == len(baseline_children):
+                pairs.append((-1, new_children[j]))
+                j += 1
+                continue
+
+            baseline_name = baseline.get_name(baseline_children[i])
+            new_name = new.get_name(new_children[j])
+
+            if baseline_name == new_name:
+                pairs.append((baseline_children[i], new_children[j]))
+                i += 1
+                j += 1
+            elif baseline_name < new_name:
+                pairs.append((baseline_children[i], -1))
+                i += 1
+            else:
+                pairs.append((-1, new_children[j]))
+                j += 1
+
+        for x, y in reversed(pairs):
+            stack.append((x, y, index))
+
+    result._finish()
+    return result
+
+
+class TimeIndex:
+    """
+    A class describing an index of a time-ordered flame graph allowing
+    the flame graph to be sliced to a time window (see slice()).
+
+    In a time-ordered flame graph, the children of every block are in
+    chronological order and laid out one after another from the start of
+    their parent, so every block spans the [offset, offset + value)
+    interval on the time axis (in the units of values), where the offset
+    is the prefix sum of the values of its preceding siblings plus
+    the offset of its parent. The index stores the children of every
+    block contiguously along with their offsets, so the children
+    overlapping a time window are found with binary search.
+    """
+
+    def __init__(self, graph: FlameGraph):
+        """
+        Construct a TimeIndex object.
+
+        :param FlameGraph graph: A time-ordered flame graph.
+        """
+        n = len(graph._parent)
+        value = graph._value
+        first_child = graph._first_child
+        next_sibling = graph._next_sibling
+        offsets = array(value.typecode, [0]) * n
+        child_start = array('i', [0]) * (n + 1)
+        child_items = array('i')
+        child_offsets = array(value.typecode)
+
+        # Blocks are in preorder, so the offset of every block is known
+        # before its children are visited.
+        for block in range(n):
+            child_start[block] = len(child_items)
+            offset = offsets[block]
+            child = first_child[block]
+
+            while child != -1:
+                offsets[child] = offset
+                child_items.append(child)
+                child_offsets.append(offset)
+                offset += value[child]
+                child = next_sibling[child]
+
+        child_start[n] = len(child_items)
+
+        self._graph = graph
+        self._child_start = child_start
+        self._child_items = child_items
+        self._child_offsets = child_offsets
+
+    @property
+    def graph(self):
+        return self._graph
+
+    def slice(self, start, end) -> FlameGraph:
+        """
+        Get the part of the flame graph within a time window, i.e.
+        a time-ordered flame graph with the blocks overlapping the window,
+        with their values reduced to the overlaps. The cost is
+        proportional to the size of the result (times the logarithm of
+        the number of siblings for the blocks crossing the window bounds)
+        rather than to the size of the flame graph.
+
+        :param start: The start of the window on the time axis (see
+                      the class docstring), inclusive.
+        :param end: The end of the window on the time axis, exclusive.
+        """
+        graph = self._graph
+        value = graph._value
+        child_start = self._child_start
+        child_items = self._child_items
+        child_offsets = self._child_offsets
+
+        result = FlameGraph()
+        stack = [(0, 0, -1)]
+
+        while len(stack) > 0:
+            block, offset, parent = stack.pop()
+            block_end = offset + value[block]
+            overlap = min(block_end, end) - max(offset, start)
+
+            if overlap <= 0 and parent != -1:
+                continue
+
+            index = result._add_block(parent)
+            result._set_block(index, graph.get_name(block), max(0, overlap),
+                              graph._extra[block])
+
+            first = child_start[block]
+            last = child_start[block + 1]
+
+            if start > offset:
+                first = max(first, bisect_right(child_offsets, start,
+                                                first, last) - 1)
+
+            if end < block_end:
+                last = bisect_left(child_offsets, end, first, last)
+
+            for i in range(last - 1, first - 1, -1):
+                stack.append((child_items[i], child_offsets[i], index))
+
+        result._finish()
+        return result
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+_BLOCK_HEAD = re.compile(
+    r'[ \t\n\r]*"name"[ \t\n\r]*:[ \t\n\r]*"([^"\\\x00-\x1f]*)"'
+    r'[ \t\n\r]*,[ \t\n\r]*"value"[ \t\n\r]*:[ \t\n\r]*'
+    r'(-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?)'
+    r'[ \t\n\r]*,[ \t\n\r]*"children"[ \t\n\r]*:[ \t\n\r]*\[')
+_MAX_SCALAR_LENGTH = 64
+_LITERALS = {'t': ('true', True), 'f': ('false', False), 'n': ('null', None)}
+
+
+class _JSONReader:
+    # A minimal pull-based JSON tokenizer reading a file in chunks, so
+    # that only a chunk of the file is in memory at a time (unlike with
+    # json.load()). Tokens are returned as (kind, value) pairs, where
+    # kind is a punctuation character ("{", "}", "[", "]", ":", ","),
+    # '"' for strings, or "v" for numbers and literals.
+
+    def __init__(self, f, on_progress, chunk_size):
+        self._f = f
+        self._on_progress = on_progress
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._read = 0
+        self._eof = False
+
+    def _fill(self, pos) -> bool:
+        # Drop the consumed part of the buffer (before pos) and append
+        # the next chunk of the file. False is returned at the end of
+        # the file.
+        if self._eof:
+            return False
+
+        chunk = self._f.read(self._chunk_size)
+
+        if len(chunk) == 0:
+            self._eof = True
+            return False
+
+        self._read += len(chunk)
+        self._buf = self._buf[pos:] + chunk
+        self._pos = 0
+
+        if self._on_progress is not None:
+            self._on_progress(self._read)
+
+        return True
+
+    def error(self, message):
+        return ValueError(f'{message} (around character '
+                          f'{self._read - len(self._buf) + self._pos})')
+
+    def next_token(self):
+        while True:
+            buf = self._buf
+            pos = _WHITESPACE.match(buf, self._pos).end()
+
+            if pos == len(buf):
+                if self._fill(pos):
+                    continue
+
+                raise self.error('Unexpected end of file')
+
+            char = buf[pos]
+
+            if char in '{}[],:':
+                self._pos = pos + 1
+                return char, None
+
+            if char == '"':
+                try:
+                    value, end = scanstring(buf, pos + 1)
+                except ValueError:
+                    # The string may continue in the next chunk.
+                    if self._fill(pos):
+                        continue
+
+                    raise
+
+                self._pos = end
+                return '"', value
+
+            # Numbers and literals are short, so they are read only when
+            # they cannot be cut off at the end of the buffer.
+            if len(buf) - pos < _MAX_SCALAR_LENGTH and self._fill(pos):
+                continue
+
+            if char in _LITERALS:
+                literal, value = _LITERALS[char]
+
+                if not buf.startswith(literal, pos):
+                    raise self.error('Invalid literal')
+
+                self._pos = pos + len(literal)
+                return 'v', value
+
+            match = _NUMBER.match(buf, pos)
+
+            if match is None:
+                raise self.error(f'Unexpected character {char!r}')
+
+            number = match.group()
+            self._pos = match.end()
+
+            if match.group(1) is None and match.group(2) is None:
+                return 'v', int(number)
+
+            return 'v', float(number)
+
+    def expect(self, kind):
+        token_kind, value = self.next_token()
+
+        if token_kind != kind:
+            raise self.error(f'Expected {kind!r}')
+
+        return value
+
+    def read_value(self, kind=None, value=None):
+        # Read any JSON value, starting with a given token if it has
+        # already been read. Used for small values only (e.g. extra
+        # block properties), so recursion is fine here.
+        if kind is None:
+            kind, value = self.next_token()
+
+        if kind in ['"', 'v']:
+            return value
+
+        if kind == '[':
+            result = []
+            kind, value = self.next_token()
+
+            if kind == ']':
+                return result
+
+            while True:
+                result.append(self.read_value(kind, value))
+                kind, _ = self.next_token()
+
+                if kind == ']':
+                    return result
+
+                if kind != ',':
+                    raise self.error("Expected ',' or ']'")
+
+                kind, value = self.next_token()
+
+        if kind == '{':
+            result = {}
+            kind, key = self.next_token()
+
+            if kind == '}':
+                return result
+
+            while True:
+                if kind != '"':
+                    raise self.error('Expected a key')
+
+                self.expect(':')
+                result[key] = self.read_value()
+                kind, _ = self.next_token()
+
+                if kind == '}':
+                    return result
+
+                if kind != ',':
+                    raise self.error("Expected ',' or '}'")
+
+                kind, key = self.next_token()
+
+        raise self.error(f'Unexpected {kind!r}')
+
+    def read_tree(self) -> FlameGraph:
+        # Read a flame graph in form of nested {"name": ..., "value": ...,
+        # "children": [...]} objects, whose opening brace has already been
+        # read, directly into a FlameGraph object. Blocks are added
+        # when their objects open (i.e. in preorder), while their names,
+        # values, and other properties are set when their objects close.
+        graph = FlameGraph()
+        next_token = self.next_token
+
+        # Every frame is [index, name, value, list of other properties].
+        frames = [[graph._add_block(-1), None, None, None]]
+        object_start = True
+
+        while len(frames) > 0:
+            if object_start:
+                # Fast path: blocks usually start with "name", "value",
+                # and "children" (with no escape sequences in the name),
+                # which can be read at once.
+                match = _BLOCK_HEAD.match(self._buf, self._pos)
+
+                if match is not None:
+                    frame = frames[-1]
+                    frame[1] = match.group(1)
+
+                    if match.group(3) is None and match.group(4) is None:
+                        frame[2] = int(match.group(2))
+                    else:
+                        frame[2] = float(match.group(2))
+
+                    self._pos = match.end()
+                    object_start = False
+                    kind, _ = next_token()
+
+                    if kind == '{':
+                        frames.append([graph._add_block(frame[0]),
+                                       None, None, None])
+                        object_start = True
+                    elif kind != ']':
+                        raise self.error("Expected '{' or ']'")
+
+                    continue
+
+            kind, key = next_token()
+
+            if kind == '}':
+                index, name, value, extra = frames.pop()
+
+                if name is None or value is None:
+                    raise self.error('Block without "name" or "value"')
+
+                if extra is not None:
+                    extra = ', '.join(json.dumps(k) + ': ' + json.dumps(v)
+                                      for k, v in extra)
+
+                graph._set_block(index, name, value, extra)
+
+                if len(frames) > 0:
+                    # The block is a child, so the children list either
+                    # continues or ends.
+                    kind, _ = next_token()
+
+                    if kind == ',':
+                        self.expect('{')
+                        frames.append([graph._add_block(frames[-1][0]),
+                                       None, None, None])
+                        object_start = True
+                    elif kind == ']':
+                        object_start = False
+                    else:
+                        raise self.error("Expected ',' or ']'")
+
+                continue
+
+            if not object_start:
+                if kind != ',':
+                    raise self.error("Expected ',' or '}'")
+
+                kind, key = next_token()
+
+            if kind != '"':
+                raise self.error('Expected a key')
+
+            self.expect(':')
+            frame = frames[-1]
+            object_start = False
+
+            if key == 'children':
+                self.expect('[')
+                kind, _ = next_token()
+
+                if kind == '{':
+                    frames.append([graph._add_block(frame[0]),
+                                   None, None, None])
+                    object_start = True
+                elif kind != ']':
+                    raise self.error("Expected '{' or ']'")
+            elif key == 'name':
+                frame[1] = self.read_value()
+            elif key == 'value':
+                frame[2] = self.read_value()
+            elif frame[3] is None:
+                frame[3] = [(key, self.read_value())]
+            else:
+                frame[3].append((key, self.read_value()))
+
+        graph._finish()
+        return graph
+
+    def expect_end(self):
+        while _WHITESPACE.match(self._buf, self._pos).end() == \
+                len(self._buf):
+            if not self._fill(len(self._buf)):
+                return
+
+        raise self.error('Unexpected data after the end of JSON')
+
+
+def read_flame_graphs(f, on_progress=None, chunk_size: int = 1 << 20):
+    """
+    Read the flame graphs from a {pid}_{tid}.json file, i.e. a JSON
+    object mapping metrics to lists of flame graphs, incrementally.
+
+    Unlike json.load() followed by FlameGraph.from_dict(), the file is
+    read in chunks and every flame graph is built directly in the
+    columnar form, so the memory usage is proportional to the number of
+    blocks of a flame graph rather than to the size of the file (which is
+    several times smaller than the nested dictionaries json.load() would
+    produce). Flame graphs are yielded as soon as they are read, so that
+    they can be processed (e.g. compressed) before the next one is read.
+
+    :param f: The file object opened in the text mode.
+    :param on_progress: The function called with the number of characters
+                        read so far every time a chunk of the file is read.
+                        None for no function.
+    :param int chunk_size: The number of characters read at once.
+    :return: The generator of (metric, FlameGraph object) pairs, in
+             the order of the file.
+    :raises ValueError: When the file is not a valid JSON object of
+                        the expected structure.
+    """
+    reader = _JSONReader(f, on_progress, chunk_size)
+    reader.expect('{')
+    kind, metric = reader.next_token()
+
+    if kind == '}':
+        reader.expect_end()
+        return
+
+    while True:
+        if kind != '"':
+            raise reader.error('Expected a metric')
+
+        reader.expect(':')
+        reader.expect('[')
+        kind, _ = reader.next_token()
+
+        if kind != ']':
+            while True:
+                if kind != '{':
+                    raise reader.error('Expected a flame graph')
+
+                yield metric, reader.read_tree()
+                kind, _ = reader.next_token()
+
+                if kind == ']':
+                    break
+
+                if kind != ',':
+                    raise reader.error("Expected ',' or ']'")
+
+                kind, _ = reader.next_token()
+
+        kind, _ = reader.next_token()
+
+        if kind == '}':
+            reader.expect_end()
+            return
+
+        if kind != ',':
+            raise reader.error("Expected ',' or '}'")
+
+        kind, metric = reader.next_token()
+
+
+class CompressedFlameGraph:
+    """
+    A class describing the result of compressing a FlameGraph object
+    (see FlameGraph.compress()).
+
+    Blocks of a compressed flame graph are either blocks of the original
+    flame graph (with the same indices) or "(compressed)" blocks (with
+    indices starting from the number of original blocks, the offset
+    from which is their "compressed_id"). The children of every block
+    (or hidden children in case of "(compressed)" blocks) are stored
+    as a contiguous range of a single array. Original blocks which were
+    not visited during compression keep their original children.
+    """
+
+    def __init__(self, graph: FlameGraph):
+        n = len(graph._parent)
+
+        self._graph = graph
+        self._start = array('i', [-1]) * n
+        self._end = array('i', [-1]) * n
+        self._items = array('i')
+        self._block_value = array(graph._value.typecode)
+        self._sizes = None
+        self._lo = float('-inf')
+        self._hi = float('inf')
+
+    @property
+    def lo(self):
+        return self._lo
+
+    @property
+    def hi(self):
+        return self._hi
+
+    def _get_children(self, block: int):
+        if self._start[block] == -1:
+            return self._graph.get_children(block)
+
+        return self._items[self._start[block]:self._end[block]]
+
+    def _get_sizes(self) -> array:
+        if self._sizes is not None:
+            return self._sizes
+
+        n = len(self._graph._parent)
+        original_sizes = self._graph._subtree_size
+        sizes = array('i', [0]) * len(self._start)
+        stack = [(0, False)]
+
+        while len(stack) > 0:
+            block, visited = stack.pop()
+
+            if block < n and self._start[block] == -1:
+                sizes[block] = original_sizes[block]
+            elif visited:
+                size = 1
+
+                for child in self._get_children(block):
+                    size += sizes[child]
+
+                sizes[block] = size
+            else:
+                stack.append((block, True))
+                stack.extend((c, False) for c in self._get_children(block))
+
+        self._sizes = sizes
+        return sizes
+
+    def find(self, index: int):
+        """
+        Get the internal ID of the block with a given preorder index
+        (which can be passed to to_json()), or None if there is no
+        such block.
+
+        The preorder takes into account both "children" and
+        "hidden_children" of blocks, so the index of every block
+        is stable as long as the flame graph stays the same.
+
+        :param int index: The preorder index of a block, where 0
+                          corresponds to the root.
+        """
+        sizes = self._get_sizes()
+
+        if index < 0 or index >= sizes[0]:
+            return None
+
+        block = 0
+        current = 0
+
+        while current != index:
+            current += 1
+
+            for child in self._get_children(block):
+                if index < current + sizes[child]:
+                    block = child
+                    break
+
+                current += sizes[child]
+
+        return block
+
+    def to_json(self, block: int = 0, max_depth: int = None,
+                id_prefix: str = '', first_index: int = 0) -> str:
+        """
+        Serialize the compressed flame graph (or its subtree) to a JSON
+        string in the format expected by d3-flame-graph.
+
+        If max_depth is set, only the top max_depth + 1 levels are
+        serialized, where blocks hidden inside "(compressed)" blocks
+        are treated as one level deeper than their "(compressed)" blocks.
+        The blocks at the last level which have any children are replaced
+        with stubs, i.e. blocks with the same name, value, and other
+        properties, but with no children. Instead, every stub has
+        the "stub_id" key set to <id_prefix><preorder index of the block>
+        (see find()), so that its subtree can be fetched later.
+
+        :param int block: The internal ID of the block to start from
+                          (see find()), 0 corresponds to the root.
+        :param int max_depth: The maximum depth of the serialized flame
+                              graph (0 means that only the first block is
+                              included). If it is None, the depth
+                              is not limited.
+        :param str id_prefix: The prefix of stub IDs.
+        :param int first_index: The preorder index of the first block.
+        """
+        graph = self._graph
+        n = len(graph._parent)
+        names = graph._name
+        encoded_names = graph._encoded_names
+        value = graph._value
+        extra = graph._extra
+        block_value = self._block_value
+        sizes = None if max_depth is None else self._get_sizes()
+
+        parts = []
+        stack = [(block, 0)]
+        index = first_index - 1
+
+        while len(stack) > 0:
+            item = stack.pop()
+
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+
+            block, depth = item
+            index += 1
+            children = self._get_children(block)
+
+            if block < n:
+                head = '{"name": ' + encoded_names[names[block]] + \
+                    ', "value": ' + repr(value[block]) + ', "children": ['
+                tail = ']}' if extra[block] is None else \
+                    '], ' + extra[block] + '}'
+            else:
+                head = '{"name": "(compressed)", "value": ' + \
+                    repr(block_value[block - n]) + \
+                    ', "children": [], "compressed_id": ' + \
+                    str(block - n) + ', "hidden_children": ['
+                tail = ']}'
+
+            if max_depth is not None and depth >= max_depth and \
+               len(children) > 0:
+                stub_id = json.dumps(f'{id_prefix}{index}')
+
+                if block < n:
+                    parts.append(head + tail[:-1] + ', "stub_id": ' +
+                                 stub_id + '}')
+                else:
+                    parts.append(head[:-len(', "hidden_children": [')] +
+                                 ', "stub_id": ' + stub_id + '}')
+
+                index += sizes[block] - 1
+                continue
+
+            parts.append(head)
+            stack.append(tail)
+
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], depth + 1))
+
+                if i > 0:
+                    stack.append(', ')
+
+        return ''.join(parts)
+
+    def encode_binary(self, encoder: BinaryEncoder, block: int = 0,
+                      max_depth: int = None, id_prefix: str = '',
+                      first_index: int = 0):
+        """
+        Write the compressed flame graph (or its subtree) to a binary
+        wire format encoder, with the same result as encoding the object
+        serialized by to_json() but without building the JSON string.
+        Only the extra block properties (e.g. "cold" or "offsets") are
+        parsed from their pre-serialized JSON fragments.
+
+        :param BinaryEncoder encoder: The encoder.
+        :param int block: See to_json().
+        :param int max_depth: See to_json().
+        :param str id_prefix: See to_json().
+        :param int first_index: See to_json().
+        """
+        graph = self._graph
+        n = len(graph._parent)
+        names = graph._name
+        name_strings = graph._names
+        value = graph._value
+        extra = graph._extra
+        block_value = self._block_value
+        sizes = None if max_depth is None else self._get_sizes()
+        parsed_extra = {}
+
+        def get_extra(block):
+            if extra[block] is None:
+                return {}
+
+            result = parsed_extra.get(extra[block])
+
+            if result is None:
+                result = json.loads('{' + extra[block] + '}')
+                parsed_extra[extra[block]] = result
+
+            return result
+
+        # The extra properties of a block follow its children, so they
+        # are pushed to the stack as dictionaries.
+        stack = [(block, 0)]
+        index = first_index - 1
+
+        while len(stack) > 0:
+            item = stack.pop()
+
+            if isinstance(item, dict):
+                for k, v in item.items():
+                    encoder.write_key(k)
+                    encoder.write(v)
+
+                continue
+
+            block, depth = item
+            index += 1
+            children = self._get_children(block)
+            is_stub = max_depth is not None and depth >= max_depth and \
+                len(children) > 0
+
+            if block < n:
+                properties = get_extra(block)
+                encoder.begin_object(3 + len(properties) + int(is_stub))
+                encoder.write_key('name')
+                encoder.write(name_strings[names[block]])
+                encoder.write_key('value')
+                encoder.write(value[block])
+                encoder.write_key('children')
+
+                if is_stub:
+                    encoder.begin_array(0)
+                    stack.append({**properties,
+                                  'stub_id': f'{id_prefix}{index}'})
+                else:
+                    encoder.begin_array(len(children))
+                    stack.append(properties)
+            else:
+                encoder.begin_object(5)
+                encoder.write_key('name')
+                encoder.write('(compressed)')
+                encoder.write_key('value')
+                encoder.write(block_value[block - n])
+                encoder.write_key('children')
+                encoder.begin_array(0)
+                encoder.write_key('compressed_id')
+                encoder.write(block - n)
+
+                if is_stub:
+                    encoder.write_key('stub_id')
+                    encoder.write(f'{id_prefix}{index}')
+                else:
+                    encoder.write_key('hidden_children')
+                    encoder.begin_array(len(children))
+
+            if is_stub:
+                index += sizes[block] - 1
+                continue
+
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], depth + 1))
+
+
+class ThresholdIndex:
+    """
+    A class describing a sorted set of disjoint compression threshold
+    intervals, each corresponding to one distinct result of compressing
+    the flame graphs of a thread/process (see FlameGraph.compress()).
+
+    Looking up the interval a threshold falls into is a binary search,
+    so a flame graph computed once can be reused for every threshold
+    within its interval (e.g. when a user changes the threshold
+    only slightly).
+    """
+
+    def __init__(self, intervals=[]):
+        """
+        Construct a ThresholdIndex object.
+
+        :param list intervals: The list of (lo, hi) pairs the index
+                               should initially consist of.
+        """
+        self._lows = array('d')
+        self._highs = array('d')
+
+        for lo, hi in intervals:
+            self.add(lo, hi)
+
+    def find(self, threshold):
+        """
+        Get the (lo, hi) interval such that lo < threshold <= hi, or None
+        if the threshold is not covered by the index.
+
+        :param float threshold: A compression threshold.
+        """
+        i = bisect_left(self._lows, threshold) - 1
+
+        if i >= 0 and threshold <= self._highs[i]:
+            return self._lows[i], self._highs[i]
+
+        return None
+
+    def add(self, lo, hi):
+        """
+        Add a new interval to the index. Intervals overlapping
+        the existing ones are ignored.
+
+        :param float lo: The exclusive lower bound of the interval.
+        :param float hi: The inclusive upper bound of the interval.
+        """
+        if lo >= hi:
+            return
+
+        i = bisect_left(self._lows, lo)
+
+        if (i > 0 and self._highs[i - 1] > lo) or \
+           (i < len(self._lows) and self._lows[i] < hi):
+            return
+
+        self._lows.insert(i, lo)
+        self._highs.insert(i, hi)
+
+    def get_intervals(self) -> list:
+        """
+        Get the sorted list of (lo, hi) pairs the index consists of.
+        """
+        return list(zip(self._lows, self._highs))
+
+    def to_json(self) -> str:
+        return json.dumps(self.get_intervals())
+
+    def from_json(json_str: str):
+        return ThresholdIndex(json.loads(json_str))
+
+    def __len__(self):
+        return len(self._lows)
@@ -0,0 +1,181 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import copy
+import threading
+from collections import Counter
+from .results import Identifier
+
+
+class SessionIndex:
+    """
+    A class describing an in-memory index of profiling sessions stored
+    inside a given profiling results directory, sorted in the same way
+    as by ProfilingResults.get_all_ids().
+
+    The index is refreshed lazily before every query, but only if
+    the modification time of the results directory has changed (i.e.
+    a session has been added, removed, or renamed). Even then, only
+    the names of new directories are parsed, so keeping the index
+    up to date is cheap for directories with tens of thousands of
+    sessions.
+    """
+
+    def __init__(self, profiling_storage: str):
+        """
+        Construct a SessionIndex object.
+
+        :param str profiling_storage: The path string to a profiling
+                                      results directory.
+        """
+        self._profiling_storage = profiling_storage
+        self._mtime = None
+        self._ids = {}
+        self._sorted = []
+        self._executors = Counter()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Bring the index up to date with the results directory if its
+        modification time has changed since the last refresh.
+        """
+        with self._lock:
+            mtime = os.stat(self._profiling_storage).st_mtime_ns
+
+            if mtime == self._mtime:
+                return
+
+            # The modification time is obtained before scanning, so that
+            # any change made during the scan triggers another refresh.
+            names = set()
+
+            with os.scandir(self._profiling_storage) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            names.add(entry.name)
+                    except OSError:
+                        continue
+
+            # New objects are created instead of modifying the existing
+            # ones, as they may be used by queries at the same time.
+            ids = {k: v for k, v in self._ids.items() if k in names}
+            sorted_ids = [x for x in self._sorted if x[1] in names]
+            executors = Counter(x.executor for x in ids.values()
+                                if x is not None)
+            new_ids = []
+
+            for name in names:
+                if name in ids:
+                    continue
+
+                try:
+                    identifier = Identifier(name)
+                except ValueError:
+                    # Invalid names are remembered as well, so that they
+                    # are not parsed again in the next refresh.
+                    ids[name] = None
+                    continue
+
+                ids[name] = identifier
+                executors[identifier.executor] += 1
+                new_ids.append((identifier.sort_key, name))
+
+            # sorted_ids is already sorted, so sorting it again after
+            # appending new sessions takes roughly linear time.
+            sorted_ids += new_ids
+            sorted_ids.sort()
+
+            self._ids = ids
+            self._sorted = sorted_ids
+            self._executors = executors
+            self._mtime = mtime
+
+    def query(self, executor: str = None, name: str = None,
+              date_from: tuple = None, date_to: tuple = None,
+              offset: int = 0, limit: int = None) -> tuple:
+        """
+        Get a page of the sorted list of sessions matching given
+        criteria, refreshing the index beforehand if needed.
+
+        Every returned identifier has its label set to its position in
+        the whole sorted list of sessions (i.e. in the same way as
+        in ProfilingResults.get_all_ids()).
+
+        :param str executor: If set, only the sessions with this
+                             executor are returned.
+        :param str name: If set, only the sessions with the profiled
+                         filename containing this string (ignoring case)
+                         are returned.
+        :param tuple date_from: If set, only the sessions started on
+                                or after this (year, month, day) date
+                                are returned.
+        :param tuple date_to: If set, only the sessions started on
+                              or before this (year, month, day) date
+                              are returned.
+        :param int offset: The number of matching sessions to skip.
+        :param int limit: The maximum number of sessions to return
+                          (None for no limit).
+        :return: A (total number of matching sessions, list of Identifier
+                 objects) tuple.
+        """
+        self.refresh()
+
+        with self._lock:
+            sorted_ids = self._sorted
+            ids = self._ids
+
+        if name is not None:
+            name = name.lower()
+
+        if executor is None and name is None and date_from is None and \
+           date_to is None:
+            matching = range(len(sorted_ids))
+        else:
+            matching = []
+
+            for i, (sort_key, id_str) in enumerate(sorted_ids):
+                identifier = ids[id_str]
+
+                # The first three elements of a sort key are the negated
+                # year, month, and day.
+                date = (-sort_key[0], -sort_key[1], -sort_key[2])
+
+                if (executor is None or identifier.executor == executor) \
+                   and (name is None or name in identifier.name.lower()) \
+                   and (date_from is None or date >= date_from) \
+                   and (date_to is None or date <= date_to):
+                    matching.append(i)
+
+        end = len(matching) if limit is None else offset + limit
+        result = []
+
+        for i in matching[offset:end]:
+            identifier = copy.copy(ids[sorted_ids[i][1]])
+            result.append(identifier.set_label_if_none(str(i)))
+
+        return len(matching), result
+
+    def contains(self, id_str: str) -> bool:
+        """
+        Check whether a valid session with a given identifier is in
+        the results directory, refreshing the index beforehand if needed.
+        As the index is built from the directory listing, this also
+        guarantees that the identifier does not point outside
+        the results directory.
+
+        :param str id_str: A profiling session identifier string.
+        """
+        self.refresh()
+
+        with self._lock:
+            return self._ids.get(id_str) is not None
+
+    def get_executors(self) -> list:
+        """
+        Get the sorted list of executors of all sessions in the index.
+        """
+        with self._lock:
+            return sorted(self._executors)
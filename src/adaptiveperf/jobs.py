@@ -0,0 +1,240 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+_local = threading.local()
+
+
+def report_progress(phase: str, progress: float):
+    """
+    Report the progress of the computation running in the current thread
+    to its job (see JobManager). Nothing happens if the computation does
+    not run as a job.
+
+    :param str phase: The name of the current phase of the computation
+                      (e.g. "load", "compress", or "serialize").
+    :param float progress: The progress of the current phase between
+                           0 and 1.
+    """
+    job = getattr(_local, 'job', None)
+
+    if job is not None:
+        job.update(phase, progress)
+
+
+class Job:
+    """
+    A class describing a computation running in the background
+    (see JobManager). A job is in one of the following states:
+    * "running": the computation is in progress (or waiting to start,
+      in which case its phase is "waiting"),
+    * "done": the computation has finished and its result is available,
+    * "failed": the computation has raised an exception.
+    """
+
+    # The minimum change of progress which is passed to the update
+    # callback, so that the callback is not called too often.
+    PROGRESS_STEP = 0.05
+
+    def __init__(self, job_id: str, on_update=None):
+        """
+        Construct a Job object.
+
+        :param str job_id: The identifier of the job.
+        :param on_update: The function called with the job whenever its
+                          state or phase changes (or its progress changes
+                          by at least PROGRESS_STEP). None for no function.
+        """
+        self._id = job_id
+        self._on_update = on_update
+        self._state = 'running'
+        self._phase = 'waiting'
+        self._progress = 0
+        self._published_progress = 0
+        self._result = None
+        self._error = None
+        self._finished = None
+        self._event = threading.Event()
+
+    def update(self, phase: str, progress: float):
+        """
+        Update the phase and the progress of the job.
+
+        :param str phase: The name of the current phase.
+        :param float progress: The progress of the current phase between
+                               0 and 1.
+        """
+        publish = phase != self._phase or \
+            abs(progress - self._published_progress) >= Job.PROGRESS_STEP
+
+        self._phase = phase
+        self._progress = progress
+
+        if publish:
+            self._published_progress = progress
+            self.publish()
+
+    def run(self, func):
+        """
+        Run the computation of the job in the current thread.
+
+        :param func: The function to be called without arguments,
+                     returning the result of the job.
+        """
+        _local.job = self
+
+        try:
+            self._result = func()
+            self._state = 'done'
+        except Exception as e:
+            self._error = e
+            self._state = 'failed'
+        finally:
+            _local.job = None
+            self._finished = time.monotonic()
+            self.publish()
+            self._event.set()
+
+    def publish(self):
+        """
+        Call the update callback of the job (if any) with the job.
+        """
+        if self._on_update is not None:
+            self._on_update(self)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the job finishes (successfully or not).
+
+        :param float timeout: The maximum number of seconds to wait
+                              (None for no limit).
+        :return: Whether the job has finished.
+        """
+        return self._event.wait(timeout)
+
+    def to_dict(self) -> dict:
+        """
+        Get a dictionary describing the status of the job, i.e.
+        {"job": <identifier>, "state": <state>, "phase": <phase>,
+        "progress": <progress of the phase between 0 and 1>,
+        "pid": <PID of the process running the job>}.
+        """
+        return {
+            'job': self._id,
+            'state': self._state,
+            'phase': self._phase,
+            'progress': self._progress,
+            'pid': os.getpid()
+        }
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def result(self):
+        return self._result
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def finished(self):
+        return self._finished
+
+
+class JobManager:
+    """
+    A class describing a pool of threads running computations which can
+    take too long to be done within a single request (e.g. compressing
+    a huge flame graph), so that the client can poll for their progress
+    and results instead.
+
+    Jobs are identified by keys chosen by the caller, so submitting
+    a computation with the key of an unfinished (or recently finished)
+    job returns the existing job instead of starting a new one. Finished
+    jobs are forgotten after a given number of seconds.
+
+    The threads are started lazily, so a JobManager object can be
+    created before forking worker processes.
+    """
+
+    def __init__(self, max_workers: int = 2, retention: float = 60,
+                 on_update=None):
+        """
+        Construct a JobManager object.
+
+        :param int max_workers: The maximum number of jobs running at
+                                the same time.
+        :param float retention: The number of seconds finished jobs (along
+                                with their results) are kept for.
+        :param on_update: The function called with a job whenever
+                          the job changes (see Job). None for no function.
+        """
+        self._max_workers = max_workers
+        self._retention = retention
+        self._on_update = on_update
+        self._jobs = {}
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _remove_expired(self):
+        now = time.monotonic()
+
+        for job_id in [k for k, v in self._jobs.items()
+                       if v.finished is not None and
+                       now - v.finished > self._retention]:
+            del self._jobs[job_id]
+
+    def submit(self, job_id: str, func) -> Job:
+        """
+        Start a job running a given function in the background, unless
+        a job with the same identifier exists.
+
+        :param str job_id: The identifier of the job.
+        :param func: The function to be called without arguments,
+                     returning the result of the job.
+        :return: The new or the existing job.
+        """
+        with self._lock:
+            self._remove_expired()
+            job = self._jobs.get(job_id)
+
+            if job is not None:
+                return job
+
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers,
+                    thread_name_prefix='adaptiveperf-job')
+                self._pid = os.getpid()
+
+            job = Job(job_id, self._on_update)
+            self._jobs[job_id] = job
+
+        job.publish()
+        self._executor.submit(job.run, func)
+
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """
+        Get the job with a given identifier, or None if there is no
+        such job (or it has expired).
+
+        :param str job_id: The identifier of the job.
+        """
+        with self._lock:
+            self._remove_expired()
+            return self._jobs.get(job_id)
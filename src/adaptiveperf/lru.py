@@ -0,0 +1,117 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def get_object_size(value) -> int:
+    """
+    Estimate the size in bytes of an object in memory along with
+    the objects it refers to (through containers and attributes), with
+    every object counted once.
+
+    :param value: The object.
+    """
+    size = 0
+    seen = set()
+    to_visit = [value]
+
+    while len(to_visit) > 0:
+        x = to_visit.pop()
+
+        if id(x) in seen:
+            continue
+
+        seen.add(id(x))
+        size += sys.getsizeof(x)
+
+        if isinstance(x, dict):
+            to_visit.extend(x.keys())
+            to_visit.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            to_visit.extend(x)
+        elif hasattr(x, '__dict__'):
+            to_visit.append(x.__dict__)
+
+    return size
+
+
+class LRUCache:
+    """
+    A class describing a thread-safe in-memory cache of objects with
+    a limit on their total size (as estimated by the caller), where
+    the least recently used objects are dropped first when the limit is
+    exceeded. An object larger than the limit on its own is not cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Construct an LRUCache object.
+
+        :param int max_bytes: The maximum total size of cached objects
+                              in bytes.
+        """
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the object with a given key, or None if it is not cached.
+
+        :param key: The key of an object. It must be hashable.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int):
+        """
+        Cache an object, replacing the one with the same key (if any).
+
+        :param key: The key of the object. It must be hashable.
+        :param value: The object (not None).
+        :param int size: The size of the object in bytes.
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+
+            if old is not None:
+                self._size -= old[1]
+
+            if size > self._max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        """
+        Remove all cached objects.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def __len__(self):
+        return len(self._entries)
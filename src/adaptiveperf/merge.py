@@ -0,0 +1,296 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import struct
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .flamegraph import FlameGraph, read_flame_graphs, merge_flame_graphs
+from .store import SessionStore
+from .jobs import report_progress
+
+
+# The number of flame graphs merged at once by a worker process, so that
+# only this number of flame graphs (along with the merged one) is held
+# in memory at any time regardless of the number of threads/processes.
+MERGE_BATCH_SIZE = 16
+
+# The number of chunks of threads/processes merged separately per worker
+# process before the chunks are reduced, so that the work is balanced
+# even when the flame graphs differ in size.
+CHUNKS_PER_PROCESS = 4
+
+# The minimum number of threads/processes merged in worker processes,
+# below which starting the work there costs more than it saves.
+MIN_PARALLEL_MERGE = 128
+
+# The pool of worker processes of the current process, created when it
+# is first needed (see _get_executor()).
+_executor = None
+_executor_key = None
+_executor_lock = threading.Lock()
+
+
+def pack_flame_graphs(graphs: dict) -> bytes:
+    """
+    Serialize a dictionary of metrics and flame graphs, e.g. for passing
+    it between processes or storing it in the on-disk cache. Use
+    unpack_flame_graphs() for the reverse.
+
+    :param dict graphs: The dictionary mapping metric names to FlameGraph
+                        objects.
+    """
+    parts = []
+
+    for metric, graph in graphs.items():
+        name = metric.encode('utf-8')
+        data = graph.to_bytes()
+        parts += [struct.pack('=I', len(name)), name,
+                  struct.pack('=Q', len(data)), data]
+
+    return b''.join(parts)
+
+
+def unpack_flame_graphs(data: bytes) -> dict:
+    """
+    Deserialize a dictionary of metrics and flame graphs serialized by
+    pack_flame_graphs().
+
+    :param bytes data: The serialized dictionary.
+    :raises ValueError: When the data are invalid.
+    """
+    graphs = {}
+    view = memoryview(data)
+    offset = 0
+
+    try:
+        while offset < len(view):
+            length, = struct.unpack_from('=I', view, offset)
+            offset += 4
+            metric = bytes(view[offset:offset + length]).decode('utf-8')
+            offset += length
+            length, = struct.unpack_from('=Q', view, offset)
+            offset += 8
+
+            if offset + length > len(view):
+                raise ValueError('The flame graph data are truncated!')
+
+            graphs[metric] = FlameGraph.from_bytes(
+                bytes(view[offset:offset + length]))
+            offset += length
+    except struct.error as e:
+        raise ValueError(f'The flame graph data are invalid: {e}')
+
+    return graphs
+
+
+def read_thread_flame_graphs(session_path: Path, store: SessionStore,
+                             pid_tid: str):
+    """
+    Read the non-time-ordered flame graphs (i.e. the first ones of every
+    metric) of a thread/process, from the session store if it has them
+    or from the flame graph file otherwise.
+
+    :param pathlib.Path session_path: The path to a profiling session
+                                      directory.
+    :param SessionStore store: The store of the session (None if there
+                               is none).
+    :param str pid_tid: The thread/process ID in form of "<PID>_<TID>".
+    :return: The generator of (metric, FlameGraph object) pairs.
+    """
+    seen = set()
+
+    if store is not None and store.has_flame_graphs(pid_tid):
+        for metric, data in store.get_flame_graphs(pid_tid):
+            if metric not in seen:
+                seen.add(metric)
+                yield metric, FlameGraph.from_bytes(data)
+    else:
+        path = session_path / 'processed' / f'{pid_tid}.json'
+
+        with path.open(mode='r') as f:
+            for metric, graph in read_flame_graphs(f):
+                if metric not in seen:
+                    seen.add(metric)
+                    yield metric, graph
+
+
+def merge_thread_flame_graphs(session_path: str, pid_tids: list) -> dict:
+    """
+    Merge the non-time-ordered flame graphs of given threads/processes
+    of a profiling session by call path (see merge_flame_graphs()),
+    separately for every metric. The flame graphs are read and merged
+    in batches of MERGE_BATCH_SIZE.
+
+    :param str session_path: The path string to a profiling session
+                             directory.
+    :param list pid_tids: The list of thread/process IDs in form of
+                          "<PID>_<TID>".
+    :return: The dictionary mapping metric names to merged FlameGraph
+             objects.
+    """
+    session_path = Path(session_path)
+    store = SessionStore.open(session_path)
+    merged = {}
+    batches = {}
+
+    def flush(metric):
+        graphs = batches.pop(metric)
+
+        if metric in merged:
+            graphs.insert(0, merged[metric])
+
+        merged[metric] = merge_flame_graphs(graphs)
+
+    for pid_tid in pid_tids:
+        for metric, graph in read_thread_flame_graphs(session_path, store,
+                                                      pid_tid):
+            batch = batches.setdefault(metric, [])
+            batch.append(graph)
+
+            if len(batch) == MERGE_BATCH_SIZE:
+                flush(metric)
+
+    for metric in list(batches.keys()):
+        flush(metric)
+
+    return merged
+
+
+def _merge_chunk(session_path: str, pid_tids: list) -> bytes:
+    return pack_flame_graphs(merge_thread_flame_graphs(session_path,
+                                                       pid_tids))
+
+
+def _merge_packed(first: bytes, second: bytes) -> bytes:
+    graphs = unpack_flame_graphs(first)
+
+    for metric, graph in unpack_flame_graphs(second).items():
+        if metric in graphs:
+            graphs[metric] = merge_flame_graphs([graphs[metric], graph])
+        else:
+            graphs[metric] = graph
+
+    return pack_flame_graphs(graphs)
+
+
+def merge_session_flame_graphs(session_path: str, pid_tids: list,
+                               processes: int = 1) -> dict:
+    """
+    Merge the non-time-ordered flame graphs of given threads/processes of
+    a profiling session in the same way as merge_thread_flame_graphs(),
+    but in parallel in a pool of worker processes: the threads/processes
+    are split into chunks merged independently, after which the merged
+    chunks are reduced pairwise (level by level) until one remains.
+
+    The progress is reported to the current job (if any) in the "merge"
+    phase.
+
+    :param str session_path: The path string to a profiling session
+                             directory.
+    :param list pid_tids: The list of thread/process IDs in form of
+                          "<PID>_<TID>".
+    The worker processes are started with the "forkserver" method (or
+    "spawn" where it is unavailable) rather than forked from the current
+    process, which may be running other threads, and they are kept for
+    later calls, so that only one pool exists per process.
+
+    :param str session_path: The path string to a profiling session
+                             directory.
+    :param list pid_tids: The list of thread/process IDs in form of
+                          "<PID>_<TID>".
+    :param int processes: The number of worker processes. If it is 1 (or
+                          there are fewer than MIN_PARALLEL_MERGE
+                          threads/processes), everything is merged in
+                          the current process.
+    :return: The dictionary mapping metric names to merged FlameGraph
+             objects. The result is the same as the one of
+             merge_thread_flame_graphs() regardless of the number of
+             worker processes.
+    """
+    chunk_count = min(len(pid_tids) // MERGE_BATCH_SIZE,
+                      processes * CHUNKS_PER_PROCESS)
+
+    if processes <= 1 or chunk_count <= 1 or \
+       len(pid_tids) < MIN_PARALLEL_MERGE:
+        report_progress('merge', 0)
+        return merge_thread_flame_graphs(session_path, pid_tids)
+
+    # The chunks are contiguous and reduced in order, so that the order
+    # of the merged blocks is the same as when merging sequentially.
+    chunks = [pid_tids[i * len(pid_tids) // chunk_count:
+                       (i + 1) * len(pid_tids) // chunk_count]
+              for i in range(chunk_count)]
+
+    # Every level of the reduction halves the number of merged chunks,
+    # so there are chunk_count - 1 reductions in total.
+    steps = 2 * chunk_count - 1
+    done = 0
+
+    executor = _get_executor(processes)
+
+    try:
+        futures = [executor.submit(_merge_chunk, str(session_path), chunk)
+                   for chunk in chunks]
+        level = []
+
+        # The results are collected in order, so that the order of
+        # the merged blocks does not depend on timing.
+        for future in futures:
+            level.append(future.result())
+            done += 1
+            report_progress('merge', done / steps)
+
+        while len(level) > 1:
+            futures = [executor.submit(_merge_packed, level[i], level[i + 1])
+                       for i in range(0, len(level) - 1, 2)]
+            rest = level[-1:] if len(level) % 2 == 1 else []
+            level = []
+
+            for future in futures:
+                level.append(future.result())
+                done += 1
+                report_progress('merge', done / steps)
+
+            level += rest
+    except BrokenProcessPool:
+        # A pool with a worker process which died unexpectedly cannot be
+        # used anymore, so a new one is started next time.
+        _discard_executor(executor)
+        raise
+
+    return unpack_flame_graphs(level[0])
+
+
+def _get_executor(processes: int) -> ProcessPoolExecutor:
+    # The pool is tied to the process it was created in, as a forked
+    # child (e.g. a Gunicorn worker) cannot use the pool of its parent.
+    global _executor, _executor_key
+    key = (os.getpid(), processes)
+
+    with _executor_lock:
+        if _executor is None or _executor_key != key:
+            if _executor is not None and _executor_key[0] == key[0]:
+                _executor.shutdown(wait=False)
+
+            method = 'forkserver' if 'forkserver' in \
+                multiprocessing.get_all_start_methods() else 'spawn'
+            _executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context(method))
+            _executor_key = key
+
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+    executor.shutdown(wait=False)
@@ -0,0 +1,256 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import time
+import threading
+from bisect import bisect_left
+
+
+# The upper bounds of the histogram buckets of durations in seconds
+# and response sizes in bytes.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                    0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216, 67108864)
+
+
+def format_labels(labels: dict) -> str:
+    """
+    Format a dictionary of labels in the Prometheus text format, e.g.
+    '{endpoint="tree",phase="parse"}' (or an empty string if there are
+    no labels).
+
+    :param dict labels: The dictionary of label names and values.
+    """
+    if len(labels) == 0:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{k}="{escape(v)}"'
+                          for k, v in labels.items()) + '}'
+
+
+def format_metric(name: str, metric_type: str, description: str,
+                  samples: list) -> str:
+    """
+    Format a metric in the Prometheus text format.
+
+    :param str name: The name of a metric.
+    :param str metric_type: The type of a metric ("counter", "gauge",
+                            or "histogram").
+    :param str description: The description of a metric.
+    :param list samples: The list of (name suffix, labels dictionary,
+                         value) tuples, e.g. ('_bucket', {'le': '0.1'},
+                         10) for a histogram bucket.
+    """
+    lines = [f'# HELP {name} {description}',
+             f'# TYPE {name} {metric_type}']
+
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """
+    A class describing a Prometheus-style histogram, i.e. a set of
+    cumulative counters of observations falling into buckets with given
+    upper bounds, along with the count and the sum of all observations.
+    """
+
+    def __init__(self, buckets: tuple):
+        """
+        Construct a Histogram object.
+
+        :param tuple buckets: The sorted upper bounds of the buckets
+                              (the +Inf bucket is added automatically).
+        """
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0
+        self._count = 0
+
+    def observe(self, value):
+        """
+        Record an observation.
+
+        :param value: The observed value.
+        """
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def get_samples(self, labels: dict) -> list:
+        """
+        Get the samples of the histogram in the form accepted by
+        format_metric().
+
+        :param dict labels: The labels to be attached to every sample.
+        """
+        samples = []
+        total = 0
+
+        for bound, count in zip(self._buckets + ('+Inf',), self._counts):
+            total += count
+            samples.append(('_bucket', dict(labels, le=str(bound)), total))
+
+        samples.append(('_sum', labels, self._sum))
+        samples.append(('_count', labels, self._count))
+
+        return samples
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+
+class PhaseTimer:
+    """
+    A class describing a timer measuring how long consecutive phases
+    of processing a request (e.g. parsing and computing) take.
+    """
+
+    def __init__(self):
+        """
+        Construct a PhaseTimer object.
+        """
+        self._durations = {}
+        self._phase = None
+        self._start = None
+
+    def start(self, phase: str):
+        """
+        Finish the current phase (if any) and start a new one.
+        Starting a phase which has already been measured adds to its
+        duration.
+
+        :param str phase: The name of a phase.
+        """
+        self.stop()
+        self._phase = phase
+        self._start = time.perf_counter()
+
+    def stop(self):
+        """
+        Finish the current phase (if any).
+        """
+        if self._phase is None:
+            return
+
+        self._durations[self._phase] = \
+            self._durations.get(self._phase, 0) + \
+            time.perf_counter() - self._start
+        self._phase = None
+
+    def get_server_timing(self) -> str:
+        """
+        Get the value of the Server-Timing HTTP header describing
+        the measured phases, with durations in ms, e.g.
+        "parse;dur=0.52, compute;dur=12.3".
+        """
+        return ', '.join(f'{phase};dur={duration * 1000:.2f}'
+                         for phase, duration in self._durations.items())
+
+    @property
+    def durations(self):
+        return self._durations
+
+
+class RequestMetrics:
+    """
+    A class describing thread-safe, process-wide metrics of requests
+    handled by the web server, grouped by the type of a request
+    (e.g. "tree" or "flame_graph"):
+    * the number of requests per status code,
+    * the histograms of the total duration and the duration of every
+      phase of handling requests (see PhaseTimer),
+    * the histogram of the response sizes in bytes (after compression).
+    """
+
+    def __init__(self):
+        """
+        Construct a RequestMetrics object.
+        """
+        self._requests = {}
+        self._durations = {}
+        self._phase_durations = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, request_type: str, status: int, durations: dict,
+                size: int):
+        """
+        Record a handled request.
+
+        :param str request_type: The type of a request.
+        :param int status: The HTTP status code of the response.
+        :param dict durations: The dictionary of phase names and their
+                               durations in seconds (see PhaseTimer).
+        :param int size: The size of the response body in bytes.
+        """
+        with self._lock:
+            key = (request_type, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            if request_type not in self._durations:
+                self._durations[request_type] = Histogram(DURATION_BUCKETS)
+                self._sizes[request_type] = Histogram(SIZE_BUCKETS)
+
+            self._durations[request_type].observe(sum(durations.values()))
+            self._sizes[request_type].observe(size)
+
+            for phase, duration in durations.items():
+                key = (request_type, phase)
+
+                if key not in self._phase_durations:
+                    self._phase_durations[key] = Histogram(DURATION_BUCKETS)
+
+                self._phase_durations[key].observe(duration)
+
+    def get_request_count(self, request_type: str, status: int) -> int:
+        """
+        Get the number of recorded requests of a given type and status
+        code.
+
+        :param str request_type: The type of a request.
+        :param int status: The HTTP status code.
+        """
+        with self._lock:
+            return self._requests.get((request_type, status), 0)
+
+    def render(self) -> str:
+        """
+        Get the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            requests = [('', {'endpoint': t, 'status': s}, v)
+                        for (t, s), v in sorted(self._requests.items())]
+            durations = [x for t, h in sorted(self._durations.items())
+                         for x in h.get_samples({'endpoint': t})]
+            phase_durations = [
+                x for (t, p), h in sorted(self._phase_durations.items())
+                for x in h.get_samples({'endpoint': t, 'phase': p})]
+            sizes = [x for t, h in sorted(self._sizes.items())
+                     for x in h.get_samples({'endpoint': t})]
+
+        return ''.join([
+            format_metric('adaptiveperf_requests_total', 'counter',
+                          'Number of handled requests.', requests),
+            format_metric('adaptiveperf_request_duration_seconds',
+                          'histogram', 'Time spent on handling requests.',
+                          durations),
+            format_metric('adaptiveperf_request_phase_duration_seconds',
+                          'histogram', 'Time spent on every phase of '
+                          'handling requests.', phase_durations),
+            format_metric('adaptiveperf_response_size_bytes', 'histogram',
+                          'Size of response bodies (after compression).',
+                          sizes)
+        ])
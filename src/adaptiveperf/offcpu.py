@@ -0,0 +1,136 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+from array import array
+from bisect import bisect_right
+
+
+class OffCpuPyramid:
+    """
+    A class describing a multi-resolution representation of
+    the off-CPU regions of a thread/process, used for rendering them
+    in the timeline at a level of detail matching the zoom level.
+
+    Level 0 stores the original regions. Every next level is obtained
+    by merging the regions of the previous level separated by gaps
+    smaller than a threshold, which grows geometrically with the level
+    (see BASE_GAP and GAP_FACTOR). Every merged region also keeps the
+    total off-CPU time of the original regions it covers.
+
+    Querying a time window at a given resolution (i.e. the time span of
+    one pixel) starts from the coarsest level whose gap threshold does
+    not exceed the resolution, so the amount of work depends on
+    the number of pixels rather than the number of original regions.
+    """
+
+    # The gap threshold of level 1 in ms.
+    BASE_GAP = 0.001
+
+    # The ratio of the gap thresholds of consecutive levels.
+    GAP_FACTOR = 4
+
+    def __init__(self, regions):
+        """
+        Construct an OffCpuPyramid object.
+
+        :param list regions: The list of off-CPU regions in form of
+                             (start time, length) pairs in ms, in any
+                             order.
+        """
+        starts = array('d')
+        ends = array('d')
+        off_times = array('d')
+
+        # Overlapping regions are merged at level 0 already, so that
+        # the regions of every level are sorted by both start and
+        # end times.
+        for start, length in sorted(regions):
+            end = start + length
+
+            if len(ends) > 0 and start < ends[-1]:
+                off_times[-1] += max(0, end - ends[-1])
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+                off_times.append(length)
+
+        self._gaps = [0]
+        self._levels = [(starts, ends, off_times)]
+
+        gap = OffCpuPyramid.BASE_GAP
+
+        while len(self._levels[-1][0]) > 1:
+            level = OffCpuPyramid._merge(*self._levels[-1], gap)
+
+            # Levels identical to the previous one are not stored.
+            if len(level[0]) < len(self._levels[-1][0]):
+                self._gaps.append(gap)
+                self._levels.append(level)
+
+            gap *= OffCpuPyramid.GAP_FACTOR
+
+    def _merge(starts, ends, off_times, gap):
+        new_starts = array('d')
+        new_ends = array('d')
+        new_off_times = array('d')
+
+        for i in range(len(starts)):
+            if len(new_ends) > 0 and starts[i] - new_ends[-1] < gap:
+                new_ends[-1] = ends[i]
+                new_off_times[-1] += off_times[i]
+            else:
+                new_starts.append(starts[i])
+                new_ends.append(ends[i])
+                new_off_times.append(off_times[i])
+
+        return new_starts, new_ends, new_off_times
+
+    def query(self, start: float, end: float, resolution: float) -> list:
+        """
+        Get the off-CPU regions overlapping a given time window, with
+        the regions separated by gaps smaller than a given resolution
+        merged together.
+
+        :param float start: The start of the time window in ms.
+        :param float end: The end of the time window in ms.
+        :param float resolution: The resolution in ms, e.g. the time span
+                                 of one pixel of the timeline.
+        :return: The list of [start time, length, off-CPU time] lists
+                 (all in ms), where the off-CPU time is the total time
+                 spent off-CPU within a (possibly merged) region.
+        :raises ValueError: When the resolution is negative.
+        """
+        if resolution < 0:
+            raise ValueError('resolution must not be negative!')
+
+        level = bisect_right(self._gaps, resolution) - 1
+        starts, ends, off_times = self._levels[level]
+
+        result = []
+        last_end = None
+        i = bisect_right(ends, start)
+
+        while i < len(starts) and starts[i] < end:
+            if last_end is not None and starts[i] - last_end < resolution:
+                result[-1][1] = ends[i] - result[-1][0]
+                result[-1][2] += off_times[i]
+            else:
+                result.append([starts[i], ends[i] - starts[i],
+                               off_times[i]])
+
+            last_end = ends[i]
+            i += 1
+
+        return result
+
+    @property
+    def nbytes(self):
+        """
+        The approximate size of the pyramid in memory in bytes.
+        """
+        return sum(x.itemsize * len(x) for level in self._levels
+                   for x in level)
+
+    def __len__(self):
+        return len(self._levels[0][0])
@@ -0,0 +1,167 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import re
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+
+PERF_MAP_LINE_REGEX = re.compile(r'^([0-9a-fA-F]+)\s+([0-9a-fA-F]+)\s+(.+)$')
+
+
+def read_perf_map(path: Path):
+    """
+    Iterate over the entries of a perf symbol map (i.e. a perf-<PID>.map
+    file), yielding (start address, end address, symbol name) tuples in
+    the order of the file. The end address is inclusive. Lines with
+    incorrect syntax are reported to stderr and skipped.
+
+    :param pathlib.Path path: The path to a perf symbol map.
+    """
+    with path.open(mode='r') as f:
+        for i, line in enumerate(f, 1):
+            match = PERF_MAP_LINE_REGEX.search(line.strip())
+
+            if match is None:
+                print(f'Line {i}, {path}: '
+                      'incorrect syntax, ignoring.',
+                      file=sys.stderr)
+                continue
+
+            start = int(match.group(1), 16)
+            yield start, start + int(match.group(2), 16) - 1, match.group(3)
+
+
+class PerfMapIndex:
+    """
+    A class describing a compact index of a perf symbol map, sorted by
+    start addresses and allowing symbols to be looked up by address with
+    binary search.
+
+    The index is built once with PerfMapIndex.build() and can be stored
+    in a file and memory-mapped afterwards, so looking up a few symbols
+    does not require parsing (or even reading) the whole map, which can
+    take hundreds of MB for JIT-heavy programs.
+
+    Layout (all integers are unsigned 64-bit in the native byte order,
+    as the index is meant to be read on the machine it is built on):
+    * the "APM1" magic bytes,
+    * the number of entries N,
+    * N start addresses (sorted),
+    * N inclusive end addresses,
+    * N + 1 offsets of symbol names in the string table (the name of
+      the i-th entry spans from the i-th to the (i + 1)-th offset),
+    * the string table, i.e. the concatenated UTF-8 symbol names.
+    """
+
+    MAGIC = b'APM1'
+
+    def build(path: Path) -> bytes:
+        """
+        Build the index of a perf symbol map.
+
+        :param pathlib.Path path: The path to a perf symbol map.
+        """
+        starts = array('Q')
+        ends = array('Q')
+        names = []
+
+        for start, end, name in read_perf_map(path):
+            starts.append(start)
+            ends.append(end)
+            names.append(name)
+
+        # The sort is stable, so entries with the same start address
+        # stay in the order of the file.
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        encoded_names = [names[i].encode('utf-8', errors='surrogateescape')
+                         for i in order]
+        offsets = array('Q', [0])
+
+        for name in encoded_names:
+            offsets.append(offsets[-1] + len(name))
+
+        return b''.join([
+            PerfMapIndex.MAGIC,
+            struct.pack('=Q', len(order)),
+            array('Q', (starts[i] for i in order)).tobytes(),
+            array('Q', (ends[i] for i in order)).tobytes(),
+            offsets.tobytes()
+        ] + encoded_names)
+
+    def __init__(self, data):
+        """
+        Construct a PerfMapIndex object.
+
+        :param data: The index returned by PerfMapIndex.build(), either
+                     as bytes or as an mmap.mmap object.
+        :raises ValueError: When the data is not a valid index.
+        """
+        view = memoryview(data)
+        header_size = len(PerfMapIndex.MAGIC) + 8
+
+        if len(view) < header_size or \
+           bytes(view[:len(PerfMapIndex.MAGIC)]) != PerfMapIndex.MAGIC:
+            raise ValueError('The data is not a perf map index!')
+
+        count = struct.unpack_from('=Q', view, len(PerfMapIndex.MAGIC))[0]
+        names_start = header_size + (3 * count + 1) * 8
+
+        if len(view) < names_start:
+            raise ValueError('The perf map index is truncated!')
+
+        self._data = data
+        self._starts = view[header_size:
+                            header_size + count * 8].cast('Q')
+        self._ends = view[header_size + count * 8:
+                          header_size + 2 * count * 8].cast('Q')
+        self._offsets = view[header_size + 2 * count * 8:
+                             names_start].cast('Q')
+        self._names = view[names_start:]
+
+    def open(path: Path):
+        """
+        Construct a PerfMapIndex object from an index stored in a file,
+        memory-mapping the file.
+
+        :param pathlib.Path path: The path to a file with the index.
+        :raises ValueError: When the file is not a valid index.
+        """
+        with path.open(mode='rb') as f:
+            if path.stat().st_size == 0:
+                raise ValueError('The data is not a perf map index!')
+
+            # The mapping stays valid after closing the file.
+            return PerfMapIndex(mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ))
+
+    def resolve(self, address: int):
+        """
+        Get the name of the symbol containing a given address, or None
+        if there is no such symbol. If several symbols start before
+        the address, the one starting last is checked.
+
+        :param int address: The address to be resolved.
+        """
+        i = bisect_right(self._starts, address) - 1
+
+        if i < 0 or address > self._ends[i]:
+            return None
+
+        return bytes(self._names[self._offsets[i]:
+                                 self._offsets[i + 1]]).decode(
+                                     'utf-8', errors='surrogateescape')
+
+    @property
+    def nbytes(self):
+        """
+        The size of the index data in bytes.
+        """
+        return len(self._data)
+
+    def __len__(self):
+        return len(self._starts)
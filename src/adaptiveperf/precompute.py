@@ -0,0 +1,175 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import re
+import time
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .results import ProfilingResults
+from .cache import SessionCache
+from .wire import get_content_encodings
+
+
+def precompute_session(profiling_storage: str, identifier: str,
+                       cache_dir: str, cache_max_bytes: int,
+                       threshold: float, max_depth: int) -> float:
+    """
+    Compute everything the website asks for when a profiling session is
+    opened and store it in the on-disk cache of the session, i.e.:
+    * the skeleton of the thread/process tree,
+    * the perf symbol map indices,
+    * the flame graphs of all threads/processes at a given threshold and
+      depth.
+
+    Everything is stored in the binary wire format and compressed with
+    all supported content encodings, in the same way as when it is
+    requested by the website. JSON flame graphs (requested only by
+    other clients) are not precomputed.
+
+    :param str profiling_storage: The path string to a profiling
+                                  results directory.
+    :param str identifier: The identifier of a profiling session stored
+                           inside the results directory.
+    :param str cache_dir: The path string to a directory where
+                          per-session on-disk caches are stored (see
+                          SessionCache).
+    :param int cache_max_bytes: The maximum total size of on-disk cache
+                                entries in bytes per session.
+    :param float threshold: The flame graph compression threshold (see
+                            ProfilingResults.get_flame_graph()).
+    :param int max_depth: The flame graph depth (see
+                          ProfilingResults.get_flame_graph()). If it is
+                          0, flame graphs are computed in full.
+    :return: The number of seconds the computation took.
+    """
+    start = time.perf_counter()
+    results = SessionCache(profiling_storage, 0, cache_dir,
+                           cache_max_bytes).get(identifier)
+    encodings = get_content_encodings()
+
+    def compress(data):
+        if data is None:
+            return
+
+        for encoding in encodings:
+            results.get_compressed(data, encoding)
+
+    compress(results.get_binary(
+        results.get_json_tree(include_off_cpu=False, skeleton=True)))
+    results.index_perf_maps()
+
+    processed_path = Path(profiling_storage) / identifier / 'processed'
+
+    for path in sorted(processed_path.glob('*_*.json')):
+        match = re.search(r'^(\d+)_(\d+)\.json$', path.name)
+
+        if match is None:
+            continue
+
+        compress(results.get_flame_graph(
+            match.group(1), match.group(2), threshold,
+            None if max_depth == 0 else max_depth, binary=True))
+
+    return time.perf_counter() - start
+
+
+def import_session(profiling_storage: str, identifier: str) -> float:
+    """
+    Create the store of a profiling session (see SessionStore), unless
+    it exists and it is up to date.
+
+    :param str profiling_storage: The path string to a profiling
+                                  results directory.
+    :param str identifier: The identifier of a profiling session stored
+                           inside the results directory.
+    :return: The number of seconds the import took.
+    """
+    start = time.perf_counter()
+    ProfilingResults(profiling_storage, identifier).create_store()
+    return time.perf_counter() - start
+
+
+def precompute(profiling_storage: str, cache_dir: str,
+               cache_max_bytes: int, jobs: int = None, since: tuple = None,
+               threshold: float = 0.025, max_depth: int = 30) -> int:
+    """
+    Run precompute_session() for all profiling sessions stored inside
+    a given profiling results directory in parallel, printing
+    the progress to stdout and errors to stderr.
+
+    :param str profiling_storage: The path string to a profiling
+                                  results directory.
+    :param str cache_dir: See precompute_session().
+    :param int cache_max_bytes: See precompute_session().
+    :param int jobs: The number of worker processes (None for
+                     the number of CPUs).
+    :param tuple since: If set, only the sessions started on or after
+                        this (year, month, day) date are processed.
+    :param float threshold: See precompute_session().
+    :param int max_depth: See precompute_session().
+    :return: The number of sessions which could not be processed.
+    """
+    return run_for_sessions(profiling_storage, jobs, since,
+                            precompute_session, cache_dir, cache_max_bytes,
+                            threshold, max_depth)
+
+
+def import_sessions(profiling_storage: str, jobs: int = None,
+                    since: tuple = None) -> int:
+    """
+    Run import_session() for all profiling sessions stored inside
+    a given profiling results directory in parallel, printing
+    the progress to stdout and errors to stderr.
+
+    :param str profiling_storage: The path string to a profiling
+                                  results directory.
+    :param int jobs: See precompute().
+    :param tuple since: See precompute().
+    :return: The number of sessions which could not be imported.
+    """
+    return run_for_sessions(profiling_storage, jobs, since, import_session)
+
+
+def run_for_sessions(profiling_storage: str, jobs: int, since: tuple,
+                     func, *args) -> int:
+    """
+    Call a function for all profiling sessions stored inside a given
+    profiling results directory in parallel, printing the progress to
+    stdout and errors to stderr.
+
+    :param str profiling_storage: The path string to a profiling
+                                  results directory.
+    :param int jobs: See precompute().
+    :param tuple since: See precompute().
+    :param func: The function called with the path string to the results
+                 directory, a session identifier, and args, returning
+                 the number of seconds it took.
+    :return: The number of sessions for which the function failed.
+    """
+    ids = ProfilingResults.get_all_ids(profiling_storage)
+
+    if since is not None:
+        ids = [x for x in ids if (x.year, x.month, x.day) >= since]
+
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(func, profiling_storage, x.value,
+                                   *args): x.value
+                   for x in ids}
+
+        for i, future in enumerate(as_completed(futures), 1):
+            identifier = futures[future]
+
+            try:
+                duration = future.result()
+                print(f'[{i}/{len(ids)}] {identifier}: '
+                      f'done in {duration:.2f} s', flush=True)
+            except Exception:
+                failed += 1
+                print(f'[{i}/{len(ids)}] {identifier}: failed',
+                      flush=True)
+                traceback.print_exc()
+
+    return failed
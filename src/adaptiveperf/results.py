@@ -5,11 +5,26 @@ import re
 import sys
 import json
 import csv
+import hashlib
+import threading
+from fnmatch import fnmatch
 from zipfile import ZipFile
 from zipfile import Path as ZipFilePath
 from treelib import Tree
 from pathlib import Path
-from collections import deque
+from .flamegraph import FlameGraph, ThresholdIndex, TimeIndex, \
+    read_flame_graphs, merge_flame_graphs, diff_flame_graphs
+from .wire import BinaryEncoder, encode_binary, compress_payload
+from .offcpu import OffCpuPyramid
+from .lru import LRUCache, get_object_size
+from .perfmap import read_perf_map, PerfMapIndex
+from .sources import SourceArchive
+from .singleflight import SingleFlight
+from .jobs import report_progress
+from .merge import merge_session_flame_graphs, merge_thread_flame_graphs, \
+    pack_flame_graphs, unpack_flame_graphs, read_thread_flame_graphs
+from .store import SessionStore, SessionStoreWriter
+from .symbols import SymbolIndex
 
 
 class Identifier:
@@ -133,6 +148,17 @@ class Identifier:
     def value(self):
         return self._id_str
 
+    @property
+    def sort_key(self):
+        """
+        The key for sorting identifiers from the newest to the oldest
+        session (and then by executor, profiled filename, and label).
+        """
+        return (-self.year, -self.month, -self.day, -self.hour,
+                -self.minute, 0 if self._second is None else -self.second,
+                self._executor, self._name,
+                '' if self._label is None else self._label)
+
     def __eq__(self, other):
         return self.value == other.value
 
@@ -146,6 +172,27 @@ class ProfilingResults:
     stored inside a given profiling results directory.
     """
 
+    # The files parsed when a ProfilingResults object is constructed,
+    # relative to the session directory.
+    SESSION_FILES = [
+        Path('processed') / 'metadata.json',
+        Path('processed') / 'event_dict.data',
+        Path('out') / 'event_dict.data',
+        Path('processed') / 'roofline.csv',
+        Path('processed') / 'sources.json',
+        Path('processed') / 'src.zip',
+        Path('processed') / 'src_index.json'
+    ]
+
+    # The attributes keeping the results of the most recent computations
+    # in memory, in form of (key, value...) tuples (see memory_size).
+    MEMORY_SLOTS = [
+        '_last_compressed',
+        '_last_time_indices',
+        '_last_merged',
+        '_last_symbol_index'
+    ]
+
     def get_all_ids(path_str: str) -> list:
         """
         Get the identifiers of all profiling sessions stored in
@@ -156,50 +203,127 @@ class ProfilingResults:
         :return: The list of identifiers that can be used
                  for constructing a ProfilingResults object.
         """
-        id_str_list = []
+        ids = []
         path = Path(path_str)
 
         for x in filter(Path.is_dir, path.glob('*')):
             try:
-                identifier = Identifier(x.name)
+                ids.append(Identifier(x.name))
             except ValueError:
                 continue
 
-            id_str_list.append((x.name,
-                                (-identifier.year,
-                                 -identifier.month,
-                                 -identifier.day,
-                                 -identifier.hour,
-                                 -identifier.minute,
-                                 0 if identifier.second is None
-                                 else -identifier.second,
-                                 identifier.executor,
-                                 identifier.name,
-                                 '' if identifier.label is None
-                                 else identifier.label)))
-
-        return list(
-            map(lambda x:
-                Identifier(x[1][0]).set_label_if_none(str(x[0])),
-                enumerate(sorted(id_str_list, key=lambda x: x[1]))))
-
-    def __init__(self, profiling_storage: str, identifier: str):
+        ids.sort(key=lambda x: x.sort_key)
+
+        return [x.set_label_if_none(str(i)) for i, x in enumerate(ids)]
+
+    def __init__(self, profiling_storage: str, identifier: str,
+                 cache=None, single_flight: SingleFlight = None,
+                 create_store: bool = False, merge_processes: int = 1,
+                 off_cpu_cache_size: int = 16 * 1024 * 1024,
+                 perf_map_cache_size: int = 64 * 1024 * 1024,
+                 hot_functions_cache_size: int = 16 * 1024 * 1024):
         """
         Construct a ProfilingResults object.
 
+        If the session has an up-to-date SessionStore, the session data
+        are read from the store when needed rather than from the session
+        files (which are still used for the data not kept in the store,
+        e.g. the source code archive). Otherwise, the session files are
+        parsed as usual.
+
         :param str profiling_storage: The path string to a profiling
                                       results directory.
         :param str identifier: The identifier of a profiling session
                                stored inside the results directory.
                                Call get_all_ids() for the list of all
                                valid identifiers.
+        :param DiskCache cache: The on-disk cache where the results of
+                                costly computations (e.g. compressed
+                                flame graphs) should be stored. If it is
+                                None, nothing is cached.
+        :param SingleFlight single_flight: The object coalescing identical
+                                           computations requested
+                                           concurrently (it can be shared
+                                           by several ProfilingResults
+                                           objects). If it is None,
+                                           a new one is created. Across
+                                           processes, computations are
+                                           coalesced with the locks of
+                                           the on-disk cache (if enabled).
+        :param bool create_store: Whether the store of the session should
+                                  be created (see create_store()) if it
+                                  does not exist or it is out of date.
+                                  If it cannot be created, a warning is
+                                  printed and the session files are used.
+        :param int merge_processes: The number of worker processes merging
+                                    flame graphs of many threads/processes
+                                    (see get_merged_flame_graph()). If it
+                                    is 1, they are merged in the current
+                                    process.
+        :param int off_cpu_cache_size: The maximum total size in bytes of
+                                       the off-CPU pyramids kept in
+                                       memory (see
+                                       get_off_cpu_regions()), the least
+                                       recently used ones are dropped
+                                       first.
+        :param int perf_map_cache_size: The maximum total size in bytes
+                                        of the perf map indices kept in
+                                        memory (see resolve_symbols()),
+                                        the least recently used ones are
+                                        dropped first.
+        :param int hot_functions_cache_size: The maximum total size in
+                                             bytes of the tables of
+                                             functions kept in memory
+                                             (see get_hot_functions()),
+                                             the least recently used
+                                             ones are dropped first.
         """
         self._path = Path(profiling_storage) / identifier
         self._thread_tree = None
+        self._cache = cache
+        self._single_flight = SingleFlight() if single_flight is None \
+            else single_flight
+        self._last_compressed = None
+        self._last_time_indices = None
+        self._last_merged = None
+        self._last_symbol_index = None
+        self._hot_functions = LRUCache(hot_functions_cache_size)
+        self._merge_processes = merge_processes
+        self._off_cpu_pyramids = LRUCache(off_cpu_cache_size)
+        self._perf_map_indices = LRUCache(perf_map_cache_size)
+        self._slot_sizes = {}
+        self._threshold_indices = {}
+        self._threshold_lock = threading.Lock()
+
+        # The fingerprint is taken once, before reading any files, so
+        # that a store created from them is never considered up to date
+        # if they change in the meantime. It identifies the session
+        # files in memory from then on (see the fingerprint property).
+        self._take_fingerprint()
+        self._store = SessionStore.open(self._path)
+
+        self._source_zip_path = None
+        self._source_archive = None
+
+        if (self._path / 'processed' / 'src.zip').exists():
+            self._source_zip_path = self._path / 'processed' / 'src.zip'
+            self._source_archive = SourceArchive(self._source_zip_path)
+
+        if self._store is not None:
+            self._metadata = None
+            self._metrics = self._store.get_property('metrics')
+            self._general_metrics = self._store.get_property(
+                'general_metrics')
+            self._sources = self._store.get_property('sources')
+            self._source_index = self._store.get_property('source_index')
+            self._start_time = self._store.get_property('start_time')
+            return
 
         with (self._path / 'processed' / 'metadata.json').open(mode='r') as f:
             self._metadata = json.load(f)
 
+        self._start_time = self._metadata.get('start_time', 0)
+
         metrics_path = self._path / 'processed' / 'event_dict.data'
 
         if not metrics_path.exists():
@@ -230,15 +354,13 @@ class ProfilingResults:
 
         self._sources = {}
         self._source_index = {}
-        self._source_zip_path = None
 
         if (self._path / 'processed' / 'sources.json').exists():
             with (self._path / 'processed' / 'sources.json').open(
                     mode='r') as f:
                 self._sources = json.load(f)
 
-        if (self._path / 'processed' / 'src.zip').exists():
-            self._source_zip_path = self._path / 'processed' / 'src.zip'
+        if self._source_zip_path is not None:
             src_index_path = self._path / 'processed' / 'src_index.json'
 
             if src_index_path.exists():
@@ -256,6 +378,156 @@ class ProfilingResults:
                         with src_index_path.open(mode='w') as f:
                             f.write(index_str)
 
+                        self._take_fingerprint()
+
+        if create_store:
+            try:
+                self._single_flight.run(('store', str(self._path)),
+                                        self.create_store)
+            except Exception as e:
+                print(f'Could not create the store of {self._path} ({e}), '
+                      'using the session files.', file=sys.stderr)
+
+    def create_store(self):
+        """
+        Convert the session files to a SessionStore in the session
+        directory, replacing the existing store (if any). The store is
+        used by ProfilingResults objects constructed afterwards as long
+        as the session files stay the same. Nothing happens if this
+        object already reads from an up-to-date store.
+
+        :raises OSError: When the store cannot be written (e.g. because
+                         the session directory is read-only).
+        :raises ValueError: When a session file is invalid.
+        """
+        if self._store is not None:
+            return
+
+        processed_path = self._path / 'processed'
+        mappings = {}
+        symbol_index = SymbolIndex()
+
+        with SessionStoreWriter(self._path, self._fingerprint) as writer:
+            writer.put_property('metrics', self._metrics)
+            writer.put_property('general_metrics', self._general_metrics)
+            writer.put_property('sources', self._sources)
+            writer.put_property('source_index', self._source_index)
+            writer.put_property('start_time', self._start_time)
+            writer.put_metadata(self._metadata)
+
+            for path in sorted(processed_path.glob('*_callchains.json')):
+                kind = re.search(r'^(.+)_callchains\.json$',
+                                 path.name).group(1)
+
+                with path.open(mode='r') as f:
+                    mappings[kind] = json.load(f)
+
+                writer.put_callchain_mappings(kind, mappings[kind])
+
+            for path in sorted(processed_path.glob('perf-*.map')):
+                if re.search(r'^perf-\d+\.map$', path.name) is not None:
+                    writer.put_perf_map_index(path.name,
+                                              PerfMapIndex.build(path))
+
+            # Flame graphs are read and stored one by one, so that only
+            # one of them is in memory at a time. The symbol index is
+            # built along the way (from the first, i.e. non-time-ordered,
+            # flame graph of every metric).
+            for path in sorted(processed_path.glob('*_*.json')):
+                if re.search(r'^\d+_\d+\.json$', path.name) is None:
+                    continue
+
+                indexed = set()
+
+                with path.open(mode='r') as f:
+                    for metric, graph in read_flame_graphs(f):
+                        writer.put_flame_graph(path.stem, metric,
+                                               graph.to_bytes())
+
+                        if metric not in indexed:
+                            indexed.add(metric)
+                            symbol_index.add(path.stem, metric, graph,
+                                             mappings.get(metric, {}))
+
+            writer.put_property('symbol_index',
+                                [symbol_index.get_entries(),
+                                 symbol_index.get_totals()])
+
+    @property
+    def has_store(self):
+        return self._store is not None
+
+    def _take_fingerprint(self):
+        self._fingerprint = SessionStore.get_fingerprint(self._path)
+        self._fingerprint_key = tuple(self._fingerprint)
+
+    @property
+    def fingerprint(self):
+        """
+        The fingerprint of the session files (see
+        SessionStore.get_fingerprint()) as a tuple, taken when
+        the object was constructed. The results of computations involving
+        many session files are identified by it, so that the files do not
+        need to be listed and checked every time.
+        """
+        return self._fingerprint_key
+
+    def _get_processed_paths(self, pattern):
+        # Get the list of pathlib.Path objects pointing to the files in
+        # "processed" with names matching a glob pattern, as listed in
+        # the fingerprint.
+        processed_path = Path('processed')
+        paths = []
+
+        for name, _, _ in self._fingerprint:
+            path = Path(name)
+
+            if path.parent == processed_path and fnmatch(path.name, pattern):
+                paths.append(self._path / path)
+
+        return paths
+
+    @property
+    def memory_size(self):
+        """
+        The estimated size in bytes of the data kept in memory by
+        the object beyond what is parsed from the session files, i.e.
+        the off-CPU pyramids, the perf map indices, the cached source
+        code files and the results of the most recent computations.
+        The latter are measured only when they change.
+        """
+        size = self._off_cpu_pyramids.size + \
+            self._perf_map_indices.size + self._hot_functions.size
+
+        with self._threshold_lock:
+            size += sum(16 * len(x) + 64
+                        for x in self._threshold_indices.values())
+
+        if self._source_archive is not None:
+            size += self._source_archive.size
+
+        slot_sizes = {}
+
+        for name in ProfilingResults.MEMORY_SLOTS:
+            slot = getattr(self, name)
+
+            if slot is None:
+                continue
+
+            # The keys identify the values, so a slot is measured again
+            # only when its key changes.
+            last = self._slot_sizes.get(name)
+
+            if last is not None and last[0] == slot[0]:
+                slot_sizes[name] = last
+            else:
+                slot_sizes[name] = (slot[0], get_object_size(slot[1:]))
+
+            size += slot_sizes[name][1]
+
+        self._slot_sizes = slot_sizes
+        return size
+
     def get_general_analysis(self, analysis_type):
         """
         Get general analysis data of a specified type. If the type
@@ -353,172 +625,983 @@ class ProfilingResults:
         else:
             return None
 
-    def get_flame_graph(self, pid, tid, compress_threshold):
+    def get_flame_graph(self, pid, tid, compress_threshold,
+                        max_depth=None, time_range=None, binary=False):
         """
         Get a flame graph of the thread/process with a given PID and TID
         to be rendered by d3-flame-graph, taking into account to collapse
         blocks taking less than a specified share of total samples.
 
+        Every computed flame graph is valid for a whole interval of
+        thresholds (see FlameGraph.compress()), so if the on-disk cache
+        is enabled, the interval and the serialized flame graph are cached
+        and subsequent requests with any threshold from the interval
+        are answered without computing anything.
+
         :param int pid: The PID of a thread/process in the session.
         :param int tid: The TID of a thread/process in the session.
         :param float compress_threshold: A compression threshold. For
                                          example, if its value is 0.10,
                                          blocks taking less than 10% of
                                          total samples will be collapsed.
+        :param int max_depth: If set, only the top max_depth + 1 levels
+                              of every flame graph are returned, with
+                              the blocks at the last level replaced with
+                              stubs (see CompressedFlameGraph.to_json()).
+                              The stub IDs are in form of
+                              "<metric>:<0 for non-time-ordered, 1 for
+                              time-ordered>:<preorder index>" and can be
+                              passed to get_flame_graph_subtree().
+        :param tuple time_range: If set, the flame graphs are restricted
+                                 to a time window given as a (start, end)
+                                 pair of timestamps in milliseconds, on
+                                 the same scale as "start_time" in
+                                 get_json_tree(). See _get_time_offsets()
+                                 for how the window is mapped to
+                                 the flame graphs.
+        :param bool binary: Whether the result should be in the binary
+                            wire format (see get_binary()) rather than
+                            a JSON string.
+        :raises ValueError: When max_depth is smaller than 1 or
+                            the time window is invalid.
+        """
+        time_range = self._check_time_range(time_range)
+
+        if max_depth is None and time_range is None:
+            return self._get_full_flame_graph(pid, tid, compress_threshold,
+                                              binary)
+
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        p = self._path / 'processed' / f'{pid}_{tid}.json'
+        cache_key = ('flame_graph_truncated', str(pid), str(tid),
+                     float(compress_threshold),
+                     None if max_depth is None else int(max_depth))
+
+        if time_range is not None:
+            cache_key += time_range
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            compressed = self._compress_flame_graphs(pid, tid,
+                                                     compress_threshold,
+                                                     time_range)
+
+            if compressed is None:
+                return None
+
+            return self._serialize_flame_graphs(
+                compressed[0], None if max_depth is None else int(max_depth),
+                binary)
+
+        return self._get_cached(cache_key, [p], compute, binary)
+
+    def get_flame_graph_subtree(self, pid, tid, compress_threshold,
+                                node_id, max_depth=None, time_range=None,
+                                binary=False):
+        """
+        Get a subtree of a flame graph returned by get_flame_graph(), with
+        the root being a stub with a given ID. None is returned if there
+        is no block with such ID.
+
+        :param int pid: The PID of a thread/process in the session.
+        :param int tid: The TID of a thread/process in the session.
+        :param float compress_threshold: A compression threshold (see
+                                         get_flame_graph()).
+        :param str node_id: The stub ID of the subtree root (see
+                            get_flame_graph()).
+        :param int max_depth: If set, only the top max_depth + 1 levels
+                              of the subtree are returned, in the same way
+                              as in get_flame_graph().
+        :param tuple time_range: The time window the flame graph is
+                                 restricted to (see get_flame_graph()).
+        :param bool binary: Whether the result should be in the binary
+                            wire format (see get_binary()) rather than
+                            a JSON string.
+        :raises ValueError: When a provided stub ID is incorrect,
+                            max_depth is smaller than 1, or the time
+                            window is invalid.
+        """
+        time_range = self._check_time_range(time_range)
+        metric, variant, index = node_id.rsplit(':', 2)
+        variant = int(variant)
+        index = int(index)
+
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        p = self._path / 'processed' / f'{pid}_{tid}.json'
+        cache_key = ('flame_graph_subtree', str(pid), str(tid),
+                     float(compress_threshold), node_id,
+                     None if max_depth is None else int(max_depth))
+
+        if time_range is not None:
+            cache_key += time_range
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            compressed = self._compress_flame_graphs(pid, tid,
+                                                     compress_threshold,
+                                                     time_range)
+
+            if compressed is None:
+                return None
+
+            return self._get_subtree_json(compressed[0], metric, variant,
+                                          index, max_depth, binary)
+
+        return self._get_cached(cache_key, [p], compute, binary)
+
+    def _get_subtree_json(self, graphs, metric, variant, index, max_depth,
+                          binary=False):
+        if metric not in graphs or variant not in [0, 1]:
+            return None
+
+        graph = graphs[metric][variant]
+
+        if graph is None:
+            return None
+
+        block = graph.find(index)
+
+        if block is None:
+            return None
+
+        max_depth = None if max_depth is None else int(max_depth)
+
+        if binary:
+            encoder = BinaryEncoder()
+            graph.encode_binary(encoder, block, max_depth,
+                                f'{metric}:{variant}:', index)
+            return encoder.to_bytes()
+
+        return graph.to_json(block, max_depth, f'{metric}:{variant}:', index)
+
+    def get_merged_flame_graph(self, pid, compress_threshold,
+                               max_depth=None, binary=False):
         """
+        Get a flame graph of all threads/processes with a given PID (or
+        of the whole session), i.e. their non-time-ordered flame graphs
+        merged by call path, in the same format as get_flame_graph()
+        returns except that the time-ordered flame graphs are null (they
+        cannot be merged meaningfully).
+
+        The flame graphs are merged in parallel by a pool of worker
+        processes (see merge_session_flame_graphs()). The merged flame
+        graphs are stored in the on-disk cache (if enabled) before they
+        are compressed, so requests with other thresholds do not merge
+        them again.
+
+        :param int pid: The PID of the threads/processes to be merged.
+                        If it is None, all threads/processes of
+                        the session are merged.
+        :param float compress_threshold: A compression threshold (see
+                                         get_flame_graph()).
+        :param int max_depth: See get_flame_graph(). The stub IDs can be
+                              passed to get_merged_flame_graph_subtree().
+        :param bool binary: Whether the result should be in the binary
+                            wire format (see get_binary()) rather than
+                            a JSON string.
+        :raises ValueError: When max_depth is smaller than 1.
+        """
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        sources = self.get_merged_sources(pid)
+
+        if len(sources) == 0:
+            return None
+
+        cache_key = ('flame_graph_merged', 'all' if pid is None else str(pid),
+                     float(compress_threshold),
+                     None if max_depth is None else int(max_depth))
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            graphs = self._compress_merged_flame_graphs(pid, sources,
+                                                        compress_threshold)
+            return self._serialize_flame_graphs(
+                graphs, None if max_depth is None else int(max_depth),
+                binary)
+
+        return self._get_cached(cache_key, sources, compute, binary)
+
+    def get_merged_flame_graph_subtree(self, pid, compress_threshold,
+                                       node_id, max_depth=None,
+                                       binary=False):
+        """
+        Get a subtree of a flame graph returned by get_merged_flame_graph()
+        in the same way as get_flame_graph_subtree() does for
+        get_flame_graph().
+
+        :param int pid: The PID of the merged threads/processes (None for
+                        the whole session).
+        :param float compress_threshold: A compression threshold (see
+                                         get_flame_graph()).
+        :param str node_id: The stub ID of the subtree root.
+        :param int max_depth: See get_flame_graph_subtree().
+        :param bool binary: See get_flame_graph().
+        :raises ValueError: When a provided stub ID is incorrect or
+                            max_depth is smaller than 1.
+        """
+        metric, variant, index = node_id.rsplit(':', 2)
+        variant = int(variant)
+        index = int(index)
+
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        sources = self.get_merged_sources(pid)
+
+        if len(sources) == 0:
+            return None
+
+        cache_key = ('flame_graph_merged_subtree',
+                     'all' if pid is None else str(pid),
+                     float(compress_threshold), node_id,
+                     None if max_depth is None else int(max_depth))
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            graphs = self._compress_merged_flame_graphs(pid, sources,
+                                                        compress_threshold)
+            return self._get_subtree_json(graphs, metric, variant, index,
+                                          max_depth, binary)
+
+        return self._get_cached(cache_key, sources, compute, binary)
+
+    def get_differential_flame_graph(self, reference, baseline,
+                                     baseline_reference, compress_threshold,
+                                     max_depth=None, binary=False):
+        """
+        Get a differential flame graph comparing the non-time-ordered
+        flame graphs of a thread/process (or merged threads/processes, see
+        get_merged_flame_graph()) with the baseline ones, possibly from
+        another session (e.g. of a previous build of the same program).
+
+        The flame graphs are aligned by call path (see
+        diff_flame_graphs()) and returned in the same format as
+        get_merged_flame_graph() returns, with "baseline" and "delta"
+        set for every block, so that they can be rendered by
+        d3-flame-graph in the differential mode. Only the metrics present
+        in both sessions are compared.
+
+        If the baseline is from another session, the compressed callchain
+        names are replaced with the symbol names (see
+        get_callchain_mappings()) before aligning the flame graphs, as
+        every session compresses the names on its own.
+
+        :param str reference: The flame graphs to be compared:
+                              "<PID>_<TID>" for a thread/process,
+                              "<PID>" for all threads/processes with
+                              a given PID, or "all" for the whole session.
+        :param ProfilingResults baseline: The session of the baseline
+                                          flame graphs (it can be this
+                                          session).
+        :param str baseline_reference: The baseline flame graphs, in
+                                       the same form as reference.
+        :param float compress_threshold: A compression threshold (see
+                                         get_flame_graph()).
+        :param int max_depth: See get_flame_graph(). The stub IDs can be
+                              passed to
+                              get_differential_flame_graph_subtree().
+        :param bool binary: Whether the result should be in the binary
+                            wire format (see get_binary()) rather than
+                            a JSON string.
+        :raises ValueError: When any reference is incorrect or max_depth
+                            is smaller than 1.
+        """
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        sources = self.get_reference_sources(reference) + \
+            baseline.get_reference_sources(baseline_reference)
+
+        if not all(p.exists() for p in sources):
+            return None
+
+        cache_key = ('flame_graph_diff', reference, str(baseline._path),
+                     baseline_reference, float(compress_threshold),
+                     None if max_depth is None else int(max_depth))
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            graphs = self._compress_differential_flame_graphs(
+                reference, baseline, baseline_reference, sources,
+                compress_threshold)
+            return self._serialize_flame_graphs(
+                graphs, None if max_depth is None else int(max_depth),
+                binary)
+
+        return self._get_cached(cache_key, sources, compute, binary)
+
+    def get_differential_flame_graph_subtree(self, reference, baseline,
+                                             baseline_reference,
+                                             compress_threshold, node_id,
+                                             max_depth=None, binary=False):
+        """
+        Get a subtree of a flame graph returned by
+        get_differential_flame_graph() in the same way as
+        get_flame_graph_subtree() does for get_flame_graph().
+
+        :param str reference: See get_differential_flame_graph().
+        :param ProfilingResults baseline: See
+                                          get_differential_flame_graph().
+        :param str baseline_reference: See get_differential_flame_graph().
+        :param float compress_threshold: A compression threshold (see
+                                         get_flame_graph()).
+        :param str node_id: The stub ID of the subtree root.
+        :param int max_depth: See get_flame_graph_subtree().
+        :param bool binary: See get_flame_graph().
+        :raises ValueError: When any reference or the stub ID is
+                            incorrect or max_depth is smaller than 1.
+        """
+        metric, variant, index = node_id.rsplit(':', 2)
+        variant = int(variant)
+        index = int(index)
+
+        if max_depth is not None and int(max_depth) < 1:
+            raise ValueError('max_depth must be at least 1!')
+
+        sources = self.get_reference_sources(reference) + \
+            baseline.get_reference_sources(baseline_reference)
+
+        if not all(p.exists() for p in sources):
+            return None
+
+        cache_key = ('flame_graph_diff_subtree', reference,
+                     str(baseline._path), baseline_reference,
+                     float(compress_threshold), node_id,
+                     None if max_depth is None else int(max_depth))
+
+        if binary:
+            cache_key += ('binary',)
+
+        def compute():
+            graphs = self._compress_differential_flame_graphs(
+                reference, baseline, baseline_reference, sources,
+                compress_threshold)
+            return self._get_subtree_json(graphs, metric, variant, index,
+                                          max_depth, binary)
+
+        return self._get_cached(cache_key, sources, compute, binary)
+
+    def _compress_differential_flame_graphs(self, reference, baseline,
+                                            baseline_reference, sources,
+                                            compress_threshold):
+        compress_threshold = float(compress_threshold)
+        key = ('diff', reference, str(baseline._path), baseline_reference,
+               compress_threshold,
+               self.fingerprint, baseline.fingerprint)
+        last_compressed = self._last_compressed
+
+        if last_compressed is not None and last_compressed[0] == key:
+            return last_compressed[1]
+
+        def compress():
+            new_graphs = self._get_reference_flame_graphs(reference)
+            baseline_graphs = baseline._get_reference_flame_graphs(
+                baseline_reference)
+
+            if baseline._path != self._path:
+                new_graphs = self._get_symbol_flame_graphs(new_graphs)
+                baseline_graphs = baseline._get_symbol_flame_graphs(
+                    baseline_graphs)
+
+            metrics = [k for k in new_graphs if k in baseline_graphs]
+            result = {}
+
+            for j, k in enumerate(metrics):
+                report_progress('compress', j / len(metrics))
+                graph = diff_flame_graphs(baseline_graphs[k], new_graphs[k])
+                result[k] = [graph.compress(compress_threshold, False), None]
+
+            self._last_compressed = (key, result)
+            return result
+
+        return self._single_flight.run((str(self._path), 'compress') + key,
+                                       compress)
+
+    def _parse_reference(self, reference):
+        # Convert a reference to flame graphs (see
+        # get_differential_flame_graph()) to a (PID, TID) pair, with
+        # the TID being None for merged threads/processes and the PID
+        # being None for the whole session.
+        if reference == 'all':
+            return None, None
+
+        match = re.search(r'^(\d+)(?:_(\d+))?$', str(reference))
+
+        if match is None:
+            raise ValueError(f'{reference} is not a valid reference to '
+                             'flame graphs!')
+
+        return match.group(1), match.group(2)
+
+    def get_reference_sources(self, reference) -> list:
+        """
+        Get the list of pathlib.Path objects pointing to the flame graph
+        files of given threads/processes.
+
+        :param str reference: The threads/processes in the form accepted
+                              by get_differential_flame_graph().
+        :raises ValueError: When the reference is incorrect.
+        """
+        pid, tid = self._parse_reference(reference)
+
+        if tid is not None:
+            return [self._path / 'processed' / f'{pid}_{tid}.json']
+
+        sources = self.get_merged_sources(pid)
+
+        # A path which does not exist is returned for the references
+        # without any flame graphs, so that they are treated as missing.
+        return sources if len(sources) > 0 else \
+            [self._path / 'processed' / f'{reference}_*.json']
+
+    def _get_reference_flame_graphs(self, reference):
+        pid, tid = self._parse_reference(reference)
+
+        if tid is None:
+            return self._get_merged_flame_graphs(
+                pid, self.get_merged_sources(pid))
+
+        # Merging the flame graphs of a single thread/process guarantees
+        # that the names of sibling blocks are unique.
+        return merge_thread_flame_graphs(str(self._path), [f'{pid}_{tid}'])
+
+    def _get_symbol_flame_graphs(self, graphs):
+        mappings = json.loads(self.get_callchain_mappings())
+        result = {}
+
+        for k, graph in graphs.items():
+            names = {name: symbol[0]
+                     for name, symbol in mappings.get(k, {}).items()}
+            result[k] = merge_flame_graphs([graph.rename(names)])
+
+        return result
+
+    def get_merged_sources(self, pid=None) -> list:
+        """
+        Get the sorted list of pathlib.Path objects pointing to the flame
+        graph files of all threads/processes with a given PID (or of all
+        threads/processes in the session if the PID is None), as listed
+        when the object was constructed (see the fingerprint property).
+
+        :param int pid: The PID of the threads/processes.
+        """
+        paths = []
+
+        for path in self._get_processed_paths('*_*.json'):
+            match = re.search(r'^(\d+)_(\d+)\.json$', path.name)
+
+            if match is not None and (pid is None or
+                                      match.group(1) == str(pid)):
+                paths.append((int(match.group(1)), int(match.group(2)),
+                              path))
+
+        return [x[2] for x in sorted(paths)]
+
+    def _compress_merged_flame_graphs(self, pid, sources,
+                                      compress_threshold):
+        compress_threshold = float(compress_threshold)
+        key = ('merged', 'all' if pid is None else str(pid),
+               compress_threshold, self.fingerprint)
+        last_compressed = self._last_compressed
+
+        if last_compressed is not None and last_compressed[0] == key:
+            return last_compressed[1]
+
+        def compress():
+            graphs = self._get_merged_flame_graphs(pid, sources)
+            result = {}
+
+            for j, (k, graph) in enumerate(graphs.items()):
+                report_progress('compress', j / len(graphs))
+                result[k] = [graph.compress(compress_threshold, False), None]
+
+            self._last_compressed = (key, result)
+            return result
+
+        return self._single_flight.run((str(self._path), 'compress') + key,
+                                       compress)
+
+    def _get_merged_flame_graphs(self, pid, sources):
+        # The merged flame graphs are kept in memory until other ones
+        # are merged, as the website typically asks for several
+        # depth-limited parts of the same flame graphs in a row.
+        key = ('all' if pid is None else str(pid), self.fingerprint)
+        last_merged = self._last_merged
+
+        if last_merged is not None and last_merged[0] == key:
+            return last_merged[1]
+
+        def merge():
+            pid_tids = [p.stem for p in sources]
+            return pack_flame_graphs(merge_session_flame_graphs(
+                str(self._path), pid_tids, self._merge_processes))
+
+        packed = self._get_cached(('merged_flame_graphs', key[0]), sources,
+                                  merge, binary=True)
+        graphs = unpack_flame_graphs(packed)
+        self._last_merged = (key, graphs)
+
+        return graphs
+
+    def _find_threshold_interval(self, pid, tid, compress_threshold):
+        # Get the threshold interval (see ThresholdIndex) of the flame
+        # graphs of a thread/process containing a given threshold, or
+        # None if it is not known yet. The index of every thread/process
+        # is kept in memory, whether the on-disk cache is enabled or not.
+        # It is read from the on-disk cache (if enabled) when it is first
+        # needed and whenever a threshold is not covered, as other
+        # processes may have added intervals to it in the meantime.
+        p = self._path / 'processed' / f'{pid}_{tid}.json'
+
+        try:
+            stat = p.stat()
+        except FileNotFoundError:
+            return None
+
+        key = (str(pid), str(tid), stat.st_mtime_ns, stat.st_size)
+
+        with self._threshold_lock:
+            index = self._threshold_indices.get(key)
+            interval = None if index is None else \
+                index.find(compress_threshold)
+
+        if interval is not None or self._cache is None:
+            return interval
+
+        index_str = self._cache.get(('flame_graph_index', str(pid),
+                                     str(tid)), [p])
+
+        if index_str is None:
+            return None
+
+        return self._add_threshold_intervals(
+            key, ThresholdIndex.from_json(index_str).get_intervals(),
+            compress_threshold)
+
+    def _add_threshold_intervals(self, key, intervals,
+                                 compress_threshold=None):
+        # Add intervals to the threshold index kept in memory (see
+        # _find_threshold_interval()) and return the interval containing
+        # a given threshold (None if there is none).
+        with self._threshold_lock:
+            index = self._threshold_indices.get(key)
+
+            if index is None:
+                # The indices of the previous versions of the file are
+                # not needed anymore.
+                self._threshold_indices = {
+                    k: v for k, v in self._threshold_indices.items()
+                    if k[:2] != key[:2]}
+                index = ThresholdIndex()
+                self._threshold_indices[key] = index
+
+            for lo, hi in intervals:
+                index.add(lo, hi)
+
+            if compress_threshold is None:
+                return None
+
+            return index.find(compress_threshold)
+
+    def _get_full_flame_graph(self, pid, tid, compress_threshold,
+                              binary=False):
         p = self._path / 'processed' / f'{pid}_{tid}.json'
 
         if not p.exists():
             return None
 
-        with p.open(mode='r') as f:
-            data = json.load(f)
+        compress_threshold = float(compress_threshold)
+        kind = 'flame_graph_binary' if binary else 'flame_graph'
+
+        def lookup():
+            if self._cache is None:
+                return None
+
+            interval = self._find_threshold_interval(pid, tid,
+                                                     compress_threshold)
+
+            if interval is None:
+                cache_key = (kind, str(pid), str(tid), compress_threshold)
+            else:
+                cache_key = (kind, str(pid), str(tid)) + interval
+
+            return self._cache.get(cache_key, [p], binary)
+
+        cached = lookup()
+
+        if cached is not None:
+            return cached
+
+        def compute():
+            # The flame graph may have been computed while waiting.
+            cached = lookup()
+
+            if cached is not None:
+                return cached
+
+            return self._compute_full_flame_graph(pid, tid,
+                                                  compress_threshold, binary)
+
+        return self._coalesce((kind, str(pid), str(tid),
+                               compress_threshold), [p], compute)
+
+    def _compute_full_flame_graph(self, pid, tid, compress_threshold,
+                                  binary=False):
+        p = self._path / 'processed' / f'{pid}_{tid}.json'
+        compressed = self._compress_flame_graphs(pid, tid,
+                                                 compress_threshold)
+
+        if compressed is None:
+            return None
+
+        graphs, lo, hi = compressed
+        result = self._serialize_flame_graphs(graphs, binary=binary)
+        kind = 'flame_graph_binary' if binary else 'flame_graph'
+
+        if self._cache is not None:
+            if lo < compress_threshold <= hi:
+                # The index is read again in case it has been updated
+                # in the meantime (e.g. by another process).
+                index_key = ('flame_graph_index', str(pid), str(tid))
+                index_str = self._cache.get(index_key, [p])
+                index = ThresholdIndex() if index_str is None else \
+                    ThresholdIndex.from_json(index_str)
+                index.add(lo, hi)
+                self._cache.put(index_key, [p], index.to_json())
+                cache_key = (kind, str(pid), str(tid), lo, hi)
+            else:
+                cache_key = (kind, str(pid), str(tid), compress_threshold)
+
+            self._cache.put(cache_key, [p], result)
+
+        return result
 
-        for k, v in data.items():
+    def _check_time_range(self, time_range):
+        if time_range is None:
+            return None
+
+        start, end = float(time_range[0]), float(time_range[1])
+
+        if not start < end:
+            raise ValueError('The start of a time range must be before '
+                             'its end!')
+
+        return (start, end)
+
+    def _compress_flame_graphs(self, pid, tid, compress_threshold,
+                               time_range=None):
+        # The most recently compressed flame graphs are kept in memory,
+        # as the website typically asks for several depth-limited parts
+        # of the same flame graphs in a row.
+        p = self._path / 'processed' / f'{pid}_{tid}.json'
+
+        try:
+            stat = p.stat()
+        except FileNotFoundError:
+            return None
+
+        compress_threshold = float(compress_threshold)
+        interval = None
+
+        if time_range is None:
+            interval = self._find_threshold_interval(pid, tid,
+                                                     compress_threshold)
+
+        # All thresholds within a known interval give the same result,
+        # so they share the compressed flame graphs.
+        key = (str(pid), str(tid),
+               compress_threshold if interval is None else interval,
+               stat.st_mtime_ns, stat.st_size, time_range)
+
+        last_compressed = self._last_compressed
+
+        if last_compressed is not None and last_compressed[0] == key:
+            return last_compressed[1]
+
+        # Different requests (e.g. for the full and the depth-limited
+        # flame graphs) can need the same compressed flame graphs at
+        # the same time, so they are computed only once.
+        return self._single_flight.run(
+            (str(self._path), 'compress') + key,
+            lambda: self._load_compressed_flame_graphs(
+                p, pid, tid, compress_threshold, key, time_range))
+
+    def _load_compressed_flame_graphs(self, p, pid, tid, compress_threshold,
+                                      key, time_range=None):
+        report_progress('load', 0)
+
+        graphs = {}
+        lo = float('-inf')
+        hi = float('inf')
+
+        def add(k, graph, progress):
+            nonlocal lo, hi
+            v = graphs.setdefault(k, [])
+
+            if len(v) == 2:
+                raise RuntimeError(f'{k} in {pid}_{tid}.json should have '
+                                   'exactly 2 elements, but it has more')
+
+            report_progress('compress', progress)
+            compressed = graph.compress(compress_threshold, len(v) == 1)
+            v.append(compressed)
+            lo = max(lo, compressed.lo)
+            hi = min(hi, compressed.hi)
+
+        if time_range is not None:
+            indices = self._get_time_indices(p, pid, tid, key[3:5])
+
+            for j, (k, index) in enumerate(indices.items()):
+                start, end = self._get_time_offsets(pid, tid, index.graph,
+                                                    time_range)
+                sliced = index.slice(start, end)
+
+                # The non-time-ordered flame graph is the time-ordered
+                # one with the blocks of the same names and parents
+                # merged, so it is derived from the slice.
+                add(k, merge_flame_graphs([sliced]), j / len(indices))
+                add(k, sliced, (j + 0.5) / len(indices))
+        elif self._store is not None and \
+                self._store.has_flame_graphs(f'{pid}_{tid}'):
+            for k, data in self._store.get_flame_graphs(f'{pid}_{tid}'):
+                add(k, FlameGraph.from_bytes(data), len(graphs) / 2)
+        else:
+            size = max(1, p.stat().st_size)
+            read = 0
+
+            def on_progress(count):
+                nonlocal read
+                read = count
+                report_progress('load', min(1, read / size))
+
+            # The file is read incrementally and every flame graph
+            # is compressed as soon as it is read, so that the file is
+            # never held in memory in form of nested dictionaries (which
+            # take several times more memory than the file itself).
+            with p.open(mode='r') as f:
+                for k, graph in read_flame_graphs(f, on_progress):
+                    add(k, graph, min(1, read / size))
+
+        for k, v in graphs.items():
             if len(v) != 2:
                 raise RuntimeError(f'{k} in {pid}_{tid}.json should have '
                                    f'exactly 2 elements, but it has {len(v)}')
 
-            compressed_blocks_lists = [[], []]
-            queue = deque([(v[0], v[0]['value'], False, False,
-                            compressed_blocks_lists[0]),
-                           (v[1], v[1]['value'], True, False,
-                            compressed_blocks_lists[1])])
-
-            while len(queue) > 0:
-                result, total, time_ordered, parent_is_compressed, \
-                    compressed_blocks = queue.pop()
-
-                children = result['children']
-                new_children = []
-                compressed_value = 0
-                hidden_children = []
-                compressed_children = set()
-
-                for i, child in enumerate(children):
-                    if child['value'] < compress_threshold * total:
-                        compressed_children.add(i)
-                    else:
-                        queue.append((child, total, time_ordered, False,
-                                      compressed_blocks))
-
-                for i, child in enumerate(children):
-                    if time_ordered:
-                        if i in compressed_children:
-                            compressed_value += child['value']
-                            hidden_children.append(child)
-                        else:
-                            if compressed_value > 0:
-                                if compressed_value == total \
-                                   and parent_is_compressed:
-                                    new_children += hidden_children
-                                else:
-                                    new_child = {
-                                        'name': '(compressed)',
-                                        'value': compressed_value,
-                                        'children': hidden_children,
-                                        'compressed_id': len(compressed_blocks)
-                                    }
-
-                                    queue.append((new_child,
-                                                  compressed_value,
-                                                  time_ordered,
-                                                  True,
-                                                  compressed_blocks))
-
-                                    compressed_blocks.append(new_child)
-                                    new_children.append(new_child)
-
-                                compressed_value = 0
-                                hidden_children = []
-
-                            new_children.append(child)
-                    else:
-                        if i in compressed_children:
-                            compressed_value += child['value']
-                            hidden_children.append(child)
-                        else:
-                            new_children.append(child)
-
-                if compressed_value > 0:
-                    if len(hidden_children) == 1 and \
-                       len(hidden_children[0]['children']) == 0:
-                        new_children += hidden_children
-                    elif compressed_value == total and parent_is_compressed:
-                        if len(hidden_children) > 1:
-                            part1_cnt = len(hidden_children) // 2
-
-                            compressed_value_part1 = 0
-                            for i in range(part1_cnt):
-                                compressed_value_part1 += \
-                                    hidden_children[i]['value']
-
-                            compressed_value_part2 = compressed_value - \
-                                compressed_value_part1
-
-                            new_child1 = {
-                                'name': '(compressed)',
-                                'value': compressed_value_part1,
-                                'children': hidden_children[:part1_cnt],
-                                'compressed_id': len(compressed_blocks)
-                            }
-
-                            new_child2 = {
-                                'name': '(compressed)',
-                                'value': compressed_value_part2,
-                                'children': hidden_children[part1_cnt:],
-                                'compressed_id': len(compressed_blocks) + 1
-                            }
-
-                            queue.append((new_child1, compressed_value_part1,
-                                          time_ordered, True,
-                                          compressed_blocks))
-                            queue.append((new_child2, compressed_value_part2,
-                                          time_ordered, True,
-                                          compressed_blocks))
-
-                            compressed_blocks.append(new_child1)
-                            compressed_blocks.append(new_child2)
-
-                            new_children.append(new_child1)
-                            new_children.append(new_child2)
-                        else:
-                            new_children += hidden_children
-                    else:
-                        new_child = {
-                            'name': '(compressed)',
-                            'value': compressed_value,
-                            'children': hidden_children,
-                            'compressed_id': len(compressed_blocks)
-                        }
+        result = (graphs, lo, hi)
+
+        if time_range is None and lo < compress_threshold <= hi:
+            # The result is kept under the key of its interval, so that
+            # it is reused for all thresholds within it.
+            self._add_threshold_intervals(key[:2] + key[3:5], [(lo, hi)])
+            key = key[:2] + ((lo, hi),) + key[3:]
+
+        self._last_compressed = (key, result)
 
-                        queue.append((new_child, compressed_value,
-                                      time_ordered, True,
-                                      compressed_blocks))
+        return result
 
-                        compressed_blocks.append(new_child)
-                        new_children.append(new_child)
+    def _get_time_indices(self, p, pid, tid, version):
+        # The time indices of the most recently sliced flame graphs are
+        # kept in memory, as the website typically asks for several time
+        # windows of the same flame graphs in a row.
+        key = (str(pid), str(tid)) + tuple(version)
+        last_time_indices = self._last_time_indices
 
-                if 'compressed_id' in result:
-                    result['children'] = []
-                    result['hidden_children'] = new_children
+        if last_time_indices is not None and last_time_indices[0] == key:
+            return last_time_indices[1]
+
+        def load():
+            report_progress('index', 0)
+            indices = {}
+            seen = set()
+
+            def add(k, graph):
+                # Only the time-ordered flame graphs (i.e. the second
+                # ones of every metric) are indexed.
+                if k in seen:
+                    indices[k] = TimeIndex(graph)
                 else:
-                    result['children'] = new_children
+                    seen.add(k)
 
-            for compressed_blocks in compressed_blocks_lists:
-                deleted_block_ids = set()
-                for block in compressed_blocks:
-                    if block['compressed_id'] in deleted_block_ids:
-                        continue
+            if self._store is not None and \
+               self._store.has_flame_graphs(f'{pid}_{tid}'):
+                for k, data in self._store.get_flame_graphs(f'{pid}_{tid}'):
+                    add(k, FlameGraph.from_bytes(data))
+            else:
+                with p.open(mode='r') as f:
+                    for k, graph in read_flame_graphs(f):
+                        add(k, graph)
+
+            self._last_time_indices = (key, indices)
+            return indices
+
+        return self._single_flight.run(
+            (str(self._path), 'time_index') + key, load)
+
+    def _get_time_offsets(self, pid, tid, graph, time_range):
+        # Map a time window in milliseconds to the offsets in the units of
+        # values of a time-ordered flame graph (see TimeIndex), assuming
+        # that the width of the root corresponds to the runtime of
+        # the thread/process (or its sampled time if the runtime is
+        # unknown) and the samples are spread evenly over it. The mapping
+        # is exact for wall time and approximate for other metrics.
+        node = self.get_thread_tree().get_node(f'{pid}_{tid}')
+
+        if node is None:
+            raise ValueError(f'There is no thread/process {pid}/{tid}!')
+
+        _, _, start_time, runtime = node.tag
+
+        if runtime == -1:
+            runtime = self._get_sampled_time(f'{pid}_{tid}')
+
+        if runtime is None or runtime <= 0:
+            raise ValueError(f'The runtime of {pid}/{tid} is unknown!')
+
+        total = graph.get_value(0)
+        offsets = []
+
+        for t in time_range:
+            offset = min(max((t * 1000000 - start_time) / runtime, 0),
+                         1) * total
+
+            if isinstance(total, int):
+                offset = round(offset)
+
+            offsets.append(offset)
+
+        return tuple(offsets)
+
+    def _coalesce(self, key, sources, func):
+        # Identical computations requested concurrently are run only
+        # once, in this process by SingleFlight and across processes
+        # by the locks of the on-disk cache. func() should check
+        # the on-disk cache first, as the result may have been stored
+        # there while waiting.
+        def run():
+            if self._cache is None:
+                return func()
+
+            with self._cache.lock(key, sources):
+                return func()
+
+        return self._single_flight.run((str(self._path),) + key, run)
 
-                    while (len(block['hidden_children']) == 1 and
-                           'hidden_children' in block['hidden_children'][0]):
-                        deleted_block_ids.add(
-                            block['hidden_children'][0]['compressed_id'])
-                        block['hidden_children'] = \
-                            block['hidden_children'][0]['hidden_children']
+    def _get_cached(self, cache_key, sources, func, binary=False):
+        # Return the on-disk cache entry with a given key, computing it
+        # with func() and storing it if it does not exist (None returned
+        # by func() is not stored). See _coalesce() for how concurrent
+        # computations are handled.
+        if self._cache is None:
+            return self._single_flight.run(
+                (str(self._path),) + cache_key, func)
 
-        return json.dumps(data)
+        cached = self._cache.get(cache_key, sources, binary)
+
+        if cached is not None:
+            return cached
+
+        def compute():
+            cached = self._cache.get(cache_key, sources, binary)
+
+            if cached is not None:
+                return cached
+
+            result = func()
+
+            if result is not None:
+                self._cache.put(cache_key, sources, result)
+
+            return result
+
+        return self._coalesce(cache_key, sources, compute)
+
+    def _serialize_flame_graphs(self, graphs, max_depth=None, binary=False):
+        if binary:
+            encoder = BinaryEncoder()
+            encoder.begin_object(len(graphs))
+
+            for j, (k, v) in enumerate(graphs.items()):
+                report_progress('serialize', j / len(graphs))
+                encoder.write_key(k)
+                encoder.begin_array(len(v))
+
+                for i in range(len(v)):
+                    if v[i] is None:
+                        encoder.write(None)
+                    else:
+                        v[i].encode_binary(encoder, max_depth=max_depth,
+                                           id_prefix=f'{k}:{i}:')
+
+            return encoder.to_bytes()
+
+        parts = []
+
+        for j, (k, v) in enumerate(graphs.items()):
+            report_progress('serialize', j / len(graphs))
+            parts.append(json.dumps(k) + ': [' +
+                         ', '.join('null' if v[i] is None else
+                                   v[i].to_json(max_depth=max_depth,
+                                                id_prefix=f'{k}:{i}:')
+                                   for i in range(len(v))) + ']')
+
+        return '{' + ', '.join(parts) + '}'
+
+    def get_binary(self, json_str: str) -> bytes:
+        """
+        Convert a JSON string returned by any other method of this class
+        to the binary wire format (see encode_binary()).
+
+        Flame graphs, which are the largest payloads, should be requested
+        in the binary format directly instead (with binary=True), as
+        this function parses the whole JSON string first. If the on-disk
+        cache is enabled, the result is cached there under the hash of
+        the JSON string, so that payloads are not re-encoded on every
+        request.
+
+        :param str json_str: A JSON string.
+        """
+        return self._convert_cached(
+            'binary', json_str.encode(),
+            lambda data: encode_binary(json.loads(data)))
+
+    def get_compressed(self, data: bytes, encoding: str) -> bytes:
+        """
+        Compress a response payload with a given HTTP content encoding
+        (see compress_payload()).
+
+        If the on-disk cache is enabled, the result is cached there in
+        the same way as in get_binary().
+
+        :param bytes data: The payload to be compressed.
+        :param str encoding: A content encoding returned by
+                             get_content_encodings().
+        """
+        return self._convert_cached(
+            encoding, data, lambda data: compress_payload(data, encoding))
+
+    def _convert_cached(self, kind, data, func):
+        if self._cache is None:
+            return func(data)
+
+        cache_key = (kind, hashlib.sha256(data).hexdigest())
+        return self._get_cached(cache_key, [], lambda: func(data),
+                                binary=True)
 
     def get_callchain_mappings(self):
         """
@@ -530,6 +1613,11 @@ class ProfilingResults:
         captured during tree profiling and full symbol and
         library/executable names.
         """
+        if self._store is not None:
+            mappings = self._store.get_callchain_mappings()
+            return '{' + ', '.join(json.dumps(k) + ': ' + v
+                                   for k, v in mappings.items()) + '}'
+
         paths = (self._path / 'processed').glob('*_callchains.json')
         result_dict = {}
 
@@ -540,6 +1628,167 @@ class ProfilingResults:
 
         return json.dumps(result_dict)
 
+    def get_symbol_index_sources(self) -> list:
+        """
+        Get the list of pathlib.Path objects pointing to the session files
+        the symbol index (see get_symbol_index()) is built from, i.e.
+        the flame graph files and the callchain mapping files.
+        """
+        return self.get_merged_sources() + \
+            self._get_processed_paths('*_callchains.json')
+
+    def get_symbol_index(self) -> SymbolIndex:
+        """
+        Get the SymbolIndex object of the session.
+
+        The index is taken from the session store if it has one.
+        Otherwise, it is built from the flame graph files (or the flame
+        graphs in an older store) and stored in the on-disk cache
+        (if enabled). Either way, it is kept in memory until the session
+        files change.
+        """
+        return self._get_last_symbol_index()[1]
+
+    def _get_last_symbol_index(self):
+        # Get the (key, SymbolIndex object) pair kept in memory, where
+        # the key identifies the session files the index was built from.
+        key = self.fingerprint
+        last_symbol_index = self._last_symbol_index
+
+        if last_symbol_index is not None and last_symbol_index[0] == key:
+            return last_symbol_index
+
+        stored = None if self._store is None else \
+            self._store.get_property('symbol_index')
+
+        if stored is not None:
+            index = SymbolIndex(*stored)
+        else:
+            sources = self.get_symbol_index_sources()
+
+            def build():
+                mappings = json.loads(self.get_callchain_mappings())
+                index = SymbolIndex()
+
+                for j, path in enumerate(sources):
+                    if not path.name.endswith('_callchains.json'):
+                        report_progress('load', j / len(sources))
+
+                        for metric, graph in read_thread_flame_graphs(
+                                self._path, self._store, path.stem):
+                            index.add(path.stem, metric, graph,
+                                      mappings.get(metric, {}))
+
+                return index.to_json()
+
+            index = SymbolIndex.from_json(self._get_cached(
+                ('symbol_index',), sources, build))
+
+        last_symbol_index = (key, index)
+        self._last_symbol_index = last_symbol_index
+
+        return last_symbol_index
+
+    def search_symbols(self, query, metric=None, exact=False, limit=100):
+        """
+        Get a JSON object string describing the threads/processes and
+        the metrics in which the symbols matching a query appear, along
+        with their total and self values there (see SymbolIndex.search()
+        for the format).
+
+        :param str query: The query, matched case-insensitively against
+                          the symbol names.
+        :param str metric: The metric the results should be limited to
+                           (None for all metrics).
+        :param bool exact: Whether symbols should match the query
+                           exactly rather than contain it.
+        :param int limit: The maximum number of symbols returned.
+        :raises ValueError: When limit is smaller than 1.
+        """
+        return json.dumps(self.get_symbol_index().search(
+            query, metric, exact, int(limit)))
+
+    def get_hot_functions(self, reference, metric, sort='self', offset=0,
+                          limit=50):
+        """
+        Get a JSON object string describing a page of the table of
+        the functions of a thread/process (or of all threads/processes
+        with a given PID, or of the whole session) sorted by their self
+        or total values of a given metric, in form of:
+        {"total": <the sum of the root values of the flame graphs>,
+        "count": <the number of functions>, "functions": [{"symbol":
+        <name>, "total": <total value>, "self": <self value>}, ...]}.
+
+        The table is computed from the symbol index (see
+        get_symbol_index()) once per scope, metric and sort value, and
+        kept sorted in memory until the session files change (or it is
+        dropped as the least recently used one), so that all its pages
+        are sliced from it. None is returned if
+        there are no flame graphs of the metric within the scope.
+
+        :param str reference: The threads/processes in the form accepted
+                              by get_differential_flame_graph().
+        :param str metric: The metric of the values.
+        :param str sort: The value the functions are sorted by (from
+                         the highest), i.e. "self" or "total".
+        :param int offset: The number of functions skipped.
+        :param int limit: The maximum number of functions returned.
+        :raises ValueError: When the reference or the sort value is
+                            incorrect, offset is negative, or limit is
+                            smaller than 1.
+        """
+        offset = int(offset)
+        limit = int(limit)
+
+        if sort not in ['self', 'total']:
+            raise ValueError(f'{sort} is not a valid sort value!')
+
+        if offset < 0:
+            raise ValueError('offset must not be negative!')
+
+        if limit < 1:
+            raise ValueError('limit must be at least 1!')
+
+        pid, tid = self._parse_reference(reference)
+        index_key, index = self._get_last_symbol_index()
+        key = (str(reference), metric, sort, index_key)
+        aggregated = self._hot_functions.get(key)
+
+        if aggregated is None:
+            def compute():
+                aggregated = index.aggregate(metric, pid, tid)
+
+                if aggregated is None:
+                    return (None, [])
+
+                # The functions are sorted by the other value and
+                # the name as well, so that pages are stable.
+                first, second = (2, 1) if sort == 'self' else (1, 2)
+                aggregated[1].sort(key=lambda x: (-x[first], -x[second],
+                                                  x[0]))
+                return aggregated
+
+            aggregated = self._single_flight.run(
+                (str(self._path), 'hot_functions') + key, compute)
+            self._hot_functions.put(key, aggregated,
+                                    get_object_size(aggregated))
+
+        scope_value, functions = aggregated
+
+        if scope_value is None:
+            return None
+
+        return json.dumps({
+            'total': scope_value,
+            'count': len(functions),
+            'functions': [{
+                'symbol': symbol,
+                'total': total,
+                'self': self_value
+            } for symbol, total, self_value in
+                functions[offset:offset + limit]]
+        })
+
     def get_thread_tree(self) -> Tree:
         """
         Get a treelib.Tree object representing the thread/process tree of
@@ -550,13 +1799,16 @@ class ProfilingResults:
 
         tree = Tree()
 
-        for n in self._metadata['thread_tree']:
+        nodes = self._metadata['thread_tree'] if self._store is None \
+            else self._store.get_thread_nodes()
+
+        for n in nodes:
             tree.create_node(**n)
 
         self._thread_tree = tree
         return tree
 
-    def get_json_tree(self):
+    def get_json_tree(self, include_off_cpu=True, skeleton=False):
         """
         Get a JSON object string representing the thread/process tree of
         the session.
@@ -602,11 +1854,35 @@ class ProfilingResults:
         * "children": the list of all threads/processes spawned by the
           thread/process. Each element has the same structure as the root
           except for "general_metrics" which is absent.
+
+        :param bool include_off_cpu: Whether "off_cpu" should be included.
+                                     If it is False, "off_cpu" is absent
+                                     and off-CPU regions should be obtained
+                                     with get_off_cpu_regions() instead.
+        :param bool skeleton: Whether only the shape of the tree along with
+                              the timing information should be returned.
+                              If it is True, "off_cpu", "start_callchain",
+                              "src", and "src_index" are absent and
+                              "metrics" is set only for the root (it is
+                              the same for all threads/processes anyway).
+                              The missing data should be obtained with
+                              get_thread_details() and
+                              get_source_mappings() instead.
         """
+        sources = [self._path / p for p in ProfilingResults.SESSION_FILES]
+        cache_key = ('tree', bool(include_off_cpu), bool(skeleton))
+
+        return self._get_cached(
+            cache_key, sources,
+            lambda: self._compute_json_tree(include_off_cpu, skeleton))
+
+    def _compute_json_tree(self, include_off_cpu, skeleton):
         def to_ms(num):
             return None if num is None else num / 1000000
 
+        report_progress('load', 0)
         tree = self.get_thread_tree()
+        report_progress('serialize', 0)
 
         def node_to_dict(node, is_root):
             process_name, pid_tid, start_time, runtime = node.tag
@@ -616,14 +1892,7 @@ class ProfilingResults:
             if runtime != -1:
                 runtime = to_ms(runtime)
 
-            offcpu_regions = list(
-                map(lambda x: (to_ms(x[0] -
-                                     self._metadata.get('start_time', 0)),
-                               to_ms(x[1])),
-                    self._metadata['offcpu_regions'].get(pid_tid_code, [])))
-
-            total_sampled_time = \
-                to_ms(self._metadata['sampled_times'].get(pid_tid_code, None))
+            total_sampled_time = to_ms(self._get_sampled_time(pid_tid_code))
 
             if total_sampled_time is None:
                 total_sampled_time = runtime
@@ -635,17 +1904,26 @@ class ProfilingResults:
                 'sampled_time': total_sampled_time,
                 'name': process_name,
                 'pid_tid': pid_tid,
-                'off_cpu': offcpu_regions,
-                'start_callchain': self._metadata['callchains'].get(
-                    pid_tid.split('/')[1], []),
-                'metrics': self._metrics,
                 'children': []
             }
 
+            if not skeleton:
+                to_return['start_callchain'] = \
+                    self._get_start_callchain(pid_tid_code)
+
+                if include_off_cpu:
+                    to_return['off_cpu'] = \
+                        self._get_off_cpu_list(pid_tid_code)
+
+            if is_root or not skeleton:
+                to_return['metrics'] = self._metrics
+
             if is_root:
                 to_return['general_metrics'] = self._general_metrics
-                to_return['src'] = self._sources
-                to_return['src_index'] = self._source_index
+
+                if not skeleton:
+                    to_return['src'] = self._sources
+                    to_return['src_index'] = self._source_index
 
             children = tree.children(node.identifier)
 
@@ -659,29 +1937,240 @@ class ProfilingResults:
         if tree.root is None:
             return json.dumps({})
         else:
-            return json.dumps(node_to_dict(tree.get_node(tree.root),
-                                           True))
+            return json.dumps(node_to_dict(tree.get_node(tree.root), True))
+
+    def get_thread_details(self, ids, include_off_cpu=True):
+        """
+        Get a JSON object string mapping given thread/process IDs to
+        the details omitted by get_json_tree() in the skeleton mode, i.e.
+        JSON objects with "start_callchain" and "off_cpu" (see
+        get_json_tree() for their description). Unknown IDs are mapped to
+        objects with empty lists.
+
+        :param list ids: The list of thread/process IDs in form of
+                         "<PID>_<TID>" (i.e. "id" in get_json_tree()).
+        :param bool include_off_cpu: Whether "off_cpu" should be included
+                                     (see get_json_tree()).
+        """
+        result = {}
+
+        for pid_tid in ids:
+            details = {
+                'start_callchain': self._get_start_callchain(pid_tid)
+            }
 
-    def get_source_code(self, filename):
+            if include_off_cpu:
+                details['off_cpu'] = self._get_off_cpu_list(pid_tid)
+
+            result[pid_tid] = details
+
+        return json.dumps(result)
+
+    def get_source_mappings(self):
+        """
+        Get a JSON object string with "src" and "src_index" omitted by
+        get_json_tree() in the skeleton mode (see get_json_tree() for
+        their description).
+        """
+        return json.dumps({
+            'src': self._sources,
+            'src_index': self._source_index
+        })
+
+    def _get_sampled_time(self, pid_tid):
+        if self._store is not None:
+            return self._store.get_sampled_time(pid_tid)
+
+        return self._metadata['sampled_times'].get(pid_tid, None)
+
+    def _get_start_callchain(self, pid_tid):
+        if self._store is not None:
+            return self._store.get_start_callchain(pid_tid.split('_')[-1])
+
+        return self._metadata['callchains'].get(pid_tid.split('_')[-1], [])
+
+    def get_off_cpu_regions(self, ids, start, end, resolution,
+                            sampling=0):
+        """
+        Get a JSON object string representing the off-CPU regions of
+        given threads/processes within a time window, at a level of
+        detail matching a given resolution (see OffCpuPyramid.query()).
+
+        The object maps thread/process IDs to lists of
+        [start time, length, off-CPU time] lists, where all times are in
+        milliseconds and the off-CPU time is the total time spent
+        off-CPU within a region (regions separated by gaps smaller than
+        the resolution are merged together). Unknown IDs are mapped to
+        empty lists.
+
+        :param list ids: The list of thread/process IDs in form of
+                         "<PID>_<TID>" (i.e. "id" in get_json_tree()).
+        :param float start: The start of the time window in ms.
+        :param float end: The end of the time window in ms.
+        :param float resolution: The resolution in ms, e.g. the time span
+                                 of one pixel of the timeline.
+        :param int sampling: The off-CPU timeline sampling period in ms,
+                             0 disables sampling. If it is not 0, only
+                             the regions crossing a multiple of
+                             the sampling period or starting/ending at one
+                             are taken into account.
+        :raises ValueError: When the resolution is negative.
+        """
+        result = {}
+
+        for pid_tid in ids:
+            key = (pid_tid, sampling)
+            pyramid = self._off_cpu_pyramids.get(key)
+
+            if pyramid is None:
+                regions = self._get_off_cpu_list(pid_tid)
+
+                if sampling != 0:
+                    regions = [x for x in regions
+                               if x[0] % sampling == 0 or
+                               (x[0] + x[1]) % sampling == 0 or
+                               x[0] // sampling !=
+                               (x[0] + x[1]) // sampling]
+
+                pyramid = OffCpuPyramid(regions)
+                self._off_cpu_pyramids.put(key, pyramid, pyramid.nbytes)
+
+            result[pid_tid] = pyramid.query(start, end, resolution)
+
+        return json.dumps(result)
+
+    def _get_off_cpu_list(self, pid_tid):
+        start_time = self._start_time
+
+        if self._store is not None:
+            regions = self._store.get_off_cpu_regions(pid_tid)
+        else:
+            regions = self._metadata.get('offcpu_regions', {}).get(
+                pid_tid, [])
+
+        return [((x[0] - start_time) / 1000000, x[1] / 1000000)
+                for x in regions]
+
+    def resolve_symbols(self, symbols):
+        """
+        Get a JSON object string mapping given symbols in form of
+        "<perf map name>:<hex address>" (e.g. "perf-1784.map:0x7f0a1c")
+        to the names of the symbols containing the addresses according to
+        the perf symbol maps obtained in the session, or to null if
+        a map or an address is unknown.
+
+        Every map is converted to a PerfMapIndex object the first
+        time it is used. If the on-disk cache is enabled, the index is
+        stored there and memory-mapped, so that it is built only once
+        across requests and server restarts.
+
+        :param list symbols: The list of symbol strings.
+        :raises ValueError: When a symbol string has incorrect syntax.
+        """
+        result = {}
+
+        for symbol in symbols:
+            map_name, separator, address = symbol.rpartition(':')
+
+            if separator == '':
+                raise ValueError(f'Incorrect symbol: {symbol}')
+
+            address = int(address, 16)
+            index = self._get_perf_map_index(map_name)
+
+            result[symbol] = None if index is None else \
+                index.resolve(address)
+
+        return json.dumps(result)
+
+    def index_perf_maps(self):
+        """
+        Build the PerfMapIndex objects of all perf symbol maps obtained
+        in the session in advance, so that resolve_symbols() does not
+        have to do it (see resolve_symbols() for details).
+        """
+        for map_path in sorted(
+                (self._path / 'processed').glob('perf-*.map')):
+            self._get_perf_map_index(map_path.name)
+
+    def _get_perf_map_index(self, map_name):
+        # The map name is checked so that no file outside
+        # the session directory can be read.
+        if re.search(r'^perf-\d+\.map$', map_name) is None:
+            return None
+
+        map_path = self._path / 'processed' / map_name
+
+        try:
+            stat = map_path.stat()
+        except OSError:
+            return None
+
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._perf_map_indices.get(map_name)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        index = None
+
+        if self._store is not None:
+            data = self._store.get_perf_map_index(map_name)
+
+            if data is not None:
+                index = PerfMapIndex(data)
+
+        if index is None and self._cache is not None:
+            cache_key = ('perf_map_index', map_name)
+            index_path = self._cache.get_path(cache_key, [map_path])
+
+            if index_path is None:
+                def build():
+                    # The index may have been built while waiting.
+                    if self._cache.get_path(cache_key, [map_path]) is None:
+                        self._cache.put(cache_key, [map_path],
+                                        PerfMapIndex.build(map_path))
+
+                self._coalesce(cache_key, [map_path], build)
+                index_path = self._cache.get_path(cache_key, [map_path])
+
+            if index_path is not None:
+                try:
+                    index = PerfMapIndex.open(index_path)
+                except (OSError, ValueError):
+                    index = None
+
+        if index is None:
+            index = PerfMapIndex(PerfMapIndex.build(map_path))
+
+        self._perf_map_indices.put(map_name, (key, index), index.nbytes)
+        return index
+
+    def get_source_code(self, filename, lines=None):
         """
         Get a source code stored in the session under a specified
         name.
 
+        Source codes are read through a SourceArchive object, so
+        the recently used ones are kept decompressed in memory.
+
         :param str filename: The name of a source code to be
                              obtained. It must come from "src_index"
                              produced by get_thread_tree().
+        :param tuple lines: If set, only the lines in this (first, last)
+                            range (1-based and inclusive) are returned
+                            in form of a JSON object string described
+                            in SourceArchive.get_lines().
         """
-        if self._source_zip_path is None:
+        if self._source_archive is None:
             return None
 
-        with ZipFile(self._source_zip_path) as zip:
-            path = ZipFilePath(zip, filename)
+        if lines is None:
+            entry = self._source_archive.get(filename)
+            return None if entry is None else entry[0]
 
-            if not path.exists():
-                return None
-
-            with path.open() as f:
-                return f.read()
+        result = self._source_archive.get_lines(filename, *lines)
+        return None if result is None else json.dumps(result)
 
     def get_perf_maps(self):
         """
@@ -695,24 +2184,8 @@ class ProfilingResults:
         result_dict = {}
 
         for map_path in map_paths:
-            data = []
-            with map_path.open(mode='r') as f:
-                for i, line in enumerate(f, 1):
-                    match = re.search(
-                        r'^([0-9a-fA-F]+)\s+([0-9a-fA-F]+)\s+(.+)$',
-                        line.strip())
-
-                    if match is None:
-                        print(f'Line {i}, {map_path}: '
-                              'incorrect syntax, ignoring.',
-                              file=sys.stderr)
-                        continue
-
-                    data.append(('0x' + match.group(1),
-                                 hex(int(match.group(1), 16) +
-                                     int(match.group(2), 16) - 1),
-                                 match.group(3)))
-
+            data = [(hex(start), hex(end), name)
+                    for start, end, name in read_perf_map(map_path)]
             data.sort(key=lambda x: int(x[0], 16))
             result_dict[map_path.name] = data
 
@@ -0,0 +1,79 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    A class coalescing concurrent identical computations within
+    a process: when a computation with a given key is requested while
+    another one with the same key is in progress (e.g. because several
+    people open the same flame graph at once), the caller waits for
+    the computation in progress and gets its result (or its exception)
+    instead of repeating it.
+
+    Nothing is cached: a computation requested after the previous one
+    with the same key has finished runs again. Across processes,
+    computations are coalesced by DiskCache.lock() instead.
+    """
+
+    def __init__(self):
+        """
+        Construct a SingleFlight object.
+        """
+        self._calls = {}
+        self._coalesced = 0
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """
+        Call a function, unless a call with the same key is in progress,
+        in which case wait for it and return its result (or raise its
+        exception) instead.
+
+        :param key: The key of a computation. It must be hashable.
+        :param func: The function to be called without arguments.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            else:
+                self._coalesced += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.event.set()
+
+        return call.result
+
+    @property
+    def coalesced(self):
+        return self._coalesced
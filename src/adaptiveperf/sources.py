@@ -0,0 +1,191 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import threading
+from array import array
+from pathlib import Path
+from zipfile import ZipFile
+from collections import OrderedDict
+
+
+class SourceArchive:
+    """
+    A class describing a ZIP archive with source code files (i.e. src.zip
+    in a session) which is read many times, e.g. for code previews.
+
+    Instead of opening the archive and decompressing a file for every
+    request, SourceArchive keeps a pool of open ZipFile handles (so that
+    concurrent requests do not block each other) and an LRU cache of
+    decompressed files with a limit on their total size. Every cached
+    file also has an index of the offsets of its lines, so that line
+    ranges can be extracted without scanning the file.
+    """
+
+    def __init__(self, path: Path, max_handles: int = 4,
+                 max_bytes: int = 64 * 1024 * 1024):
+        """
+        Construct a SourceArchive object.
+
+        :param pathlib.Path path: The path to a ZIP archive.
+        :param int max_handles: The maximum number of idle ZipFile
+                                handles kept open.
+        :param int max_bytes: The maximum total size of cached
+                              decompressed files in bytes.
+        """
+        self._path = path
+        self._max_handles = max_handles
+        self._max_bytes = max_bytes
+        self._handles = []
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _read(self, name: str):
+        with self._lock:
+            handle = self._handles.pop() if len(self._handles) > 0 \
+                else None
+
+        if handle is None:
+            handle = ZipFile(self._path)
+
+        try:
+            try:
+                info = handle.getinfo(name)
+            except KeyError:
+                return None
+
+            if info.is_dir():
+                return None
+
+            data = handle.read(info)
+        finally:
+            with self._lock:
+                if len(self._handles) < self._max_handles:
+                    self._handles.append(handle)
+                    handle = None
+
+            if handle is not None:
+                handle.close()
+
+        # Newlines are translated in the same way as when a file
+        # is opened in text mode.
+        code = data.decode('utf-8', errors='replace')
+        code = code.replace('\r\n', '\n').replace('\r', '\n')
+
+        line_offsets = array('Q', [0])
+        pos = code.find('\n')
+
+        while pos != -1:
+            line_offsets.append(pos + 1)
+            pos = code.find('\n', pos + 1)
+
+        if line_offsets[-1] == len(code) and len(line_offsets) > 1:
+            line_offsets.pop()
+
+        return code, line_offsets, len(data)
+
+    def get(self, name: str):
+        """
+        Get a (file contents string, line offsets array) tuple of a file
+        stored in the archive under a given name, or None if there
+        is no such file. The i-th element of the array is the offset
+        of the (i + 1)-th line within the string.
+
+        :param str name: The name of a file inside the archive.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+
+            if entry is not None:
+                self._entries.move_to_end(name)
+                return entry[0], entry[1]
+
+        entry = self._read(name)
+
+        if entry is None:
+            return None
+
+        with self._lock:
+            old_entry = self._entries.pop(name, None)
+
+            if old_entry is not None:
+                self._size -= old_entry[2]
+
+            if entry[2] <= self._max_bytes:
+                self._entries[name] = entry
+                self._size += entry[2]
+
+                while self._size > self._max_bytes:
+                    _, (_, _, evicted_size) = \
+                        self._entries.popitem(last=False)
+                    self._size -= evicted_size
+
+        return entry[0], entry[1]
+
+    def get_lines(self, name: str, first: int, last: int):
+        """
+        Get a dictionary describing a range of lines of a file stored in
+        the archive under a given name, or None if there is no such file.
+        The dictionary has the following keys:
+        * "first": the number of the first returned line (1-based),
+        * "last": the number of the last returned line,
+        * "line_count": the number of lines of the whole file,
+        * "code": the returned lines,
+        * "line_offsets": the offsets of the returned lines within "code".
+
+        The range is clipped to the lines of the file.
+
+        :param str name: The name of a file inside the archive.
+        :param int first: The number of the first line to be returned
+                          (1-based).
+        :param int last: The number of the last line to be returned
+                         (inclusive).
+        """
+        entry = self.get(name)
+
+        if entry is None:
+            return None
+
+        code, line_offsets = entry
+        line_count = len(line_offsets)
+        first = max(1, first)
+        last = min(line_count, last)
+
+        if first > last:
+            return {
+                'first': first,
+                'last': first - 1,
+                'line_count': line_count,
+                'code': '',
+                'line_offsets': []
+            }
+
+        start = line_offsets[first - 1]
+        end = line_offsets[last] if last < line_count else len(code)
+
+        return {
+            'first': first,
+            'last': last,
+            'line_count': line_count,
+            'code': code[start:end],
+            'line_offsets': [x - start for x in
+                             line_offsets[first - 1:last]]
+        }
+
+    @property
+    def size(self):
+        """
+        The total size of cached source code files in bytes.
+        """
+        return self._size
+
+    def close(self):
+        """
+        Close all idle ZipFile handles.
+        """
+        with self._lock:
+            handles = self._handles
+            self._handles = []
+
+        for handle in handles:
+            handle.close()
@@ -19,14 +19,16 @@ var window_dict = {};
 // (Profiling) session directory structure:
 // {
 //     '<session ID>': {
+//         'index': <number of sessions opened before this one>,
 //         'label': ...,
 //         'result_cache': ...,
 //         'callchain_obj': ...,
 //         'callchain_dict': ...,
-//         'perf_maps_obj': ...,
 //         'perf_maps_cache': ...,
 //         'sampled_diff_dict': ...,
 //         'item_list': ...,
+//         'item_set': ...,
+//         'offcpu_state': ...,
 //         'group_list': ...,
 //         'item_dict': ...,
 //         'callchain_dict': ...,
@@ -39,6 +41,254 @@ var window_dict = {};
 // }
 var session_dict = {};
 
+// The flame graphs chosen as the baseline of differential flame graphs
+// (see setDiffBaseline()), in form of:
+// {
+//     'session_id': <ID of the session of the flame graphs>,
+//     'reference': <"<PID>_<TID>" for a thread/process or "all" for the whole session>,
+//     'description': <description shown in window titles>
+// }
+// It is undefined until a baseline is chosen.
+var diff_baseline = undefined;
+
+// Decoder of the binary wire format described in wire.py (the format
+// is requested from the server by getSessionData() instead of JSON,
+// as it is much smaller and faster to parse for large flame graphs
+// and trees).
+function decodeBinary(buffer) {
+    var bytes = new Uint8Array(buffer);
+    var view = new DataView(buffer);
+    var pos = 0;
+
+    if (String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) !==
+        'APB1') {
+        throw new Error('The data is not in the binary wire format!');
+    }
+
+    pos = 4;
+
+    // Multiplication is used instead of bit shifts, as the latter
+    // work on 32-bit integers only.
+    function readVarint() {
+        var result = 0;
+        var scale = 1;
+        var byte;
+
+        do {
+            byte = bytes[pos++];
+            result += (byte & 0x7f) * scale;
+            scale *= 128;
+        } while (byte & 0x80);
+
+        return result;
+    }
+
+    function readInt() {
+        var value = readVarint();
+        return value % 2 === 0 ? value / 2 : -(value + 1) / 2;
+    }
+
+    var decoder = new TextDecoder('utf-8');
+    var strings = new Array(readVarint());
+
+    for (var i = 0; i < strings.length; i++) {
+        var length = readVarint();
+        strings[i] = decoder.decode(bytes.subarray(pos, pos + length));
+        pos += length;
+    }
+
+    function readValue() {
+        var tag = bytes[pos++];
+
+        switch (tag) {
+        case 0:
+            return null;
+        case 1:
+            return false;
+        case 2:
+            return true;
+        case 3:
+            return readInt();
+        case 4:
+            var value = view.getFloat64(pos, true);
+            pos += 8;
+            return value;
+        case 5:
+            return strings[readVarint()];
+        case 6:
+            var array = new Array(readVarint());
+
+            for (var i = 0; i < array.length; i++) {
+                array[i] = readValue();
+            }
+
+            return array;
+        case 7:
+            var int_array = new Array(readVarint());
+
+            for (var i = 0; i < int_array.length; i++) {
+                int_array[i] = readInt();
+            }
+
+            return int_array;
+        case 8:
+            var obj = {};
+            var count = readVarint();
+
+            for (var i = 0; i < count; i++) {
+                var key = strings[readVarint()];
+                obj[key] = readValue();
+            }
+
+            return obj;
+        default:
+            throw new Error('Unknown tag ' + tag + '!');
+        }
+    }
+
+    return readValue();
+}
+
+// How often the status of a background job computing session data
+// is polled (in ms, see getSessionData()).
+const JOB_POLL_INTERVAL = 500;
+
+// How many functions are shown at once in a hot functions window (the rest
+// is paginated by the server, see "hot" in the docstring of query() in
+// app.py).
+const HOT_FUNCTIONS_PAGE_SIZE = 50;
+
+// Sends a GET request relevant to a session with given data and returns
+// a jQuery promise resolved with the decoded response (see the docstring
+// of query() in app.py). The response is requested in the binary wire
+// format. GET is used so that the browser can cache responses and
+// revalidate them with ETags.
+//
+// If method is "POST", the data are sent in the request body instead.
+// This is meant for batches of many IDs, whose query strings could exceed
+// the request line limit of the server (4094 bytes in Gunicorn by
+// default).
+//
+// If on_progress is provided, the data are requested with "async", so
+// that long computations (e.g. of huge flame graphs) run in
+// the background on the server. In this case, the status of the job is
+// polled and passed to on_progress (see job_status() in app.py) until
+// the job finishes, after which the request is repeated to get the data.
+function getSessionData(session_id, data, on_progress, method) {
+    var deferred = $.Deferred();
+    var xhr = new XMLHttpRequest();
+    var request_data = new URLSearchParams(on_progress === undefined ? data :
+        Object.assign({async: true}, data));
+
+    if (method === 'POST') {
+        xhr.open('POST', session_id + '/');
+        xhr.setRequestHeader('Content-Type',
+                             'application/x-www-form-urlencoded');
+    } else {
+        xhr.open('GET', session_id + '/?' + request_data);
+    }
+
+    xhr.responseType = 'arraybuffer';
+    xhr.setRequestHeader('Accept', 'application/x-adaptiveperf-binary');
+
+    xhr.onload = function() {
+        if (xhr.status === 202 && on_progress !== undefined) {
+            var status = JSON.parse(new TextDecoder('utf-8').decode(
+                xhr.response));
+
+            on_progress(status);
+            pollJob(status.job, on_progress).done(() => {
+                getSessionData(session_id, data, on_progress, method).done(
+                    deferred.resolve).fail(deferred.reject);
+            }).fail(deferred.reject);
+            return;
+        }
+
+        if (xhr.status !== 200) {
+            deferred.reject(xhr);
+            return;
+        }
+
+        var result;
+
+        try {
+            result = decodeBinary(xhr.response);
+        } catch (e) {
+            console.error(e);
+            deferred.reject(xhr);
+            return;
+        }
+
+        deferred.resolve(result);
+    };
+
+    xhr.onerror = function() {
+        deferred.reject(xhr);
+    };
+
+    xhr.send(method === 'POST' ? request_data.toString() : null);
+
+    return deferred.promise();
+}
+
+// Polls the status of a background job computing session data until it
+// finishes, passing every status to on_progress. Returns a jQuery promise
+// resolved when the job finishes successfully (or is no longer known to
+// the server, in which case repeating the request either returns
+// the data or starts the job again) and rejected when the job fails.
+function pollJob(job_id, on_progress) {
+    var deferred = $.Deferred();
+
+    function poll() {
+        $.ajax({
+            url: 'jobs/' + job_id,
+            method: 'GET',
+            dataType: 'json'
+        }).done(status => {
+            on_progress(status);
+
+            if (status.state === 'running') {
+                setTimeout(poll, JOB_POLL_INTERVAL);
+            } else if (status.state === 'failed') {
+                deferred.reject({status: 500});
+            } else {
+                deferred.resolve();
+            }
+        }).fail(ajax_obj => {
+            if (ajax_obj.status === 404) {
+                deferred.resolve();
+            } else {
+                deferred.reject(ajax_obj);
+            }
+        });
+    }
+
+    setTimeout(poll, JOB_POLL_INTERVAL);
+
+    return deferred.promise();
+}
+
+// Shows the status of a background job (see pollJob()) next to a loading
+// indicator (i.e. #loading or its copy).
+function showLoadingProgress(loading_jquery, status) {
+    const phases = {
+        waiting: 'Waiting',
+        load: 'Loading',
+        compress: 'Compressing',
+        serialize: 'Serializing'
+    };
+
+    var progress = loading_jquery.find('.loading_progress');
+
+    if (status === undefined || status.state !== 'running') {
+        progress.text('');
+        return;
+    }
+
+    progress.text((phases[status.phase] || status.phase) + '... ' +
+                  Math.floor(status.progress * 100) + '%');
+}
+
 // Window templates
 function createWindowDOM(type, timeline_group_id) {
     const window_header = `
@@ -152,6 +402,59 @@ function createWindowDOM(type, timeline_group_id) {
   </p>
   <div class="flamegraph_svg"></div>
 </div>
+`,
+        hot_functions: `
+<div class="hot_functions_choice">
+  <select name="metric" class="hot_functions_metric">
+    <option value="" disabled="disabled">
+      Metric...
+    </option>
+  </select>
+  <select name="sort" class="hot_functions_sort">
+    <option value="self" selected="selected">Sort by self value</option>
+    <option value="total">Sort by total value</option>
+  </select>
+  <span class="pointer hot_functions_previous">&lt; Previous</span>
+  <span class="hot_functions_page"></span>
+  <span class="pointer hot_functions_next">Next &gt;</span>
+</div>
+<div class="hot_functions_results scrollable">
+  <table class="hot_functions_table">
+    <thead>
+      <tr>
+        <th>#</th>
+        <th>Function</th>
+        <th>Self</th>
+        <th>Self (%)</th>
+        <th>Total</th>
+        <th>Total (%)</th>
+      </tr>
+    </thead>
+    <tbody></tbody>
+  </table>
+</div>
+`,
+        symbol_search: `
+<div class="symbol_search_choice">
+  <input type="text" class="symbol_search_query"
+         placeholder="Function name..." />
+  <input type="checkbox" class="symbol_search_exact" />
+  <label class="symbol_search_exact_label">Exact match</label>
+</div>
+<div class="symbol_search_summary"></div>
+<div class="symbol_search_results scrollable">
+  <table class="symbol_search_table">
+    <thead>
+      <tr>
+        <th>Thread/process</th>
+        <th>Metric</th>
+        <th>Total</th>
+        <th>Self</th>
+      </tr>
+    </thead>
+    <tbody></tbody>
+  </table>
+</div>
 `,
         code: `
 <div class="code_choice">
@@ -177,6 +480,10 @@ function createWindowDOM(type, timeline_group_id) {
     <path d="M120-220v-80h80v80h-80Zm0-140v-80h80v80h-80Zm0-140v-80h80v80h-80ZM260-80v-80h80v80h-80Zm100-160q-33 0-56.5-23.5T280-320v-480q0-33 23.5-56.5T360-880h360q33 0 56.5 23.5T800-800v480q0 33-23.5 56.5T720-240H360Zm0-80h360v-480H360v480Zm40 240v-80h80v80h-80Zm-200 0q-33 0-56.5-23.5T120-160h80v80Zm340 0v-80h80q0 33-23.5 56.5T540-80ZM120-640q0-33 23.5-56.5T200-720v80h-80Zm420 80Z" />
   </svg>
 </div>
+<div class="code_range">
+  <span class="code_range_info"></span>
+  <span class="pointer code_range_all">(show the whole file)</span>
+</div>
 <div class="code_container">
   <pre><code class="code_box"></code></pre>
 </div>
@@ -193,7 +500,7 @@ function createWindowDOM(type, timeline_group_id) {
 
     root.append(content);
 
-    var session_id = $('#results_combobox').prop('selectedIndex');
+    var session_id = session_dict[$('#results_combobox').val()].index;
     var index = 0;
     var new_window_id = undefined;
 
@@ -245,45 +552,143 @@ function createWindowDOM(type, timeline_group_id) {
 var current_focused_window_id = undefined;
 var largest_z_index = 0;
 
+// Returns the name of a perf map symbol (i.e. an address in form of
+// "[0x...]" within a perf map with a given name) if it has already been
+// resolved by resolveSymbols(), otherwise the address itself.
 function getSymbolFromMap(addr, map_name) {
     var session = session_dict[$('#results_combobox').val()];
     if ([addr, map_name] in session.perf_maps_cache) {
         return session.perf_maps_cache[[addr, map_name]];
     }
 
+    return addr;
+}
+
+// Resolves given perf map symbols (i.e. [address, map name] pairs as
+// stored in the callchain mappings) of a session on the server (see
+// "symbols" in the docstring of query() in app.py), in batches of 200,
+// so that getSymbolFromMap() can return their names afterwards.
+// Returns a jQuery promise resolved with whether any symbol has been
+// requested.
+function resolveSymbols(session_id, symbols) {
+    var cache = session_dict[session_id].perf_maps_cache;
     var regex = /^\[(0x[0-9a-f]+)\]$/;
-    var match = regex.exec(addr);
+    var to_resolve = {};
+
+    for (const [addr, map_name] of symbols) {
+        var match = regex.exec(addr);
 
-    if (match == null) {
-        return addr;
+        if (match != null && !([addr, map_name] in cache)) {
+            to_resolve[map_name + ':' + match[1]] = [addr, map_name];
+        }
     }
 
-    var addr_int = parseInt(match[1], 16);
+    var keys = Object.keys(to_resolve);
+    var promises = [];
+
+    for (var i = 0; i < keys.length; i += 200) {
+        promises.push(getSessionData(session_id, {
+            symbols: keys.slice(i, i + 200).join(',')
+        }, undefined, 'POST').done(result => {
+            for (const [key, name] of Object.entries(result)) {
+                // Unknown symbols are cached as well, so that they
+                // are not requested again.
+                cache[to_resolve[key]] =
+                    name === null ? to_resolve[key][0] : name;
+            }
+        }));
+    }
+
+    var deferred = $.Deferred();
+    $.when(...promises).always(() => deferred.resolve(keys.length > 0));
+    return deferred.promise();
+}
+
+// The state of the paginated list of sessions in #results_combobox
+// (see the docstring of sessions() in app.py).
+var session_page = {
+    offset: 0,
+    limit: 100,
+    total: 0
+};
+
+function loadSessionPage(offset) {
+    var request_data = {
+        offset: offset,
+        limit: session_page.limit,
+        executor: $('#session_executor').val(),
+        name: $('#session_name').val(),
+        from: $('#session_from').val(),
+        to: $('#session_to').val()
+    };
+
+    $.ajax({
+        url: 'sessions',
+        method: 'GET',
+        dataType: 'json',
+        data: request_data
+    }).done(result => {
+        session_page.offset = result.offset;
+        session_page.total = result.total;
+
+        var executor_select = $('#session_executor');
+
+        if (executor_select.children().length === 1) {
+            for (var i = 0; i < result.executors.length; i++) {
+                executor_select.append($('<option></option>')
+                                       .attr('value', result.executors[i])
+                                       .text(result.executors[i]));
+            }
+        }
 
-    if (map_name in session.perf_maps_obj) {
-        var data = session.perf_maps_obj[map_name];
-        var start = 0;
-        var end = data.length - 1;
+        // The selected option (either the placeholder or the currently
+        // opened session) is kept, so that the opened session stays
+        // selected regardless of the page.
+        var combobox = $('#results_combobox');
+        var selected_value = combobox.val();
+        combobox.children('option:not(:selected)').remove();
 
-        while (start <= end) {
-            var middle = Math.floor((start + end) / 2);
-            var addr1 = parseInt(data[middle][0], 16);
-            var addr2 = parseInt(data[middle][1], 16);
+        for (var i = 0; i < result.sessions.length; i++) {
+            var session = result.sessions[i];
 
-            if (addr_int >= addr1 && addr_int <= addr2) {
-                session.perf_maps_cache[[addr, map_name]] = data[middle][2];
-                return data[middle][2];
-            } else if (addr_int < addr1) {
-                end = middle - 1;
-            } else {
-                start = middle + 1;
+            if (session.id === selected_value) {
+                continue;
             }
+
+            combobox.append($('<option></option>')
+                            .attr('value', session.id)
+                            .attr('data-label', session.label)
+                            .text(session.text));
         }
-    }
 
-    return addr;
+        if (result.total === 0) {
+            $('#session_page_info').text('No sessions found');
+        } else {
+            $('#session_page_info').text(
+                (result.offset + 1) + '-' +
+                    (result.offset + result.sessions.length) + ' of ' +
+                    result.total);
+        }
+
+        $('#session_prev').prop('disabled', result.offset === 0);
+        $('#session_next').prop(
+            'disabled',
+            result.offset + result.sessions.length >= result.total);
+    }).fail(ajax_obj => {
+        alert('Could not load the list of profiling sessions! (HTTP code ' +
+              ajax_obj.status + ')');
+    });
+}
+
+function onSessionPageClick(direction) {
+    loadSessionPage(Math.max(
+        0, session_page.offset + direction * session_page.limit));
 }
 
+$(document).ready(function() {
+    loadSessionPage(0);
+});
+
 $(document).on('change', '#results_combobox', function() {
     $('#settings').hide();
     $('#block').hide();
@@ -295,15 +700,11 @@ $(document).on('change', '#results_combobox', function() {
 
         if (!(value in session_dict)) {
             session_init = true;
-            session_dict[value] = {};
+            session_dict[value] = {
+                index: Object.keys(session_dict).length
+            };
         }
 
-        var ajaxPostOptions = {
-            url: value + '/',
-            method: 'POST',
-            data: {tree: true}
-        };
-
         function parseResult(result) {
             function from_json_to_item(json, level,
                                        item_list, group_list,
@@ -399,36 +800,17 @@ $(document).on('change', '#results_combobox', function() {
                     Object.assign(src_index_dict, json.src_index);
                 }
 
-                if (level > 0) {
+                if (level > 0 && 'start_callchain' in json) {
                     callchain_dict[item.id] = json.start_callchain;
                 }
 
-                for (var i = 0; i < json.off_cpu.length; i++) {
-                    var start = json.off_cpu[i][0];
-                    var end = start + json.off_cpu[i][1];
-                    var offcpu_sampling = parseInt(
-                        $('#viewer_script').attr('data-offcpu-sampling'));
-
-                    if (offcpu_sampling === 0 ||
-                        start % offcpu_sampling === 0 ||
-                        end % offcpu_sampling === 0 ||
-                        Math.floor(start / offcpu_sampling) != Math.floor(
-                            end / offcpu_sampling)) {
-                        var off_cpu_item = {
-                            id: json.id + '_offcpu' + i,
-                            group: json.id,
-                            type: 'background',
-                            content: '',
-                            start: json.off_cpu[i][0],
-                            end: json.off_cpu[i][0] + json.off_cpu[i][1],
-                            style: 'background-color:#0294e3'
-                        };
-
-                        item_list.push(off_cpu_item);
+                for (var i = 0; i < json.children.length; i++) {
+                    // In the skeleton mode, the metrics are sent only
+                    // for the root.
+                    if (!('metrics' in json.children[i])) {
+                        json.children[i].metrics = json.metrics;
                     }
-                }
 
-                for (var i = 0; i < json.children.length; i++) {
                     from_json_to_item(json.children[i],
                                       level + 1,
                                       item_list,
@@ -446,24 +828,6 @@ $(document).on('change', '#results_combobox', function() {
                 }
             }
 
-            function part2() {
-                $.ajax({
-                    url: $('#block').attr('result_id') + '/',
-                    method: 'POST',
-                    dataType: 'json',
-                    data: {perf_map: true}
-                }).done(ajax_obj => {
-                    session_dict[value].perf_maps_obj = ajax_obj;
-                    part3(true);
-                }).fail(ajax_obj => {
-                    session_dict[value].perf_maps_obj = {};
-                    alert('Could not obtain the perf symbol maps! You ' +
-                          'will not get meaningful names when checking ' +
-                          'stack traces e.g. for JIT-ed codes.');
-                    part3(true);
-                });
-            }
-
             function part3(init) {
                 if (init) {
                     session_dict[value].label = label;
@@ -483,7 +847,7 @@ $(document).on('change', '#results_combobox', function() {
                     session_dict[value].overall_end_time = [0];
                     session_dict[value].src_cache = {};
 
-                    from_json_to_item(JSON.parse(result), 0,
+                    from_json_to_item(result, 0,
                                       session_dict[value].item_list,
                                       session_dict[value].group_list,
                                       session_dict[value].item_dict,
@@ -496,6 +860,26 @@ $(document).on('change', '#results_combobox', function() {
                                       session_dict[value].sampled_diff_dict,
                                       session_dict[value].src_dict,
                                       session_dict[value].src_index_dict);
+
+                    session_dict[value].item_set = new vis.DataSet(
+                        session_dict[value].item_list);
+                    session_dict[value].offcpu_state = {
+                        loaded: {},
+                        item_ids: {},
+                        request: 0
+                    };
+                    session_dict[value].details_loaded = {};
+
+                    // The source code mappings are needed only when
+                    // displaying callchains, so they are loaded in
+                    // the background.
+                    var src_dict = session_dict[value].src_dict;
+                    var src_index_dict = session_dict[value].src_index_dict;
+
+                    getSessionData(value, {src_map: true}).done(result => {
+                        Object.assign(src_dict, result.src);
+                        Object.assign(src_index_dict, result.src_index);
+                    });
                 }
 
                 var container = $('#block')[0];
@@ -507,7 +891,7 @@ $(document).on('change', '#results_combobox', function() {
 
                 var timeline = new vis.Timeline(
                     container,
-                    session_dict[value].item_list,
+                    session_dict[value].item_set,
                     session_dict[value].group_list,
                     {
                         format: {
@@ -529,7 +913,55 @@ $(document).on('change', '#results_combobox', function() {
                     }
                 );
 
+                // Thread/process details and off-CPU regions are loaded
+                // only for the visible groups and off-CPU regions are
+                // reloaded after zooming, scrolling, or expanding
+                // a group (which triggers "changed").
+                var lazy_load_timeout = undefined;
+
+                function scheduleLazyLoad() {
+                    clearTimeout(lazy_load_timeout);
+                    lazy_load_timeout = setTimeout(() => {
+                        loadThreadDetails(value, timeline.getVisibleGroups());
+                        loadOffCpuRegions(value, timeline);
+                    }, 200);
+                }
+
+                timeline.on('rangechanged', scheduleLazyLoad);
+                timeline.on('changed', scheduleLazyLoad);
+
+                // The details of a group may not have been loaded yet
+                // if it has become visible just before opening the menu.
+                // The same applies to the perf map symbols in its start
+                // callchain, which are resolved on the server.
                 timeline.on('contextmenu', function (props) {
+                    if (props.group == null) {
+                        return;
+                    }
+
+                    props.event.preventDefault();
+
+                    loadThreadDetails(value, [props.group]).then(() => {
+                        var callchain_obj = session_dict[value].callchain_obj;
+                        var callchain =
+                            session_dict[value].callchain_dict[props.group];
+                        var symbols = [];
+
+                        if (callchain_obj !== undefined &&
+                            callchain !== undefined) {
+                            for (const [name, offset] of callchain) {
+                                if (name in callchain_obj['syscall']) {
+                                    symbols.push(
+                                        callchain_obj['syscall'][name]);
+                                }
+                            }
+                        }
+
+                        return resolveSymbols(value, symbols);
+                    }).always(() => onThreadContextMenu(props));
+                });
+
+                function onThreadContextMenu(props) {
                     if (props.group != null) {
                         var item_list = session_dict[value].item_list;
                         var group_list = session_dict[value].group_list;
@@ -626,6 +1058,75 @@ $(document).on('change', '#results_combobox', function() {
                                         '${props.group}')">
                                           Flame graphs
                                        </div>`).appendTo('#thread_menu_items');
+
+                                    // The flame graphs can also be restricted
+                                    // to the part of the timeline currently
+                                    // visible (e.g. after zooming into
+                                    // the startup of a thread).
+                                    var range = timeline.getWindow();
+
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'flame_graphs',
+                                        '${props.group}', {time_range: [
+                                        ${range.start.valueOf()},
+                                        ${range.end.valueOf()}]})">
+                                          Flame graphs (visible time range)
+                                       </div>`).appendTo('#thread_menu_items');
+
+                                    // The flame graphs of all threads of
+                                    // the process (or of all processes in
+                                    // the session) are merged by the server.
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'flame_graphs',
+                                        '${props.group}', {merged: 'process'})">
+                                          Flame graphs (all threads of the process)
+                                       </div>`).appendTo('#thread_menu_items');
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'flame_graphs',
+                                        '${props.group}', {merged: 'session'})">
+                                          Flame graphs (whole session)
+                                       </div>`).appendTo('#thread_menu_items');
+
+                                    // Any flame graphs (also from another
+                                    // session) can be chosen as the baseline
+                                    // for differential flame graphs.
+                                    $(`<div class="menu_item"
+                                        onclick="setDiffBaseline('${value}',
+                                        '${props.group}')">
+                                          Use flame graphs as comparison baseline
+                                       </div>`).appendTo('#thread_menu_items');
+                                    $(`<div class="menu_item"
+                                        onclick="setDiffBaseline('${value}', 'all')">
+                                          Use whole-session flame graphs as comparison baseline
+                                       </div>`).appendTo('#thread_menu_items');
+
+                                    // The tables of the hottest functions
+                                    // are computed by the server from all
+                                    // flame graphs of a given scope.
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'hot_functions',
+                                        '${props.group}', {scope: 'thread'})">
+                                          Hot functions
+                                       </div>`).appendTo('#thread_menu_items');
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'hot_functions',
+                                        '${props.group}', {scope: 'process'})">
+                                          Hot functions (all threads of the process)
+                                       </div>`).appendTo('#thread_menu_items');
+                                    $(`<div class="menu_item"
+                                        onclick="onMenuItemClick(event, 'hot_functions',
+                                        '${props.group}', {scope: 'session'})">
+                                          Hot functions (whole session)
+                                       </div>`).appendTo('#thread_menu_items');
+
+                                    if (diff_baseline !== undefined) {
+                                        $(`<div class="menu_item"
+                                            onclick="onMenuItemClick(event, 'flame_graphs',
+                                            '${props.group}', {diff: true})">
+                                              Compare flame graphs with baseline
+                                              (${diff_baseline.description})
+                                           </div>`).appendTo('#thread_menu_items');
+                                    }
                                 }
                             } else {
                                 $(`<div class="menu_item"
@@ -671,19 +1172,15 @@ $(document).on('change', '#results_combobox', function() {
 
                         closeAllMenus(props.event, 'thread_menu_block');
                     }
-                });
+                }
             }
 
             $('#block').attr('result_id', value);
 
-            $.ajax({
-                url: $('#block').attr('result_id') + '/',
-                method: 'POST',
-                dataType: 'json',
-                data: {callchain: true}
-            }).done(ajax_obj => {
+            getSessionData($('#block').attr('result_id'),
+                           {callchain: true}).done(ajax_obj => {
                 session_dict[value].callchain_obj = ajax_obj;
-                part2();
+                part3(true);
             }).fail(ajax_obj => {
                 alert('Could not obtain the callchain mappings! You ' +
                       'will not get meaningful names when checking ' +
@@ -692,7 +1189,9 @@ $(document).on('change', '#results_combobox', function() {
             });
         }
 
-        $.ajax(ajaxPostOptions)
+        showLoadingProgress($('#loading'));
+        getSessionData(value, {tree: 'skeleton', lod: true},
+                       status => showLoadingProgress($('#loading'), status))
             .done(parseResult)
             .fail(function(ajax_obj) {
                 if (ajax_obj.status === 500) {
@@ -707,6 +1206,141 @@ $(document).on('change', '#results_combobox', function() {
     });
 });
 
+// Loads the details of given groups of a session timeline (i.e. their
+// start callchains, see "details" in the docstring of query() in app.py)
+// which have not been loaded yet, in batches of 200 groups. Returns
+// a jQuery promise resolved when the details of all the groups have been
+// processed (including the ones requested earlier and still pending).
+function loadThreadDetails(session_id, groups) {
+    var session = session_dict[session_id];
+
+    // Every group maps either to true (loaded) or to the promise of
+    // the pending request.
+    var loaded = session.details_loaded;
+    var root_id = session.group_list[0].id;
+    var to_load = groups.filter(group => !(group in loaded));
+    var promises = new Set();
+
+    for (const group of groups) {
+        if (group in loaded && loaded[group] !== true) {
+            promises.add(loaded[group]);
+        }
+    }
+
+    for (var i = 0; i < to_load.length; i += 200) {
+        const batch = to_load.slice(i, i + 200);
+        const promise = getSessionData(session_id, {
+            details: batch.join(','),
+            lod: true
+        }, undefined, 'POST').done(result => {
+            for (const [group, details] of Object.entries(result)) {
+                // The start callchain of the root is not displayed.
+                if (group !== root_id) {
+                    session.callchain_dict[group] = details.start_callchain;
+                }
+
+                loaded[group] = true;
+            }
+        }).fail(() => {
+            for (const group of batch) {
+                delete loaded[group];
+            }
+        });
+
+        for (const group of batch) {
+            loaded[group] = promise;
+        }
+
+        promises.add(promise);
+    }
+
+    return $.when(...promises);
+}
+
+// Loads the off-CPU regions of the visible groups of a session timeline
+// at the level of detail matching the current zoom level, i.e. with
+// the regions closer to each other than one pixel merged by the server
+// (see "off_cpu_regions" in the docstring of query() in app.py).
+// The regions are requested for a window three times as wide as
+// the visible one, so that small scrolls do not need new requests.
+// The opacity of a region reflects the share of its time spent off-CPU.
+function loadOffCpuRegions(session_id, timeline) {
+    var session = session_dict[session_id];
+    var state = session.offcpu_state;
+    var range = timeline.getWindow();
+    var start = range.start.valueOf();
+    var end = range.end.valueOf();
+    var span = end - start;
+
+    // The resolution is rounded down to a power of 2, so that it
+    // does not change (and trigger reloading) on every small zoom.
+    var resolution = Math.pow(2, Math.floor(Math.log2(
+        span / Math.max(1, $('#block').width()))));
+
+    var to_load = [];
+
+    for (const group of timeline.getVisibleGroups()) {
+        var loaded = state.loaded[group];
+
+        if (loaded === undefined || loaded.resolution !== resolution ||
+            loaded.start > start || loaded.end < end) {
+            to_load.push(group);
+        }
+    }
+
+    if (to_load.length === 0) {
+        return;
+    }
+
+    var request_start = Math.max(0, start - span);
+    var request_end = end + span;
+    var request = ++state.request;
+
+    for (var i = 0; i < to_load.length; i += 200) {
+        getSessionData(session_id, {
+            off_cpu_regions: to_load.slice(i, i + 200).join(','),
+            start: request_start,
+            end: request_end,
+            resolution: resolution
+        }, undefined, 'POST').done(result => {
+            // Responses to requests superseded by newer ones are
+            // ignored, as they may be at a different level of detail.
+            if (request !== state.request) {
+                return;
+            }
+
+            for (const [group, regions] of Object.entries(result)) {
+                var items = [];
+
+                for (var j = 0; j < regions.length; j++) {
+                    var opacity = regions[j][1] > 0 ?
+                        Math.max(0.3, regions[j][2] / regions[j][1]) : 1;
+
+                    items.push({
+                        id: group + '_offcpu' + j,
+                        group: group,
+                        type: 'background',
+                        content: '',
+                        start: regions[j][0],
+                        end: regions[j][0] + regions[j][1],
+                        style: 'background-color:#0294e3; opacity:' +
+                            Math.min(1, opacity)
+                    });
+                }
+
+                session.item_set.remove(state.item_ids[group] || []);
+                session.item_set.add(items);
+                state.item_ids[group] = items.map(x => x.id);
+                state.loaded[group] = {
+                    start: request_start,
+                    end: request_end,
+                    resolution: resolution
+                };
+            }
+        });
+    }
+}
+
 function closeAllMenus() {
     $('#thread_menu_block').hide();
     $('#general_analysis_menu_block').hide();
@@ -717,6 +1351,7 @@ function setupWindow(window_obj, type, data) {
     loading_jquery.removeAttr('id');
     loading_jquery.attr('class', 'loading');
     loading_jquery.prependTo(window_obj.find('.window_content'));
+    showLoadingProgress(loading_jquery);
     loading_jquery.show();
 
     window_obj.appendTo('body');
@@ -738,10 +1373,42 @@ function setupWindow(window_obj, type, data) {
         window_obj.find('.flamegraph_download').attr(
             'onclick', 'downloadFlameGraph(\'' + window_obj.attr('id') + '\')');
 
+        var time_range = data.time_range;
+        var subject = session.item_dict[data.timeline_group_id];
+
+        if (data.merged === 'process') {
+            subject = 'all threads of PID ' +
+                data.timeline_group_id.split('_')[0];
+        } else if (data.merged === 'session') {
+            subject = 'all threads/processes';
+        }
+
+        // The compared flame graphs are of the same kind as the baseline
+        // ones (i.e. of a thread/process or of the whole session).
+        var diff = undefined;
+
+        if (data.diff) {
+            diff = {
+                reference: diff_baseline.reference === 'all' ?
+                    'all' : data.timeline_group_id,
+                baseline_reference: diff_baseline.reference,
+                session_id: diff_baseline.session_id,
+                description: diff_baseline.description
+            };
+
+            if (diff.reference === 'all') {
+                subject = 'all threads/processes';
+            }
+
+            subject += ' compared with ' + diff.description;
+        }
+
         window_obj.find('.window_title').html(
             '[Session: ' + session.label + '] ' +
-                'Flame graphs for ' +
-                session.item_dict[data.timeline_group_id]);
+                'Flame graphs for ' + subject +
+                (time_range === undefined ? '' :
+                 ' between ' + time_range[0].toFixed(3) + ' ms and ' +
+                 time_range[1].toFixed(3) + ' ms'));
         var to_remove = [];
         window_obj.find('.flamegraph_metric > option').each(function() {
             if (!this.disabled) {
@@ -761,15 +1428,33 @@ function setupWindow(window_obj, type, data) {
 
         window_obj.find('.flamegraph_metric').val('walltime');
         window_obj.find('.flamegraph_time_ordered').prop('checked', false);
+
+        // Merged and differential flame graphs have no time-ordered
+        // variant.
+        window_obj.find('.flamegraph_time_ordered').prop(
+            'disabled', data.merged !== undefined || diff !== undefined);
         window_obj.find('.flamegraph').attr('data-id', data.timeline_group_id);
 
         var window_id = window_obj.attr('id');
+        var depth = parseInt($('#depth_input').val());
+
+        window_dict[window_id].data.threshold =
+            1.0 * parseFloat($('#threshold_input').val()) / 100;
+        window_dict[window_id].data.time_range = time_range;
+        window_dict[window_id].data.merged = data.merged;
+        window_dict[window_id].data.diff = diff;
+
+        var request_data = getFlameGraphRequestData(window_id);
+
+        if (depth > 0) {
+            request_data.depth = depth;
+        }
+
+        var cache_key = JSON.stringify(request_data);
 
-        if (data.timeline_group_id + '_' +
-            parseFloat($('#threshold_input').val()) in session.result_cache) {
-            window_dict[window_id].data.result_obj = session.result_cache[
-                data.timeline_group_id + '_' + parseFloat($(
-                    '#threshold_input').val())];
+        if (cache_key in session.result_cache) {
+            window_dict[window_id].data.result_obj =
+                session.result_cache[cache_key];
 
             if (!('walltime' in window_dict[window_id].data.result_obj)) {
                 window_dict[window_id].data.flamegraph_obj = undefined;
@@ -782,19 +1467,10 @@ function setupWindow(window_obj, type, data) {
 
             loading_jquery.hide();
         } else {
-            var pid_tid = data.timeline_group_id.split('_');
-
-            $.ajax({
-                url: $('#block').attr('result_id') + '/',
-                method: 'POST',
-                dataType: 'json',
-                data: {pid: pid_tid[0], tid: pid_tid[1],
-                       threshold: 1.0 * parseFloat($(
-                           '#threshold_input').val()) / 100}
-            }).done(ajax_obj => {
-                session.result_cache[
-                    data.timeline_group_id + '_' + parseFloat($(
-                        '#threshold_input').val())] = ajax_obj;
+            getSessionData($('#block').attr('result_id'), request_data,
+                           status => showLoadingProgress(
+                               loading_jquery, status)).done(ajax_obj => {
+                session.result_cache[cache_key] = ajax_obj;
                 window_dict[window_id].data.result_obj = ajax_obj;
 
                 if (!('walltime' in window_dict[window_id].data.result_obj)) {
@@ -846,12 +1522,8 @@ function setupWindow(window_obj, type, data) {
                              session.result_cache[type]);
             loading_jquery.hide();
         } else {
-            $.ajax({
-                url: $('#block').attr('result_id') + '/',
-                method: 'POST',
-                dataType: 'json',
-                data: {general_analysis: type}
-            }).done(ajax_obj => {
+            getSessionData($('#block').attr('result_id'),
+                           {general_analysis: type}).done(ajax_obj => {
                 session.result_cache[type] = ajax_obj;
                 window_dict[window_obj.attr('id')].data = ajax_obj;
                 openRooflinePlot(window_obj, ajax_obj);
@@ -862,6 +1534,67 @@ function setupWindow(window_obj, type, data) {
                 onWindowCloseClick(window_obj.attr('id'));
             });
         }
+    } else if (type === 'hot_functions') {
+        var window_id = window_obj.attr('id');
+        var reference = data.timeline_group_id;
+        var subject = session.item_dict[data.timeline_group_id];
+
+        if (data.scope === 'process') {
+            reference = data.timeline_group_id.split('_')[0];
+            subject = 'all threads of PID ' + reference;
+        } else if (data.scope === 'session') {
+            reference = 'all';
+            subject = 'all threads/processes';
+        }
+
+        window_obj.find('.window_title').html(
+            '[Session: ' + session.label + '] Hot functions of ' + subject);
+
+        for (const [k, v] of Object.entries(
+            session.metrics_dict[data.timeline_group_id])) {
+            if (v.flame_graph) {
+                window_obj.find('.hot_functions_metric').append(
+                    new Option(v.title, k));
+            }
+        }
+
+        window_obj.find('.hot_functions_metric').val('walltime');
+        window_obj.find('.hot_functions_metric').attr(
+            'onchange', 'loadHotFunctions(\'' + window_id + '\', 0)');
+        window_obj.find('.hot_functions_sort').attr(
+            'onchange', 'loadHotFunctions(\'' + window_id + '\', 0)');
+        window_obj.find('.hot_functions_previous').attr(
+            'onclick', 'onHotFunctionsPageClick(\'' + window_id + '\', -1)');
+        window_obj.find('.hot_functions_next').attr(
+            'onclick', 'onHotFunctionsPageClick(\'' + window_id + '\', 1)');
+
+        window_dict[window_id].data.session_id = $('#block').attr('result_id');
+        window_dict[window_id].data.reference = reference;
+        window_dict[window_id].data.request = 0;
+        window_dict[window_id].data.loading_jquery = loading_jquery;
+
+        loadHotFunctions(window_id, 0);
+    } else if (type === 'symbol_search') {
+        var window_id = window_obj.attr('id');
+
+        window_obj.find('.window_title').html(
+            '[Session: ' + session.label + '] ' +
+                'Functions in all threads/processes');
+        window_obj.find('.symbol_search_exact').attr(
+            'id', window_id + '_exact');
+        window_obj.find('.symbol_search_exact_label').attr(
+            'for', window_id + '_exact');
+        window_obj.find('.symbol_search_query').attr(
+            'oninput', 'onSymbolSearchChange(\'' + window_id + '\')');
+        window_obj.find('.symbol_search_exact').attr(
+            'onchange', 'onSymbolSearchChange(\'' + window_id + '\')');
+
+        window_dict[window_id].data.session_id = $('#block').attr('result_id');
+        window_dict[window_id].data.request = 0;
+        window_dict[window_id].data.loading_jquery = loading_jquery;
+
+        loading_jquery.hide();
+        window_obj.find('.symbol_search_query').focus();
     } else if (type === 'code') {
         window_obj.find('.window_title').html(
             '[Session: ' + session.label + '] ' +
@@ -877,14 +1610,36 @@ function setupWindow(window_obj, type, data) {
         window_dict[window_obj.attr('id')].data.files_and_lines =
             structuredClone(data.files_and_lines);
 
-        prepareCodePreview(window_obj, data.code,
+        prepareCodePreview(window_obj, data.code, data.default_file,
                            data.files_and_lines[data.default_file])
 
         loading_jquery.hide();
     }
 }
 
-function prepareCodePreview(window_obj, code, lines) {
+// code_obj is an object returned by loadSourceCode() for the file
+// with a given path.
+function prepareCodePreview(window_obj, code_obj, path, lines) {
+    var code = code_obj.code;
+    var partial = code_obj.first > 1 || code_obj.last < code_obj.line_count;
+
+    if (partial) {
+        var numf = new Intl.NumberFormat('en-US');
+        window_obj.find('.code_range_info').text(
+            'Showing lines ' + numf.format(code_obj.first) + '-' +
+                numf.format(code_obj.last) + ' of ' +
+                numf.format(code_obj.line_count));
+        window_obj.find('.code_range_all').off('click');
+        window_obj.find('.code_range_all').on('click', function() {
+            loadSourceCode(path).done(full_code_obj => {
+                prepareCodePreview(window_obj, full_code_obj, path, lines);
+            });
+        });
+        window_obj.find('.code_range').show();
+    } else {
+        window_obj.find('.code_range').hide();
+    }
+
     window_obj.find('.code_container').scrollTop(0);
     var code_box = window_obj.find('.code_box');
     code_box.html('');
@@ -899,17 +1654,18 @@ function prepareCodePreview(window_obj, code, lines) {
 
     code_box.text(code);
     window_obj.find('.code_copy_all').off('click');
-    window_obj.find('.code_copy_all').on('click', {
-        code: code
-    }, function(event) {
-        navigator.clipboard.writeText(event.data.code);
-        window.alert('Code copied to clipboard!');
+    window_obj.find('.code_copy_all').on('click', function() {
+        loadSourceCode(path).done(full_code_obj => {
+            navigator.clipboard.writeText(full_code_obj.code);
+            window.alert('Code copied to clipboard!');
+        });
     });
 
     var line_to_go = undefined;
 
     hljs.highlightElement(window_obj.find('.code_box')[0]);
-    hljs.lineNumbersBlockSync(window_obj.find('.code_box')[0]);
+    hljs.lineNumbersBlockSync(window_obj.find('.code_box')[0],
+                              {startFrom: code_obj.first});
 
     var numf = new Intl.NumberFormat('en-US');
 
@@ -939,10 +1695,10 @@ function prepareCodePreview(window_obj, code, lines) {
     }
 
     if (line_to_go !== undefined) {
-        if (line_to_go > 3) {
+        if (line_to_go > code_obj.first + 3) {
             line_to_go -= 3;
         } else {
-            line_to_go = 1;
+            line_to_go = code_obj.first;
         }
 
         var container = window_obj.find('.code_container');
@@ -964,59 +1720,92 @@ function prepareCodePreview(window_obj, code, lines) {
 // default_path corresponds to <path> to be displayed first
 // when a code preview window is shown.
 function openCode(data, default_path) {
-    var session = session_dict[$('#results_combobox').val()];
-    var load = function(code) {
+    loadSourceCode(default_path, data[default_path]).done(code_obj => {
         var new_window = createWindowDOM('code');
         new_window.css('top', 'calc(50% - 275px)');
         new_window.css('left', 'calc(50% - 375px)');
         setupWindow(new_window, 'code', {
-            code: code,
+            code: code_obj,
             files_and_lines: data,
             default_file: default_path,
         });
-    };
-
-    if (default_path in session.src_cache) {
-        load(session.src_cache[default_path]);
-    } else {
-        $.ajax({
-            url: $('#block').attr('result_id') + '/',
-            method: 'POST',
-            dataType: 'text',
-            data: {src: session.src_index_dict[default_path]}
-        }).done(src_code => {
-            session.src_cache[default_path] = src_code;
-            load(src_code);
-        }).fail(ajax_obj => {
-            window.alert('Could not load ' + default_path + '!');
-        });
-    }
+    });
 }
 
 function onCodeFileChange(window_id, event) {
-    var session = session_dict[$('#results_combobox').val()];
     var path = event.currentTarget.value;
-    var load = function(code) {
-        var window_obj = $('#' + window_id);
-        prepareCodePreview(window_obj, code,
-                           window_dict[window_id].data.files_and_lines[path]);
-    };
+    var lines = window_dict[window_id].data.files_and_lines[path];
+
+    loadSourceCode(path, lines).done(code_obj => {
+        prepareCodePreview($('#' + window_id), code_obj, path, lines);
+    });
+}
+
+// The number of lines shown in a code preview before the first and
+// after the last highlighted line.
+const CODE_PREVIEW_CONTEXT = 200;
+
+// Loads the source code file with a given path in the current session
+// and returns a jQuery promise resolved with an object with "code",
+// "first", "last", and "line_count" (see "src" in the docstring of
+// query() in app.py). If lines (in the format of the values of data
+// in openCode()) is provided and not empty, only the lines around
+// the highlighted ones are loaded, as source files can be large
+// (e.g. generated ones). Otherwise, the whole file is loaded.
+function loadSourceCode(path, lines) {
+    var session = session_dict[$('#results_combobox').val()];
+    var session_id = $('#block').attr('result_id');
+    var line_numbers = Object.keys(lines || {}).map(x => parseInt(x));
+    var promise;
+    var cache_key;
+
+    if (line_numbers.length > 0) {
+        var first = Math.max(
+            1, Math.min(...line_numbers) - CODE_PREVIEW_CONTEXT);
+        var last = Math.max(...line_numbers) + CODE_PREVIEW_CONTEXT;
+        cache_key = path + ':' + first + '-' + last;
+
+        if (cache_key in session.src_cache) {
+            return $.Deferred().resolve(session.src_cache[cache_key]).promise();
+        }
 
-    if (path in session.src_cache) {
-        load(session.src_cache[path]);
+        promise = getSessionData(session_id, {
+            src: session.src_index_dict[path],
+            lines: first + '-' + last
+        });
     } else {
-        $.ajax({
-            url: $('#block').attr('result_id') + '/',
-            method: 'POST',
+        cache_key = path;
+
+        if (cache_key in session.src_cache) {
+            return $.Deferred().resolve(session.src_cache[cache_key]).promise();
+        }
+
+        promise = $.ajax({
+            url: session_id + '/',
+            method: 'GET',
             dataType: 'text',
             data: {src: session.src_index_dict[path]}
-        }).done(src_code => {
-            session.src_cache[path] = src_code;
-            load(src_code);
-        }).fail(ajax_obj => {
-            window.alert('Could not load ' + path + '!');
+        }).then(src_code => {
+            var line_count = src_code.split('\n').length;
+
+            if (src_code.endsWith('\n')) {
+                line_count--;
+            }
+
+            return {
+                code: src_code,
+                first: 1,
+                last: line_count,
+                line_count: line_count
+            };
         });
     }
+
+    return promise.done(code_obj => {
+        session.src_cache[cache_key] = code_obj;
+    }).fail(ajax_obj => {
+        window.alert('Could not load ' + path + '!');
+    });
 }
 
 function openRooflinePlot(window_obj, roofline_obj) {
@@ -1209,7 +1998,13 @@ function onRooflineTypeChange(event, window_id) {
     functionPlot(roofline_obj.plot_config);
 }
 
-function onMenuItemClick(event, analysis_type, timeline_group_id) {
+// The options are passed to setupWindow() along with the timeline group.
+// Flame graphs support the following ones:
+// * time_range: the [start, end] pair of timeline timestamps in ms the flame
+//   graphs are restricted to,
+// * merged: "process" or "session" for the flame graphs of all threads of
+//   the process of the timeline group or of all threads in the session.
+function onMenuItemClick(event, analysis_type, timeline_group_id, options) {
     $('#thread_menu_block').hide();
     $('#general_analysis_menu_block').hide();
 
@@ -1217,9 +2012,9 @@ function onMenuItemClick(event, analysis_type, timeline_group_id) {
     new_window.css('top', event.pageY + 'px');
     new_window.css('left', event.pageX + 'px');
 
-    setupWindow(new_window, analysis_type, {
+    setupWindow(new_window, analysis_type, Object.assign({
         timeline_group_id: timeline_group_id
-    });
+    }, options));
 }
 
 function changeFocus(window_id) {
@@ -1341,12 +2136,158 @@ function updateFlameGraph(window_id, data, always_change_height) {
         if (data !== null) {
             flamegraph_total = data['value'];
             flamegraph_obj.update(data, update_height);
+            resolveFlameGraphSymbols(window_id, data);
         } else {
             update_height();
         }
     }
 }
 
+// Resolves the perf map symbols of the blocks of a flame graph which
+// have not been resolved yet (see resolveSymbols()) and redraws
+// the flame graph afterwards, so that their names are displayed instead
+// of addresses.
+function resolveFlameGraphSymbols(window_id, data) {
+    var window_obj = $('#' + window_id);
+    var session_id = $('#block').attr('result_id');
+    var callchain_obj = session_dict[session_id].callchain_obj;
+    var flamegraph_obj = window_dict[window_id].data.flamegraph_obj;
+
+    if (callchain_obj === undefined) {
+        return;
+    }
+
+    var mapping = callchain_obj[window_obj.find('.flamegraph_metric').val()];
+    var symbols = [];
+    var stack = [data];
+
+    while (stack.length > 0) {
+        var node = stack.pop();
+
+        if (mapping !== undefined && node.name in mapping) {
+            symbols.push(mapping[node.name]);
+        }
+
+        for (const key of ['children', 'hidden_children']) {
+            if (key in node) {
+                for (const child of node[key]) {
+                    stack.push(child);
+                }
+            }
+        }
+    }
+
+    resolveSymbols(session_id, symbols).done(requested => {
+        if (requested && window_id in window_dict &&
+            window_dict[window_id].data.flamegraph_obj === flamegraph_obj) {
+            flamegraph_obj.update();
+        }
+    });
+}
+
+// Chooses the flame graphs of a thread/process (or of the whole session if
+// the timeline group is "all") as the baseline of differential flame graphs
+// opened afterwards, possibly in another session.
+function setDiffBaseline(session_id, timeline_group_id) {
+    closeAllMenus();
+
+    var session = session_dict[session_id];
+    var description = timeline_group_id === 'all' ?
+        'all threads/processes' : session.item_dict[timeline_group_id];
+
+    diff_baseline = {
+        session_id: session_id,
+        reference: timeline_group_id,
+        description: description + ' [Session: ' + session.label + ']'
+    };
+}
+
+// Returns the request arguments identifying the flame graphs shown in
+// a window, i.e. the thread/process (or the merged threads/processes),
+// the compression threshold, and the time range (if any).
+function getFlameGraphRequestData(window_id) {
+    var window_obj = $('#' + window_id);
+    var data = window_dict[window_id].data;
+    var pid_tid = window_obj.find('.flamegraph').attr('data-id').split('_');
+    var request_data = {threshold: data.threshold};
+
+    if (data.diff !== undefined) {
+        request_data.diff = data.diff.reference;
+        request_data.baseline = data.diff.baseline_reference;
+
+        if (data.diff.session_id !== $('#block').attr('result_id')) {
+            request_data.baseline_session = data.diff.session_id;
+        }
+    } else if (data.merged === 'process') {
+        request_data.merged = pid_tid[0];
+    } else if (data.merged === 'session') {
+        request_data.merged = 'all';
+    } else {
+        request_data.pid = pid_tid[0];
+        request_data.tid = pid_tid[1];
+    }
+
+    if (data.time_range !== undefined) {
+        request_data.t0 = data.time_range[0];
+        request_data.t1 = data.time_range[1];
+    }
+
+    return request_data;
+}
+
+// Replaces a flame graph stub (i.e. a block with "stub_id" set by the server
+// instead of its children) with its subtree fetched from the server.
+function loadFlameGraphStub(window_id, node) {
+    var window_obj = $('#' + window_id);
+    var stub_id = node.data.stub_id;
+    var request_data = getFlameGraphRequestData(window_id);
+    var depth = parseInt($('#depth_input').val());
+
+    request_data.node = stub_id;
+
+    if (depth > 0) {
+        request_data.depth = depth;
+    }
+
+    getSessionData($('#block').attr('result_id'),
+                   request_data).done(subtree => {
+        if (node.data.stub_id !== stub_id) {
+            return;
+        }
+
+        delete node.data.stub_id;
+        node.data.children = subtree.children;
+
+        if ('hidden_children' in subtree) {
+            node.data.hidden_children = subtree.hidden_children;
+        }
+
+        updateFlameGraph(window_id, d3.select('#' + window_obj.find(
+            '.flamegraph_svg').attr('id')).datum().data, false);
+    }).fail(ajax_obj => {
+        window.alert('Could not load the flame graph blocks!');
+    });
+}
+
+// Returns the colour of a differential flame graph block in the same way as
+// the differential mode of d3-flame-graph does: red for blocks which have
+// grown compared with the baseline and blue for the ones which have shrunk,
+// more saturated the bigger the change is relative to the block.
+function getDifferentialColor(node) {
+    var delta = node.data.delta || 0;
+    var value = Math.max(node.data.value, Math.abs(delta));
+    var other = value === 0 ? 220 :
+        Math.round(220 * (1 - Math.abs(delta) / value));
+
+    if (delta > 0) {
+        return 'rgb(220, ' + other + ', ' + other + ')';
+    } else if (delta < 0) {
+        return 'rgb(' + other + ', ' + other + ', 220)';
+    } else {
+        return 'rgb(220, 220, 220)';
+    }
+}
+
 function openFlameGraph(window_id, metric) {
     var window_obj = $('#' + window_id);
     var result_obj = window_dict[window_id].data.result_obj;
@@ -1354,9 +2295,13 @@ function openFlameGraph(window_id, metric) {
     var flamegraph_obj = window_dict[window_id].data.flamegraph_obj;
     flamegraph_obj.inverted(true);
     flamegraph_obj.sort(window_obj.find('.flamegraph_time_ordered').prop('checked') ? false : true);
+    var diff = window_dict[window_id].data.diff;
+
     flamegraph_obj.color(function(node, original_color) {
         if (node.highlight) {
             return original_color;
+        } else if (diff !== undefined) {
+            return getDifferentialColor(node);
         } else if (node.data.cold) {
             return '#039dfc';
         } else if (node.data.name === "(compressed)") {
@@ -1375,7 +2320,9 @@ function openFlameGraph(window_id, metric) {
         }
     });
     flamegraph_obj.onClick(function(node) {
-        if ("hidden_children" in node.data) {
+        if ("stub_id" in node.data) {
+            loadFlameGraphStub(window_id, node);
+        } else if ("hidden_children" in node.data) {
             var parent = node.parent.data;
             var new_children = [];
 
@@ -1397,6 +2344,13 @@ function openFlameGraph(window_id, metric) {
     flamegraph_obj.onContextMenu(function(node) {
         var session = session_dict[$('#results_combobox').val()];
         var symbol = session.callchain_obj[window_obj.find('.flamegraph_metric').val()][node.data.name];
+
+        // Differential flame graphs of two sessions have symbol names
+        // instead of compressed callchain names.
+        if (symbol === undefined) {
+            return;
+        }
+
         var offset_dict = session.src_dict[symbol[1]];
 
         if (offset_dict === undefined) {
@@ -1438,8 +2392,16 @@ function openFlameGraph(window_id, metric) {
     flamegraph_obj.setLabelHandler(function(node) {
         var numf = new Intl.NumberFormat('en-US');
         var getName = window_dict[window_id].data.flamegraph_obj.getName();
-        return getName(node) + ' (' + numf.format(node.data.value) +
-            ' unit(s), ' + (100 * (node.x1 - node.x0)).toFixed(2) + '%)';
+        var label = getName(node) + ' (' + numf.format(node.data.value) +
+            ' unit(s), ' + (100 * (node.x1 - node.x0)).toFixed(2) + '%';
+
+        if (diff !== undefined && 'delta' in node.data) {
+            label += ', baseline: ' + numf.format(node.data.baseline) +
+                ' unit(s), change: ' + (node.data.delta > 0 ? '+' : '') +
+                numf.format(node.data.delta) + ' unit(s)';
+        }
+
+        return label + ')';
     });
     flamegraph_obj.setSearchHandler(function(results, sum, total) {
         window_obj.find('.flamegraph_search_blocks').html(results.length.toLocaleString());
@@ -1472,6 +2434,9 @@ function openFlameGraph(window_id, metric) {
     updateFlameGraph(window_id, null, true);
     flamegraph_obj.width(window_obj.find('.flamegraph_svg').outerWidth());
     flamegraph_obj.update();
+    resolveFlameGraphSymbols(
+        window_id,
+        d3.select('#' + window_obj.find('.flamegraph_svg').attr('id')).datum().data);
 
     window_obj.find('.flamegraph')[0].scrollTop = 0;
 }
@@ -1554,6 +2519,195 @@ function onSearchQueryChange(window_id, value) {
     }
 }
 
+// Loads the page of the hot functions table starting from a given offset
+// for the metric and the sort order chosen in a hot functions window.
+function loadHotFunctions(window_id, offset) {
+    var window_obj = $('#' + window_id);
+    var data = window_dict[window_id].data;
+    var session = session_dict[data.session_id];
+    var request = ++data.request;
+    var request_data = {
+        hot: data.reference,
+        metric: window_obj.find('.hot_functions_metric').val(),
+        sort: window_obj.find('.hot_functions_sort').val(),
+        offset: offset,
+        limit: HOT_FUNCTIONS_PAGE_SIZE
+    };
+    var cache_key = JSON.stringify(request_data);
+
+    var show = result => {
+        if (request === data.request) {
+            data.offset = offset;
+            data.count = result.count;
+            showHotFunctions(window_id, result);
+            data.loading_jquery.hide();
+        }
+    };
+
+    if (cache_key in session.result_cache) {
+        show(session.result_cache[cache_key]);
+        return;
+    }
+
+    showLoadingProgress(data.loading_jquery);
+    data.loading_jquery.show();
+
+    getSessionData(data.session_id, request_data,
+                   status => showLoadingProgress(
+                       data.loading_jquery, status)).done(result => {
+        session.result_cache[cache_key] = result;
+        show(result);
+    }).fail(ajax_obj => {
+        if (request === data.request) {
+            data.offset = 0;
+            data.count = 0;
+            window_obj.find('.hot_functions_page').text(
+                'No functions to show');
+            window_obj.find('.hot_functions_table tbody').empty();
+            data.loading_jquery.hide();
+        }
+    });
+}
+
+function onHotFunctionsPageClick(window_id, direction) {
+    var data = window_dict[window_id].data;
+    var offset = data.offset + direction * HOT_FUNCTIONS_PAGE_SIZE;
+
+    if (data.count !== undefined && offset >= 0 && offset < data.count) {
+        loadHotFunctions(window_id, offset);
+    }
+}
+
+// Fills a hot functions window with a page of the table returned by
+// the server, with the values also shown as percentages of the value of
+// all flame graphs in the scope.
+function showHotFunctions(window_id, result) {
+    var window_obj = $('#' + window_id);
+    var offset = window_dict[window_id].data.offset;
+    var numf = new Intl.NumberFormat('en-US');
+    var tbody = window_obj.find('.hot_functions_table tbody');
+
+    var percentage = value => result.total > 0 ?
+        (100 * value / result.total).toFixed(2) : '-';
+
+    tbody.empty();
+
+    if (result.count === 0) {
+        window_obj.find('.hot_functions_page').text('No functions to show');
+    } else {
+        window_obj.find('.hot_functions_page').text(
+            (offset + 1) + '-' + (offset + result.functions.length) +
+                ' of ' + result.count);
+    }
+
+    for (var i = 0; i < result.functions.length; i++) {
+        var func = result.functions[i];
+        var row = $('<tr></tr>');
+
+        row.append($('<td></td>').text(offset + i + 1));
+        row.append($('<td class="hot_functions_symbol"></td>').text(
+            func.symbol));
+        row.append($('<td></td>').text(numf.format(func.self)));
+        row.append($('<td></td>').text(percentage(func.self)));
+        row.append($('<td></td>').text(numf.format(func.total)));
+        row.append($('<td></td>').text(percentage(func.total)));
+        row.appendTo(tbody);
+    }
+}
+
+// Searches for the functions matching the query typed in a symbol search
+// window in all threads/processes of its session (see "search" in
+// the docstring of query() in app.py), waiting until the user stops
+// typing first. The first search in a session may take longer, as
+// the server builds the symbol index of the session then.
+function onSymbolSearchChange(window_id) {
+    var window_obj = $('#' + window_id);
+    var data = window_dict[window_id].data;
+    var query = window_obj.find('.symbol_search_query').val();
+    var request = ++data.request;
+
+    setTimeout(() => {
+        if (request !== data.request) {
+            return;
+        }
+
+        if (query === '') {
+            window_obj.find('.symbol_search_summary').text('');
+            window_obj.find('.symbol_search_table tbody').empty();
+            data.loading_jquery.hide();
+            return;
+        }
+
+        var request_data = {search: query};
+
+        if (window_obj.find('.symbol_search_exact').prop('checked')) {
+            request_data.exact = true;
+        }
+
+        showLoadingProgress(data.loading_jquery);
+        data.loading_jquery.show();
+
+        getSessionData(data.session_id, request_data,
+                       status => showLoadingProgress(
+                           data.loading_jquery, status)).done(result => {
+            if (request === data.request) {
+                showSymbolSearchResults(window_id, result);
+                data.loading_jquery.hide();
+            }
+        }).fail(ajax_obj => {
+            if (request === data.request) {
+                window_obj.find('.symbol_search_summary').text(
+                    'Could not search for the functions!');
+                window_obj.find('.symbol_search_table tbody').empty();
+                data.loading_jquery.hide();
+            }
+        });
+    }, 300);
+}
+
+// Fills a symbol search window with the results returned by the server.
+// Clicking a thread/process opens its flame graphs.
+function showSymbolSearchResults(window_id, result) {
+    var window_obj = $('#' + window_id);
+    var session_id = window_dict[window_id].data.session_id;
+    var session = session_dict[session_id];
+    var numf = new Intl.NumberFormat('en-US');
+    var tbody = window_obj.find('.symbol_search_table tbody');
+
+    tbody.empty();
+    window_obj.find('.symbol_search_summary').text(
+        result.count + ' matching function(s)' +
+            (result.count > result.symbols.length ?
+             ', showing the first ' + result.symbols.length : ''));
+
+    for (const symbol of result.symbols) {
+        $('<tr class="symbol_search_symbol"></tr>').append(
+            $('<td colspan="4"></td>').text(symbol.symbol)).appendTo(tbody);
+
+        for (const occurrence of symbol.occurrences) {
+            var metrics = session.metrics_dict[occurrence.thread] || {};
+            var metric = occurrence.metric in metrics ?
+                metrics[occurrence.metric].title : occurrence.metric;
+            var row = $('<tr class="pointer"></tr>');
+
+            row.append($('<td></td>').text(
+                session.item_dict[occurrence.thread] || occurrence.thread));
+            row.append($('<td></td>').text(metric));
+            row.append($('<td></td>').text(numf.format(occurrence.total)));
+            row.append($('<td></td>').text(numf.format(occurrence.self)));
+            row.attr('title', 'Open the flame graphs of this thread/process');
+
+            if (session_id === $('#block').attr('result_id')) {
+                row.attr('onclick', 'onMenuItemClick(event, ' +
+                         '\'flame_graphs\', \'' + occurrence.thread +
+                         '\')');
+            }
+
+            row.appendTo(tbody);
+        }
+    }
+}
+
 function onWindowMouseUp(window_id) {
     var window_obj = $('#' + window_id);
     if (window_dict[window_id].being_resized) {
@@ -1750,6 +2904,11 @@ function onGeneralAnalysesClick(event) {
            </div>`).appendTo('#general_analysis_menu_items');
     }
 
+    $(`<div class="menu_item"
+        onclick="onMenuItemClick(event, 'symbol_search')">
+         Search functions in all threads/processes
+       </div>`).appendTo('#general_analysis_menu_items');
+
     $('#general_analysis_menu_block').css('top', event.clientY);
     $('#general_analysis_menu_block').css('left', event.clientX);
     $('#general_analysis_menu_block').outerHeight('auto');
@@ -0,0 +1,392 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+
+class SessionStore:
+    """
+    A class describing a read-only, indexed SQLite database containing
+    the data of a profiling session converted from the files in its
+    "processed" directory (see SessionStoreWriter), so that they can be
+    accessed piece by piece instead of parsing whole files, i.e.:
+    * the session properties (e.g. metrics and source code mappings),
+    * the thread/process tree,
+    * the sampled times, start callchains, and off-CPU regions by
+      thread/process,
+    * the flame graphs by thread/process in the columnar form (see
+      FlameGraph.to_bytes()),
+    * the perf symbol map indices by map name (see PerfMapIndex),
+    * the callchain mappings by event type.
+
+    The store is located in the session directory and it is valid only
+    as long as the session files it has been created from stay
+    the same (see get_fingerprint()).
+
+    Every process (and thread) opens its own connection to the database
+    lazily, so a SessionStore object can be shared by threads.
+    """
+
+    FILE_NAME = 'session.sqlite3'
+
+    # The version of the database layout, increased whenever the layout
+    # changes so that outdated stores are not used.
+    VERSION = 1
+
+    def get_fingerprint(session_path: Path) -> list:
+        """
+        Get a fingerprint of the files a store of a session is created
+        from, i.e. the sorted list of (path relative to the session
+        directory, modification time in ns, size in bytes) triples of
+        all files in "processed" and of "out/event_dict.data".
+
+        :param pathlib.Path session_path: The path to a session directory.
+        """
+        result = []
+        paths = [Path('out') / 'event_dict.data']
+
+        try:
+            with os.scandir(session_path / 'processed') as it:
+                for entry in it:
+                    if entry.is_file():
+                        paths.append(Path('processed') / entry.name)
+        except FileNotFoundError:
+            pass
+
+        for path in paths:
+            try:
+                stat = (session_path / path).stat()
+            except FileNotFoundError:
+                continue
+
+            result.append((str(path), stat.st_mtime_ns, stat.st_size))
+
+        result.sort()
+        return result
+
+    def open(session_path: Path):
+        """
+        Open the store of a session, or return None if the session has
+        no store or it is out of date or invalid.
+
+        :param pathlib.Path session_path: The path to a session directory.
+        """
+        path = session_path / SessionStore.FILE_NAME
+
+        if not path.exists():
+            return None
+
+        store = SessionStore(path)
+
+        try:
+            if store.get_property('version') != SessionStore.VERSION:
+                return None
+
+            files = [tuple(x) for x in store._get_connection().execute(
+                'SELECT path, mtime_ns, size FROM files ORDER BY path')]
+        except (OSError, sqlite3.Error):
+            return None
+
+        if files != SessionStore.get_fingerprint(session_path):
+            return None
+
+        return store
+
+    def __init__(self, path: Path):
+        """
+        Construct a SessionStore object. Use open() for checking whether
+        the store is valid first.
+
+        :param pathlib.Path path: The path to a store database file.
+        """
+        self._path = path
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        connection = sqlite3.connect(
+            self._path.resolve().as_uri() + '?mode=ro', uri=True,
+            timeout=30)
+
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+
+        return connection
+
+    def _fetch_one(self, query, parameters):
+        row = self._get_connection().execute(query, parameters).fetchone()
+        return None if row is None else row[0]
+
+    def get_property(self, key: str):
+        """
+        Get a session property (e.g. "metrics"), or None if it is
+        not set.
+
+        :param str key: The name of a property.
+        """
+        value = self._fetch_one('SELECT value FROM properties WHERE key = ?',
+                                (key,))
+        return None if value is None else json.loads(value)
+
+    def get_thread_nodes(self) -> list:
+        """
+        Get the list of the nodes of the thread/process tree, in the same
+        form as "thread_tree" in metadata.json.
+        """
+        return [json.loads(x[0]) for x in self._get_connection().execute(
+            'SELECT node FROM threads ORDER BY position')]
+
+    def get_sampled_time(self, pid_tid: str):
+        """
+        Get the sampled time of a thread/process, or None if it is
+        unknown.
+
+        :param str pid_tid: The ID of a thread/process in form of
+                            "<PID>_<TID>".
+        """
+        return self._fetch_one('SELECT time FROM sampled_times WHERE id = ?',
+                               (pid_tid,))
+
+    def get_start_callchain(self, tid: str) -> list:
+        """
+        Get the callchain spawning a thread/process (an empty list if it
+        is unknown).
+
+        :param str tid: The TID of a thread/process.
+        """
+        value = self._fetch_one(
+            'SELECT callchain FROM start_callchains WHERE tid = ?', (tid,))
+        return [] if value is None else json.loads(value)
+
+    def get_off_cpu_regions(self, pid_tid: str) -> list:
+        """
+        Get the off-CPU regions of a thread/process in form of
+        [start timestamp, length] lists in ns, in the order of
+        metadata.json.
+
+        :param str pid_tid: The ID of a thread/process in form of
+                            "<PID>_<TID>".
+        """
+        return [list(x) for x in self._get_connection().execute(
+            'SELECT start, length FROM off_cpu_regions WHERE id = ? '
+            'ORDER BY position', (pid_tid,))]
+
+    def get_flame_graphs(self, pid_tid: str):
+        """
+        Iterate over the flame graphs of a thread/process in the order of
+        its {pid}_{tid}.json file, yielding (metric, bytes returned by
+        FlameGraph.to_bytes()) pairs. Nothing is yielded if
+        the thread/process has no flame graphs.
+
+        :param str pid_tid: The ID of a thread/process in form of
+                            "<PID>_<TID>".
+        """
+        yield from self._get_connection().execute(
+            'SELECT metric, graph FROM flame_graphs WHERE id = ? '
+            'ORDER BY position', (pid_tid,))
+
+    def has_flame_graphs(self, pid_tid: str) -> bool:
+        """
+        Check whether there are flame graphs of a thread/process.
+
+        :param str pid_tid: The ID of a thread/process in form of
+                            "<PID>_<TID>".
+        """
+        return self._fetch_one('SELECT 1 FROM flame_graphs WHERE id = ? '
+                               'LIMIT 1', (pid_tid,)) is not None
+
+    def get_perf_map_index(self, map_name: str) -> bytes:
+        """
+        Get the index of a perf symbol map returned by PerfMapIndex.build(),
+        or None if there is no such map.
+
+        :param str map_name: The name of a map, e.g. "perf-1784.map".
+        """
+        return self._fetch_one('SELECT data FROM perf_maps WHERE name = ?',
+                               (map_name,))
+
+    def get_callchain_mappings(self) -> dict:
+        """
+        Get the dictionary mapping event types to JSON strings of
+        the callchain mappings (see
+        ProfilingResults.get_callchain_mappings()).
+        """
+        return dict(self._get_connection().execute(
+            'SELECT kind, mapping FROM callchain_mappings ORDER BY kind'))
+
+
+class SessionStoreWriter:
+    """
+    A class describing a context manager creating the store of
+    a profiling session (see SessionStore). The store is written to
+    a temporary file, which atomically replaces the previous store (if
+    any) when the context exits successfully, so readers never see
+    a partially written store. If an exception is raised, the temporary
+    file is removed.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE properties (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+        'CREATE TABLE files (path TEXT PRIMARY KEY, '
+        'mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)',
+        'CREATE TABLE threads (position INTEGER PRIMARY KEY, '
+        'node TEXT NOT NULL)',
+        'CREATE TABLE sampled_times (id TEXT PRIMARY KEY, time)',
+        'CREATE TABLE start_callchains (tid TEXT PRIMARY KEY, '
+        'callchain TEXT NOT NULL)',
+        'CREATE TABLE off_cpu_regions (position INTEGER PRIMARY KEY, '
+        'id TEXT NOT NULL, start INTEGER NOT NULL, length INTEGER NOT NULL)',
+        'CREATE INDEX off_cpu_regions_id ON off_cpu_regions (id, start)',
+        'CREATE TABLE flame_graphs (position INTEGER PRIMARY KEY, '
+        'id TEXT NOT NULL, metric TEXT NOT NULL, graph BLOB NOT NULL)',
+        'CREATE INDEX flame_graphs_id ON flame_graphs (id, position)',
+        'CREATE TABLE perf_maps (name TEXT PRIMARY KEY, data BLOB NOT NULL)',
+        'CREATE TABLE callchain_mappings (kind TEXT PRIMARY KEY, '
+        'mapping TEXT NOT NULL)'
+    ]
+
+    def __init__(self, session_path: Path, fingerprint: list):
+        """
+        Construct a SessionStoreWriter object.
+
+        :param pathlib.Path session_path: The path to a session directory.
+        :param list fingerprint: The fingerprint of the session files
+                                 the store is created from (see
+                                 SessionStore.get_fingerprint()), taken
+                                 before reading them.
+        """
+        self._session_path = session_path
+        self._fingerprint = fingerprint
+        self._tmp_path = None
+        self._connection = None
+
+    def __enter__(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self._session_path,
+                                        prefix='.session-',
+                                        suffix='.sqlite3.tmp')
+        os.close(fd)
+        self._tmp_path = Path(tmp_path)
+
+        try:
+            self._connection = sqlite3.connect(tmp_path)
+            self._connection.execute('PRAGMA journal_mode=OFF')
+            self._connection.execute('PRAGMA synchronous=OFF')
+
+            for statement in SessionStoreWriter.SCHEMA:
+                self._connection.execute(statement)
+        except BaseException:
+            self._abort()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._abort()
+            return False
+
+        try:
+            self.put_property('version', SessionStore.VERSION)
+            self._connection.executemany(
+                'INSERT INTO files VALUES (?, ?, ?)', self._fingerprint)
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+            os.chmod(self._tmp_path, 0o644)
+            os.replace(self._tmp_path,
+                       self._session_path / SessionStore.FILE_NAME)
+        except BaseException:
+            self._abort()
+            raise
+
+        return False
+
+    def _abort(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+        try:
+            self._tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def put_property(self, key: str, value):
+        """
+        Store a session property.
+
+        :param str key: The name of a property.
+        :param value: The JSON-serializable value of a property.
+        """
+        self._connection.execute('INSERT OR REPLACE INTO properties '
+                                 'VALUES (?, ?)', (key, json.dumps(value)))
+
+    def put_metadata(self, metadata: dict):
+        """
+        Store the thread/process data from metadata.json, i.e.
+        the thread/process tree, the sampled times, the start callchains,
+        and the off-CPU regions.
+
+        :param dict metadata: The parsed metadata.json.
+        """
+        self._connection.executemany(
+            'INSERT INTO threads VALUES (?, ?)',
+            ((i, json.dumps(node)) for i, node in
+             enumerate(metadata.get('thread_tree', []))))
+        self._connection.executemany(
+            'INSERT INTO sampled_times VALUES (?, ?)',
+            metadata.get('sampled_times', {}).items())
+        self._connection.executemany(
+            'INSERT INTO start_callchains VALUES (?, ?)',
+            ((k, json.dumps(v)) for k, v in
+             metadata.get('callchains', {}).items()))
+        self._connection.executemany(
+            'INSERT INTO off_cpu_regions (id, start, length) '
+            'VALUES (?, ?, ?)',
+            ((k, x[0], x[1]) for k, v in
+             metadata.get('offcpu_regions', {}).items() for x in v))
+
+    def put_flame_graph(self, pid_tid: str, metric: str, graph: bytes):
+        """
+        Store a flame graph of a thread/process. Flame graphs should be
+        stored in the order of the {pid}_{tid}.json file.
+
+        :param str pid_tid: The ID of a thread/process in form of
+                            "<PID>_<TID>".
+        :param str metric: The metric of a flame graph.
+        :param bytes graph: The flame graph returned by
+                            FlameGraph.to_bytes().
+        """
+        self._connection.execute(
+            'INSERT INTO flame_graphs (id, metric, graph) VALUES (?, ?, ?)',
+            (pid_tid, metric, graph))
+
+    def put_perf_map_index(self, map_name: str, index: bytes):
+        """
+        Store the index of a perf symbol map.
+
+        :param str map_name: The name of a map, e.g. "perf-1784.map".
+        :param bytes index: The index returned by PerfMapIndex.build().
+        """
+        self._connection.execute('INSERT INTO perf_maps VALUES (?, ?)',
+                                 (map_name, index))
+
+    def put_callchain_mappings(self, kind: str, mappings: dict):
+        """
+        Store the callchain mappings of an event type.
+
+        :param str kind: The event type, e.g. "syscall".
+        :param dict mappings: The parsed <event type>_callchains.json.
+        """
+        self._connection.execute(
+            'INSERT INTO callchain_mappings VALUES (?, ?)',
+            (kind, json.dumps(mappings)))
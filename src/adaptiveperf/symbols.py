@@ -0,0 +1,207 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+from .flamegraph import FlameGraph
+
+
+class SymbolIndex:
+    """
+    A class describing an inverted index of the functions appearing in
+    the flame graphs of a profiling session, mapping every symbol
+    (i.e. a compressed callchain name translated to the full symbol
+    name, see ProfilingResults.get_callchain_mappings()) to
+    the threads/processes and the metrics it appears in, along with its
+    total and self values there (see FlameGraph.get_function_values()).
+    The value of the root of every indexed flame graph is kept as well.
+
+    Only the non-time-ordered flame graphs are indexed, as
+    the time-ordered ones have the same values. Once built, the index
+    answers queries such as "which threads call malloc and how much" or
+    "which functions are the hottest in this process" without reading
+    any flame graph.
+    """
+
+    def __init__(self, entries=[], totals=[]):
+        """
+        Construct a SymbolIndex object.
+
+        :param list entries: The list of [symbol, thread/process ID,
+                             metric, total value, self value] lists
+                             the index should initially consist of
+                             (e.g. returned by get_entries()).
+        :param list totals: The list of [thread/process ID, metric,
+                            root value] lists of the indexed flame graphs
+                            (e.g. returned by get_totals()).
+        """
+        self._symbols = {}
+        self._totals = {}
+        self._lower_symbols = None
+
+        for symbol, pid_tid, metric, total, self_value in entries:
+            self._symbols.setdefault(symbol, []).append(
+                [pid_tid, metric, total, self_value])
+
+        for pid_tid, metric, value in totals:
+            self._totals[(pid_tid, metric)] = value
+
+    def add(self, pid_tid: str, metric: str, graph: FlameGraph,
+            mapping: dict = {}):
+        """
+        Add the functions of a non-time-ordered flame graph to the index.
+
+        :param str pid_tid: The thread/process ID of the flame graph in
+                            form of "<PID>_<TID>".
+        :param str metric: The metric of the flame graph.
+        :param FlameGraph graph: The flame graph.
+        :param dict mapping: The dictionary mapping compressed callchain
+                             names of the metric to [symbol name,
+                             library/executable name] lists. The names
+                             absent from it are indexed as they are.
+        """
+        # The names are translated before aggregating, as several
+        # compressed names can correspond to the same symbol.
+        graph = graph.rename({k: v[0] for k, v in mapping.items()})
+
+        for symbol, (total, self_value) in \
+                graph.get_function_values().items():
+            self._symbols.setdefault(symbol, []).append(
+                [pid_tid, metric, total, self_value])
+
+        self._totals[(pid_tid, metric)] = graph.get_value(0)
+        self._lower_symbols = None
+
+    def search(self, query: str, metric: str = None, exact: bool = False,
+               limit: int = 100) -> dict:
+        """
+        Find the symbols matching a query.
+
+        :param str query: The query, matched case-insensitively against
+                          the symbol names.
+        :param str metric: The metric the occurrences of the symbols
+                           should be limited to (None for all metrics).
+        :param bool exact: Whether symbols should match the query
+                           exactly rather than contain it.
+        :param int limit: The maximum number of symbols returned.
+        :return: {"count": <number of matching symbols>, "symbols":
+                 [{"symbol": <name>, "occurrences": [{"thread":
+                 <thread/process ID>, "metric": <metric>, "total":
+                 <total value>, "self": <self value>}, ...]}, ...]},
+                 with the exact matches first, followed by the other
+                 matches from the shortest, and the occurrences sorted
+                 by metric and from the highest total value.
+        :raises ValueError: When limit is smaller than 1.
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1!')
+
+        if self._lower_symbols is None:
+            self._lower_symbols = [(k.lower(), k) for k in self._symbols]
+
+        query = query.lower()
+        matches = []
+
+        for lower, symbol in self._lower_symbols:
+            if lower == query or (not exact and query in lower):
+                occurrences = [x for x in self._symbols[symbol]
+                               if metric is None or x[1] == metric]
+
+                if len(occurrences) > 0:
+                    matches.append((lower != query, len(symbol), symbol,
+                                    occurrences))
+
+        matches.sort(key=lambda x: x[:3])
+
+        return {
+            'count': len(matches),
+            'symbols': [{
+                'symbol': symbol,
+                'occurrences': [{
+                    'thread': pid_tid,
+                    'metric': occurrence_metric,
+                    'total': total,
+                    'self': self_value
+                } for pid_tid, occurrence_metric, total, self_value in
+                    sorted(occurrences, key=lambda x: (x[1], -x[2]))]
+            } for _, _, symbol, occurrences in matches[:limit]]
+        }
+
+    def aggregate(self, metric: str, pid: str = None,
+                  tid: str = None) -> tuple:
+        """
+        Add up the total and self values of every function across
+        the threads/processes within a given scope, in one pass over
+        the index.
+
+        :param str metric: The metric of the values.
+        :param str pid: The PID of the threads/processes (None for all
+                        threads/processes in the session).
+        :param str tid: The TID of the thread/process (None for all
+                        threads/processes with the PID).
+        :return: The (value of the scope, list of [symbol, total value,
+                 self value] lists) pair, where the value of the scope is
+                 the sum of the root values of its flame graphs. None is
+                 returned if no flame graph of the metric is within
+                 the scope.
+        """
+        def in_scope(pid_tid):
+            if pid is None:
+                return True
+
+            if tid is None:
+                return pid_tid.split('_')[0] == pid
+
+            return pid_tid == f'{pid}_{tid}'
+
+        scope_value = None
+
+        for (pid_tid, total_metric), value in self._totals.items():
+            if total_metric == metric and in_scope(pid_tid):
+                scope_value = value if scope_value is None \
+                    else scope_value + value
+
+        if scope_value is None:
+            return None
+
+        functions = []
+
+        for symbol, occurrences in self._symbols.items():
+            total = 0
+            self_value = 0
+            found = False
+
+            for pid_tid, occurrence_metric, x, y in occurrences:
+                if occurrence_metric == metric and in_scope(pid_tid):
+                    total += x
+                    self_value += y
+                    found = True
+
+            if found:
+                functions.append([symbol, total, self_value])
+
+        return scope_value, functions
+
+    def get_entries(self) -> list:
+        """
+        Get the list of [symbol, thread/process ID, metric, total value,
+        self value] lists the index consists of.
+        """
+        return [[symbol] + x for symbol, occurrences in self._symbols.items()
+                for x in occurrences]
+
+    def get_totals(self) -> list:
+        """
+        Get the list of [thread/process ID, metric, root value] lists of
+        the indexed flame graphs.
+        """
+        return [[pid_tid, metric, value]
+                for (pid_tid, metric), value in self._totals.items()]
+
+    def to_json(self) -> str:
+        return json.dumps([self.get_entries(), self.get_totals()])
+
+    def from_json(json_str: str):
+        return SymbolIndex(*json.loads(json_str))
+
+    def __len__(self):
+        return len(self._symbols)
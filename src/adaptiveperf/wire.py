@@ -0,0 +1,336 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import gzip
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The binary wire format is a compact alternative to JSON for sending
+# JSON-compatible data to the website (see decodeBinary() in viewer.js).
+# All strings (both object keys and values) are stored only once in
+# a string table and referred to by their indices afterwards.
+#
+# Layout:
+# * the "APB1" magic bytes,
+# * the number of strings in the string table (varint),
+# * for every string: its length in bytes (varint) and its UTF-8 bytes,
+# * the encoded value.
+#
+# Every value starts with a one-byte tag:
+# * TAG_NULL, TAG_FALSE, TAG_TRUE: no further bytes,
+# * TAG_INT: a zigzag-encoded varint,
+# * TAG_FLOAT: a little-endian 64-bit float,
+# * TAG_STRING: a string table index (varint),
+# * TAG_ARRAY: the number of elements (varint) followed by the elements,
+# * TAG_INT_ARRAY: the number of elements (varint) followed by
+#   the zigzag-encoded varints (used for non-empty arrays of integers),
+# * TAG_OBJECT: the number of keys (varint) followed by pairs of
+#   a key string table index (varint) and a value.
+#
+# Varints are unsigned little-endian base-128 integers, i.e. every byte
+# stores 7 bits and has its highest bit set if more bytes follow.
+BINARY_MAGIC = b'APB1'
+BINARY_MIME_TYPE = 'application/x-adaptiveperf-binary'
+
+TAG_NULL = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING = 5
+TAG_ARRAY = 6
+TAG_INT_ARRAY = 7
+TAG_OBJECT = 8
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    buffer.append(value)
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+class BinaryEncoder:
+    """
+    A class describing an incremental encoder of values to the binary
+    wire format described at the top of wire.py, so that large payloads
+    (e.g. flame graphs) can be encoded directly from their own data
+    structures rather than converted to JSON-compatible objects first.
+
+    Objects and arrays are written as their headers (see begin_object()
+    and begin_array()) followed by their keys and values or elements,
+    where object keys are written with write_key() and all other values
+    with write(). The number of keys/elements must match the headers.
+    """
+
+    def __init__(self):
+        """
+        Construct a BinaryEncoder object with nothing written.
+        """
+        self._string_ids = {}
+        self._strings = []
+        self._body = bytearray()
+
+    def _get_string_id(self, string: str) -> int:
+        string_id = self._string_ids.get(string)
+
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[string] = string_id
+            self._strings.append(string)
+
+        return string_id
+
+    def begin_object(self, count: int):
+        """
+        Write the header of an object.
+
+        :param int count: The number of keys of the object.
+        """
+        self._body.append(TAG_OBJECT)
+        _write_varint(self._body, count)
+
+    def begin_array(self, count: int):
+        """
+        Write the header of an array.
+
+        :param int count: The number of elements of the array.
+        """
+        self._body.append(TAG_ARRAY)
+        _write_varint(self._body, count)
+
+    def write_key(self, key: str):
+        """
+        Write an object key, which should be followed by its value.
+
+        :param str key: The key.
+        """
+        _write_varint(self._body, self._get_string_id(key))
+
+    def write(self, obj):
+        """
+        Write a JSON-compatible object (e.g. returned by json.loads()).
+
+        :param obj: A JSON-compatible object.
+        :raises ValueError: When the object is not JSON-compatible.
+        """
+        body = self._body
+
+        # Object keys are pushed to the stack as one-element tuples, which
+        # never appear in JSON-compatible objects.
+        stack = [obj]
+
+        while len(stack) > 0:
+            item = stack.pop()
+
+            if item is None:
+                body.append(TAG_NULL)
+            elif item is False:
+                body.append(TAG_FALSE)
+            elif item is True:
+                body.append(TAG_TRUE)
+            elif isinstance(item, int):
+                body.append(TAG_INT)
+                _write_varint(body, _zigzag(item))
+            elif isinstance(item, float):
+                body.append(TAG_FLOAT)
+                body += struct.pack('<d', item)
+            elif isinstance(item, str):
+                body.append(TAG_STRING)
+                _write_varint(body, self._get_string_id(item))
+            elif isinstance(item, tuple):
+                _write_varint(body, self._get_string_id(item[0]))
+            elif isinstance(item, list):
+                if len(item) > 0 and all(type(x) is int for x in item):
+                    body.append(TAG_INT_ARRAY)
+                    _write_varint(body, len(item))
+
+                    for x in item:
+                        _write_varint(body, _zigzag(x))
+                else:
+                    body.append(TAG_ARRAY)
+                    _write_varint(body, len(item))
+                    stack.extend(reversed(item))
+            elif isinstance(item, dict):
+                body.append(TAG_OBJECT)
+                _write_varint(body, len(item))
+
+                for k, v in reversed(list(item.items())):
+                    if not isinstance(k, str):
+                        raise ValueError(f'Object keys must be strings, '
+                                         f'got {type(k).__name__}!')
+
+                    stack.append(v)
+                    stack.append((k,))
+            else:
+                raise ValueError(f'{type(item).__name__} cannot be encoded '
+                                 'in the binary wire format!')
+
+    def to_bytes(self) -> bytes:
+        """
+        Get the encoded payload of everything written so far.
+        """
+        result = bytearray(BINARY_MAGIC)
+        _write_varint(result, len(self._strings))
+
+        for string in self._strings:
+            encoded = string.encode('utf-8', errors='surrogatepass')
+            _write_varint(result, len(encoded))
+            result += encoded
+
+        result += self._body
+
+        return bytes(result)
+
+
+def encode_binary(obj) -> bytes:
+    """
+    Encode a JSON-compatible object (e.g. returned by json.loads())
+    to the binary wire format described at the top of wire.py.
+
+    :param obj: A JSON-compatible object.
+    :raises ValueError: When the object is not JSON-compatible.
+    """
+    encoder = BinaryEncoder()
+    encoder.write(obj)
+    return encoder.to_bytes()
+
+
+def decode_binary(data: bytes):
+    """
+    Decode an object encoded with encode_binary().
+
+    :param bytes data: The encoded object.
+    :raises ValueError: When the data is not in the binary wire format.
+    """
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError('The data is not in the binary wire format!')
+
+    pos = len(BINARY_MAGIC)
+
+    def read_varint():
+        nonlocal pos
+        result = 0
+        shift = 0
+
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+
+            if byte < 0x80:
+                return result
+
+    def read_int():
+        value = read_varint()
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+    strings = []
+
+    for _ in range(read_varint()):
+        length = read_varint()
+        strings.append(data[pos:pos + length].decode(
+            'utf-8', errors='surrogatepass'))
+        pos += length
+
+    # Every stack entry is a [container, number of elements left] list,
+    # where container is the array or object being filled.
+    root = []
+    stack = [[root, 1]]
+
+    try:
+        while len(stack) > 0:
+            top = stack[-1]
+
+            if top[1] == 0:
+                stack.pop()
+                continue
+
+            top[1] -= 1
+
+            if isinstance(top[0], dict):
+                key = strings[read_varint()]
+
+            tag = data[pos]
+            pos += 1
+            container = None
+
+            if tag == TAG_NULL:
+                value = None
+            elif tag == TAG_FALSE:
+                value = False
+            elif tag == TAG_TRUE:
+                value = True
+            elif tag == TAG_INT:
+                value = read_int()
+            elif tag == TAG_FLOAT:
+                value = struct.unpack_from('<d', data, pos)[0]
+                pos += 8
+            elif tag == TAG_STRING:
+                value = strings[read_varint()]
+            elif tag == TAG_INT_ARRAY:
+                value = [read_int() for _ in range(read_varint())]
+            elif tag == TAG_ARRAY:
+                value = []
+                container = value
+            elif tag == TAG_OBJECT:
+                value = {}
+                container = value
+            else:
+                raise ValueError(f'Unknown tag {tag}!')
+
+            if isinstance(top[0], dict):
+                top[0][key] = value
+            else:
+                top[0].append(value)
+
+            if container is not None:
+                stack.append([container, read_varint()])
+    except (IndexError, struct.error):
+        raise ValueError('The binary data is truncated!')
+
+    if pos != len(data):
+        raise ValueError('The binary data has trailing bytes!')
+
+    return root[0]
+
+
+def get_content_encodings() -> list:
+    """
+    Get the list of HTTP content encodings supported by
+    compress_payload(), in the order of preference. zstd is supported
+    only if the "zstandard" package is installed.
+    """
+    if zstandard is None:
+        return ['gzip']
+    else:
+        return ['zstd', 'gzip']
+
+
+def compress_payload(data: bytes, encoding: str) -> bytes:
+    """
+    Compress a response payload with a given HTTP content encoding.
+    The result depends only on the payload and the encoding.
+
+    :param bytes data: The payload to be compressed.
+    :param str encoding: A content encoding returned by
+                         get_content_encodings().
+    :raises ValueError: When the encoding is not supported.
+    """
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    elif encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    else:
+        raise ValueError(f'Unsupported content encoding: {encoding}')
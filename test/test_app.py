@@ -0,0 +1,677 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import gzip
+import json
+import time
+import pytest
+from urllib.parse import urlencode
+from zipfile import ZipFile
+from gunicorn.config import Config
+from gunicorn.http.parser import RequestParser
+from gunicorn.http.errors import LimitRequestLine
+from adaptiveperf import SessionCache, SessionIndex, SharedCache, \
+    RequestMetrics, JobManager, ProfilingResults, SymbolIndex, \
+    decode_binary
+
+
+IDENTIFIER = '2023_12_10_11_13_14_test__test2'
+
+
+@pytest.fixture()
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('FLASK_PROFILING_STORAGE', str(tmp_path))
+
+    try:
+        import adaptiveperf.app as app_module
+    except FileNotFoundError:
+        pytest.skip('The website files have not been set up '
+                    '(run js_setup.sh)')
+
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    processed_path.mkdir(parents=True)
+
+    children = [{'name': f'function_{i}', 'value': 10, 'children': []}
+                for i in range(200)]
+    tree = {'name': 'all', 'value': 2000, 'children': children}
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree]
+    }))
+
+    monkeypatch.setitem(app_module.app.config, 'PROFILING_STORAGE',
+                        str(tmp_path))
+    monkeypatch.setattr(app_module, 'session_cache',
+                        SessionCache(str(tmp_path), 1024 * 1024,
+                                     str(tmp_path / 'cache'),
+                                     1024 * 1024))
+    monkeypatch.setattr(app_module, 'session_index',
+                        SessionIndex(str(tmp_path)))
+    monkeypatch.setattr(app_module, 'request_metrics', RequestMetrics())
+    monkeypatch.setattr(app_module, 'job_manager', JobManager())
+
+    return app_module.app.test_client()
+
+
+def send_like_viewer(client, data, method='GET'):
+    # Send a request in the same way as getSessionData() in viewer.js
+    # does, passing it through the request parser of Gunicorn (with its
+    # default limits) first, as the website is served by Gunicorn.
+    query = urlencode(data)
+
+    if method == 'POST':
+        raw = f'POST /{IDENTIFIER}/ HTTP/1.1\r\nHost: localhost\r\n' \
+            'Content-Type: application/x-www-form-urlencoded\r\n' \
+            f'Content-Length: {len(query)}\r\n\r\n{query}'
+    else:
+        raw = f'GET /{IDENTIFIER}/?{query} HTTP/1.1\r\n' \
+            'Host: localhost\r\n\r\n'
+
+    parsed = next(RequestParser(Config(), iter([raw.encode()]),
+                                ('127.0.0.1', 0)))
+    response = client.open(
+        parsed.uri, method=parsed.method, data=parsed.body.read(),
+        content_type='application/x-www-form-urlencoded',
+        headers={'Accept': 'application/x-adaptiveperf-binary'})
+
+    return response.status_code, decode_binary(response.data) \
+        if response.status_code == 200 else None
+
+
+def test_get_and_post_equivalent(client):
+    query = {'pid': 1, 'tid': 1, 'threshold': 0.001}
+    get_response = client.get(f'/{IDENTIFIER}/', query_string=query)
+    post_response = client.post(f'/{IDENTIFIER}/', data=query)
+
+    assert get_response.status_code == 200
+    assert get_response.data == post_response.data
+    assert get_response.headers['ETag'] == post_response.headers['ETag']
+    assert len(json.loads(get_response.data)['walltime'][0]['children']) \
+        == 200
+
+
+def test_conditional_get(client, tmp_path):
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.001'
+    etag = client.get(url).headers['ETag']
+
+    response = client.get(url, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+    (tmp_path / IDENTIFIER / 'processed' / '1_1.json').write_text(
+        json.dumps({'walltime': [
+            {'name': 'all', 'value': 1, 'children': []},
+            {'name': 'all', 'value': 1, 'children': []}
+        ]}))
+
+    response = client.get(url, headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_compression_and_binary_format(client):
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.001'
+    plain = client.get(url)
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert gzip.decompress(compressed.data) == plain.data
+
+    binary = client.get(url, headers={
+        'Accept': 'application/x-adaptiveperf-binary'
+    })
+
+    assert binary.mimetype == 'application/x-adaptiveperf-binary'
+    assert decode_binary(binary.data) == json.loads(plain.data)
+
+
+def test_binary_flame_graphs(client, tmp_path, monkeypatch):
+    (tmp_path / IDENTIFIER / 'processed' / '1_2.json').write_text(
+        json.dumps({'walltime': [{'name': 'all', 'value': 5, 'children': [
+            {'name': 'outer', 'value': 5, 'children': [
+                {'name': 'inner', 'value': 5, 'children': []}]}]}] * 2}))
+
+    def get(url, binary):
+        response = client.get(f'/{IDENTIFIER}/?{url}', headers={
+            'Accept': 'application/x-adaptiveperf-binary'
+        } if binary else {})
+        return decode_binary(response.data) if binary else \
+            json.loads(response.data)
+
+    urls = ['pid=1&tid=1&threshold=0.001',
+            'pid=1&tid=2&threshold=0&depth=1',
+            'merged=all&threshold=0&depth=1',
+            'diff=1_1&baseline=all&threshold=0']
+    expected = [get(url, False) for url in urls]
+    stub_id = expected[1]['walltime'][0]['children'][0]['stub_id']
+    urls.append(f'pid=1&tid=2&threshold=0&depth=1&node={stub_id}')
+    expected.append(get(urls[-1], False))
+
+    # Flame graphs must be encoded directly rather than converted
+    # from JSON.
+    monkeypatch.setattr(ProfilingResults, 'get_binary', None)
+
+    for url, value in zip(urls, expected):
+        assert get(url, True) == value
+
+
+def test_conditional_get_without_loading(client, monkeypatch):
+    import adaptiveperf.app as app_module
+
+    urls = [f'/{IDENTIFIER}/?merged=all&threshold=0',
+            f'/{IDENTIFIER}/?diff=1_1&baseline=all&threshold=0',
+            f'/{IDENTIFIER}/?hot=all']
+    etags = [client.get(url).headers['ETag'] for url in urls]
+
+    app_module.session_cache.clear()
+    monkeypatch.setattr(ProfilingResults, '__init__', None)
+
+    for url, etag in zip(urls, etags):
+        assert client.get(url, headers={'If-None-Match': etag}) \
+            .status_code == 304
+
+
+def test_bad_requests(client):
+    assert client.get(f'/{IDENTIFIER}/').status_code == 400
+    assert client.get(f'/{IDENTIFIER}/?pid=1&tid=2&threshold=0.1') \
+        .status_code == 404
+    assert client.get('/wrong/?tree=1').status_code == 404
+
+
+def test_sessions(client, tmp_path):
+    (tmp_path / '2024_01_01_00_00_00_host__test').mkdir()
+
+    result = client.get('/sessions?limit=1').get_json()
+
+    assert result['total'] == 2
+    assert result['sessions'] == [{
+        'id': '2024_01_01_00_00_00_host__test',
+        'label': '0',
+        'text': '0: [host] test (2024-01-01 00:00:00)'
+    }]
+    assert result['executors'] == ['host', 'test']
+
+    result = client.get('/sessions?executor=test&from=2023-12-10').get_json()
+
+    assert [x['id'] for x in result['sessions']] == [IDENTIFIER]
+    assert client.get('/sessions?from=yesterday').status_code == 400
+
+
+def test_off_cpu_regions(client, tmp_path):
+    (tmp_path / IDENTIFIER / 'processed' / 'metadata.json').write_text(
+        json.dumps({
+            'start_time': 1000000,
+            'offcpu_regions': {
+                '1_1': [[1000000, 1000000], [2500000, 1000000],
+                        [10000000, 2000000]]
+            }
+        }))
+
+    url = f'/{IDENTIFIER}/?off_cpu_regions=1_1,1_2&start=0&end=20'
+    response = client.get(url + '&resolution=0')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        '1_1': [[0, 1, 1], [1.5, 1, 1], [9, 2, 2]],
+        '1_2': []
+    }
+
+    response = client.get(url + '&resolution=1')
+
+    assert json.loads(response.data) == {
+        '1_1': [[0, 2.5, 2], [9, 2, 2]],
+        '1_2': []
+    }
+
+    assert client.get(url).status_code == 400
+    assert client.get(url + '&resolution=-1').status_code == 404
+
+
+def test_off_cpu_regions_full_batch(client, tmp_path):
+    ids = [f'{4194000 + i}_{4194000 + i}' for i in range(200)]
+
+    (tmp_path / IDENTIFIER / 'processed' / 'metadata.json').write_text(
+        json.dumps({
+            'start_time': 1000000,
+            'offcpu_regions': {x: [[2000000, 1000000]] for x in ids}
+        }))
+
+    # This is the largest batch sent by loadOffCpuRegions() in viewer.js.
+    status, result = send_like_viewer(client, {
+        'off_cpu_regions': ','.join(ids),
+        'start': 0.5,
+        'end': 123456.78125,
+        'resolution': 0.0009765625
+    }, 'POST')
+
+    assert status == 200
+    assert result == {x: [[1, 1, 1]] for x in ids}
+
+
+def test_skeleton_tree_and_details(client, tmp_path):
+    (tmp_path / IDENTIFIER / 'processed' / 'metadata.json').write_text(
+        json.dumps({
+            'thread_tree': [
+                {'tag': ['a.out', '1/1', 0, 1000000], 'identifier': '1_1'},
+                {'tag': ['a.out', '1/2', 10, 500000], 'identifier': '1_2',
+                 'parent': '1_1'}
+            ],
+            'offcpu_regions': {'1_2': [[1000000, 1000000]]},
+            'sampled_times': {},
+            'callchains': {'2': [['x', '0x1']]},
+            'start_time': 0
+        }))
+
+    full = json.loads(client.get(f'/{IDENTIFIER}/?tree=1').data)
+    skeleton = json.loads(
+        client.get(f'/{IDENTIFIER}/?tree=skeleton').data)
+    child = skeleton['children'][0]
+
+    assert skeleton['metrics'] == full['metrics']
+    assert set(skeleton) == set(full) - {'start_callchain', 'off_cpu',
+                                         'src', 'src_index'}
+    assert set(child) == set(full['children'][0]) - {
+        'start_callchain', 'off_cpu', 'metrics'}
+
+    response = client.get(f'/{IDENTIFIER}/?details=1_1,1_2')
+
+    assert json.loads(response.data) == {
+        '1_1': {'start_callchain': [], 'off_cpu': []},
+        '1_2': {'start_callchain': [['x', '0x1']], 'off_cpu': [[1, 1]]}
+    }
+
+    response = client.get(f'/{IDENTIFIER}/?details=1_2&lod=1')
+
+    assert json.loads(response.data) == {
+        '1_2': {'start_callchain': [['x', '0x1']]}
+    }
+
+    response = client.get(f'/{IDENTIFIER}/?src_map=1')
+
+    assert json.loads(response.data) == {'src': {}, 'src_index': {}}
+
+
+def test_details_full_batch(client, tmp_path):
+    ids = [f'{4194000 + i}_{4194000 + i}' for i in range(200)]
+
+    (tmp_path / IDENTIFIER / 'processed' / 'metadata.json').write_text(
+        json.dumps({
+            'thread_tree': [
+                {'tag': ['a.out', x.replace('_', '/'), 0, 1000000],
+                 'identifier': x} for x in ids
+            ],
+            'offcpu_regions': {},
+            'sampled_times': {},
+            'callchains': {},
+            'start_time': 0
+        }))
+
+    # This is the largest batch sent by loadThreadDetails() in viewer.js.
+    data = {'details': ','.join(ids), 'lod': 'true'}
+    status, result = send_like_viewer(client, data, 'POST')
+
+    assert status == 200
+    assert result == {x: {'start_callchain': []} for x in ids}
+
+
+def test_symbols(client, tmp_path):
+    (tmp_path / IDENTIFIER / 'processed' / 'perf-1.map').write_text(
+        '10 10 first\n')
+
+    response = client.get(f'/{IDENTIFIER}/?symbols=perf-1.map:0x15,'
+                          'perf-1.map:0x25')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'perf-1.map:0x15': 'first',
+                                         'perf-1.map:0x25': None}
+    assert client.get(f'/{IDENTIFIER}/?symbols=perf-1.map:xyz') \
+        .status_code == 404
+
+
+def test_symbols_full_batch(client, tmp_path):
+    (tmp_path / IDENTIFIER / 'processed' / 'perf-123456.map').write_text(
+        '7f0a00000000 100000 first\n')
+
+    # This is the largest batch sent by resolveSymbols() in viewer.js.
+    symbols = [f'perf-123456.map:{hex(0x7f0a00000000 + i * 0x100)}'
+               for i in range(200)]
+    data = {'symbols': ','.join(symbols)}
+
+    with pytest.raises(LimitRequestLine):
+        send_like_viewer(client, data)
+
+    status, result = send_like_viewer(client, data, 'POST')
+
+    assert status == 200
+    assert result == {x: 'first' for x in symbols}
+
+
+def test_source_code_lines(client, tmp_path):
+    with ZipFile(tmp_path / IDENTIFIER / 'processed' / 'src.zip',
+                 mode='w') as zip:
+        zip.writestr('1', 'a\nb\nc\n')
+
+    response = client.get(f'/{IDENTIFIER}/?src=1')
+
+    assert response.mimetype == 'text/plain'
+    assert response.data == b'a\nb\nc\n'
+
+    response = client.get(f'/{IDENTIFIER}/?src=1&lines=2-2')
+
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.data) == {
+        'first': 2, 'last': 2, 'line_count': 3, 'code': 'b\n',
+        'line_offsets': [0]
+    }
+    assert client.get(f'/{IDENTIFIER}/?src=1&lines=2').status_code == 404
+    assert client.get(f'/{IDENTIFIER}/?src=2&lines=1-2').status_code == 404
+
+
+def test_metrics(client):
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.001'
+    response = client.get(url)
+    phases = [x.split(';')[0] for x in
+              response.headers['Server-Timing'].split(', ')]
+
+    assert phases == ['parse', 'compute', 'serialize']
+
+    response = client.get(url, headers={'If-None-Match':
+                                        response.headers['ETag']})
+
+    assert response.status_code == 304
+    assert response.headers['Server-Timing'].startswith('parse;dur=')
+
+    client.get(f'/{IDENTIFIER}/?pid=1')
+    client.get('/sessions')
+
+    response = client.get('/metrics')
+    lines = response.data.decode().splitlines()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'adaptiveperf_requests_total{endpoint="flame_graph",' \
+        'status="200"} 1' in lines
+    assert 'adaptiveperf_requests_total{endpoint="flame_graph",' \
+        'status="304"} 1' in lines
+    assert 'adaptiveperf_requests_total{endpoint="invalid",' \
+        'status="400"} 1' in lines
+    assert 'adaptiveperf_requests_total{endpoint="sessions",' \
+        'status="200"} 1' in lines
+    assert 'adaptiveperf_request_phase_duration_seconds_count{' \
+        'endpoint="flame_graph",phase="compute"} 1' in lines
+    assert 'adaptiveperf_response_size_bytes_count{' \
+        'endpoint="flame_graph"} 2' in lines
+    assert 'adaptiveperf_session_cache_misses_total 1' in lines
+    assert 'adaptiveperf_coalesced_computations_total 0' in lines
+
+
+def test_shared_cache(client, tmp_path, monkeypatch):
+    import adaptiveperf.app as app_module
+
+    monkeypatch.setattr(app_module, 'shared_cache',
+                        SharedCache(tmp_path / 'shared.sqlite3',
+                                    1024 * 1024))
+
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.001'
+    responses = []
+
+    for _ in range(2):
+        responses.append(client.get(url, headers={'Accept-Encoding':
+                                                  'gzip'}))
+        responses.append(client.get(url))
+
+    # The second round is served without loading the session.
+    assert app_module.session_cache.hits + \
+        app_module.session_cache.misses == 2
+    assert responses[2].data == responses[0].data
+    assert responses[2].headers['Content-Encoding'] == 'gzip'
+    assert responses[2].headers['ETag'] == responses[0].headers['ETag']
+    assert responses[3].data == responses[1].data
+    assert 'Content-Encoding' not in responses[3].headers
+    assert responses[3].mimetype == 'application/json'
+
+
+def test_async(client, tmp_path, monkeypatch):
+    import adaptiveperf.app as app_module
+
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.001'
+    expected = client.get(url)
+    response = client.get(url + '&async=1')
+
+    assert response.status_code == 200
+    assert response.data == expected.data
+    assert response.headers['ETag'] == expected.headers['ETag']
+
+    original = ProfilingResults.get_flame_graph
+
+    def slow_get_flame_graph(*args):
+        time.sleep(0.5)
+        return original(*args)
+
+    monkeypatch.setattr(ProfilingResults, 'get_flame_graph',
+                        slow_get_flame_graph)
+    monkeypatch.setattr(app_module, 'async_wait', 0)
+
+    url = f'/{IDENTIFIER}/?pid=1&tid=1&threshold=0.002&async=1'
+    response = client.get(url)
+    status = json.loads(response.data)
+
+    assert response.status_code == 202
+    assert status['state'] == 'running'
+    assert response.headers['Location'] == f'/jobs/{status["job"]}'
+    assert 'ETag' not in response.headers
+
+    for _ in range(50):
+        status = json.loads(client.get(f'/jobs/{status["job"]}').data)
+
+        if status['state'] != 'running':
+            break
+
+        time.sleep(0.1)
+
+    assert status['state'] == 'done'
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.data == expected.data
+    assert client.get('/jobs/unknown').status_code == 404
+
+    response = client.get(f'/{IDENTIFIER}/?pid=1&tid=2&threshold=0.1&'
+                          'async=1')
+
+    assert response.status_code == 202
+
+    location = response.headers['Location']
+
+    for _ in range(50):
+        if json.loads(client.get(location).data)['state'] != 'running':
+            break
+
+        time.sleep(0.1)
+
+    assert client.get(f'/{IDENTIFIER}/?pid=1&tid=2&threshold=0.1&'
+                      'async=1').status_code == 404
+
+
+def test_merged_flame_graphs(client, tmp_path):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+
+    for pid_tid, name in [('1_2', 'function_0'), ('2_3', 'other')]:
+        (processed_path / f'{pid_tid}.json').write_text(json.dumps({
+            'walltime': [{'name': 'all', 'value': 5, 'children': [
+                {'name': name, 'value': 5, 'children': [
+                    {'name': 'inner', 'value': 5, 'children': []}]}]}] * 2
+        }))
+
+    def get(url):
+        response = client.get(f'/{IDENTIFIER}/?threshold=0&{url}')
+        return response.status_code, json.loads(response.data) \
+            if response.status_code == 200 else None
+
+    status, process = get('merged=1')
+    _, session = get('merged=all')
+    _, truncated = get('merged=all&depth=1')
+    stub_id = truncated['walltime'][0]['children'][0]['stub_id']
+    _, subtree = get(f'merged=all&depth=1&node={stub_id}')
+
+    assert status == 200
+    assert process['walltime'][1] is None
+    assert process['walltime'][0]['value'] == 2005
+    assert process['walltime'][0]['children'][0] == \
+        {'name': 'function_0', 'value': 15, 'children': [
+            {'name': 'inner', 'value': 5, 'children': []}]}
+    assert session['walltime'][0]['value'] == 2010
+    assert session['walltime'][0]['children'][-1]['name'] == 'other'
+    assert subtree == session['walltime'][0]['children'][0]
+    assert get('merged=9')[0] == 404
+
+
+def test_differential_flame_graphs(client, tmp_path):
+    baseline_identifier = '2023_12_09_11_13_14_test__test2'
+    processed_path = tmp_path / baseline_identifier / 'processed'
+    processed_path.mkdir(parents=True)
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [{'name': 'all', 'value': 30, 'children': [
+            {'name': 'function_0', 'value': 20, 'children': []},
+            {'name': 'removed', 'value': 10, 'children': []}
+        ]}] * 2
+    }))
+
+    def get(url):
+        response = client.get(f'/{IDENTIFIER}/?threshold=0&{url}')
+        return response.status_code, json.loads(response.data) \
+            if response.status_code == 200 else None
+
+    status, diff = get('diff=1_1&baseline=1_1&'
+                       f'baseline_session={baseline_identifier}')
+    root = diff['walltime'][0]
+    children = {x['name']: x for x in root['children']}
+
+    assert status == 200
+    assert diff['walltime'][1] is None
+    assert (root['value'], root['baseline'], root['delta']) == \
+        (2000, 30, 1970)
+    assert children['function_0'] == {'name': 'function_0', 'value': 10,
+                                      'baseline': 20, 'delta': -10,
+                                      'children': []}
+    assert children['removed']['delta'] == -10
+    assert children['function_1']['delta'] == 10
+
+    _, same = get('diff=1_1&baseline=all')
+
+    assert all(x['delta'] == 0 for x in same['walltime'][0]['children'])
+    assert get('diff=1_1&baseline=1_1&baseline_session='
+               '2020_01_01_00_00_00_missing__test')[0] == 404
+    assert get('diff=1_1&baseline=1_1&baseline_session=..')[0] == 404
+
+    # Sessions outside the results directory must not be reachable.
+    outside_path = tmp_path.parent / f'{tmp_path.name}_outside'
+    (outside_path / 'processed').mkdir(parents=True)
+    (outside_path / 'processed' / 'metadata.json').write_text('{}')
+    (outside_path / 'processed' / '1_1.json').write_text(
+        (processed_path / '1_1.json').read_text())
+
+    assert get('diff=1_1&baseline=1_1&baseline_session='
+               f'{IDENTIFIER}/../../{outside_path.name}')[0] == 404
+    assert get('diff=1_1&baseline=x')[0] == 404
+    assert get('diff=1_1&baseline=1_2')[0] == 404
+
+
+def test_symbol_search(client, tmp_path):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    (processed_path / 'walltime_callchains.json').write_text(json.dumps({
+        'function_1': ['malloc', '/lib/libc.so']
+    }))
+
+    def get(url):
+        response = client.get(f'/{IDENTIFIER}/?{url}')
+        return response.status_code, json.loads(response.data) \
+            if response.status_code == 200 else None
+
+    status, result = get('search=MALLOC')
+
+    assert status == 200
+    assert result == {'count': 1, 'symbols': [
+        {'symbol': 'malloc', 'occurrences': [
+            {'thread': '1_1', 'metric': 'walltime', 'total': 10,
+             'self': 10}]}]}
+    assert get('search=function_1&exact=1')[1]['count'] == 0
+    assert get('search=function_&limit=5')[1]['count'] == 199
+    assert len(get('search=function_&limit=5')[1]['symbols']) == 5
+    assert get('search=function&limit=0')[0] == 404
+
+    # The session is reloaded when a thread/process is added to it.
+    etag = client.get(f'/{IDENTIFIER}/?search=brand_new').headers['ETag']
+    (processed_path / '1_3.json').write_text(json.dumps({
+        'walltime': [{'name': 'all', 'value': 5, 'children': [
+            {'name': 'brand_new', 'value': 5, 'children': []}]}] * 2
+    }))
+    stat = processed_path.stat()
+    os.utime(processed_path, ns=(stat.st_atime_ns,
+                                 stat.st_mtime_ns + 1000000000))
+    response = client.get(f'/{IDENTIFIER}/?search=brand_new')
+
+    assert response.headers['ETag'] != etag
+    assert json.loads(response.data)['count'] == 1
+
+
+def test_hot_functions(client, tmp_path):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    (processed_path / '1_2.json').write_text(json.dumps({
+        'walltime': [{'name': 'all', 'value': 30, 'children': [
+            {'name': 'function_7', 'value': 30, 'children': [
+                {'name': 'function_8', 'value': 20, 'children': []}]}]}] * 2
+    }))
+
+    def get(url):
+        response = client.get(f'/{IDENTIFIER}/?{url}')
+        return response.status_code, json.loads(response.data) \
+            if response.status_code == 200 else None
+
+    status, session = get('hot=all&limit=3')
+    _, process = get('hot=1&sort=total&limit=2')
+    _, thread = get('hot=1_2&offset=1')
+    _, page = get('hot=all&offset=199')
+
+    assert status == 200
+    assert session == {'total': 2030, 'count': 200, 'functions': [
+        {'symbol': 'function_8', 'total': 30, 'self': 30},
+        {'symbol': 'function_7', 'total': 40, 'self': 20},
+        {'symbol': 'function_0', 'total': 10, 'self': 10}]}
+    assert process['functions'] == [
+        {'symbol': 'function_7', 'total': 40, 'self': 20},
+        {'symbol': 'function_8', 'total': 30, 'self': 30}]
+    assert thread == {'total': 30, 'count': 2, 'functions': [
+        {'symbol': 'function_7', 'total': 30, 'self': 10}]}
+    assert [x['symbol'] for x in page['functions']] == ['function_99']
+    assert get('hot=1&metric=cache-misses')[0] == 404
+    assert get('hot=9_9')[0] == 404
+    assert get('hot=1&sort=name')[0] == 404
+    assert get('hot=invalid')[0] == 404
+
+
+def test_hot_functions_memoized(client, monkeypatch):
+    calls = []
+    aggregate = SymbolIndex.aggregate
+
+    def counting_aggregate(self, *args):
+        calls.append(args)
+        return aggregate(self, *args)
+
+    monkeypatch.setattr(SymbolIndex, 'aggregate', counting_aggregate)
+
+    # The table of every scope, metric and sort value is computed once,
+    # whichever pages are requested and in which order.
+    for url in ['hot=all', 'hot=1_1', 'hot=all&offset=50', 'hot=1_1',
+                'hot=all&sort=total', 'hot=all&limit=10']:
+        assert client.get(f'/{IDENTIFIER}/?{url}').status_code == 200
+
+    assert len(calls) == 3
@@ -0,0 +1,210 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import json
+from adaptiveperf import DiskCache, CacheStatistics, ProfilingResults
+
+
+def test_get_put(tmp_path):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+
+    cache = DiskCache(tmp_path / 'cache', 1024)
+
+    assert cache.get(('test', 1), [source]) is None
+
+    cache.put(('test', 1), [source], 'payload')
+
+    assert cache.get(('test', 1), [source]) == 'payload'
+    assert cache.get(('test', 2), [source]) is None
+
+    cache.put(('test', 3), [source], b'\x00\xffpayload')
+
+    assert cache.get(('test', 3), [source], binary=True) == \
+        b'\x00\xffpayload'
+    assert cache.get_path(('test', 3), [source]).read_bytes() == \
+        b'\x00\xffpayload'
+    assert cache.get_path(('test', 4), [source]) is None
+
+
+def test_statistics(tmp_path):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+
+    statistics = CacheStatistics()
+    cache = DiskCache(tmp_path / 'cache', 1024, statistics)
+
+    cache.get(('test',), [source])
+    cache.put(('test',), [source], 'payload')
+    cache.get(('test',), [source])
+    cache.get_path(('test',), [source])
+    cache.get_path(('other',), [source])
+
+    assert statistics.hits == 2
+    assert statistics.misses == 2
+
+
+def test_source_change(tmp_path):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+
+    cache = DiskCache(tmp_path / 'cache', 1024)
+    cache.put(('test',), [source], 'payload')
+
+    source.write_text('{"a": 1}')
+
+    assert cache.get(('test',), [source]) is None
+
+
+def test_eviction(tmp_path):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+
+    cache = DiskCache(tmp_path / 'cache', 25)
+
+    for i in range(3):
+        cache.put(('test', i), [source], 'x' * 10)
+
+        # Make sure that the modification times of entries differ
+        for entry in (tmp_path / 'cache').iterdir():
+            stat = entry.stat()
+            os.utime(entry, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns - 1000000000))
+
+    assert cache.get(('test', 0), [source]) is None
+    assert cache.get(('test', 1), [source]) == 'x' * 10
+    assert cache.get(('test', 2), [source]) == 'x' * 10
+
+
+def test_eviction_scans_only_over_limit(tmp_path, mocker):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+
+    cache = DiskCache(tmp_path / 'cache', 25)
+    cache.put(('test', 0), [source], 'x' * 10)
+
+    scandir = mocker.spy(os, 'scandir')
+    cache.put(('test', 1), [source], 'x' * 10)
+    cache.put(('test', 1), [source], 'y' * 10)
+
+    assert scandir.call_count == 0
+
+    # Another cache object (e.g. in another process) sees the same
+    # total size.
+    DiskCache(tmp_path / 'cache', 25).put(('test', 2), [source], 'x' * 10)
+
+    assert scandir.call_count == 1
+    assert sum(cache.get(('test', i), [source]) is not None
+               for i in range(3)) == 2
+
+
+def test_flame_graph_cached(tmp_path, mocker):
+    identifier = '2023_12_10_11_13_14_test__test2'
+    processed_path = tmp_path / identifier / 'processed'
+    processed_path.mkdir(parents=True)
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [
+            {'name': 'all', 'value': 10, 'children': []},
+            {'name': 'all', 'value': 10, 'children': []}
+        ]
+    }))
+
+    cache = DiskCache(tmp_path / 'cache', 1024 * 1024)
+    results = ProfilingResults(str(tmp_path), identifier, cache)
+
+    expected = results.get_flame_graph(1, 1, 0.1)
+
+    load = mocker.patch('adaptiveperf.results.read_flame_graphs')
+
+    assert results.get_flame_graph(1, 1, 0.1) == expected
+    load.assert_not_called()
+
+
+def test_flame_graph_threshold_interval_cached(tmp_path, mocker):
+    identifier = '2023_12_10_11_13_14_test__test2'
+    processed_path = tmp_path / identifier / 'processed'
+    processed_path.mkdir(parents=True)
+
+    tree = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'a', 'value': 6, 'children': []},
+        {'name': 'b', 'value': 3, 'children': []}
+    ]}
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree]
+    }))
+
+    cache = DiskCache(tmp_path / 'cache', 1024 * 1024)
+    results = ProfilingResults(str(tmp_path), identifier, cache)
+
+    expected = results.get_flame_graph(1, 1, 0.2)
+
+    load = mocker.patch('adaptiveperf.results.read_flame_graphs')
+
+    assert results.get_flame_graph(1, 1, 0.25) == expected
+    load.assert_not_called()
+
+
+def test_flame_graph_threshold_interval_in_memory(tmp_path, mocker):
+    identifier = '2023_12_10_11_13_14_test__test2'
+    processed_path = tmp_path / identifier / 'processed'
+    processed_path.mkdir(parents=True)
+
+    tree = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'a', 'value': 6, 'children': []},
+        {'name': 'b', 'value': 3, 'children': []}
+    ]}
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree]
+    }))
+
+    # The threshold intervals are used without the on-disk cache too.
+    results = ProfilingResults(str(tmp_path), identifier)
+    expected = results.get_flame_graph(1, 1, 0.2)
+
+    load = mocker.patch('adaptiveperf.results.read_flame_graphs')
+
+    assert results.get_flame_graph(1, 1, 0.25) == expected
+    assert json.loads(results.get_flame_graph(1, 1, 0.1, 1)) == \
+        json.loads(results.get_flame_graph(1, 1, 0.2, 1))
+    load.assert_not_called()
+
+
+def test_flame_graph_subtree(tmp_path):
+    identifier = '2023_12_10_11_13_14_test__test2'
+    processed_path = tmp_path / identifier / 'processed'
+    processed_path.mkdir(parents=True)
+
+    tree = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'a', 'value': 6, 'children': [
+            {'name': 'c', 'value': 6, 'children': []}
+        ]},
+        {'name': 'b', 'value': 3, 'children': []}
+    ]}
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree]
+    }))
+
+    cache = DiskCache(tmp_path / 'cache', 1024 * 1024)
+    results = ProfilingResults(str(tmp_path), identifier, cache)
+
+    truncated = json.loads(results.get_flame_graph(1, 1, 0.2, 1))
+
+    assert truncated['walltime'][0]['children'][0] == \
+        {'name': 'a', 'value': 6, 'children': [],
+         'stub_id': 'walltime:0:1'}
+    assert truncated['walltime'][1]['children'][1] == \
+        {'name': 'b', 'value': 3, 'children': []}
+
+    assert json.loads(results.get_flame_graph_subtree(
+        1, 1, 0.2, 'walltime:0:1')) == tree['children'][0]
+    assert results.get_flame_graph_subtree(1, 1, 0.2, 'walltime:0:10') is None
+    assert results.get_flame_graph_subtree(1, 1, 0.2, 'other:0:1') is None
@@ -0,0 +1,465 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import io
+import copy
+import json
+import random
+import pytest
+from collections import deque
+from adaptiveperf import FlameGraph, ThresholdIndex, TimeIndex, \
+    BinaryEncoder, read_flame_graphs, merge_flame_graphs, \
+    diff_flame_graphs, decode_binary
+
+
+def reference_compress(v, compress_threshold):
+    # This is the compression code of ProfilingResults.get_flame_graph()
+    # before FlameGraph.compress() was introduced.
+    compressed_blocks_lists = [[], []]
+    queue = deque([(v[0], v[0]['value'], False, False,
+                    compressed_blocks_lists[0]),
+                   (v[1], v[1]['value'], True, False,
+                    compressed_blocks_lists[1])])
+
+    while len(queue) > 0:
+        result, total, time_ordered, parent_is_compressed, \
+            compressed_blocks = queue.pop()
+
+        children = result['children']
+        new_children = []
+        compressed_value = 0
+        hidden_children = []
+        compressed_children = set()
+
+        for i, child in enumerate(children):
+            if child['value'] < compress_threshold * total:
+                compressed_children.add(i)
+            else:
+                queue.append((child, total, time_ordered, False,
+                              compressed_blocks))
+
+        for i, child in enumerate(children):
+            if time_ordered:
+                if i in compressed_children:
+                    compressed_value += child['value']
+                    hidden_children.append(child)
+                else:
+                    if compressed_value > 0:
+                        if compressed_value == total \
+                           and parent_is_compressed:
+                            new_children += hidden_children
+                        else:
+                            new_child = {
+                                'name': '(compressed)',
+                                'value': compressed_value,
+                                'children': hidden_children,
+                                'compressed_id': len(compressed_blocks)
+                            }
+
+                            queue.append((new_child,
+                                          compressed_value,
+                                          time_ordered,
+                                          True,
+                                          compressed_blocks))
+
+                            compressed_blocks.append(new_child)
+                            new_children.append(new_child)
+
+                        compressed_value = 0
+                        hidden_children = []
+
+                    new_children.append(child)
+            else:
+                if i in compressed_children:
+                    compressed_value += child['value']
+                    hidden_children.append(child)
+                else:
+                    new_children.append(child)
+
+        if compressed_value > 0:
+            if len(hidden_children) == 1 and \
+               len(hidden_children[0]['children']) == 0:
+                new_children += hidden_children
+            elif compressed_value == total and parent_is_compressed:
+                if len(hidden_children) > 1:
+                    part1_cnt = len(hidden_children) // 2
+
+                    compressed_value_part1 = 0
+                    for i in range(part1_cnt):
+                        compressed_value_part1 += \
+                            hidden_children[i]['value']
+
+                    compressed_value_part2 = compressed_value - \
+                        compressed_value_part1
+
+                    new_child1 = {
+                        'name': '(compressed)',
+                        'value': compressed_value_part1,
+                        'children': hidden_children[:part1_cnt],
+                        'compressed_id': len(compressed_blocks)
+                    }
+
+                    new_child2 = {
+                        'name': '(compressed)',
+                        'value': compressed_value_part2,
+                        'children': hidden_children[part1_cnt:],
+                        'compressed_id': len(compressed_blocks) + 1
+                    }
+
+                    queue.append((new_child1, compressed_value_part1,
+                                  time_ordered, True,
+                                  compressed_blocks))
+                    queue.append((new_child2, compressed_value_part2,
+                                  time_ordered, True,
+                                  compressed_blocks))
+
+                    compressed_blocks.append(new_child1)
+                    compressed_blocks.append(new_child2)
+
+                    new_children.append(new_child1)
+                    new_children.append(new_child2)
+                else:
+                    new_children += hidden_children
+            else:
+                new_child = {
+                    'name': '(compressed)',
+                    'value': compressed_value,
+                    'children': hidden_children,
+                    'compressed_id': len(compressed_blocks)
+                }
+
+                queue.append((new_child, compressed_value,
+                              time_ordered, True,
+                              compressed_blocks))
+
+                compressed_blocks.append(new_child)
+                new_children.append(new_child)
+
+        if 'compressed_id' in result:
+            result['children'] = []
+            result['hidden_children'] = new_children
+        else:
+            result['children'] = new_children
+
+    for compressed_blocks in compressed_blocks_lists:
+        deleted_block_ids = set()
+        for block in compressed_blocks:
+            if block['compressed_id'] in deleted_block_ids:
+                continue
+
+            while (len(block['hidden_children']) == 1 and
+                   'hidden_children' in block['hidden_children'][0]):
+                deleted_block_ids.add(
+                    block['hidden_children'][0]['compressed_id'])
+                block['hidden_children'] = \
+                    block['hidden_children'][0]['hidden_children']
+
+    return v
+
+
+def random_tree(rng, depth):
+    children = []
+
+    if depth > 0:
+        for _ in range(rng.randint(0, 6)):
+            children.append(random_tree(rng, depth - 1))
+
+    value = sum(c['value'] for c in children) + rng.choice(
+        [0, 0, 1, 5, 50, 1000])
+
+    node = {'name': f'f{rng.randint(0, 20)}', 'value': value,
+            'children': children}
+
+    if rng.random() < 0.1:
+        node['cold'] = True
+
+    return node
+
+
+def compress(v, compress_threshold):
+    graph1 = FlameGraph.from_dict(v[0]).compress(compress_threshold, False)
+    graph2 = FlameGraph.from_dict(v[1]).compress(compress_threshold, True)
+    return [json.loads(graph1.to_json()), json.loads(graph2.to_json())], \
+        max(graph1.lo, graph2.lo), min(graph1.hi, graph2.hi)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_reference(seed):
+    rng = random.Random(seed)
+    v = [random_tree(rng, 4), random_tree(rng, 4)]
+
+    for threshold in [0, 0.001, 0.01, 0.025, 0.1, 0.3, 0.5, 1]:
+        expected = reference_compress(copy.deepcopy(v), threshold)
+        result, _, _ = compress(v, threshold)
+
+        assert json.dumps(result) == json.dumps(expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_threshold_interval(seed):
+    rng = random.Random(seed)
+    v = [random_tree(rng, 4), random_tree(rng, 4)]
+
+    for threshold in [0.001, 0.01, 0.025, 0.1, 0.3]:
+        result, lo, hi = compress(v, threshold)
+
+        if lo >= hi:
+            continue
+
+        for other in [hi, lo + (hi - lo) / 2,
+                      max(lo, threshold - 1e-6) + 1e-12]:
+            if lo < other <= hi:
+                assert json.dumps(compress(v, other)[0]) == \
+                    json.dumps(result)
+
+
+def test_threshold_index():
+    index = ThresholdIndex([(0.1, 0.2), (0.3, 0.4)])
+
+    assert index.find(0.1) is None
+    assert index.find(0.15) == (0.1, 0.2)
+    assert index.find(0.2) == (0.1, 0.2)
+    assert index.find(0.25) is None
+    assert index.find(0.4) == (0.3, 0.4)
+
+    index.add(0.15, 0.25)
+    index.add(0.2, 0.3)
+
+    assert len(index) == 3
+    assert index.find(0.25) == (0.2, 0.3)
+    assert index.get_intervals() == [(0.1, 0.2), (0.2, 0.3), (0.3, 0.4)]
+    assert ThresholdIndex.from_json(index.to_json()).find(0.35) == \
+        (0.3, 0.4)
+
+
+def expand_stubs(tree, get_subtree):
+    stack = [tree]
+
+    while len(stack) > 0:
+        node = stack.pop()
+
+        if 'stub_id' in node:
+            subtree = get_subtree(node['stub_id'])
+            del node['stub_id']
+            node['children'] = subtree['children']
+
+            if 'hidden_children' in subtree:
+                node['hidden_children'] = subtree['hidden_children']
+
+        stack.extend(node['children'])
+        stack.extend(node.get('hidden_children', []))
+
+
+@pytest.mark.parametrize('max_depth', [1, 2, 3])
+def test_truncate_and_expand(max_depth):
+    rng = random.Random(max_depth)
+    v = [random_tree(rng, 4), random_tree(rng, 4)]
+    tree, _, _ = compress(v, 0.1)
+    graph = FlameGraph.from_dict(v[1]).compress(0.1, True)
+
+    def get_subtree(stub_id):
+        index = int(stub_id.split(':')[-1])
+        return json.loads(graph.to_json(graph.find(index), max_depth,
+                                        'm:1:', index))
+
+    truncated = json.loads(graph.to_json(max_depth=max_depth,
+                                         id_prefix='m:1:'))
+    expand_stubs(truncated, get_subtree)
+
+    assert json.dumps(truncated) == json.dumps(tree[1])
+    assert graph.find(-1) is None
+    assert graph.find(len(graph._get_sizes()) + 1000) is None
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('max_depth', [None, 1, 3])
+def test_encode_binary_same_as_json(seed, max_depth):
+    rng = random.Random(seed)
+    v = [random_tree(rng, 4), random_tree(rng, 4)]
+
+    for threshold in [0, 0.025, 0.3]:
+        for time_ordered in [False, True]:
+            graph = FlameGraph.from_dict(v[int(time_ordered)]).compress(
+                threshold, time_ordered)
+            # Subtrees are encoded in the same way as well.
+            block = graph.find(1)
+            blocks = [(0, 0)] if block is None else [(0, 0), (block, 1)]
+            encoder = BinaryEncoder()
+            encoder.begin_array(len(blocks))
+
+            for x, index in blocks:
+                graph.encode_binary(encoder, x, max_depth, 'm:0:', index)
+
+            assert decode_binary(encoder.to_bytes()) == [
+                json.loads(graph.to_json(x, max_depth, 'm:0:', index))
+                for x, index in blocks]
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_read_flame_graphs(seed, chunk_size):
+    rng = random.Random(seed)
+    data = {
+        'walltime': [random_tree(rng, 4), random_tree(rng, 4)],
+        'cache-"misses"': [
+            {'name': 'all', 'value': 2.5, 'children': [
+                {'children': [], 'value': 1, 'name': 'fé\n\\',
+                 'offsets': [1, {'a': None}], 'cold': False}
+            ]},
+            {'name': 'all', 'value': 0, 'children': []}
+        ]
+    }
+    text = json.dumps(data, indent=rng.choice([None, 1]))
+    read = []
+
+    graphs = list(read_flame_graphs(io.StringIO(text), read.append,
+                                    chunk_size))
+
+    assert [k for k, _ in graphs] == ['walltime', 'walltime',
+                                      'cache-"misses"', 'cache-"misses"']
+    assert read[-1] == len(text)
+
+    for (k, graph), tree in zip(graphs, data['walltime'] +
+                                data['cache-"misses"']):
+        for time_ordered in [False, True]:
+            expected = FlameGraph.from_dict(tree).compress(0.1, time_ordered)
+            result = graph.compress(0.1, time_ordered)
+
+            assert result.to_json() == expected.to_json()
+
+
+def test_read_deep_flame_graph():
+    depth = 10000
+    text = '{"walltime": [' + \
+        '{"name": "f", "value": 1, "children": [' * depth + \
+        ']}' * depth + ']}'
+
+    (metric, graph), = read_flame_graphs(io.StringIO(text))
+
+    assert metric == 'walltime'
+    assert len(graph._parent) == depth
+    assert graph.get_children(depth - 2) == [depth - 1]
+
+
+@pytest.mark.parametrize('text', [
+    '', '[]', '{"walltime": {}}', '{"walltime": [{"name": "a"}]}',
+    '{"walltime": [{"name": "a", "value": 1, "children": [}]}',
+    '{"walltime": [{"name": "a", "value": 1, "children": []},]}',
+    '{"walltime": []} x'
+])
+def test_read_invalid_flame_graphs(text):
+    with pytest.raises(ValueError):
+        list(read_flame_graphs(io.StringIO(text)))
+
+
+def reference_slice(node, offset, start, end, is_root=True):
+    overlap = min(offset + node['value'], end) - max(offset, start)
+
+    if overlap <= 0 and not is_root:
+        return None
+
+    result = dict(node, value=max(0, overlap), children=[])
+
+    for child in node['children']:
+        sliced = reference_slice(child, offset, start, end, False)
+        offset += child['value']
+
+        if sliced is not None:
+            result['children'].append(sliced)
+
+    return result
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_time_index_slice(seed):
+    rng = random.Random(seed)
+    tree = random_tree(rng, 4)
+    index = TimeIndex(FlameGraph.from_dict(tree))
+
+    for _ in range(20):
+        start = rng.randint(-10, tree['value'] + 10)
+        end = rng.randint(start, tree['value'] + 20)
+        expected = FlameGraph.from_dict(
+            reference_slice(tree, 0, start, end)).compress(0, True)
+        result = index.slice(start, end).compress(0, True)
+
+        assert result.to_json() == expected.to_json()
+
+
+def test_merge_flame_graphs():
+    tree1 = {'name': 'all', 'value': 6, 'children': [
+        {'name': 'a', 'value': 2, 'children': [
+            {'name': 'c', 'value': 1, 'children': []}
+        ], 'cold': True},
+        {'name': 'b', 'value': 1, 'children': []},
+        {'name': 'a', 'value': 3, 'children': [
+            {'name': 'c', 'value': 2, 'children': []},
+            {'name': 'd', 'value': 1, 'children': []}
+        ]}
+    ]}
+    tree2 = {'name': 'all', 'value': 1, 'children': [
+        {'name': 'b', 'value': 1, 'children': []}
+    ]}
+
+    merged = merge_flame_graphs([FlameGraph.from_dict(tree1),
+                                 FlameGraph.from_dict(tree2)])
+
+    assert json.loads(merged.compress(0, False).to_json()) == \
+        {'name': 'all', 'value': 7, 'children': [
+            {'name': 'a', 'value': 5, 'children': [
+                {'name': 'c', 'value': 3, 'children': []},
+                {'name': 'd', 'value': 1, 'children': []}
+            ], 'cold': True},
+            {'name': 'b', 'value': 2, 'children': []}
+        ]}
+
+
+def test_diff_flame_graphs():
+    baseline = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'b', 'value': 4, 'children': [
+            {'name': 'c', 'value': 4, 'children': []}
+        ]},
+        {'name': 'a', 'value': 6, 'children': [], 'cold': True}
+    ]}
+    new = {'name': 'root', 'value': 12.5, 'children': [
+        {'name': 'a', 'value': 2, 'children': []},
+        {'name': 'd', 'value': 0.5, 'children': []},
+        {'name': 'b', 'value': 10, 'children': [
+            {'name': 'e', 'value': 10, 'children': []}
+        ]}
+    ]}
+
+    diff = diff_flame_graphs(FlameGraph.from_dict(baseline),
+                             FlameGraph.from_dict(new))
+
+    assert json.loads(diff.compress(0, False).to_json()) == \
+        {'name': 'root', 'value': 12.5, 'baseline': 10, 'delta': 2.5,
+         'children': [
+             {'name': 'a', 'value': 2, 'baseline': 6, 'delta': -4,
+              'children': []},
+             {'name': 'b', 'value': 10, 'baseline': 4, 'delta': 6,
+              'children': [
+                  {'name': 'c', 'value': 0, 'baseline': 4, 'delta': -4,
+                   'children': []},
+                  {'name': 'e', 'value': 10, 'baseline': 0, 'delta': 10,
+                   'children': []}
+              ]},
+             {'name': 'd', 'value': 0.5, 'baseline': 0, 'delta': 0.5,
+              'children': []}
+         ]}
+
+
+def test_get_function_values():
+    tree = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'a', 'value': 7, 'children': [
+            {'name': 'b', 'value': 4, 'children': [
+                {'name': 'a', 'value': 3, 'children': []}
+            ]},
+            {'name': 'c', 'value': 1, 'children': []}
+        ]},
+        {'name': 'b', 'value': 2.5, 'children': []}
+    ]}
+
+    # The recursive call of "a" is counted in its self value only.
+    assert FlameGraph.from_dict(tree).get_function_values() == {
+        'a': [7, 5], 'b': [6.5, 3.5], 'c': [1, 1]}
@@ -0,0 +1,74 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import time
+import threading
+from adaptiveperf import JobManager, report_progress
+
+
+def test_job():
+    updates = []
+    manager = JobManager(on_update=lambda job: updates.append(job.to_dict()))
+    event = threading.Event()
+
+    def compute():
+        report_progress('load', 0)
+        event.wait()
+
+        for i in range(100):
+            report_progress('compress', i / 100)
+
+        return 'result'
+
+    job = manager.submit('a', compute)
+
+    assert manager.submit('a', lambda: 'other') is job
+    assert manager.get('a') is job
+    assert manager.get('b') is None
+    assert not job.wait(0.1)
+    assert job.to_dict()['state'] == 'running'
+    assert job.to_dict()['phase'] == 'load'
+
+    event.set()
+
+    assert job.wait(5)
+    assert job.state == 'done'
+    assert job.result == 'result'
+
+    phases = [(x['state'], x['phase']) for x in updates]
+
+    assert phases[:2] == [('running', 'waiting'), ('running', 'load')]
+    assert phases[-1] == ('done', 'compress')
+
+    # Progress updates are throttled.
+    assert 10 <= phases.count(('running', 'compress')) <= 21
+
+
+def test_failed_job():
+    manager = JobManager()
+
+    def compute():
+        raise ValueError('test')
+
+    job = manager.submit('a', compute)
+
+    assert job.wait(5)
+    assert job.state == 'failed'
+    assert isinstance(job.error, ValueError)
+
+
+def test_expiry():
+    manager = JobManager(retention=0.1)
+    job = manager.submit('a', lambda: 'result')
+
+    assert job.wait(5)
+    assert manager.get('a') is job
+
+    time.sleep(0.2)
+
+    assert manager.get('a') is None
+    assert manager.submit('a', lambda: 'result') is not job
+
+
+def test_report_progress_outside_job():
+    report_progress('load', 0.5)
@@ -0,0 +1,69 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+from array import array
+from adaptiveperf import LRUCache, get_object_size
+
+
+def test_get_and_put():
+    cache = LRUCache(100)
+
+    assert cache.get('a') is None
+
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 20)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') == 2
+    assert cache.size == 30
+    assert len(cache) == 2
+
+    cache.put('a', 3, 5)
+
+    assert cache.get('a') == 3
+    assert cache.size == 25
+
+
+def test_eviction():
+    cache = LRUCache(100)
+    cache.put('a', 1, 40)
+    cache.put('b', 2, 40)
+
+    # 'a' becomes the most recently used object, so 'b' is dropped.
+    cache.get('a')
+    cache.put('c', 3, 40)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.size == 80
+
+
+def test_too_large():
+    cache = LRUCache(100)
+    cache.put('a', 1, 40)
+    cache.put('a', 2, 101)
+
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_clear():
+    cache = LRUCache(100)
+    cache.put('a', 1, 40)
+    cache.clear()
+
+    assert cache.get('a') is None
+    assert cache.size == 0
+    assert len(cache) == 0
+
+
+def test_get_object_size():
+    shared = 'x' * 10000
+    small = get_object_size([1, 2, 3])
+
+    assert get_object_size([shared]) > 10000
+    assert get_object_size([shared] * 10) < 2 * 10000
+    assert get_object_size({'a': [shared]}) > get_object_size([shared])
+    assert get_object_size([array('d', [0]) * 1000]) > 8000
+    assert small < 1000
@@ -0,0 +1,95 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import random
+import pytest
+import adaptiveperf.merge
+from adaptiveperf import FlameGraph, merge_flame_graphs, \
+    merge_session_flame_graphs, merge_thread_flame_graphs, \
+    pack_flame_graphs, unpack_flame_graphs
+
+
+def random_tree(rng, depth):
+    children = []
+
+    if depth > 0:
+        for _ in range(rng.randint(0, 4)):
+            children.append(random_tree(rng, depth - 1))
+
+    return {'name': f'f{rng.randint(0, 5)}',
+            'value': sum(c['value'] for c in children) + rng.randint(0, 10),
+            'children': children}
+
+
+@pytest.fixture()
+def session_path(tmp_path):
+    rng = random.Random(0)
+    processed_path = tmp_path / 'processed'
+    processed_path.mkdir()
+    trees = []
+
+    for tid in range(1, 13):
+        tree = random_tree(rng, 3)
+        trees.append(tree)
+        (processed_path / f'1_{tid}.json').write_text(json.dumps({
+            'walltime': [tree, {'name': 'all', 'value': 0, 'children': []}]
+        }))
+
+    return tmp_path, trees
+
+
+def to_json(graphs):
+    return {k: json.loads(v.compress(0, False).to_json())
+            for k, v in graphs.items()}
+
+
+@pytest.mark.parametrize('processes', [1, 2, 3])
+def test_merge_session_flame_graphs(session_path, processes, monkeypatch):
+    path, trees = session_path
+    monkeypatch.setattr(adaptiveperf.merge, 'MERGE_BATCH_SIZE', 2)
+    monkeypatch.setattr(adaptiveperf.merge, 'MIN_PARALLEL_MERGE', 0)
+
+    merged = merge_session_flame_graphs(
+        str(path), [f'1_{tid}' for tid in range(1, 13)], processes)
+    expected = merge_flame_graphs([FlameGraph.from_dict(x) for x in trees])
+
+    assert list(merged.keys()) == ['walltime']
+    assert merged['walltime'].get_value(0) == expected.get_value(0)
+
+    # The result does not depend on the number of worker processes.
+    assert to_json(merged) == to_json({'walltime': expected})
+    assert to_json(merged) == to_json(merge_thread_flame_graphs(
+        str(path), [f'1_{tid}' for tid in range(1, 13)]))
+
+
+def test_merge_session_flame_graphs_threshold(session_path, monkeypatch):
+    path, trees = session_path
+
+    def fail(processes):
+        raise AssertionError('No worker processes should be used!')
+
+    monkeypatch.setattr(adaptiveperf.merge, 'MERGE_BATCH_SIZE', 2)
+    monkeypatch.setattr(adaptiveperf.merge, '_get_executor', fail)
+
+    merged = merge_session_flame_graphs(
+        str(path), [f'1_{tid}' for tid in range(1, 13)], 2)
+
+    assert list(merged.keys()) == ['walltime']
+
+
+def test_pack_flame_graphs():
+    graphs = {
+        'walltime': FlameGraph.from_dict(
+            {'name': 'all', 'value': 3, 'children': [
+                {'name': 'a', 'value': 3, 'children': [], 'cold': True}]}),
+        'cache-"misses"': FlameGraph.from_dict(
+            {'name': 'all', 'value': 0.5, 'children': []})
+    }
+    data = pack_flame_graphs(graphs)
+
+    assert to_json(unpack_flame_graphs(data)) == to_json(graphs)
+    assert unpack_flame_graphs(b'') == {}
+
+    with pytest.raises(ValueError):
+        unpack_flame_graphs(data[:-10])
@@ -0,0 +1,72 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+from adaptiveperf import Histogram, PhaseTimer, RequestMetrics, \
+    format_metric
+
+
+def test_histogram():
+    histogram = Histogram((1, 10))
+
+    for value in [0.5, 1, 5, 100]:
+        histogram.observe(value)
+
+    assert histogram.count == 4
+    assert histogram.sum == 106.5
+    assert histogram.get_samples({'a': 'b'}) == [
+        ('_bucket', {'a': 'b', 'le': '1'}, 2),
+        ('_bucket', {'a': 'b', 'le': '10'}, 3),
+        ('_bucket', {'a': 'b', 'le': '+Inf'}, 4),
+        ('_sum', {'a': 'b'}, 106.5),
+        ('_count', {'a': 'b'}, 4)
+    ]
+
+
+def test_format_metric():
+    assert format_metric('test_total', 'counter', 'Test.', [
+        ('', {}, 1),
+        ('', {'path': 'a"b\\c\n'}, 2)
+    ]) == ('# HELP test_total Test.\n'
+           '# TYPE test_total counter\n'
+           'test_total 1\n'
+           'test_total{path="a\\"b\\\\c\\n"} 2\n')
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    timer.start('parse')
+    timer.start('compute')
+    timer.start('parse')
+    timer.stop()
+    timer.stop()
+
+    assert list(timer.durations.keys()) == ['parse', 'compute']
+    assert all(x >= 0 for x in timer.durations.values())
+    assert timer.get_server_timing().startswith('parse;dur=')
+    assert ', compute;dur=' in timer.get_server_timing()
+
+
+def test_request_metrics():
+    metrics = RequestMetrics()
+    metrics.observe('tree', 200, {'parse': 0.5, 'compute': 1}, 2000)
+    metrics.observe('tree', 200, {'parse': 0.5}, 0)
+    metrics.observe('src', 404, {'parse': 0.1}, 0)
+
+    assert metrics.get_request_count('tree', 200) == 2
+    assert metrics.get_request_count('src', 404) == 1
+    assert metrics.get_request_count('src', 200) == 0
+
+    lines = metrics.render().splitlines()
+
+    assert 'adaptiveperf_requests_total{endpoint="tree",status="200"} 2' \
+        in lines
+    assert 'adaptiveperf_request_duration_seconds_sum{endpoint="tree"} 2.0' \
+        in lines
+    assert 'adaptiveperf_request_phase_duration_seconds_count{' \
+        'endpoint="tree",phase="parse"} 2' in lines
+    assert 'adaptiveperf_request_phase_duration_seconds_count{' \
+        'endpoint="tree",phase="compute"} 1' in lines
+    assert 'adaptiveperf_response_size_bytes_bucket{endpoint="tree",' \
+        'le="1024"} 1' in lines
+    assert 'adaptiveperf_response_size_bytes_bucket{endpoint="tree",' \
+        'le="4096"} 2' in lines
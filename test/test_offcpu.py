@@ -0,0 +1,123 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import random
+import pytest
+from adaptiveperf import OffCpuPyramid
+
+
+def random_regions(count, seed):
+    rng = random.Random(seed)
+    regions = []
+    time = 0
+
+    for _ in range(count):
+        time += rng.choice([0.0001, 0.002, 0.01, 0.5, 3])
+        length = rng.choice([0.0005, 0.01, 1])
+        regions.append((time, length))
+        time += length
+
+    rng.shuffle(regions)
+    return regions
+
+
+def naive_query(regions, start, end, resolution):
+    result = []
+
+    for region_start, length in sorted(regions):
+        region_end = region_start + length
+
+        if region_end <= start or region_start >= end:
+            continue
+
+        if len(result) > 0 and \
+           region_start - (result[-1][0] + result[-1][1]) < resolution:
+            result[-1][1] = region_end - result[-1][0]
+            result[-1][2] += length
+        else:
+            result.append([region_start, length, length])
+
+    return result
+
+
+def assert_regions_equal(actual, expected):
+    assert len(actual) == len(expected)
+
+    for x, y in zip(actual, expected):
+        assert x == pytest.approx(y)
+
+
+def test_empty():
+    pyramid = OffCpuPyramid([])
+
+    assert len(pyramid) == 0
+    assert pyramid.query(0, 100, 1) == []
+
+
+def test_full_resolution():
+    regions = [(5, 1), (0, 2), (2.5, 1)]
+    pyramid = OffCpuPyramid(regions)
+
+    assert len(pyramid) == 3
+    assert pyramid.query(0, 10, 0) == [[0, 2, 2], [2.5, 1, 1], [5, 1, 1]]
+
+
+def test_overlapping_regions():
+    pyramid = OffCpuPyramid([(0, 2), (1, 3), (10, 1)])
+
+    assert pyramid.query(0, 20, 0) == [[0, 4, 4], [10, 1, 1]]
+
+
+def test_merging():
+    pyramid = OffCpuPyramid([(0, 1), (1.5, 1), (10, 1)])
+
+    assert pyramid.query(0, 20, 1) == [[0, 2.5, 2], [10, 1, 1]]
+    assert pyramid.query(0, 20, 100) == [[0, 11, 3]]
+
+
+def test_window():
+    pyramid = OffCpuPyramid([(0, 1), (5, 1), (10, 1)])
+
+    assert pyramid.query(0.5, 5.5, 0) == [[0, 1, 1], [5, 1, 1]]
+    assert pyramid.query(1, 5, 0) == []
+    assert pyramid.query(6, 100, 0) == [[10, 1, 1]]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_same_as_naive_query(seed):
+    regions = random_regions(2000, seed)
+    pyramid = OffCpuPyramid(regions)
+    end_time = max(x[0] + x[1] for x in regions)
+
+    for resolution in [0, 0.001, 0.003, 0.05, 1, 20, 1000]:
+        assert_regions_equal(
+            pyramid.query(0, end_time, resolution),
+            naive_query(regions, 0, end_time, resolution))
+
+    start, end = end_time / 3, end_time / 2
+    assert_regions_equal(pyramid.query(start, end, 0),
+                         naive_query(regions, start, end, 0))
+
+    # Merged regions crossing the window boundaries may contain regions
+    # outside the window, so they are only checked to overlap it.
+    for resolution in [0.05, 20]:
+        result = pyramid.query(start, end, resolution)
+
+        assert len(result) > 0
+
+        for region_start, length, off_time in result:
+            assert region_start < end and region_start + length > start
+            assert 0 < off_time <= length + 1e-9
+
+
+def test_nbytes():
+    assert OffCpuPyramid([]).nbytes == 0
+
+    pyramid = OffCpuPyramid(random_regions(1000, 0))
+
+    assert pyramid.nbytes >= 3 * 8 * len(pyramid)
+
+
+def test_negative_resolution():
+    with pytest.raises(ValueError):
+        OffCpuPyramid([(0, 1)]).query(0, 1, -1)
@@ -0,0 +1,118 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import random
+import pytest
+from adaptiveperf import PerfMapIndex, ProfilingResults, DiskCache
+
+
+IDENTIFIER = '2023_12_10_11_13_14_test__test2'
+
+
+@pytest.fixture()
+def perf_map(tmp_path):
+    path = tmp_path / 'perf-1.map'
+    path.write_text('7f00 10 first\n'
+                    'incorrect line\n'
+                    '7e00 100 Lua::function (with spaces)\n'
+                    '7f20 8 żółw\n')
+    return path
+
+
+def test_resolve(perf_map):
+    index = PerfMapIndex(PerfMapIndex.build(perf_map))
+
+    assert len(index) == 3
+    assert index.resolve(0x7dff) is None
+    assert index.resolve(0x7e00) == 'Lua::function (with spaces)'
+    assert index.resolve(0x7eff) == 'Lua::function (with spaces)'
+    assert index.resolve(0x7f00) == 'first'
+    assert index.resolve(0x7f0f) == 'first'
+    assert index.resolve(0x7f10) is None
+    assert index.resolve(0x7f27) == 'żółw'
+    assert index.resolve(0x7f28) is None
+
+
+def test_open(perf_map, tmp_path):
+    index_path = tmp_path / 'index'
+    index_path.write_bytes(PerfMapIndex.build(perf_map))
+
+    index = PerfMapIndex.open(index_path)
+
+    assert index.resolve(0x7f05) == 'first'
+
+
+def test_invalid_data(tmp_path):
+    with pytest.raises(ValueError):
+        PerfMapIndex(b'')
+
+    with pytest.raises(ValueError):
+        PerfMapIndex(b'APM1' + b'\xff' * 8)
+
+    (tmp_path / 'empty').write_bytes(b'')
+
+    with pytest.raises(ValueError):
+        PerfMapIndex.open(tmp_path / 'empty')
+
+
+def test_same_as_linear_search(tmp_path):
+    rng = random.Random(0)
+    entries = []
+    address = 0x1000
+
+    for i in range(1000):
+        address += rng.randint(0, 64)
+        size = rng.randint(1, 64)
+        entries.append((address, size, f'symbol_{i}'))
+        address += size
+
+    rng.shuffle(entries)
+    path = tmp_path / 'perf-2.map'
+    path.write_text(''.join(f'{a:x} {s:x} {n}\n' for a, s, n in entries))
+
+    index = PerfMapIndex(PerfMapIndex.build(path))
+
+    for _ in range(1000):
+        address = rng.randint(0x1000, address + 10)
+        expected = None
+
+        for start, size, name in entries:
+            if start <= address < start + size:
+                expected = name
+
+        assert index.resolve(address) == expected
+
+
+@pytest.mark.parametrize('disk_cache', [False, True])
+def test_resolve_symbols(tmp_path, disk_cache):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    processed_path.mkdir(parents=True)
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / 'perf-1.map').write_text('10 10 first\n20 10 second\n')
+
+    cache = DiskCache(tmp_path / 'cache', 1024 * 1024) if disk_cache \
+        else None
+    results = ProfilingResults(str(tmp_path), IDENTIFIER, cache)
+
+    for _ in range(2):
+        assert json.loads(results.resolve_symbols(
+            ['perf-1.map:0x15', 'perf-1.map:0x20', 'perf-1.map:0x30',
+             'perf-2.map:0x15', '../perf-1.map:0x15'])) == {
+                 'perf-1.map:0x15': 'first',
+                 'perf-1.map:0x20': 'second',
+                 'perf-1.map:0x30': None,
+                 'perf-2.map:0x15': None,
+                 '../perf-1.map:0x15': None
+             }
+
+    assert (tmp_path / 'cache').exists() == disk_cache
+
+    (processed_path / 'perf-1.map').write_text('10 10 changed\n')
+
+    assert json.loads(results.resolve_symbols(['perf-1.map:0x15'])) == {
+        'perf-1.map:0x15': 'changed'
+    }
+
+    with pytest.raises(ValueError):
+        results.resolve_symbols(['perf-1.map'])
@@ -0,0 +1,68 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import pytest
+from adaptiveperf import ProfilingResults, DiskCache
+from adaptiveperf.precompute import precompute, precompute_session
+
+
+@pytest.fixture()
+def results_dir(tmp_path):
+    for identifier in ['2023_12_10_11_13_14_test__test2',
+                       '2024_01_02_03_04_05_test__test3']:
+        processed_path = tmp_path / 'results' / identifier / 'processed'
+        processed_path.mkdir(parents=True)
+
+        children = [{'name': f'function_{i}', 'value': 10, 'children': []}
+                    for i in range(200)]
+        tree = {'name': 'all', 'value': 2000, 'children': children}
+
+        (processed_path / 'metadata.json').write_text(json.dumps({
+            'thread_tree': [{'tag': ['a.out', '1/1', 0, 1000000],
+                             'identifier': '1_1'}],
+            'offcpu_regions': {},
+            'sampled_times': {},
+            'callchains': {},
+            'start_time': 0
+        }))
+        (processed_path / '1_1.json').write_text(json.dumps({
+            'walltime': [tree, tree]
+        }))
+        (processed_path / 'perf-1.map').write_text('10 10 first\n')
+
+    return tmp_path / 'results'
+
+
+def test_precompute_session(results_dir, tmp_path, mocker):
+    identifier = '2023_12_10_11_13_14_test__test2'
+    precompute_session(str(results_dir), identifier,
+                       str(tmp_path / 'cache'), 1024 * 1024, 0.025, 30)
+
+    results = ProfilingResults(str(results_dir), identifier,
+                               DiskCache(tmp_path / 'cache' / identifier,
+                                         1024 * 1024))
+    put = mocker.spy(DiskCache, 'put')
+
+    # The requests made by the website when the session is opened.
+    tree = results.get_binary(
+        results.get_json_tree(include_off_cpu=False, skeleton=True))
+    flame_graph = results.get_flame_graph(1, 1, 0.025, 30, binary=True)
+    results.get_compressed(tree, 'gzip')
+    results.get_compressed(flame_graph, 'gzip')
+    results.resolve_symbols(['perf-1.map:0x10'])
+
+    assert put.call_count == 0
+    assert flame_graph == ProfilingResults(
+        str(results_dir), identifier).get_flame_graph(1, 1, 0.025, 30,
+                                                      binary=True)
+
+
+def test_precompute(results_dir, tmp_path):
+    assert precompute(str(results_dir), str(tmp_path / 'cache'),
+                      1024 * 1024, jobs=2, since=(2024, 1, 1)) == 0
+
+    assert not (tmp_path / 'cache' /
+                '2023_12_10_11_13_14_test__test2').exists()
+    assert len(list((tmp_path / 'cache' /
+                     '2024_01_02_03_04_05_test__test3').iterdir())) > 0
@@ -0,0 +1,179 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import os
+import json
+import pytest
+from adaptiveperf import SessionCache
+
+
+def create_session(path, identifier, metadata_size=0):
+    (path / identifier / 'processed').mkdir(parents=True)
+
+    with (path / identifier / 'processed' / 'metadata.json').open(
+            mode='w') as f:
+        json.dump({'thread_tree': [], 'padding': 'x' * metadata_size}, f)
+
+
+@pytest.fixture()
+def results_dir(tmp_path):
+    create_session(tmp_path, '2023_12_10_11_13_14_test__test1')
+    create_session(tmp_path, '2023_12_10_11_13_15_test__test2')
+    create_session(tmp_path, '2023_12_10_11_13_16_test__test3',
+                   metadata_size=10000)
+
+    return tmp_path
+
+
+def test_hit_and_miss(results_dir):
+    cache = SessionCache(str(results_dir), 1024 * 1024)
+
+    results1 = cache.get('2023_12_10_11_13_14_test__test1')
+    results2 = cache.get('2023_12_10_11_13_14_test__test1')
+
+    assert results1 is results2
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert len(cache) == 1
+
+
+def test_invalidation_on_change(results_dir):
+    cache = SessionCache(str(results_dir), 1024 * 1024)
+    identifier = '2023_12_10_11_13_14_test__test1'
+
+    results1 = cache.get(identifier)
+
+    metadata_path = results_dir / identifier / 'processed' / 'metadata.json'
+    metadata_path.write_text(json.dumps({'thread_tree': [], 'new': True}))
+    stat = metadata_path.stat()
+    os.utime(metadata_path, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns + 1000000000))
+
+    results2 = cache.get(identifier)
+
+    assert results1 is not results2
+    assert cache.hits == 0
+    assert cache.misses == 2
+    assert len(cache) == 1
+
+
+def test_invalidation_on_new_file(results_dir):
+    cache = SessionCache(str(results_dir), 1024 * 1024)
+    identifier = '2023_12_10_11_13_14_test__test1'
+    processed_path = results_dir / identifier / 'processed'
+
+    results1 = cache.get(identifier)
+
+    assert cache.get(identifier) is results1
+    assert results1.get_merged_sources() == []
+
+    (processed_path / '1_1.json').write_text('{}')
+    stat = processed_path.stat()
+    os.utime(processed_path, ns=(stat.st_atime_ns,
+                                 stat.st_mtime_ns + 1000000000))
+
+    results2 = cache.get(identifier)
+
+    assert results1 is not results2
+    assert results1.fingerprint != results2.fingerprint
+    assert results2.get_merged_sources() == [processed_path / '1_1.json']
+
+
+def test_session_fingerprint(results_dir, mocker):
+    cache = SessionCache(str(results_dir), 1024 * 1024)
+    identifier = '2023_12_10_11_13_14_test__test1'
+
+    fingerprint = cache.get_session_fingerprint(identifier)
+
+    assert len(cache) == 0
+    assert cache.misses == 0
+
+    results = cache.get(identifier)
+
+    assert results.fingerprint == fingerprint
+
+    # The fingerprint of the cached session is not taken again.
+    mocker.patch('adaptiveperf.cache.SessionStore.get_fingerprint')
+
+    assert cache.get_session_fingerprint(identifier) == fingerprint
+    assert cache.hits == 0
+
+
+def test_eviction(results_dir):
+    identifier1 = '2023_12_10_11_13_14_test__test1'
+    identifier2 = '2023_12_10_11_13_15_test__test2'
+    identifier3 = '2023_12_10_11_13_16_test__test3'
+    identifier4 = '2023_12_10_11_13_17_test__test4'
+
+    create_session(results_dir, identifier4)
+
+    session_size = (results_dir / identifier1 / 'processed' /
+                    'metadata.json').stat().st_size
+    cache = SessionCache(str(results_dir), 2 * session_size)
+
+    cache.get(identifier1)
+    cache.get(identifier2)
+    cache.get(identifier1)
+
+    # identifier3 is larger than the whole cache, so it must not
+    # evict anything.
+    cache.get(identifier3)
+
+    assert len(cache) == 2
+    assert cache.size == 2 * session_size
+    assert cache.hits == 1
+    assert cache.misses == 3
+
+    # identifier2 is the least recently used session now.
+    cache.get(identifier4)
+    cache.get(identifier1)
+
+    assert cache.hits == 2
+    assert cache.misses == 4
+
+    cache.get(identifier2)
+
+    assert cache.hits == 2
+    assert cache.misses == 5
+    assert len(cache) == 2
+
+
+def test_memory_size(results_dir):
+    identifier1 = '2023_12_10_11_13_14_test__test1'
+    identifier2 = '2023_12_10_11_13_15_test__test2'
+
+    (results_dir / identifier1 / 'processed' / 'metadata.json').write_text(
+        json.dumps({
+            'thread_tree': [],
+            'start_time': 0,
+            'offcpu_regions': {
+                '1_1': [[i * 3000000, 1000000] for i in range(10000)]
+            }
+        }))
+
+    file_size = (results_dir / identifier1 / 'processed' /
+                 'metadata.json').stat().st_size
+    cache = SessionCache(str(results_dir), file_size + 300000)
+    results = cache.get(identifier1)
+
+    assert results.memory_size == 0
+    assert cache.size == file_size
+
+    # The off-CPU pyramid of the thread is kept in memory, which is
+    # taken into account the next time any session is requested.
+    results.get_off_cpu_regions(['1_1'], 0, 100000, 0)
+    cache.get(identifier2)
+
+    assert results.memory_size > 0
+    assert len(cache) == 2
+    assert cache.size == file_size + results.memory_size + \
+        (results_dir / identifier2 / 'processed' /
+         'metadata.json').stat().st_size
+
+    # identifier1 is the least recently used session and it does not
+    # fit in the cache anymore.
+    results.get_off_cpu_regions(['1_1'], 0, 100000, 0, 7)
+    cache.get(identifier2)
+
+    assert len(cache) == 1
+    assert cache.get(identifier1) is not results
@@ -0,0 +1,87 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import pytest
+from adaptiveperf import SessionIndex, ProfilingResults, Identifier
+
+
+IDS = [
+    '2023_12_10_11_13_14_host1__test1',
+    '2023_12_10_11_13_15_host2__test2',
+    '2023_12_11_10_00_host1__other',
+    '2024_01_01_00_00_00_host2__Test3',
+    '2022_05_05_05_05_05_host3__test4'
+]
+
+
+@pytest.fixture()
+def results_dir(tmp_path):
+    for identifier in IDS:
+        (tmp_path / identifier).mkdir()
+
+    (tmp_path / 'not_a_session').mkdir()
+    (tmp_path / '2023_12_10_11_13_14_host1__file').write_text('')
+
+    return tmp_path
+
+
+def test_same_as_get_all_ids(results_dir):
+    index = SessionIndex(str(results_dir))
+    total, ids = index.query()
+
+    assert total == len(IDS)
+    assert ids == ProfilingResults.get_all_ids(str(results_dir))
+    assert [x.label for x in ids] == \
+        [x.label for x in ProfilingResults.get_all_ids(str(results_dir))]
+    assert index.get_executors() == ['host1', 'host2', 'host3']
+
+
+def test_pagination_and_filters(results_dir):
+    index = SessionIndex(str(results_dir))
+    _, all_ids = index.query()
+
+    total, ids = index.query(offset=1, limit=2)
+
+    assert total == len(IDS)
+    assert ids == all_ids[1:3]
+    assert [x.label for x in ids] == ['1', '2']
+
+    total, ids = index.query(executor='host1')
+
+    assert total == 2
+    assert {x.value for x in ids} == {IDS[0], IDS[2]}
+
+    total, ids = index.query(name='TEST', limit=1)
+
+    assert total == 4
+    assert [x.value for x in ids] == [IDS[3]]
+    assert ids[0].label == '0'
+
+    total, ids = index.query(date_from=(2023, 12, 10),
+                             date_to=(2023, 12, 10))
+
+    assert total == 2
+    assert {x.value for x in ids} == {IDS[0], IDS[1]}
+
+
+def test_incremental_refresh(results_dir, mocker):
+    index = SessionIndex(str(results_dir))
+    identifier_mock = mocker.patch('adaptiveperf.index.Identifier',
+                                   wraps=Identifier)
+
+    assert index.query()[0] == len(IDS)
+    assert identifier_mock.call_count == len(IDS) + 1
+
+    assert index.query()[0] == len(IDS)
+    assert identifier_mock.call_count == len(IDS) + 1
+
+    (results_dir / '2025_01_01_00_00_00_host4__new').mkdir()
+    (results_dir / IDS[0]).rmdir()
+
+    total, ids = index.query()
+
+    assert total == len(IDS)
+    assert ids[0].value == '2025_01_01_00_00_00_host4__new'
+    assert IDS[0] not in [x.value for x in ids]
+    assert identifier_mock.call_count == len(IDS) + 2
+    assert index.get_executors() == ['host1', 'host2', 'host3', 'host4']
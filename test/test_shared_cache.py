@@ -0,0 +1,79 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import multiprocessing
+from adaptiveperf import SharedCache, CacheStatistics
+
+
+def put_entry(path, key, payload):
+    SharedCache(path, 1024).put(key, payload)
+
+
+def test_get_put(tmp_path):
+    statistics = CacheStatistics()
+    cache = SharedCache(tmp_path / 'cache' / 'shared.sqlite3', 1024,
+                        statistics)
+
+    assert cache.get('a') is None
+
+    cache.put('a', b'\x00payload')
+    cache.put('b', b'')
+
+    assert cache.get('a') == b'\x00payload'
+    assert cache.get('b') == b''
+    assert statistics.hits == 2
+    assert statistics.misses == 1
+
+    cache.put('a', b'other')
+
+    assert cache.get('a') == b'other'
+
+
+def test_eviction(tmp_path):
+    cache = SharedCache(tmp_path / 'shared.sqlite3', 25)
+
+    cache.put('a', b'x' * 10)
+    cache.put('b', b'x' * 10)
+    cache.get('a')
+    cache.put('c', b'x' * 10)
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+    cache.put('d', b'x' * 26)
+
+    assert cache.get('d') is None
+
+
+def test_shared_between_processes(tmp_path):
+    path = tmp_path / 'shared.sqlite3'
+    cache = SharedCache(path, 1024)
+
+    # The connection opened by the parent must not be reused by
+    # the child.
+    assert cache.get('a') is None
+
+    process = multiprocessing.get_context('fork').Process(
+        target=lambda: cache.put('a', b'payload'))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert cache.get('a') == b'payload'
+
+    process = multiprocessing.Process(target=put_entry,
+                                      args=(path, 'b', b'other'))
+    process.start()
+    process.join()
+
+    assert cache.get('b') == b'other'
+
+
+def test_unusable_path(tmp_path):
+    (tmp_path / 'file').write_text('')
+    cache = SharedCache(tmp_path / 'file' / 'shared.sqlite3', 1024)
+
+    cache.put('a', b'payload')
+
+    assert cache.get('a') is None
@@ -0,0 +1,174 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import time
+import threading
+import multiprocessing
+import pytest
+from adaptiveperf import SingleFlight, DiskCache, ProfilingResults
+
+
+IDENTIFIER = '2023_12_10_11_13_14_test__test2'
+
+
+def run_concurrently(count, func):
+    results = [None] * count
+    errors = [None] * count
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+
+        try:
+            results[i] = func()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(count)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results, errors
+
+
+def test_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    results, errors = run_concurrently(
+        8, lambda: single_flight.run(('a',), compute))
+
+    assert results == ['result'] * 8
+    assert errors == [None] * 8
+    assert len(calls) == 1
+    assert single_flight.coalesced == 7
+
+    # Nothing is cached after the computation finishes.
+    assert single_flight.run(('a',), compute) == 'result'
+    assert len(calls) == 2
+
+
+def test_error_shared():
+    single_flight = SingleFlight()
+
+    def compute():
+        time.sleep(0.2)
+        raise ValueError('test')
+
+    results, errors = run_concurrently(
+        4, lambda: single_flight.run('a', compute))
+
+    assert all(isinstance(e, ValueError) for e in errors)
+
+    with pytest.raises(ValueError):
+        single_flight.run('a', compute)
+
+
+def test_different_keys():
+    single_flight = SingleFlight()
+    counter = iter(range(100))
+
+    results, _ = run_concurrently(
+        4, lambda: single_flight.run(
+            next(counter), lambda: time.sleep(0.1) or 'x'))
+
+    assert results == ['x'] * 4
+    assert single_flight.coalesced == 0
+
+
+def lock_and_record(path, source, events_path, name):
+    cache = DiskCache(path, 1024)
+
+    with cache.lock(('test',), [source]):
+        with events_path.open(mode='a') as f:
+            f.write(f'{name} start\n')
+
+        time.sleep(0.2)
+
+        with events_path.open(mode='a') as f:
+            f.write(f'{name} end\n')
+
+
+def test_disk_cache_lock(tmp_path):
+    source = tmp_path / 'source.json'
+    source.write_text('{}')
+    events_path = tmp_path / 'events'
+
+    processes = [multiprocessing.Process(
+        target=lock_and_record,
+        args=(tmp_path / 'cache', source, events_path, str(i)))
+        for i in range(3)]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    events = events_path.read_text().splitlines()
+
+    assert len(events) == 6
+
+    for i in range(0, 6, 2):
+        assert events[i].split()[0] == events[i + 1].split()[0]
+        assert events[i].endswith('start')
+        assert events[i + 1].endswith('end')
+
+    # The lock file must be kept for later lockers.
+    assert len(list((tmp_path / 'cache').glob('*.lock'))) == 1
+
+
+def test_disk_cache_lock_read_only(tmp_path):
+    (tmp_path / 'file').write_text('')
+    cache = DiskCache(tmp_path / 'file' / 'cache', 1024)
+
+    with cache.lock(('test',), []):
+        pass
+
+
+@pytest.mark.parametrize('disk_cache', [False, True])
+def test_flame_graph_coalesced(tmp_path, mocker, disk_cache):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    processed_path.mkdir(parents=True)
+
+    tree = {'name': 'all', 'value': 10, 'children': [
+        {'name': 'a', 'value': 6, 'children': []},
+        {'name': 'b', 'value': 3, 'children': []}
+    ]}
+
+    (processed_path / 'metadata.json').write_text('{}')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree]
+    }))
+
+    cache = DiskCache(tmp_path / 'cache', 1024 * 1024) if disk_cache \
+        else None
+    results = ProfilingResults(str(tmp_path), IDENTIFIER, cache)
+
+    original_load = ProfilingResults._load_compressed_flame_graphs
+
+    def slow_load(*args):
+        time.sleep(0.2)
+        return original_load(results, *args)
+
+    load = mocker.patch.object(results, '_load_compressed_flame_graphs',
+                               side_effect=slow_load)
+
+    flame_graphs, errors = run_concurrently(
+        8, lambda: results.get_flame_graph(1, 1, 0.2))
+
+    assert errors == [None] * 8
+    assert len(set(flame_graphs)) == 1
+    assert json.loads(flame_graphs[0])['walltime'][0]['value'] == 10
+    assert load.call_count == 1
@@ -0,0 +1,67 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import pytest
+from zipfile import ZipFile
+from adaptiveperf import SourceArchive
+
+
+@pytest.fixture()
+def archive_path(tmp_path):
+    path = tmp_path / 'src.zip'
+
+    with ZipFile(path, mode='w') as zip:
+        zip.writestr('a.c', 'int main() {\r\n    return 0;\r\n}\r\n')
+        zip.writestr('b.c', 'x' * 100)
+        zip.writestr('empty.c', '')
+        zip.writestr('dir/', '')
+
+    return path
+
+
+def test_get(archive_path):
+    archive = SourceArchive(archive_path)
+
+    code, line_offsets = archive.get('a.c')
+
+    assert code == 'int main() {\n    return 0;\n}\n'
+    assert list(line_offsets) == [0, 13, 27]
+    assert archive.get('b.c')[0] == 'x' * 100
+    assert list(archive.get('b.c')[1]) == [0]
+    assert archive.get('missing.c') is None
+    assert archive.get('dir/') is None
+
+    archive.close()
+
+
+def test_get_lines(archive_path):
+    archive = SourceArchive(archive_path)
+
+    assert archive.get_lines('a.c', 2, 3) == {
+        'first': 2,
+        'last': 3,
+        'line_count': 3,
+        'code': '    return 0;\n}\n',
+        'line_offsets': [0, 14]
+    }
+    assert archive.get_lines('a.c', -10, 1)['code'] == 'int main() {\n'
+    assert archive.get_lines('a.c', 1, 100)['last'] == 3
+    assert archive.get_lines('a.c', 5, 10)['code'] == ''
+    assert archive.get_lines('missing.c', 1, 2) is None
+
+
+def test_cache_limit(archive_path, mocker):
+    archive = SourceArchive(archive_path, max_bytes=100)
+    read = mocker.spy(archive, '_read')
+
+    archive.get('a.c')
+    archive.get('a.c')
+
+    assert read.call_count == 1
+
+    # b.c is 100 bytes long, so a.c must be evicted.
+    archive.get('b.c')
+    archive.get('b.c')
+    archive.get('a.c')
+
+    assert read.call_count == 3
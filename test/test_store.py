@@ -0,0 +1,189 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import pytest
+from zipfile import ZipFile
+from adaptiveperf import ProfilingResults, SessionStore, SessionCache, \
+    FlameGraph
+from adaptiveperf.precompute import import_sessions
+
+
+IDENTIFIER = '2023_12_10_11_13_14_test__test2'
+
+
+@pytest.fixture()
+def results_dir(tmp_path):
+    processed_path = tmp_path / IDENTIFIER / 'processed'
+    processed_path.mkdir(parents=True)
+
+    tree = {'name': 'all', 'value': 10.5, 'children': [
+        {'name': 'a', 'value': 6, 'children': [], 'cold': True},
+        {'name': 'b', 'value': 3, 'children': [
+            {'name': 'a', 'value': 1, 'children': []}
+        ]}
+    ]}
+
+    (processed_path / 'metadata.json').write_text(json.dumps({
+        'thread_tree': [{'tag': ['a.out', '1/1', 0, 5000000],
+                         'identifier': '1_1'},
+                        {'tag': ['a.out', '1/2', 1000000, 2000000],
+                         'identifier': '1_2', 'parent': '1_1'}],
+        'offcpu_regions': {'1_2': [[3000000, 1000000],
+                                   [1500000, 100000]]},
+        'sampled_times': {'1_1': 4000000},
+        'callchains': {'2': [['s1', '0x10']]},
+        'start_time': 500000
+    }))
+    (processed_path / 'event_dict.data').write_text(
+        'cache-misses Cache misses\n')
+    (processed_path / '1_1.json').write_text(json.dumps({
+        'walltime': [tree, tree],
+        'cache-misses': [tree, tree]
+    }))
+    (processed_path / 'perf-1.map').write_text('10 10 first\n20 5 second\n')
+    (processed_path / 'syscall_callchains.json').write_text(json.dumps({
+        's1': ['function', '/usr/lib/lib.so']
+    }))
+    (processed_path / 'sources.json').write_text(json.dumps({
+        '/usr/lib/lib.so': {'0x10': {'file': '/src/a.c', 'line': 1}}
+    }))
+
+    with ZipFile(processed_path / 'src.zip', mode='w') as zip:
+        zip.writestr('0', 'int main() {}\n')
+        zip.writestr('index.json', json.dumps({'/src/a.c': '0'}))
+
+    return tmp_path
+
+
+def get_all(results):
+    return [
+        results.get_json_tree(),
+        results.get_json_tree(include_off_cpu=False, skeleton=True),
+        results.get_thread_details(['1_1', '1_2', '9_9']),
+        results.get_source_mappings(),
+        results.get_off_cpu_regions(['1_2'], 0, 10, 0.001),
+        results.get_callchain_mappings(),
+        results.resolve_symbols(['perf-1.map:0x10', 'perf-1.map:0x22',
+                                 'perf-1.map:0x30', 'perf-2.map:0x10']),
+        results.get_flame_graph(1, 1, 0.2),
+        results.get_flame_graph(1, 1, 0.2, 1),
+        results.get_flame_graph(1, 2, 0.2),
+        results.get_flame_graph(1, 1, 0.2, None, (1, 3)),
+        results.get_merged_flame_graph(None, 0.2),
+        results.get_merged_flame_graph(1, 0.2, 1),
+        results.search_symbols('a'),
+        results.search_symbols('function', exact=True),
+        results.get_hot_functions('all', 'walltime'),
+        results.get_hot_functions('1_1', 'cache-misses', 'total', 1, 1),
+        results.get_source_code('0')
+    ]
+
+
+def test_store(results_dir):
+    results = ProfilingResults(str(results_dir), IDENTIFIER)
+    expected = get_all(results)
+
+    assert not results.has_store
+    assert SessionStore.open(results_dir / IDENTIFIER) is None
+
+    results.create_store()
+    stored = ProfilingResults(str(results_dir), IDENTIFIER)
+
+    assert stored.has_store
+    assert get_all(stored) == expected
+    assert list(results_dir.glob(f'{IDENTIFIER}/.session-*')) == []
+
+
+def test_time_range(results_dir):
+    results = ProfilingResults(str(results_dir), IDENTIFIER)
+
+    # 1_1 runs between 0 and 5 ms, so 1-3 ms is the 20-60% part of
+    # the root (i.e. between 2.1 and 6.3).
+    sliced = json.loads(results.get_flame_graph(1, 1, 0, None, (1, 3)))
+    truncated = json.loads(results.get_flame_graph(1, 1, 0, 1, (1, 3)))
+    stub_id = truncated['walltime'][1]['children'][1]['stub_id']
+    subtree = json.loads(results.get_flame_graph_subtree(
+        1, 1, 0, stub_id, 1, (1, 3)))
+
+    def flatten(node):
+        return [(node['name'], pytest.approx(node['value']),
+                 node.get('cold', False))] + \
+            [x for child in node['children'] for x in flatten(child)]
+
+    assert flatten(sliced['walltime'][1]) == [
+        ('all', 4.2, False), ('a', 3.9, True), ('b', 0.3, False),
+        ('a', 0.3, False)]
+    assert sliced['walltime'][0] == sliced['walltime'][1]
+    assert subtree == sliced['walltime'][1]['children'][1]
+
+    with pytest.raises(ValueError):
+        results.get_flame_graph(1, 1, 0, None, (3, 1))
+
+    assert results.get_flame_graph(9, 9, 0, None, (1, 3)) is None
+
+
+def test_store_out_of_date(results_dir):
+    ProfilingResults(str(results_dir), IDENTIFIER).create_store()
+
+    processed_path = results_dir / IDENTIFIER / 'processed'
+    (processed_path / '1_2.json').write_text(json.dumps({
+        'walltime': [{'name': 'all', 'value': 1, 'children': []},
+                     {'name': 'all', 'value': 1, 'children': []}]
+    }))
+
+    results = ProfilingResults(str(results_dir), IDENTIFIER)
+
+    assert not results.has_store
+    assert results.get_flame_graph(1, 2, 0.2) is not None
+
+    results.create_store()
+    results = ProfilingResults(str(results_dir), IDENTIFIER)
+
+    assert results.has_store
+    assert json.loads(results.get_flame_graph(1, 2, 0.2)) == {
+        'walltime': [{'name': 'all', 'value': 1, 'children': []},
+                     {'name': 'all', 'value': 1, 'children': []}]
+    }
+
+
+def test_create_on_load(results_dir):
+    cache = SessionCache(str(results_dir), 0, create_stores=True)
+
+    assert not cache.get(IDENTIFIER).has_store
+    assert cache.get(IDENTIFIER).has_store
+
+
+def test_create_failure(results_dir, mocker, capsys):
+    mocker.patch('adaptiveperf.results.SessionStoreWriter.__enter__',
+                 side_effect=OSError('Read-only file system'))
+
+    results = ProfilingResults(str(results_dir), IDENTIFIER,
+                               create_store=True)
+
+    assert not results.has_store
+    assert results.get_flame_graph(1, 1, 0.2) is not None
+    assert 'Could not create the store' in capsys.readouterr().err
+
+
+def test_import_sessions(results_dir):
+    assert import_sessions(str(results_dir), jobs=1) == 0
+    assert ProfilingResults(str(results_dir), IDENTIFIER).has_store
+
+
+def test_flame_graph_bytes():
+    tree = {'name': 'all', 'value': 3, 'children': [
+        {'name': 'ä"', 'value': 2, 'children': [], 'cold': True},
+        {'name': 'b', 'value': 1, 'children': []}
+    ]}
+    graph = FlameGraph.from_dict(tree)
+    restored = FlameGraph.from_bytes(graph.to_bytes())
+
+    assert restored.compress(0.5, True).to_json() == \
+        graph.compress(0.5, True).to_json()
+
+    with pytest.raises(ValueError):
+        FlameGraph.from_bytes(b'AFG0' + graph.to_bytes()[4:])
+
+    with pytest.raises(ValueError):
+        FlameGraph.from_bytes(graph.to_bytes()[:20])
@@ -0,0 +1,80 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import pytest
+from adaptiveperf import FlameGraph, SymbolIndex
+
+
+@pytest.fixture()
+def index():
+    index = SymbolIndex()
+    index.add('1_1', 'walltime', FlameGraph.from_dict(
+        {'name': 'all', 'value': 10, 'children': [
+            {'name': 'x1', 'value': 6, 'children': [
+                {'name': 'x2', 'value': 4, 'children': []}
+            ]},
+            {'name': 'x3', 'value': 4, 'children': []}
+        ]}), {'x1': ['main', '/bin/a.out'], 'x2': ['malloc', '/lib/libc.so'],
+              'x3': ['malloc', '/lib/libc.so']})
+    index.add('1_2', 'walltime', FlameGraph.from_dict(
+        {'name': 'all', 'value': 5, 'children': [
+            {'name': 'calloc', 'value': 5, 'children': []}
+        ]}))
+    index.add('1_2', 'cache-misses', FlameGraph.from_dict(
+        {'name': 'all', 'value': 3, 'children': [
+            {'name': 'malloc', 'value': 3, 'children': []}
+        ]}))
+
+    return index
+
+
+def test_search(index):
+    assert index.search('MALLOC') == {'count': 1, 'symbols': [
+        {'symbol': 'malloc', 'occurrences': [
+            {'thread': '1_2', 'metric': 'cache-misses', 'total': 3,
+             'self': 3},
+            {'thread': '1_1', 'metric': 'walltime', 'total': 8, 'self': 8}
+        ]}
+    ]}
+    assert [x['symbol'] for x in index.search('alloc')['symbols']] == \
+        ['calloc', 'malloc']
+    assert index.search('alloc', limit=1)['count'] == 2
+    assert [x['symbol'] for x in
+            index.search('alloc', limit=1)['symbols']] == ['calloc']
+    assert [x['symbol'] for x in index.search('ma')['symbols']] == \
+        ['main', 'malloc']
+    assert index.search('alloc', exact=True) == {'count': 0, 'symbols': []}
+    assert index.search('main', metric='cache-misses')['count'] == 0
+    assert index.search('main')['symbols'][0]['occurrences'] == [
+        {'thread': '1_1', 'metric': 'walltime', 'total': 6, 'self': 2}]
+
+    with pytest.raises(ValueError):
+        index.search('main', limit=0)
+
+
+def test_serialization(index):
+    restored = SymbolIndex.from_json(index.to_json())
+
+    assert len(restored) == len(index) == 3
+    assert restored.search('') == index.search('')
+    assert restored.aggregate('walltime') == index.aggregate('walltime')
+
+
+def test_aggregate(index):
+    index.add('2_3', 'walltime', FlameGraph.from_dict(
+        {'name': 'all', 'value': 2, 'children': [
+            {'name': 'calloc', 'value': 2, 'children': []}
+        ]}))
+
+    def aggregate(*args):
+        value, functions = index.aggregate(*args)
+        return value, sorted(functions)
+
+    assert aggregate('walltime') == (17, [
+        ['calloc', 7, 7], ['main', 6, 2], ['malloc', 8, 8]])
+    assert aggregate('walltime', '1') == (15, [
+        ['calloc', 5, 5], ['main', 6, 2], ['malloc', 8, 8]])
+    assert aggregate('walltime', '1', '2') == (5, [['calloc', 5, 5]])
+    assert aggregate('cache-misses', '1') == (3, [['malloc', 3, 3]])
+    assert index.aggregate('cache-misses', '2') is None
+    assert index.aggregate('walltime', '1', '3') is None
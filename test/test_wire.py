@@ -0,0 +1,66 @@
+# AdaptivePerfHTML: Tool for producing HTML summary of profiling results
+# Copyright (C) CERN. See LICENSE for details.
+
+import json
+import pytest
+from adaptiveperf import encode_binary, decode_binary
+
+
+@pytest.mark.parametrize('obj', [
+    None, True, False, 0, 1, -1, 127, 128, -129, 2**70, -2**70, 1.5,
+    -0.25, '', 'abc', 'zażółć', [], {}, [1, 2, -3], [1, True],
+    [1, 2.0], {'a': [None, {'b': 'a'}], 'c': []},
+    {'name': 'all', 'value': 10, 'children': [
+        {'name': 'f', 'value': 5, 'children': [], 'cold': True},
+        {'name': 'f', 'value': 5, 'children': [], 'offsets': {'0x1': 3}}
+    ]}
+])
+def test_round_trip(obj):
+    assert decode_binary(encode_binary(obj)) == obj
+
+
+def test_deep_tree():
+    tree = {'name': 'all', 'value': 1, 'children': []}
+    node = tree
+
+    for i in range(5000):
+        child = {'name': f'f{i % 10}', 'value': 1, 'children': []}
+        node['children'].append(child)
+        node = child
+
+    node = decode_binary(encode_binary(tree))
+
+    # Objects this deep cannot be compared with == because of
+    # the recursion limit.
+    for i in range(5000):
+        assert len(node['children']) == 1
+        node = node['children'][0]
+        assert node['name'] == f'f{i % 10}'
+
+    assert node['children'] == []
+
+
+def test_repeated_strings_smaller_than_json():
+    obj = [{'name': 'some_long_function_name', 'value': i, 'children': []}
+           for i in range(1000)]
+
+    assert len(encode_binary(obj)) < len(json.dumps(obj)) / 4
+
+
+def test_invalid_data():
+    with pytest.raises(ValueError):
+        encode_binary({1: 2})
+
+    with pytest.raises(ValueError):
+        encode_binary(object())
+
+    with pytest.raises(ValueError):
+        decode_binary(b'{"a": 1}')
+
+    data = encode_binary({'a': [1.5, 'b']})
+
+    with pytest.raises(ValueError):
+        decode_binary(data[:-3])
+
+    with pytest.raises(ValueError):
+        decode_binary(data + b'\x00')